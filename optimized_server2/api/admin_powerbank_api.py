@@ -10,6 +10,7 @@ import aiomysql
 from models.powerbank import Powerbank
 from models.station_powerbank import StationPowerbank
 from models.order import Order
+from utils.stats_rollup import stats_rollups
 
 
 
@@ -312,6 +313,21 @@ class AdminPowerbankAPI:
     async def get_powerbank_statistics(self, accessible_org_units=None) -> Dict[str, Any]:
         """Получает статистику по повербанкам"""
         try:
+            # Сводные счетчики (utils/stats_rollup.py), если установлены
+            if accessible_org_units != [] and await stats_rollups.ready(self.db_pool):
+                counts = await stats_rollups.powerbank_counts(self.db_pool, accessible_org_units)
+                return {
+                    "total": sum(counts.values()),
+                    "active": counts.get('active', 0),
+                    "unknown": counts.get('unknown', 0),
+                    "broken": counts.get('user_reported_broken', 0),
+                    "system_error": counts.get('system_error', 0),
+                    "written_off": counts.get('written_off', 0),
+                    "group_statistics": await stats_rollups.powerbanks_by_org_unit(
+                        self.db_pool, 'unknown', accessible_org_units
+                    )
+                }
+            
             async with self.db_pool.acquire() as conn:
                 async with conn.cursor() as cur:
                     # Формируем WHERE условие для фильтрации
@@ -486,8 +502,7 @@ class AdminPowerbankAPI:
                                 }
                                 
                                 
-                                connection.writer.write(force_eject_command)
-                                await connection.writer.drain()
+                                connection.enqueue_command(force_eject_command)
                         except Exception as e:
                             self.logger.error(f"Ошибка: {e}")
                     
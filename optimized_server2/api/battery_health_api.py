@@ -0,0 +1,108 @@
+"""
+API рейтинга состояния аккумуляторов парка (utils/battery_health.py)
+"""
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+from api.base_api import BaseAPI
+from utils.battery_health import battery_health_analyzer
+from utils.centralized_logger import get_logger
+from utils.org_unit_utils import get_admin_accessible_org_units
+
+
+logger = get_logger('battery_health_api')
+
+DEFAULT_LIMIT = 100
+
+
+class BatteryHealthAPI(BaseAPI):
+    """API аналитики аккумуляторов (для администраторов)"""
+
+    def __init__(self, db_pool):
+        super().__init__(db_pool)
+
+    async def _check_access(self, request: Request):
+        """Проверяет авторизацию и права администратора, возвращает (user, ответ с ошибкой)"""
+        is_auth, error_response = self.check_auth(request)
+        if not is_auth:
+            return None, error_response
+
+        user = self.get_user_from_request(request)
+        if not await self.check_admin_permissions(user['user_id']):
+            return None, web.json_response({'success': False, 'error': 'Недостаточно прав'}, status=403)
+        if not battery_health_analyzer.available:
+            return None, web.json_response({
+                'success': False,
+                'error': 'Аналитика недоступна: не установлен numpy'
+            }, status=503)
+        return user, None
+
+    async def get_report(self, request: Request) -> Response:
+        """
+        GET /api/analytics/battery-health?kind=powerbanks|stations&limit=100&org_unit_id=&flag=
+        Рейтинг повербанков или станций по баллу риска из последнего расчета
+        """
+        try:
+            user, error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            result = battery_health_analyzer.result
+            if result is None:
+                return web.json_response({
+                    'success': False,
+                    'error': 'Расчет еще не выполнялся',
+                    'running': battery_health_analyzer.is_running
+                }, status=404)
+
+            kind = request.query.get('kind', 'powerbanks')
+            if kind not in ('powerbanks', 'stations'):
+                return web.json_response({'success': False, 'error': 'kind: powerbanks или stations'}, status=400)
+            limit = int(request.query.get('limit', DEFAULT_LIMIT))
+            org_unit_id = int(request.query['org_unit_id']) if request.query.get('org_unit_id') else None
+            flag = request.query.get('flag')
+
+            accessible_org_units = await get_admin_accessible_org_units(self.db_pool, user['user_id'])
+            if accessible_org_units is not None:
+                accessible_org_units = set(accessible_org_units)
+            rows = [
+                row for row in result[kind]
+                if (accessible_org_units is None or row['org_unit_id'] in accessible_org_units)
+                and (org_unit_id is None or row['org_unit_id'] == org_unit_id)
+                and (flag is None or flag in row['flags'])
+            ]
+            summary = {key: value for key, value in result.items() if key not in ('powerbanks', 'stations')}
+            return web.json_response({
+                'success': True,
+                'summary': summary,
+                'running': battery_health_analyzer.is_running,
+                'kind': kind,
+                'total': len(rows),
+                'items': rows[:max(limit, 0)],
+            })
+        except ValueError:
+            return web.json_response({'success': False, 'error': 'Некорректные параметры'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка получения аналитики аккумуляторов: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def run_report(self, request: Request) -> Response:
+        """POST /api/analytics/battery-health/run - Пересчет рейтинга (ждет окончания расчета)"""
+        try:
+            _, error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            result = await battery_health_analyzer.run()
+            return web.json_response({
+                'success': True,
+                'summary': {key: value for key, value in result.items() if key not in ('powerbanks', 'stations')}
+            })
+        except Exception as e:
+            logger.error(f"Ошибка расчета аналитики аккумуляторов: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    def setup_routes(self, app):
+        """Регистрирует маршруты"""
+        app.router.add_get('/api/analytics/battery-health', self.get_report)
+        app.router.add_post('/api/analytics/battery-health/run', self.run_report)
@@ -1,7 +1,7 @@
 """
 API для выдачи повербанков
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime
 import json
 
@@ -11,6 +11,8 @@ from models.powerbank import Powerbank
 from models.order import Order
 from handlers.borrow_powerbank import BorrowPowerbankHandler
 from utils.station_resolver import StationResolver
+from utils.fleet_state import fleet_state
+from utils.powerbank_scoring import PowerbankScorer
 
 
 
@@ -22,6 +24,19 @@ class BorrowPowerbankAPI:
         self.connection_manager = connection_manager
         self.station_resolver = StationResolver(connection_manager) if connection_manager else None
         self.borrow_handler = borrow_handler if borrow_handler is not None else BorrowPowerbankHandler(db_pool, connection_manager)
+        self.powerbank_scorer = PowerbankScorer()
+    
+    async def _load_station(self, station_id: int) -> Tuple[Any, List[Any]]:
+        """
+        Станция из БД и ее слоты: из памяти шлюза для подключенной станции, иначе из БД.
+        Возвращает (station, slots) с полями Station и StationPowerbank; station = None, если не найдена
+        """
+        station, state = await fleet_state.load_station(self.db_pool, station_id, self.connection_manager)
+        if not station:
+            return None, []
+        if state is not None:
+            return station, state.sorted_slots()
+        return station, await StationPowerbank.get_station_powerbanks(self.db_pool, station_id)
     
     async def get_available_powerbanks(self, station_id: int, user_id: int = None, include_all: bool = False) -> Dict[str, Any]:
         """
@@ -29,7 +44,7 @@ class BorrowPowerbankAPI:
         """
         try:
             # Проверяем, что станция существует
-            station = await Station.get_by_id(self.db_pool, station_id)
+            station, powerbanks = await self._load_station(station_id)
             if not station:
                 return {"error": "Станция не найдена", "success": False}
             
@@ -44,8 +59,11 @@ class BorrowPowerbankAPI:
                     
                     return {"error": station_access_reason, "success": False}
             
-            # Получаем повербанки в станции
-            powerbanks = await StationPowerbank.get_station_powerbanks(self.db_pool, station_id)
+            # Повербанки станции и активные заказы по ним - двумя запросами на всю станцию
+            powerbanks_by_id = await Powerbank.get_by_ids(self.db_pool, [sp.powerbank_id for sp in powerbanks])
+            active_serials = await Order.get_active_powerbank_serials(
+                self.db_pool, [powerbank.serial_number for powerbank in powerbanks_by_id.values()]
+            )
             
             from utils.centralized_logger import get_logger
             logger = get_logger('borrow_powerbank_api')
@@ -56,7 +74,7 @@ class BorrowPowerbankAPI:
             broken_powerbanks_count = 0   
             
             for sp in powerbanks:
-                powerbank = await Powerbank.get_by_id(self.db_pool, sp.powerbank_id)
+                powerbank = powerbanks_by_id.get(sp.powerbank_id)
                 
                 # Пропускаем ТОЛЬКО если повербанк вообще не найден в БД
                 if not powerbank:
@@ -76,8 +94,7 @@ class BorrowPowerbankAPI:
                     healthy_powerbanks_count += 1
                     
                 if not is_deleted and (include_all or powerbank.status == 'active'):
-                    existing_order = await Order.get_active_by_powerbank_serial(self.db_pool, powerbank.serial_number)
-                    if existing_order:
+                    if powerbank.serial_number in active_serials:
                         continue  
                     
                     result.append({
@@ -305,7 +322,7 @@ class BorrowPowerbankAPI:
         Получает информацию о станции и доступных повербанках
         """
         try:
-            station = await Station.get_by_id(self.db_pool, station_id)
+            station, powerbanks = await self._load_station(station_id)
             if not station:
                 return {"error": "Станция не найдена", "success": False}
             
@@ -314,7 +331,6 @@ class BorrowPowerbankAPI:
                 connection = self.connection_manager.get_connection_by_station_id(station_id)
                 is_connected = connection is not None
             
-            powerbanks = await StationPowerbank.get_station_powerbanks(self.db_pool, station_id)
             active_powerbanks = [sp for sp in powerbanks if sp.powerbank_id]
             
             return {
@@ -359,81 +375,45 @@ class BorrowPowerbankAPI:
     
     async def select_optimal_powerbank(self, station_id: int) -> Dict[str, Any]:
         """
-        Выбирает оптимальный повербанк для выдачи по правилам:
-      
+        Выбирает оптимальный повербанк для выдачи по баллу PowerbankScorer
+        (заряд, SOH, ошибки слота; без повербанков в активных заказах)
         """
         try:
-            # Получаем все активные повербанки в станции
-            powerbanks = await StationPowerbank.get_station_powerbanks(self.db_pool, station_id)
+            # Слоты станции из памяти шлюза (или из БД для неподключенной)
+            station, powerbanks = await self._load_station(station_id)
             
             if not powerbanks:
                 return {"error": "В станции нет повербанков", "success": False}
             
             # Проверяем статус станции
-            station = await Station.get_by_id(self.db_pool, station_id)
             if station and station.status != 'active':
                 return {"error": f"Станция неактивна (статус: {station.status})", "success": False}
             
-            # Фильтруем только активные повербанки, не находящиеся в заказах
-            active_powerbanks = []
-            for sp in powerbanks:
-                powerbank = await Powerbank.get_by_id(self.db_pool, sp.powerbank_id)
-                if powerbank and powerbank.status == 'active':
-                    # Проверяем, что повербанк не находится в активном заказе
-                    existing_order = await Order.get_active_by_powerbank_serial(self.db_pool, powerbank.serial_number)
-                    if existing_order:
-                        continue
-                    
-                    has_errors = self._check_powerbank_errors(sp)
-                    active_powerbanks.append({
-                        'station_powerbank': sp,
-                        'powerbank': powerbank,
-                        'has_errors': has_errors,
-                        'level': sp.level or 0
-                    })
+            # Повербанки и активные заказы - двумя запросами на всю станцию, баллы - за один проход
+            powerbanks_by_id = await Powerbank.get_by_ids(self.db_pool, [sp.powerbank_id for sp in powerbanks])
+            active_serials = await Order.get_active_powerbank_serials(
+                self.db_pool, [powerbank.serial_number for powerbank in powerbanks_by_id.values()]
+            )
+            candidates = self.powerbank_scorer.candidates(
+                powerbanks, powerbanks_by_id, active_serials, self._check_powerbank_errors
+            )
             
-            if not active_powerbanks:
+            if not candidates:
                 return {"error": "Нет активных повербанков в станции", "success": False}
             
-            # Разделяем на группы: без ошибок и с ошибками
-            healthy_powerbanks = [pb for pb in active_powerbanks if not pb['has_errors']]
-            error_powerbanks = [pb for pb in active_powerbanks if pb['has_errors']]
+            healthy_count = sum(not candidate.has_errors for candidate in candidates)
+            selected_powerbank = self.powerbank_scorer.select(candidates)
+            tied_count = sum(candidate.score == selected_powerbank.score for candidate in candidates)
             
-            selected_powerbank = None
-            selection_reason = ""
-            
-            if healthy_powerbanks:
-                # Если есть здоровые повербанки, выбираем с максимальным зарядом
-                if len(healthy_powerbanks) == 1:
-                    selected_powerbank = healthy_powerbanks[0]
-                    selection_reason = "Единственный здоровый повербанк"
-                else:
-                    # Сортируем по уровню заряда (по убыванию)
-                    healthy_powerbanks.sort(key=lambda x: x['level'], reverse=True)
-                    
-                    # Если все имеют одинаковый максимальный заряд - случайный выбор
-                    max_level = healthy_powerbanks[0]['level']
-                    max_level_powerbanks = [pb for pb in healthy_powerbanks if pb['level'] == max_level]
-                    
-                    if len(max_level_powerbanks) == 1:
-                        selected_powerbank = max_level_powerbanks[0]
-                        selection_reason = f"Максимальный заряд: {max_level}%"
-                    else:
-                        # Случайный выбор среди повербанков с максимальным зарядом
-                        import random
-                        selected_powerbank = random.choice(max_level_powerbanks)
-                        selection_reason = f"Случайный выбор среди повербанков с зарядом {max_level}%"
+            if not healthy_count:
+                selection_reason = f"Максимальный балл {selected_powerbank.score:g} (все повербанки имеют ошибки)"
+            elif tied_count > 1:
+                selection_reason = f"Случайный выбор среди {tied_count} повербанков с баллом {selected_powerbank.score:g}"
             else:
-                # Если все повербанки с ошибками, выбираем случайный
-                import random
-                selected_powerbank = random.choice(active_powerbanks)
-                selection_reason = "Случайный выбор (все повербанки имеют ошибки)"
-            
-            if not selected_powerbank:
-                return {"error": "Не удалось выбрать повербанк", "success": False}
+                selection_reason = f"Максимальный балл {selected_powerbank.score:g}"
             
-            sp = selected_powerbank['station_powerbank']
-            powerbank = selected_powerbank['powerbank']
+            sp = selected_powerbank.slot
+            powerbank = selected_powerbank.powerbank
             
             return {
                 "success": True,
@@ -445,12 +425,13 @@ class BorrowPowerbankAPI:
                     "voltage": sp.voltage,
                     "temperature": sp.temperature,
                     "soh": powerbank.soh,
-                    "has_errors": selected_powerbank['has_errors']
+                    "has_errors": selected_powerbank.has_errors,
+                    "score": selected_powerbank.score
                 },
                 "selection_reason": selection_reason,
-                "total_available": len(active_powerbanks),
-                "healthy_count": len(healthy_powerbanks),
-                "error_count": len(error_powerbanks)
+                "total_available": len(candidates),
+                "healthy_count": healthy_count,
+                "error_count": len(candidates) - healthy_count
             }
             
         except Exception as e:
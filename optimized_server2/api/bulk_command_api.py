@@ -0,0 +1,208 @@
+"""
+API массовых команд станциям: громкость, адрес сервера, перезагрузка, инвентарь
+"""
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+from api.base_api import BaseAPI
+from config.settings import BULK_COMMAND_CONFIG
+from handlers.bulk_commands import BulkCommandHandler, BULK_COMMANDS
+from utils.centralized_logger import get_logger
+from utils.command_rpc import request_timeout
+from utils.org_unit_utils import get_admin_accessible_org_units
+
+
+logger = get_logger('bulk_command_api')
+
+
+class BulkCommandAPI(BaseAPI):
+    """API заданий массовых команд (для администраторов)"""
+
+    def __init__(self, db_pool, connection_manager):
+        super().__init__(db_pool)
+        self.connection_manager = connection_manager
+        self.bulk_command_handler = BulkCommandHandler(db_pool, connection_manager)
+
+    async def _check_access(self, request: Request):
+        """Проверяет авторизацию и права администратора, возвращает ответ с ошибкой или None"""
+        is_auth, error_response = self.check_auth(request)
+        if not is_auth:
+            return error_response
+
+        user = self.get_user_from_request(request)
+        if not await self.check_admin_permissions(user['user_id']):
+            return web.json_response({'success': False, 'error': 'Недостаточно прав'}, status=403)
+        return None
+
+    async def _visible_job(self, request: Request, job_id: int):
+        """Задание, доступное текущему администратору, или None"""
+        job = self.bulk_command_handler.get_job(job_id)
+        if not job:
+            return None
+        user = self.get_user_from_request(request)
+        accessible_org_units = await get_admin_accessible_org_units(self.db_pool, user['user_id'])
+        return job if job.visible_to(user['user_id'], accessible_org_units) else None
+
+    @staticmethod
+    def _command_params(command: str, data: dict):
+        """Параметры команды из запроса, возвращает (params, error)"""
+        if command == 'set_voice_volume':
+            volume_level = data.get('volume_level')
+            if not isinstance(volume_level, int) or not (0 <= volume_level <= 15):
+                return None, f'Уровень громкости должен быть от 0 до 15, получен: {volume_level}'
+            return {'volume_level': volume_level}, None
+        if command == 'set_server_address':
+            server_address = data.get('server_address')
+            server_port = data.get('server_port')
+            heartbeat_interval = data.get('heartbeat_interval', 30)
+            if not server_address:
+                return None, 'Не указан server_address'
+            if not server_port:
+                return None, 'Не указан server_port'
+            if not isinstance(heartbeat_interval, int) or not (1 <= heartbeat_interval <= 255):
+                return None, f'Интервал heartbeat должен быть от 1 до 255, получен: {heartbeat_interval}'
+            return {
+                'server_address': server_address,
+                'server_port': server_port,
+                'heartbeat_interval': heartbeat_interval,
+            }, None
+        return {}, None
+
+    async def create_job(self, request: Request) -> Response:
+        """
+        POST /api/bulk-commands - Запуск команды на группе станций
+        {"command": "set_server_address", "server_address": "...", "server_port": "...",
+         "station_ids": [...] | "org_unit_id": 5 | "all_online": true,
+         "concurrency": 20, "timeout": 10}
+        """
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+            user = self.get_user_from_request(request)
+
+            data = await request.json()
+            command = data.get('command')
+            if command not in BULK_COMMANDS:
+                return web.json_response({
+                    'success': False,
+                    'error': f'Неизвестная команда {command}, доступны: {", ".join(BULK_COMMANDS)}'
+                }, status=400)
+
+            params, error = self._command_params(command, data)
+            if error:
+                return web.json_response({'success': False, 'error': error}, status=400)
+
+            station_ids = data.get('station_ids')
+            org_unit_id = data.get('org_unit_id')
+            if org_unit_id is not None:
+                try:
+                    org_unit_id = int(org_unit_id)
+                except (TypeError, ValueError):
+                    return web.json_response({'success': False, 'error': 'Некорректный org_unit_id'}, status=400)
+            all_online = bool(data.get('all_online'))
+            if station_ids is not None and not isinstance(station_ids, list):
+                return web.json_response({'success': False, 'error': 'station_ids должен быть списком'}, status=400)
+            if not station_ids and org_unit_id is None and not all_online:
+                return web.json_response({
+                    'success': False,
+                    'error': 'Укажите station_ids, org_unit_id или all_online'
+                }, status=400)
+
+            try:
+                concurrency = int(data.get('concurrency', BULK_COMMAND_CONFIG['default_concurrency']))
+            except (TypeError, ValueError):
+                concurrency = BULK_COMMAND_CONFIG['default_concurrency']
+            concurrency = max(1, min(concurrency, BULK_COMMAND_CONFIG['max_concurrency']))
+            timeout = request_timeout(data.get('timeout'))
+
+            accessible_org_units = await get_admin_accessible_org_units(self.db_pool, user['user_id'])
+            if accessible_org_units is not None and not accessible_org_units:
+                return web.json_response({'success': False, 'error': 'Нет доступных подразделений'}, status=403)
+            if org_unit_id is not None and accessible_org_units is not None and org_unit_id not in accessible_org_units:
+                return web.json_response({'success': False, 'error': 'Нет доступа к подразделению'}, status=403)
+
+            try:
+                selected = await self.bulk_command_handler.select_stations(
+                    station_ids=station_ids, org_unit_id=org_unit_id, all_online=all_online,
+                    accessible_org_units=accessible_org_units
+                )
+            except (TypeError, ValueError):
+                return web.json_response({'success': False, 'error': 'Некорректный station_ids'}, status=400)
+            if not selected:
+                return web.json_response({'success': False, 'error': 'Нет доступных станций по фильтру'}, status=404)
+
+            job = self.bulk_command_handler.start_job(
+                command, params, list(selected), concurrency, timeout, user['user_id'],
+                org_unit_ids=set(selected.values())
+            )
+            return web.json_response({'success': True, 'data': job.to_dict(include_results=False)}, status=202)
+
+        except Exception as e:
+            logger.error(f"Ошибка запуска массовой команды: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def list_jobs(self, request: Request) -> Response:
+        """GET /api/bulk-commands - Задания процесса, доступные администратору (без результатов по станциям)"""
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            user = self.get_user_from_request(request)
+            accessible_org_units = await get_admin_accessible_org_units(self.db_pool, user['user_id'])
+            jobs = [
+                job.to_dict(include_results=False) for job in self.bulk_command_handler.jobs.values()
+                if job.visible_to(user['user_id'], accessible_org_units)
+            ]
+            return web.json_response({'success': True, 'data': list(reversed(jobs))})
+        except Exception as e:
+            logger.error(f"Ошибка получения заданий массовых команд: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def get_job(self, request: Request) -> Response:
+        """GET /api/bulk-commands/{job_id} - Прогресс и результаты по станциям"""
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            job = await self._visible_job(request, int(request.match_info['job_id']))
+            if not job:
+                return web.json_response({'success': False, 'error': 'Задание не найдено'}, status=404)
+            return web.json_response({'success': True, 'data': job.to_dict()})
+        except ValueError:
+            return web.json_response({'success': False, 'error': 'Некорректный job_id'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка получения задания массовой команды: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def cancel_job(self, request: Request) -> Response:
+        """POST /api/bulk-commands/{job_id}/cancel - Остановка задания"""
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            job_id = int(request.match_info['job_id'])
+            if not await self._visible_job(request, job_id) or not self.bulk_command_handler.cancel_job(job_id):
+                return web.json_response({
+                    'success': False,
+                    'error': 'Задание не найдено или уже завершено'
+                }, status=404)
+            return web.json_response({'success': True, 'message': f'Задание {job_id} останавливается'})
+        except ValueError:
+            return web.json_response({'success': False, 'error': 'Некорректный job_id'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка остановки задания массовой команды: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    def running_jobs(self) -> int:
+        return sum(job.status == 'running' for job in self.bulk_command_handler.jobs.values())
+
+    def setup_routes(self, app):
+        """Регистрирует маршруты"""
+        app.router.add_post('/api/bulk-commands', self.create_job)
+        app.router.add_get('/api/bulk-commands', self.list_jobs)
+        app.router.add_get('/api/bulk-commands/{job_id}', self.get_job)
+        app.router.add_post('/api/bulk-commands/{job_id}/cancel', self.cancel_job)
@@ -7,6 +7,8 @@ from aiohttp.web import Request, Response
 import aiomysql
 from datetime import datetime, timedelta
 from utils.soft_delete import SoftDeleteMixin
+from utils.hard_delete_cleanup import CLEANUP_TABLES, hard_delete_cleanup
+from utils.json_utils import serialize_for_json
 from utils.centralized_logger import get_logger
 
 
@@ -96,7 +98,10 @@ class HardDeleteAPI:
             return web.json_response({'error': f'Ошибка при удалении: {str(e)}'}, status=500)
     
     async def cleanup_old_deleted(self, request: Request) -> Response:
-        """DELETE /api/hard-delete/cleanup - Удалить старые записи с is_deleted = 1"""
+        """
+        DELETE /api/hard-delete/cleanup - Запускает фоновую очистку старых записей с is_deleted = 1
+        Удаление идет частями (utils/hard_delete_cleanup.py), прогресс - в /api/hard-delete/cleanup/jobs
+        """
         try:
             # Проверка авторизации
             user = request.get('user')
@@ -110,62 +115,92 @@ class HardDeleteAPI:
             # Получение параметров
             data = await request.json()
             entity_type = data.get('entity_type')
-            days_old = data.get('days_old', 90)  # По умолчанию 90 дней
+            days_old = int(data.get('days_old', 90))  # По умолчанию 90 дней
             
             if not entity_type:
                 return web.json_response({'error': 'Необходимо указать entity_type'}, status=400)
             
-            # Маппинг типов на таблицы
-            table_mapping = {
-                'user': 'app_user',
-                'station': 'station',
-                'powerbank': 'powerbank',
-                'org_unit': 'org_unit',
-                'order': 'orders',
-                'user_role': 'user_role',
-                'user_favorites': 'user_favorites'
-            }
-            
-            if entity_type not in table_mapping:
+            if entity_type not in CLEANUP_TABLES:
                 return web.json_response({'error': f'Неподдерживаемый тип: {entity_type}'}, status=400)
             
-            table = table_mapping[entity_type]
-            
             # Вычисляем дату отсечки
             cutoff_date = datetime.now() - timedelta(days=days_old)
             
-            # Удаляем старые записи
-            async with self.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    # Для powerbank используем power_er = 5, для остальных - только по deleted_at
-                    if table == 'powerbank':
-                        query = f"""
-                            DELETE FROM `{table}` 
-                            WHERE power_er = 5 AND status = 'system_error'
-                            AND deleted_at < %s
-                        """
-                    else:
-                        query = f"""
-                            DELETE FROM `{table}` 
-                            WHERE deleted_at < %s
-                        """
-                    await cur.execute(query, (cutoff_date,))
-                    await conn.commit()
-                    
-                    deleted_count = cur.rowcount
+            job = await hard_delete_cleanup.start(entity_type, cutoff_date, user['user_id'])
             
             return web.json_response({
                 'success': True,
-                'deleted_count': deleted_count,
-                'message': f'Удалено {deleted_count} записей {entity_type} старше {days_old} дней'
-            })
+                'job': job,
+                'message': f'Очистка {entity_type} запущена: записей старше {job["cutoff"]} - {job["total"]}'
+            }, status=202)
             
+        except ValueError:
+            return web.json_response({'error': 'Некорректный days_old'}, status=400)
         except Exception as e:
-            logger.error(f"Ошибка при очистке старых записей: {e}", exc_info=True)
+            logger.error(f"Ошибка при запуске очистки старых записей: {e}", exc_info=True)
             return web.json_response({'error': f'Ошибка при очистке: {str(e)}'}, status=500)
     
+    async def get_cleanup_jobs(self, request: Request) -> Response:
+        """GET /api/hard-delete/cleanup/jobs - Последние задания очистки"""
+        try:
+            user = request.get('user')
+            if not user:
+                return web.json_response({'error': 'Требуется авторизация'}, status=401)
+            
+            if not await self._check_service_admin(user['user_id']):
+                return web.json_response({'error': 'Недостаточно прав'}, status=403)
+            
+            jobs = await hard_delete_cleanup.list()
+            return web.json_response({'success': True, 'jobs': jobs})
+            
+        except Exception as e:
+            logger.error(f"Ошибка при получении заданий очистки: {e}", exc_info=True)
+            return web.json_response({'error': f'Ошибка: {str(e)}'}, status=500)
+    
+    async def get_cleanup_job(self, request: Request) -> Response:
+        """GET /api/hard-delete/cleanup/jobs/{job_id} - Прогресс задания очистки"""
+        try:
+            user = request.get('user')
+            if not user:
+                return web.json_response({'error': 'Требуется авторизация'}, status=401)
+            
+            if not await self._check_service_admin(user['user_id']):
+                return web.json_response({'error': 'Недостаточно прав'}, status=403)
+            
+            job = await hard_delete_cleanup.get(int(request.match_info['job_id']))
+            if not job:
+                return web.json_response({'error': 'Задание не найдено'}, status=404)
+            return web.json_response({'success': True, 'job': job})
+            
+        except ValueError:
+            return web.json_response({'error': 'Некорректный ID задания'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка при получении задания очистки: {e}", exc_info=True)
+            return web.json_response({'error': f'Ошибка: {str(e)}'}, status=500)
+    
+    async def cancel_cleanup_job(self, request: Request) -> Response:
+        """POST /api/hard-delete/cleanup/jobs/{job_id}/cancel - Остановка задания после текущей части"""
+        try:
+            user = request.get('user')
+            if not user:
+                return web.json_response({'error': 'Требуется авторизация'}, status=401)
+            
+            if not await self._check_service_admin(user['user_id']):
+                return web.json_response({'error': 'Недостаточно прав'}, status=403)
+            
+            job_id = int(request.match_info['job_id'])
+            if not await hard_delete_cleanup.cancel(job_id):
+                return web.json_response({'error': 'Задание не выполняется'}, status=409)
+            return web.json_response({'success': True, 'message': f'Задание {job_id} будет остановлено'})
+            
+        except ValueError:
+            return web.json_response({'error': 'Некорректный ID задания'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка при отмене задания очистки: {e}", exc_info=True)
+            return web.json_response({'error': f'Ошибка: {str(e)}'}, status=500)
+    
     async def get_cleanup_candidates(self, request: Request) -> Response:
-        """GET /api/hard-delete/cleanup/preview - Список записей для очистки"""
+        """GET /api/hard-delete/cleanup/preview - Число записей для очистки и первые 10"""
         try:
             # Проверка авторизации
             user = request.get('user')
@@ -183,63 +218,26 @@ class HardDeleteAPI:
             if not entity_type:
                 return web.json_response({'error': 'Необходимо указать entity_type'}, status=400)
             
-            # Маппинг типов на таблицы
-            table_mapping = {
-                'user': 'app_user',
-                'station': 'station',
-                'powerbank': 'powerbank',
-                'org_unit': 'org_unit',
-                'order': 'orders'
-            }
-            
-            if entity_type not in table_mapping:
+            if entity_type not in CLEANUP_TABLES:
                 return web.json_response({'error': f'Неподдерживаемый тип: {entity_type}'}, status=400)
             
-            table = table_mapping[entity_type]
             cutoff_date = datetime.now() - timedelta(days=days_old)
             
-            # Получаем кандидатов на удаление
-            async with self.db_pool.acquire() as conn:
-                async with conn.cursor(aiomysql.DictCursor) as cur:
-                    # Для powerbank используем power_er = 5, для остальных - только по deleted_at
-                    if table == 'powerbank':
-                        query = f"""
-                            SELECT * FROM `{table}` 
-                            WHERE power_er = 5 AND status = 'system_error'
-                            AND deleted_at < %s
-                            LIMIT 100
-                        """
-                        count_query = f"""
-                            SELECT COUNT(*) as count FROM `{table}` 
-                            WHERE power_er = 5 AND status = 'system_error'
-                            AND deleted_at < %s
-                        """
-                    else:
-                        query = f"""
-                            SELECT * FROM `{table}` 
-                            WHERE deleted_at < %s
-                            LIMIT 100
-                        """
-                        count_query = f"""
-                            SELECT COUNT(*) as count FROM `{table}` 
-                            WHERE deleted_at < %s
-                        """
-                    await cur.execute(query, (cutoff_date,))
-                    candidates = await cur.fetchall()
-                    
-                    # Подсчитываем общее количество
-                    await cur.execute(count_query, (cutoff_date,))
-                    total = (await cur.fetchone())['count']
+            # COUNT по индексу deleted_at и 10 самых старых строк вместо SELECT * LIMIT 100
+            total = await hard_delete_cleanup.count_candidates(entity_type, cutoff_date)
+            preview = await hard_delete_cleanup.preview(entity_type, cutoff_date) if total else []
             
             return web.json_response({
                 'success': True,
                 'entity_type': entity_type,
                 'days_old': days_old,
                 'total_candidates': total,
-                'preview': candidates[:10],  # Показываем первые 10
+                'preview': serialize_for_json(preview),
                 'message': f'Найдено {total} записей для удаления'
             })
             
+        except ValueError:
+            return web.json_response({'error': 'Некорректный days_old'}, status=400)
         except Exception as e:
             logger.error(f"Ошибка при получении кандидатов: {e}", exc_info=True)
             return web.json_response({'error': f'Ошибка: {str(e)}'}, status=500)
@@ -68,7 +68,7 @@ class OrdersCRUD(BaseAPI):
                     # Если это административный заказ, логируем действие
                     if is_admin_order and admin_user_id:
                         from models.action_log import ActionLog
-                        await ActionLog.create(
+                        await ActionLog.log(
                             self.db_pool,
                             user_id=admin_user_id,
                             action_type='order_create',
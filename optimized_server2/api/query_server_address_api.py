@@ -8,6 +8,7 @@ from datetime import datetime
 from utils.centralized_logger import get_logger
 from models.station import Station
 from handlers.query_server_address import QueryServerAddressHandler
+from utils.command_rpc import request_timeout, request_wait
 from utils.auth_middleware import jwt_middleware
 
 
@@ -23,8 +24,9 @@ class QueryServerAddressAPI:
     @jwt_middleware
     async def query_server_address(self, request: Request) -> Response:
         """
-        Запрашивает адрес сервера станции
+        Запрашивает адрес сервера станции и ждет ответ
         POST /api/query-server-address
+        {"station_id": 1, "wait": true, "timeout": 10} - wait=false только отправляет запрос
         """
         user_id = request['user']['user_id']
         
@@ -35,20 +37,30 @@ class QueryServerAddressAPI:
             if not station_id:
                 return web.json_response({"error": "Не указан ID станции"}, status=400)
             
+            wait = request_wait(data.get('wait'))
+            if wait is None:
+                return web.json_response({"error": "wait должен быть true или false"}, status=400)
+            
             station = await Station.get_by_id(self.db_pool, station_id)
             if not station:
                 return web.json_response({"error": "Станция не найдена"}, status=404)
             
-            response = await self.query_server_address_handler.send_query_server_address_request(station_id)
+            response = await self.query_server_address_handler.send_query_server_address_request(
+                station_id, wait=wait, timeout=request_timeout(data.get('timeout'))
+            )
             
             if response["success"]:
-                return web.json_response({
+                result = {
                     "success": True,
                     "message": response["message"],
                     "packet_hex": response.get("packet_hex")
-                })
+                }
+                if "server_address" in response:
+                    result["request_id"] = response["request_id"]
+                    result["server_address"] = response["server_address"]
+                return web.json_response(result)
             else:
-                return web.json_response({"error": response["message"]}, status=500)
+                return web.json_response({"error": response["message"]}, status=504 if response.get("timeout") else 500)
                 
         except Exception as e:
             self.logger.error(f"Администратор {user_id}: Непредвиденная ошибка при запросе адреса сервера: {e}", exc_info=True)
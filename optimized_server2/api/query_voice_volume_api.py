@@ -8,6 +8,7 @@ from datetime import datetime
 
 from models.station import Station
 from handlers.query_voice_volume import QueryVoiceVolumeHandler
+from utils.command_rpc import request_timeout, request_wait
 from utils.centralized_logger import get_logger
 
 
@@ -22,8 +23,9 @@ class QueryVoiceVolumeAPI:
     
     async def query_voice_volume(self, request: Request) -> Response:
         """
-        Запрашивает уровень громкости станции
+        Запрашивает уровень громкости станции и ждет ответ
         POST /api/query-voice-volume
+        {"station_id": 1, "wait": true, "timeout": 10} - wait=false только отправляет запрос
         """
         try:
             # Получаем данные из запроса
@@ -44,16 +46,29 @@ class QueryVoiceVolumeAPI:
                     'error': f'Станция с ID {station_id} не найдена'
                 }, status=404)
             
+            wait = request_wait(data.get('wait'))
+            if wait is None:
+                return web.json_response({
+                    'success': False,
+                    'error': 'wait должен быть true или false'
+                }, status=400)
+            
             # Отправляем запрос уровня громкости
-            result = await self.voice_volume_handler.send_voice_volume_request(station_id)
+            result = await self.voice_volume_handler.send_voice_volume_request(
+                station_id, wait=wait, timeout=request_timeout(data.get('timeout'))
+            )
             
             if result['success']:
-                return web.json_response({
+                response = {
                     'success': True,
                     'message': result['message'],
                     'station_box_id': result['station_box_id'],
                     'packet_hex': result['packet_hex']
-                })
+                }
+                if 'voice_volume' in result:
+                    response['request_id'] = result['request_id']
+                    response['voice_volume'] = result['voice_volume']
+                return web.json_response(response)
             else:
                 # Логируем ошибку
                 self.logger.error(f"API: Ошибка запроса уровня громкости для станции {station_id}: {result['error']}")
@@ -61,7 +76,7 @@ class QueryVoiceVolumeAPI:
                 return web.json_response({
                     'success': False,
                     'error': result['error']
-                }, status=500)
+                }, status=504 if result.get('timeout') else 500)
                 
         except Exception as e:
             error_msg = f"Ошибка API запроса уровня громкости: {str(e)}"
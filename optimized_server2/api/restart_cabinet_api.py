@@ -4,6 +4,7 @@ API для команды перезагрузки кабинета
 from aiohttp import web
 from handlers.restart_cabinet import RestartCabinetHandler
 from handlers.auth_handler import AuthHandler
+from utils.command_rpc import request_timeout, request_wait
 from models.user import User
 from utils.centralized_logger import get_logger
 from datetime import datetime
@@ -59,15 +60,28 @@ class RestartCabinetAPI:
                     'error': 'ID станции обязателен'
                 }, status=400)
             
+            wait = request_wait(data.get('wait'))
+            if wait is None:
+                return web.json_response({
+                    'error': 'wait должен быть true или false'
+                }, status=400)
+            
             # Отправляем команду перезагрузки
-            result = await self.restart_handler.send_restart_command(station_id, user.user_id)
+            result = await self.restart_handler.send_restart_command(
+                station_id, user.user_id,
+                wait=wait, timeout=request_timeout(data.get('timeout'))
+            )
             
             if result['success']:
-                return web.json_response({
+                response = {
                     'message': result['message'],
                     'station_box_id': result['station_box_id'],
                     'packet_hex': result['packet_hex']
-                })
+                }
+                if 'confirmed' in result:
+                    response['confirmed'] = result['confirmed']
+                    response['request_id'] = result['request_id']
+                return web.json_response(response)
             else:
                 return web.json_response({
                     'error': result['error']
@@ -79,7 +79,7 @@ class ReturnEndpoints:
             if user_id:
                 user_id = int(user_id)
             
-            result = await self.return_handler.get_pending_error_returns()
+            result = await self.return_handler.get_pending_error_returns(user_id or None)
             
             if result.get('success'):
                 return web.json_response(result)
@@ -0,0 +1,143 @@
+"""
+API для просмотра служебных метрик TCP сервера
+"""
+import hmac
+
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+from api.base_api import BaseAPI
+from config.settings import METRICS_CONFIG
+from utils.centralized_logger import get_logger
+from utils.gateway_cluster import collect_from_workers
+from utils.loop_watchdog import loop_watchdog
+from utils.runtime_metrics import runtime_metrics, render_prometheus
+
+
+logger = get_logger('server_metrics_api')
+
+
+class ServerMetricsAPI(BaseAPI):
+    """API служебных метрик сервера (только для service_admin)"""
+
+    def __init__(self, db_pool, login_admission=None, gateway_mirror=None, gateway_router=None):
+        super().__init__(db_pool)
+        self.login_admission = login_admission
+        # Связь с воркерами шлюза, когда станции обслуживают другие процессы
+        self.gateway_mirror = gateway_mirror
+        self.gateway_router = gateway_router
+
+    async def _check_access(self, request: Request):
+        """Проверяет авторизацию и права service_admin, возвращает ответ с ошибкой или None"""
+        is_auth, error_response = self.check_auth(request)
+        if not is_auth:
+            return error_response
+
+        user = self.get_user_from_request(request)
+        if not await self.check_service_admin(user['user_id']):
+            return web.json_response({'success': False, 'error': 'Недостаточно прав'}, status=403)
+        return None
+
+    async def get_login_admission(self, request: Request) -> Response:
+        """GET /api/admin/server/login-admission - Метрики очереди логинов станций"""
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            if not self.login_admission:
+                return web.json_response({
+                    'success': False,
+                    'error': 'Контроль логинов не инициализирован'
+                }, status=503)
+
+            return web.json_response({
+                'success': True,
+                'data': self.login_admission.get_stats()
+            })
+        except Exception as e:
+            logger.error(f"Ошибка получения метрик логинов: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def _collect(self, local: dict, method: str, params: dict = None) -> list:
+        """Данные этого процесса и воркеров шлюза (без повтора своего процесса)"""
+        results = [local]
+        if self.gateway_mirror and self.gateway_router:
+            try:
+                for result in await collect_from_workers(self.gateway_mirror, self.gateway_router, method, params):
+                    if result['process'] != local['process']:
+                        results.append(result)
+            except Exception as e:
+                logger.error(f"Ошибка получения {method} с воркеров шлюза: {e}")
+        return results
+
+    async def _collect_snapshots(self) -> list:
+        """Метрики этого процесса и воркеров шлюза"""
+        return await self._collect(runtime_metrics.snapshot(), 'metrics')
+
+    def _metrics_access_allowed(self, request: Request) -> bool:
+        """
+        Только с токеном METRICS_TOKEN: за обратным прокси на том же хосте
+        request.remote всегда localhost, поэтому по адресу доступ не проверяется
+        """
+        token = METRICS_CONFIG.get('token')
+        if not token:
+            return False
+        auth_header = request.headers.get('Authorization', '')
+        return hmac.compare_digest(auth_header, f'Bearer {token}')
+
+    async def get_prometheus_metrics(self, request: Request) -> Response:
+        """GET /metrics - Метрики в текстовом формате Prometheus"""
+        if not METRICS_CONFIG.get('token'):
+            return web.Response(status=403, text='metrics disabled: METRICS_TOKEN is not set\n')
+        if not self._metrics_access_allowed(request):
+            return web.Response(status=403, text='forbidden\n')
+        snapshots = await self._collect_snapshots()
+        return web.Response(
+            text=render_prometheus(snapshots),
+            content_type='text/plain',
+            charset='utf-8'
+        )
+
+    async def get_runtime_metrics(self, request: Request) -> Response:
+        """GET /api/admin/server/metrics - Метрики процессов сервера (JSON)"""
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            return web.json_response({
+                'success': True,
+                'data': {'processes': await self._collect_snapshots()}
+            })
+        except Exception as e:
+            logger.error(f"Ошибка получения метрик сервера: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def get_loop_stalls(self, request: Request) -> Response:
+        """GET /api/admin/server/loop-stalls?limit=20 - Блокировки цикла событий со стеками"""
+        try:
+            error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            try:
+                limit = max(1, min(int(request.query.get('limit', 20)), 100))
+            except ValueError:
+                return web.json_response({'success': False, 'error': 'Некорректный limit'}, status=400)
+
+            local = {'process': runtime_metrics.process_name, **loop_watchdog.get_stats(limit)}
+            return web.json_response({
+                'success': True,
+                'data': {'processes': await self._collect(local, 'loop_stalls', {'limit': limit})}
+            })
+        except Exception as e:
+            logger.error(f"Ошибка получения блокировок цикла событий: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    def setup_routes(self, app):
+        """Регистрирует маршруты"""
+        app.router.add_get('/api/admin/server/login-admission', self.get_login_admission)
+        app.router.add_get('/api/admin/server/metrics', self.get_runtime_metrics)
+        app.router.add_get('/api/admin/server/loop-stalls', self.get_loop_stalls)
+        app.router.add_get('/metrics', self.get_prometheus_metrics)
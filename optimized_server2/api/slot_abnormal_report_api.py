@@ -5,6 +5,7 @@ from typing import Dict, Any, List, Optional
 from datetime import datetime
 
 from models.station import Station
+from utils.stats_rollup import stats_rollups
 
 
 class SlotAbnormalReportAPI:
@@ -115,6 +116,18 @@ class SlotAbnormalReportAPI:
                         }
                     }
                 
+                # Сводные счетчики (utils/stats_rollup.py), если установлены
+                if await stats_rollups.ready(self.db_pool):
+                    by_event_type = await stats_rollups.abnormal_by_event_type(self.db_pool, accessible_org_units)
+                    return {
+                        "success": True,
+                        "statistics": {
+                            "total_reports": sum(by_event_type.values()),
+                            "by_event_type": by_event_type,
+                            "by_station": await stats_rollups.abnormal_top_stations(self.db_pool, accessible_org_units)
+                        }
+                    }
+                
                 # Получаем статистику с фильтрацией
                 async with self.db_pool.acquire() as conn:
                     async with conn.cursor(aiomysql.DictCursor) as cur:
@@ -0,0 +1,186 @@
+"""
+API телеметрии слотов: графики min/max/avg по станции или повербанку за период
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+from api.base_api import BaseAPI
+from config.settings import TELEMETRY_CONFIG
+from models.powerbank import Powerbank
+from models.station import Station
+from utils.centralized_logger import get_logger
+from utils.org_unit_utils import get_admin_accessible_org_units
+from utils.telemetry_store import METRICS
+from utils.time_utils import MOSCOW_TZ, from_timestamp_moscow, moscow_timestamp
+
+
+logger = get_logger('telemetry_api')
+
+DEFAULT_PERIOD = 24 * 3600
+DEFAULT_POINTS = 200
+
+
+def parse_time(value: Optional[str], default: float) -> float:
+    """Время из запроса (ISO 8601 или unix timestamp) в unix timestamp; без зоны - московское"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=MOSCOW_TZ)
+        return moment.timestamp()
+
+
+def choose_step(start: float, end: float, points: int) -> Tuple[int, int]:
+    """Шаг графика и размер интервала агрегатов, из которых он строится"""
+    resolutions = sorted(TELEMETRY_CONFIG['resolutions'])
+    step = max(int((end - start) // max(points, 1)) + 1, resolutions[0])
+    resolution = max(r for r in resolutions if r <= step)
+    # Шаг кратен интервалу агрегата, чтобы агрегат не делился между точками
+    step = -(-step // resolution) * resolution
+    return step, resolution
+
+
+class TelemetryAPI(BaseAPI):
+    """API графиков телеметрии (для администраторов)"""
+
+    def __init__(self, db_pool):
+        super().__init__(db_pool)
+
+    async def _check_access(self, request: Request, org_unit_id: Optional[int]):
+        """Проверяет авторизацию и доступ администратора к подразделению, возвращает ответ с ошибкой или None"""
+        is_auth, error_response = self.check_auth(request)
+        if not is_auth:
+            return error_response
+
+        user = self.get_user_from_request(request)
+        if not await self.check_admin_permissions(user['user_id']):
+            return web.json_response({'success': False, 'error': 'Недостаточно прав'}, status=403)
+        accessible_org_units = await get_admin_accessible_org_units(self.db_pool, user['user_id'])
+        if accessible_org_units is not None and org_unit_id not in accessible_org_units:
+            return web.json_response({'success': False, 'error': 'Нет доступа к подразделению'}, status=403)
+        return None
+
+    @staticmethod
+    def _range(request: Request) -> Tuple[float, float, int]:
+        """Период и число точек из параметров from, to, points"""
+        end = parse_time(request.query.get('to'), moscow_timestamp())
+        start = parse_time(request.query.get('from'), end - DEFAULT_PERIOD)
+        if start >= end:
+            raise ValueError('from должен быть раньше to')
+        points = min(int(request.query.get('points', DEFAULT_POINTS)), TELEMETRY_CONFIG['max_points'])
+        if points < 1:
+            raise ValueError('points должен быть положительным')
+        return start, end, points
+
+    async def _series(self, where: str, params: list, start: float, end: float, points: int,
+                      by_slot: bool) -> Tuple[int, dict]:
+        """Точки графика из slot_telemetry; возвращает шаг и {slot_number | None: [точки]}"""
+        step, resolution = choose_step(start, end, points)
+        columns = ', '.join(
+            f'MIN({metric}_min), MAX({metric}_max), SUM({metric}_sum)' for metric in METRICS
+        )
+        group = 'slot_number, ' if by_slot else ''
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT {'slot_number' if by_slot else 'NULL'}, bucket_ts DIV %s * %s AS point_ts,
+                           SUM(samples), {columns}
+                    FROM slot_telemetry
+                    WHERE {where} AND bucket_seconds = %s AND bucket_ts >= %s AND bucket_ts < %s
+                    GROUP BY {group}point_ts
+                    ORDER BY {group}point_ts
+                """, [step, step] + params + [resolution, int(start - start % resolution), int(end)])
+                rows = await cur.fetchall()
+
+        series = {}
+        for row in rows:
+            samples = int(row[2])
+            point = {'ts': from_timestamp_moscow(int(row[1])).isoformat(), 'samples': samples}
+            for position, metric in enumerate(METRICS):
+                minimum, maximum, total = row[3 + position * 3:6 + position * 3]
+                point[metric] = {
+                    'min': int(minimum),
+                    'max': int(maximum),
+                    'avg': round(float(total) / samples, 2) if samples else None,
+                }
+            series.setdefault(row[0], []).append(point)
+        return step, series
+
+    async def get_station_telemetry(self, request: Request) -> Response:
+        """
+        GET /api/telemetry/stations/{station_id}?from=&to=&points=&slot= - Графики слотов станции
+        """
+        try:
+            station_id = int(request.match_info['station_id'])
+            station = await Station.get_by_id(self.db_pool, station_id)
+            if not station:
+                return web.json_response({'success': False, 'error': 'Станция не найдена'}, status=404)
+            error_response = await self._check_access(request, station.org_unit_id)
+            if error_response:
+                return error_response
+
+            start, end, points = self._range(request)
+            where, params = 'station_id = %s', [station_id]
+            if request.query.get('slot'):
+                where += ' AND slot_number = %s'
+                params.append(int(request.query['slot']))
+            step, series = await self._series(where, params, start, end, points, by_slot=True)
+            return web.json_response({
+                'success': True,
+                'station_id': station_id,
+                'box_id': station.box_id,
+                'from': from_timestamp_moscow(start).isoformat(),
+                'to': from_timestamp_moscow(end).isoformat(),
+                'step_seconds': step,
+                'slots': [
+                    {'slot_number': slot_number, 'points': slot_points}
+                    for slot_number, slot_points in sorted(series.items())
+                ],
+            })
+        except ValueError as e:
+            return web.json_response({'success': False, 'error': f'Некорректные параметры: {e}'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка получения телеметрии станции: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def get_powerbank_telemetry(self, request: Request) -> Response:
+        """
+        GET /api/telemetry/powerbanks/{powerbank_id}?from=&to=&points= - График повербанка во всех станциях
+        """
+        try:
+            powerbank_id = int(request.match_info['powerbank_id'])
+            powerbank = await Powerbank.get_by_id(self.db_pool, powerbank_id)
+            if not powerbank:
+                return web.json_response({'success': False, 'error': 'Повербанк не найден'}, status=404)
+            error_response = await self._check_access(request, powerbank.org_unit_id)
+            if error_response:
+                return error_response
+
+            start, end, points = self._range(request)
+            step, series = await self._series('powerbank_id = %s', [powerbank_id], start, end, points,
+                                              by_slot=False)
+            return web.json_response({
+                'success': True,
+                'powerbank_id': powerbank_id,
+                'serial_number': powerbank.serial_number,
+                'from': from_timestamp_moscow(start).isoformat(),
+                'to': from_timestamp_moscow(end).isoformat(),
+                'step_seconds': step,
+                'points': series.get(None, []),
+            })
+        except ValueError as e:
+            return web.json_response({'success': False, 'error': f'Некорректные параметры: {e}'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка получения телеметрии повербанка: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    def setup_routes(self, app):
+        """Регистрирует маршруты"""
+        app.router.add_get('/api/telemetry/stations/{station_id}', self.get_station_telemetry)
+        app.router.add_get('/api/telemetry/powerbanks/{powerbank_id}', self.get_powerbank_telemetry)
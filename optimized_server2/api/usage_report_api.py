@@ -0,0 +1,109 @@
+"""
+API суточной сводки использования повербанков (utils/usage_rollup.py)
+"""
+from datetime import date, timedelta
+
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+from api.base_api import BaseAPI
+from config.settings import USAGE_ROLLUP_CONFIG
+from models.station import Station
+from utils.centralized_logger import get_logger
+from utils.org_unit_utils import get_admin_accessible_org_units
+from utils.time_utils import get_moscow_time
+from utils.usage_rollup import usage_rollup
+
+
+logger = get_logger('usage_report_api')
+
+DEFAULT_PERIOD_DAYS = 30
+
+
+class UsageReportAPI(BaseAPI):
+    """API отчетов по выдачам (для администраторов)"""
+
+    def __init__(self, db_pool):
+        super().__init__(db_pool)
+
+    async def _check_access(self, request: Request):
+        """Проверяет авторизацию и права администратора, возвращает (user, ответ с ошибкой)"""
+        is_auth, error_response = self.check_auth(request)
+        if not is_auth:
+            return None, error_response
+
+        user = self.get_user_from_request(request)
+        if not await self.check_admin_permissions(user['user_id']):
+            return None, web.json_response({'success': False, 'error': 'Недостаточно прав'}, status=403)
+        return user, None
+
+    async def get_report(self, request: Request) -> Response:
+        """
+        GET /api/analytics/usage?from=YYYY-MM-DD&to=YYYY-MM-DD&org_unit_id=&station_id=
+        Выдачи, длительность аренды, просрочки и выбросы по дням: итоги подразделений
+        или строки одной станции
+        """
+        try:
+            user, error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            end_day = date.fromisoformat(request.query['to']) if request.query.get('to') else \
+                get_moscow_time().date() - timedelta(days=1)
+            start_day = date.fromisoformat(request.query['from']) if request.query.get('from') else \
+                end_day - timedelta(days=DEFAULT_PERIOD_DAYS - 1)
+            if start_day > end_day:
+                return web.json_response({'success': False, 'error': 'from должен быть не позже to'}, status=400)
+            if (end_day - start_day).days >= USAGE_ROLLUP_CONFIG['max_report_days']:
+                return web.json_response({
+                    'success': False,
+                    'error': f"Период не больше {USAGE_ROLLUP_CONFIG['max_report_days']} дней"
+                }, status=400)
+            org_unit_id = int(request.query['org_unit_id']) if request.query.get('org_unit_id') else None
+            station_id = int(request.query['station_id']) if request.query.get('station_id') else None
+
+            accessible_org_units = await get_admin_accessible_org_units(self.db_pool, user['user_id'])
+            if station_id is not None:
+                station = await Station.get_by_id(self.db_pool, station_id)
+                if not station:
+                    return web.json_response({'success': False, 'error': 'Станция не найдена'}, status=404)
+                org_unit_id = station.org_unit_id
+            org_unit_ids = accessible_org_units
+            if org_unit_id is not None:
+                if accessible_org_units is not None and org_unit_id not in accessible_org_units:
+                    return web.json_response({'success': False, 'error': 'Нет доступа к подразделению'}, status=403)
+                org_unit_ids = [org_unit_id]
+            if org_unit_ids == []:
+                return web.json_response({'success': True, 'computed_through': None, 'totals': {}, 'items': []})
+
+            report = await usage_rollup.report(start_day, end_day, org_unit_ids, station_id)
+            return web.json_response({
+                'success': True,
+                'from': start_day.isoformat(),
+                'to': end_day.isoformat(),
+                'running': usage_rollup.is_running,
+                **report,
+            })
+        except ValueError:
+            return web.json_response({'success': False, 'error': 'Некорректные параметры'}, status=400)
+        except Exception as e:
+            logger.error(f"Ошибка получения сводки использования: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    async def run_report(self, request: Request) -> Response:
+        """POST /api/analytics/usage/run - Досчитывает сводку (ждет окончания расчета)"""
+        try:
+            _, error_response = await self._check_access(request)
+            if error_response:
+                return error_response
+
+            result = await usage_rollup.run()
+            return web.json_response({'success': True, 'result': result})
+        except Exception as e:
+            logger.error(f"Ошибка расчета сводки использования: {e}")
+            return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+    def setup_routes(self, app):
+        """Регистрирует маршруты"""
+        app.router.add_get('/api/analytics/usage', self.get_report)
+        app.router.add_post('/api/analytics/usage/run', self.run_report)
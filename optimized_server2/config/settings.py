@@ -37,6 +37,165 @@ JWT_EXPIRATION_HOURS = 24
 # Настройки соединений
 CONNECTION_TIMEOUT = 30   # 30 секунд - таймаут для heartbeat
 HEARTBEAT_INTERVAL = 30   # 30 секунд
+# Соединение без heartbeat дольше этого времени закрывается
+HEARTBEAT_TIMEOUT_SECONDS = int(os.getenv("HEARTBEAT_TIMEOUT_SECONDS", "120"))
+
+# Колесо таймеров (таймауты heartbeat и ожидающих запросов)
+TIMER_WHEEL_CONFIG = {
+    "tick_ms": int(os.getenv("TIMER_WHEEL_TICK_MS", "100")),
+}
+
+# Команды станциям с ожиданием ответа (громкость, адрес сервера, перезагрузка, ICCID)
+COMMAND_RPC_CONFIG = {
+    "timeout": float(os.getenv("COMMAND_RPC_TIMEOUT", "10")),  # секунд ожидания ответа станции
+    "max_timeout": float(os.getenv("COMMAND_RPC_MAX_TIMEOUT", "30")),  # предел таймаута из запроса API
+}
+
+# Периодический опрос инвентаря подключенных станций (0x64)
+INVENTORY_POLL_CONFIG = {
+    "enabled": os.getenv("INVENTORY_POLL_ENABLED", "true").lower() == "true",
+    "period": float(os.getenv("INVENTORY_POLL_PERIOD", "600")),  # секунд между опросами станции
+    "jitter": float(os.getenv("INVENTORY_POLL_JITTER", "0.2")),  # разброс периода, доля
+    "rate": float(os.getenv("INVENTORY_POLL_RATE", "5")),  # запросов в секунду на весь шлюз
+    "abnormal_window": float(os.getenv("INVENTORY_POLL_ABNORMAL_WINDOW", "900")),  # секунд "недавней" аномалии
+    "min_interval": float(os.getenv("INVENTORY_POLL_MIN_INTERVAL", "60")),  # не чаще для опроса вне очереди
+}
+
+# Состояние подключенных станций в памяти (utils/fleet_state.py)
+FLEET_STATE_CONFIG = {
+    "flush_interval": float(os.getenv("FLEET_STATE_FLUSH_INTERVAL", "5")),  # секунд между записями last_seen
+    "flush_batch": int(os.getenv("FLEET_STATE_FLUSH_BATCH", "1000")),  # станций в одном UPDATE
+}
+
+# Телеметрия слотов: кольцевые буферы в памяти и агрегаты по интервалам в БД (utils/telemetry_store.py)
+TELEMETRY_CONFIG = {
+    "enabled": os.getenv("TELEMETRY_ENABLED", "true").lower() == "true",
+    "buffer_size": int(os.getenv("TELEMETRY_BUFFER_SIZE", "32")),  # замеров на слот в памяти (~1 КБ)
+    "flush_interval": float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "60")),  # секунд между записями в БД
+    # Размеры интервалов агрегатов в БД, секунд (запрос берет самый крупный, не больше шага графика)
+    "resolutions": tuple(int(value) for value in os.getenv("TELEMETRY_RESOLUTIONS", "300,3600,86400").split(",")),
+    "max_points": int(os.getenv("TELEMETRY_MAX_POINTS", "2000")),  # точек в ответе API
+}
+
+# Аналитика состояния аккумуляторов парка (utils/battery_health.py)
+BATTERY_HEALTH_CONFIG = {
+    "enabled": os.getenv("BATTERY_HEALTH_ENABLED", "true").lower() == "true",
+    "interval_hours": float(os.getenv("BATTERY_HEALTH_INTERVAL", "6")),  # часов между расчетами
+    "window_days": int(os.getenv("BATTERY_HEALTH_WINDOW_DAYS", "30")),  # период данных
+    "min_days": int(os.getenv("BATTERY_HEALTH_MIN_DAYS", "5")),  # дней с замерами для тренда SOH
+    # Пороги, при которых показатель дает 1 балл риска
+    "soh_drop_alert": float(os.getenv("BATTERY_HEALTH_SOH_DROP", "5")),  # падение SOH, % за 30 дней
+    "temperature_z_alert": float(os.getenv("BATTERY_HEALTH_TEMPERATURE_Z", "3.5")),  # робастный z-score
+    "abnormal_alert": float(os.getenv("BATTERY_HEALTH_ABNORMAL_PER_WEEK", "1")),  # аномалий в неделю
+    "keep_top": int(os.getenv("BATTERY_HEALTH_KEEP_TOP", "1000")),  # хранимых строк рейтинга
+}
+
+# Буферизованная запись журналов в БД пачками (utils/batch_writer.py)
+BATCH_WRITER_CONFIG = {
+    "abnormal_reports": {
+        "max_buffer": int(os.getenv("ABNORMAL_REPORTS_MAX_BUFFER", "20000")),  # строк в очереди
+        "batch_size": int(os.getenv("ABNORMAL_REPORTS_BATCH_SIZE", "500")),  # строк в одном INSERT
+        "flush_interval": float(os.getenv("ABNORMAL_REPORTS_FLUSH_INTERVAL", "2")),  # секунд до записи неполной пачки
+        "overflow": os.getenv("ABNORMAL_REPORTS_OVERFLOW", "drop_new"),  # drop_new или drop_oldest
+    },
+    "action_logs": {
+        "max_buffer": int(os.getenv("ACTION_LOGS_MAX_BUFFER", "20000")),  # строк в очереди
+        "batch_size": int(os.getenv("ACTION_LOGS_BATCH_SIZE", "200")),  # строк в одном INSERT
+        "flush_interval": float(os.getenv("ACTION_LOGS_FLUSH_INTERVAL", "1")),  # секунд до записи неполной пачки
+        "overflow": os.getenv("ACTION_LOGS_OVERFLOW", "drop_oldest"),  # drop_new или drop_oldest
+    },
+}
+
+# Сводные счетчики статистики панели администратора (utils/stats_rollup.py)
+STATS_ROLLUP_CONFIG = {
+    "enabled": os.getenv("STATS_ROLLUP_ENABLED", "true").lower() == "true",
+    "ready_cache_seconds": float(os.getenv("STATS_ROLLUP_READY_CACHE", "300")),  # секунд между проверками триггеров
+}
+
+# Суточная сводка использования по заказам (utils/usage_rollup.py)
+USAGE_ROLLUP_CONFIG = {
+    "enabled": os.getenv("USAGE_ROLLUP_ENABLED", "true").lower() == "true",
+    "run_hour": int(os.getenv("USAGE_ROLLUP_RUN_HOUR", "3")),  # час ночного расчета по Москве
+    "recompute_days": int(os.getenv("USAGE_ROLLUP_RECOMPUTE_DAYS", "3")),  # дней, пересчитываемых каждый запуск
+    "max_report_days": int(os.getenv("USAGE_ROLLUP_MAX_REPORT_DAYS", "366")),  # дней в одном отчете
+}
+
+# Веса балла при автоматическом выборе повербанка для выдачи (utils/powerbank_scoring.py)
+BORROW_SCORING_CONFIG = {
+    "level_weight": float(os.getenv("BORROW_SCORE_LEVEL_WEIGHT", "1.0")),  # за 1% заряда
+    "soh_weight": float(os.getenv("BORROW_SCORE_SOH_WEIGHT", "0.3")),  # за 1% SOH
+    "error_penalty": float(os.getenv("BORROW_SCORE_ERROR_PENALTY", "1000")),  # штраф за ошибки слота
+}
+
+# Массовые команды станциям (задания /api/bulk-commands)
+BULK_COMMAND_CONFIG = {
+    "default_concurrency": int(os.getenv("BULK_COMMAND_CONCURRENCY", "20")),  # станций одновременно
+    "max_concurrency": int(os.getenv("BULK_COMMAND_MAX_CONCURRENCY", "200")),
+    "max_jobs": int(os.getenv("BULK_COMMAND_MAX_JOBS", "50")),  # хранимых заданий в памяти процесса
+    "progress_interval": float(os.getenv("BULK_COMMAND_PROGRESS_INTERVAL", "1.0")),  # секунд между уведомлениями
+}
+
+# Ограничение одновременных логинов станций (защита пула БД при массовом переподключении)
+LOGIN_ADMISSION_CONFIG = {
+    "max_concurrent": int(os.getenv("LOGIN_MAX_CONCURRENT", "8")),
+}
+
+# Цикл событий: auto - uvloop, если установлен; uvloop; asyncio
+EVENT_LOOP_POLICY = os.getenv("EVENT_LOOP", "auto")
+
+# Опции сокетов станций (порт -> переопределения в TCP_SOCKET_PORT_OPTIONS,
+# JSON вида {"10001": {"keepalive_idle": 30}}); 0 у буферов - размер ядра по умолчанию
+TCP_SOCKET_CONFIG = {
+    "nodelay": os.getenv("TCP_NODELAY", "true").lower() == "true",
+    "keepalive": os.getenv("TCP_KEEPALIVE", "true").lower() == "true",
+    "keepalive_idle": int(os.getenv("TCP_KEEPALIVE_IDLE", "60")),  # секунд до первой проверки
+    "keepalive_interval": int(os.getenv("TCP_KEEPALIVE_INTERVAL", "15")),  # секунд между проверками
+    "keepalive_count": int(os.getenv("TCP_KEEPALIVE_COUNT", "4")),  # проверок до разрыва
+    "rcvbuf": int(os.getenv("TCP_RCVBUF", "0")),
+    "sndbuf": int(os.getenv("TCP_SNDBUF", "0")),
+}
+TCP_SOCKET_PORT_OPTIONS = os.getenv("TCP_SOCKET_PORT_OPTIONS", "")
+
+# Многопроцессный шлюз станций (server.py --workers N)
+GATEWAY_CLUSTER_CONFIG = {
+    "workers": int(os.getenv("GATEWAY_WORKERS", "1")),
+    # Каталог Unix сокетов (создается с правами 0700): RuntimeDirectory systemd, XDG_RUNTIME_DIR или домашний
+    "socket_dir": os.getenv("GATEWAY_SOCKET_DIR") or os.path.join(
+        os.getenv("RUNTIME_DIRECTORY") or os.getenv("XDG_RUNTIME_DIR") or os.path.expanduser("~"), "zaryd_gateway"
+    ),
+    "state_sync_interval": float(os.getenv("GATEWAY_STATE_SYNC_INTERVAL", "1.0")),  # секунд
+    "call_timeout": float(os.getenv("GATEWAY_CALL_TIMEOUT", "60")),  # секунд, больше ожидания выдачи
+    # Режим запуска: all - шлюз и HTTP вместе, gateway/http - отдельными сервисами
+    "role": os.getenv("SERVER_ROLE", "all"),
+    "http_workers": int(os.getenv("HTTP_WORKERS", "1")),
+}
+
+# Метрики Prometheus (/metrics): только с заголовком Authorization: Bearer <token>, без токена отключены
+METRICS_CONFIG = {
+    "token": os.getenv("METRICS_TOKEN", ""),
+}
+
+# Остановка сервера: режим drain перед закрытием соединений
+SHUTDOWN_CONFIG = {
+    "drain_timeout": float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20")),  # секунд ожидания выдач и возвратов
+    "close_timeout": float(os.getenv("SHUTDOWN_CLOSE_TIMEOUT", "2")),  # секунд на закрытие сокетов
+}
+
+# Сторож цикла событий: стек кода, блокирующего цикл дольше порога
+LOOP_WATCHDOG_CONFIG = {
+    "enabled": os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() == "true",
+    "threshold_ms": int(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", "100")),
+    "tick_interval_ms": int(os.getenv("LOOP_WATCHDOG_TICK_MS", "50")),
+    "max_events": int(os.getenv("LOOP_WATCHDOG_MAX_EVENTS", "100")),
+}
+
+# Захват трафика станций для воспроизведения (tools/traffic_replay.py)
+TRAFFIC_CAPTURE_CONFIG = {
+    "enabled": os.getenv("TRAFFIC_CAPTURE_ENABLED", "false").lower() == "true",
+    "directory": os.getenv("TRAFFIC_CAPTURE_DIR", "logs/capture"),
+    "box_ids": os.getenv("TRAFFIC_CAPTURE_BOX_IDS", ""),  # через запятую, пусто - все станции
+    "flush_interval": float(os.getenv("TRAFFIC_CAPTURE_FLUSH_INTERVAL", "1.0")),  # секунд
+}
 
 # Настройки безопасности паролей
 PASSWORD_MIN_LENGTH = 6
@@ -73,6 +232,25 @@ POWERBANK_REMINDER_CONFIG = {
     "check_interval_hours": float(os.getenv("REMINDER_CHECK_INTERVAL", "0.5")),  # 1 раз в 30 минут
 }
 
+# Автоматическое списание невозвращенных повербанков по org_unit.write_off_hours (utils/overdue_write_off.py)
+# Необратимо меняет заказы и повербанки, поэтому включается явно после tools/overdue_write_off.py install
+OVERDUE_WRITE_OFF_CONFIG = {
+    "enabled": os.getenv("OVERDUE_WRITE_OFF_ENABLED", "false").lower() == "true",
+    "interval_minutes": float(os.getenv("OVERDUE_WRITE_OFF_INTERVAL", "30")),  # минут между проверками
+    "batch_size": int(os.getenv("OVERDUE_WRITE_OFF_BATCH_SIZE", "200")),  # заказов в одной транзакции
+    "batch_pause": float(os.getenv("OVERDUE_WRITE_OFF_BATCH_PAUSE", "0.2")),  # секунд между транзакциями
+    "mail_queue_size": int(os.getenv("OVERDUE_WRITE_OFF_MAIL_QUEUE", "10000")),  # писем в очереди
+    "mail_pause": float(os.getenv("OVERDUE_WRITE_OFF_MAIL_PAUSE", "1")),  # секунд между письмами
+}
+
+# Фоновая очистка давно удаленных записей (utils/hard_delete_cleanup.py)
+HARD_DELETE_CLEANUP_CONFIG = {
+    "chunk_size": int(os.getenv("HARD_DELETE_CHUNK_SIZE", "500")),  # строк в одной транзакции
+    "pause": float(os.getenv("HARD_DELETE_PAUSE", "0.5")),  # секунд между частями
+    "poll_interval": float(os.getenv("HARD_DELETE_POLL_INTERVAL", "5")),  # секунд между выборками новых заданий
+    "jobs_listed": int(os.getenv("HARD_DELETE_JOBS_LISTED", "50")),  # заданий в списке API
+}
+
 # Таймаут ожидания подтверждения возврата (в секундах), используется сервером
 # Клиент не может переопределять это значение через API
 RETURN_CONFIRMATION_TIMEOUT_SECONDS = int(os.getenv("RETURN_CONFIRMATION_TIMEOUT_SECONDS", "10"))
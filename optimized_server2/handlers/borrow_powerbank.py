@@ -255,6 +255,13 @@ class BorrowPowerbankHandler:
             if not connection:
                 return {"success": False, "message": "Станция не подключена"}
             
+            # Станция на другом воркере шлюза - ответ придет туда, ждем его там
+            if getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'borrow_handler', 'send_borrow_request_and_wait',
+                    station_id, powerbank_id, user_id, order_id
+                )
+            
             # Получаем информацию о повербанке и его слоте
             station_powerbank = await StationPowerbank.get_by_powerbank_id(self.db_pool, powerbank_id)
             if not station_powerbank:
@@ -284,16 +291,17 @@ class BorrowPowerbankHandler:
                 vsn=2  
             )
             
-            # Отправляем команду 
+            # Отправляем команду через очередь станции (таймаут включает ожидание в очереди)
             if connection.writer and not connection.writer.is_closing():
-                connection.writer.write(borrow_command)
-                await connection.writer.drain()
+                queued = connection.enqueue_command(borrow_command, timeout=15.0)
                 
                 # Ждем ответа от станции
                 try:
                     result = await asyncio.wait_for(future, timeout=15.0)
                     return result
                 except asyncio.TimeoutError:
+                    # Команда, не ушедшая из очереди, не должна выдать повербанк после ответа пользователю
+                    queued.cancel()
                     if order_id in self.pending_requests:
                         del self.pending_requests[order_id]
                     
@@ -342,8 +350,7 @@ class BorrowPowerbankHandler:
             
             # Отправляем команду 
             if connection.writer and not connection.writer.is_closing():
-                connection.writer.write(borrow_command)
-                await connection.writer.drain()
+                connection.enqueue_command(borrow_command, timeout=15.0)
                 
                 return {
                     "success": True,
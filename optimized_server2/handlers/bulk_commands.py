@@ -0,0 +1,277 @@
+"""
+Массовое выполнение команд станциям (громкость, адрес сервера, перезагрузка, инвентарь)
+
+Задание раскладывает команду по выбранным станциям и выполняет ее не более чем
+на concurrency станциях одновременно, ожидая ответ каждой станции не дольше timeout.
+Прогресс читается по job_id и отправляется создателю задания по WebSocket уведомлений.
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+import aiomysql
+
+from config.settings import BULK_COMMAND_CONFIG
+from handlers.query_inventory import QueryInventoryHandler
+from handlers.query_server_address import QueryServerAddressHandler
+from handlers.query_voice_volume import QueryVoiceVolumeHandler
+from handlers.restart_cabinet import RestartCabinetHandler
+from handlers.set_server_address import SetServerAddressHandler
+from handlers.set_voice_volume import SetVoiceVolumeHandler
+from utils.centralized_logger import get_logger
+from utils.time_utils import get_moscow_time
+from utils.user_notification_manager import user_notification_manager
+
+
+BULK_COMMANDS = (
+    'set_voice_volume', 'set_server_address', 'restart_cabinet',
+    'query_inventory', 'query_voice_volume', 'query_server_address',
+)
+
+# Запас на работу с БД сверх ожидания ответа станции
+STATION_TIMEOUT_GRACE = 5.0
+
+
+class BulkCommandJob:
+    """Задание массовой команды и результаты по станциям"""
+
+    def __init__(self, job_id: int, command: str, params: Dict[str, Any], station_ids: List[int],
+                 concurrency: int, timeout: float, created_by: int, org_unit_ids: Optional[Set[int]] = None):
+        self.job_id = job_id
+        self.command = command
+        self.params = params
+        self.station_ids = station_ids
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.created_by = created_by
+        # Подразделения станций задания: по ним проверяется доступ других администраторов
+        self.org_unit_ids = set(org_unit_ids or ())
+        self.created_at = get_moscow_time()
+        self.finished_at = None
+        self.status = 'running'
+        # station_id -> {'status': ok|failed|timeout|offline|cancelled, ...}
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.counts: Counter = Counter()
+        self.cancel_requested = False
+        self.task: Optional[asyncio.Task] = None
+        self._started = time.monotonic()
+        self._last_notified = 0.0
+
+    def visible_to(self, user_id: int, accessible_org_units: Optional[List[int]]) -> bool:
+        """Автор задания или администратор всех его подразделений (None - без ограничений)"""
+        if user_id == self.created_by or accessible_org_units is None:
+            return True
+        return self.org_unit_ids <= set(accessible_org_units)
+
+    def record(self, station_id: int, status: str, **details) -> None:
+        self.results[station_id] = {'status': status, **details}
+        self.counts[status] += 1
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'command': self.command,
+            'status': self.status,
+            'total': len(self.station_ids),
+            'done': len(self.results),
+            'counts': dict(self.counts),
+            'concurrency': self.concurrency,
+            'timeout': self.timeout,
+            'elapsed_seconds': round(time.monotonic() - self._started, 1),
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def to_dict(self, include_results: bool = True) -> Dict[str, Any]:
+        data = self.progress()
+        data['params'] = self.params
+        if include_results:
+            data['results'] = [{'station_id': station_id, **result} for station_id, result in self.results.items()]
+        return data
+
+
+class BulkCommandHandler:
+    """Запуск и учет заданий массовых команд процесса"""
+
+    def __init__(self, db_pool, connection_manager):
+        self.db_pool = db_pool
+        self.connection_manager = connection_manager
+        self.logger = get_logger('bulk_commands')
+        self.set_voice_volume_handler = SetVoiceVolumeHandler(db_pool, connection_manager)
+        self.set_server_address_handler = SetServerAddressHandler(db_pool, connection_manager)
+        self.restart_cabinet_handler = RestartCabinetHandler(db_pool, connection_manager)
+        self.query_inventory_handler = QueryInventoryHandler(db_pool, connection_manager)
+        self.query_voice_volume_handler = QueryVoiceVolumeHandler(db_pool, connection_manager)
+        self.query_server_address_handler = QueryServerAddressHandler(db_pool, connection_manager)
+        self.jobs: 'OrderedDict[int, BulkCommandJob]' = OrderedDict()
+        self._job_ids = itertools.count(1)
+
+    async def select_stations(self, station_ids: Optional[List[int]] = None, org_unit_id: Optional[int] = None,
+                              all_online: bool = False,
+                              accessible_org_units: Optional[List[int]] = None) -> Dict[int, Optional[int]]:
+        """
+        Станции задания: явный список, подразделение с дочерними или все подключенные.
+        accessible_org_units ограничивает выбор подразделениями администратора (None - без ограничений).
+        Возвращает station_id -> org_unit_id в порядке выбора.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute("""
+                    SELECT station_id, org_unit_id FROM station
+                    WHERE COALESCE(is_deleted, 0) = 0
+                """)
+                station_units = {row['station_id']: row['org_unit_id'] for row in await cur.fetchall()}
+
+                org_units = None
+                if org_unit_id is not None:
+                    await cur.execute("SELECT org_unit_id, parent_org_unit_id FROM org_unit")
+                    org_units = self._subtree(org_unit_id, await cur.fetchall())
+
+        if station_ids:
+            selected = [int(station_id) for station_id in dict.fromkeys(station_ids)]
+        elif org_units is not None:
+            selected = [station_id for station_id, unit in station_units.items() if unit in org_units]
+        elif all_online:
+            selected = sorted({
+                conn.station_id for conn in self.connection_manager.get_all_connections().values()
+                if conn.station_id and conn.secret_key
+            })
+        else:
+            selected = []
+
+        selected = [station_id for station_id in selected if station_id in station_units]
+        if accessible_org_units is not None:
+            allowed = set(accessible_org_units)
+            selected = [station_id for station_id in selected if station_units[station_id] in allowed]
+        return {station_id: station_units[station_id] for station_id in selected}
+
+    @staticmethod
+    def _subtree(root_id: int, rows: List[Dict[str, Any]]) -> set:
+        children: Dict[int, List[int]] = {}
+        for row in rows:
+            if row['org_unit_id'] != row['parent_org_unit_id']:
+                children.setdefault(row['parent_org_unit_id'], []).append(row['org_unit_id'])
+        subtree = {root_id}
+        stack = [root_id]
+        while stack:
+            for child in children.get(stack.pop(), []):
+                if child not in subtree:
+                    subtree.add(child)
+                    stack.append(child)
+        return subtree
+
+    def start_job(self, command: str, params: Dict[str, Any], station_ids: List[int],
+                  concurrency: int, timeout: float, created_by: int,
+                  org_unit_ids: Optional[Set[int]] = None) -> BulkCommandJob:
+        job = BulkCommandJob(next(self._job_ids), command, params, station_ids, concurrency, timeout,
+                             created_by, org_unit_ids)
+        self.jobs[job.job_id] = job
+        self._prune_jobs()
+        job.task = asyncio.create_task(self._run_job(job))
+        self.logger.info(f"Задание {job.job_id}: {command} на {len(station_ids)} станций "
+                         f"(параллельно {concurrency}, таймаут {timeout:g}с), админ {created_by}")
+        return job
+
+    def get_job(self, job_id: int) -> Optional[BulkCommandJob]:
+        return self.jobs.get(job_id)
+
+    def cancel_job(self, job_id: int) -> bool:
+        """Останавливает выдачу команд новым станциям; уже отправленные дожидаются ответа"""
+        job = self.jobs.get(job_id)
+        if not job or job.status != 'running':
+            return False
+        job.cancel_requested = True
+        return True
+
+    def _prune_jobs(self) -> None:
+        """Хранит последние max_jobs заданий (выполняющиеся не удаляются)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status != 'running']
+        for job_id in finished[:max(0, len(self.jobs) - BULK_COMMAND_CONFIG['max_jobs'])]:
+            del self.jobs[job_id]
+
+    async def _run_job(self, job: BulkCommandJob) -> None:
+        pending = iter(job.station_ids)
+
+        async def worker() -> None:
+            for station_id in pending:
+                if job.cancel_requested:
+                    job.record(station_id, 'cancelled')
+                    continue
+                await self._run_station(job, station_id)
+                await self._notify(job)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(job.concurrency, len(job.station_ids)) or 1)))
+            job.status = 'cancelled' if job.cancel_requested else 'completed'
+        except Exception as e:
+            self.logger.error(f"Задание {job.job_id} прервано: {e}")
+            job.status = 'failed'
+        job.finished_at = get_moscow_time()
+        self.logger.info(f"Задание {job.job_id} {job.status}: {dict(job.counts)}")
+        await self._notify(job, force=True)
+
+    async def _run_station(self, job: BulkCommandJob, station_id: int) -> None:
+        connection = self.connection_manager.get_connection_by_station_id(station_id)
+        if not connection or not connection.secret_key:
+            job.record(station_id, 'offline')
+            return
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._execute(job, station_id), job.timeout + STATION_TIMEOUT_GRACE)
+        except asyncio.TimeoutError:
+            job.record(station_id, 'timeout', error=f"Нет результата за {job.timeout:g} сек")
+            return
+        except Exception as e:
+            job.record(station_id, 'failed', error=str(e))
+            return
+
+        seconds = round(time.monotonic() - started, 3)
+        details = {key: result[key] for key in ('confirmed', 'request_id', 'voice_volume', 'server_address',
+                                                'slots_num', 'remain_num') if key in result}
+        if result.get('success'):
+            job.record(station_id, 'ok', seconds=seconds, **details)
+        elif result.get('timeout'):
+            job.record(station_id, 'timeout', seconds=seconds, error=result.get('error') or result.get('message'))
+        else:
+            job.record(station_id, 'failed', seconds=seconds, error=result.get('error') or result.get('message'))
+
+    async def _execute(self, job: BulkCommandJob, station_id: int) -> Dict[str, Any]:
+        params = job.params
+        if job.command == 'set_voice_volume':
+            return await self.set_voice_volume_handler.send_set_voice_volume_request(
+                station_id, params['volume_level'], wait=True, timeout=job.timeout
+            )
+        if job.command == 'set_server_address':
+            return await self.set_server_address_handler.send_set_server_address_request(
+                station_id, params['server_address'], params['server_port'], params['heartbeat_interval'],
+                wait=True, timeout=job.timeout
+            )
+        if job.command == 'restart_cabinet':
+            return await self.restart_cabinet_handler.send_restart_command(
+                station_id, job.created_by, wait=True, timeout=job.timeout
+            )
+        if job.command == 'query_inventory':
+            return await self.query_inventory_handler.send_inventory_request(station_id, wait=True, timeout=job.timeout)
+        if job.command == 'query_voice_volume':
+            return await self.query_voice_volume_handler.send_voice_volume_request(
+                station_id, wait=True, timeout=job.timeout
+            )
+        if job.command == 'query_server_address':
+            return await self.query_server_address_handler.send_query_server_address_request(
+                station_id, wait=True, timeout=job.timeout
+            )
+        raise ValueError(f"Неизвестная команда {job.command}")
+
+    async def _notify(self, job: BulkCommandJob, force: bool = False) -> None:
+        """Прогресс создателю задания по WebSocket не чаще progress_interval"""
+        now = time.monotonic()
+        if not force and now - job._last_notified < BULK_COMMAND_CONFIG['progress_interval']:
+            return
+        job._last_notified = now
+        try:
+            await user_notification_manager.send_notification(job.created_by, 'bulk_command_progress', job.progress())
+        except Exception as e:
+            self.logger.error(f"Ошибка отправки прогресса задания {job.job_id}: {e}")
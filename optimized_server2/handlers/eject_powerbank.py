@@ -135,8 +135,7 @@ class EjectPowerbankHandler:
             if eject_command:
                 # Отправляем команду на станцию
                 if connection.writer and not connection.writer.is_closing():
-                    connection.writer.write(eject_command)
-                    await connection.writer.drain()
+                    connection.enqueue_command(eject_command)
                 
         except Exception as e:
             self.logger.error(f"Ошибка: {e}")
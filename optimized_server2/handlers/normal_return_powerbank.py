@@ -43,8 +43,7 @@ class NormalReturnPowerbankHandler:
                 station_box_id=connection.box_id or f"station_{station_id}"
             )
             
-            connection.writer.write(inventory_request_packet)
-            await connection.writer.drain()
+            connection.enqueue_command(inventory_request_packet)
             
         except Exception:
             # Игнорируем ошибки (без логирования)
@@ -105,7 +104,7 @@ class NormalReturnPowerbankHandler:
                         user_id = user_result[0] if user_result else None
                 
                 # Логируем действие
-                await ActionLog.create(
+                await ActionLog.log(
                     self.db_pool,
                     user_id=user_id,
                     action_type='order_update',
@@ -277,7 +276,7 @@ class NormalReturnPowerbankHandler:
                         user_id = user_result[0] if user_result else None
                 
                 # Логируем действие
-                await ActionLog.create(
+                await ActionLog.log(
                     self.db_pool,
                     user_id=user_id,
                     action_type='order_update',
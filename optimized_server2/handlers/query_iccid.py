@@ -6,6 +6,7 @@ from datetime import datetime
 from utils.time_utils import get_moscow_time
 
 from utils.packet_utils import build_query_iccid_request, parse_query_iccid_response
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
 from utils.centralized_logger import get_logger
 
 
@@ -97,10 +98,11 @@ class QueryICCIDHandler:
         except Exception as e:
             self.logger.error(f"Ошибка: {e}")
     
-    async def send_query_iccid_command(self, station_id: int) -> Dict[str, Any]:
+    async def send_query_iccid_command(self, station_id: int, wait: bool = True,
+                                       timeout: float = DEFAULT_COMMAND_TIMEOUT) -> Dict[str, Any]:
         """
         Отправляет команду запроса ICCID на станцию
-        Возвращает результат операции
+        При wait=True ждет ответ станции и возвращает ICCID
         """
         try:
             # Получаем соединение для станции
@@ -111,23 +113,56 @@ class QueryICCIDHandler:
                     "message": "Станция не подключена"
                 }
             
+            # Станция на другом воркере шлюза - ответ придет туда, ждем его там
+            if getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'query_iccid_handler', 'send_query_iccid_command', station_id, wait, timeout
+                )
+            
             # Создаем команду запроса ICCID
             iccid_command = await self.handle_query_iccid_request(station_id, connection)
             
-            if iccid_command:
-                
+            if not iccid_command:
+                return {
+                    "success": False,
+                    "message": "Не удалось создать команду запроса ICCID"
+                }
+            
+            sent_at = get_moscow_time().isoformat()
+            if not wait:
+                connection.enqueue_command(iccid_command)
                 return {
                     "success": True,
                     "message": f"Команда запроса ICCID отправлена на станцию {station_id}",
                     "station_id": station_id,
-                    "sent_at": get_moscow_time().isoformat()
+                    "sent_at": sent_at
                 }
-            else:
+            
+            # Ответ сохраняет в БД обработчик шлюза (handle_query_iccid_response)
+            response = await connection.send_command(iccid_command, timeout=timeout)
+            if response.get("Error"):
                 return {
                     "success": False,
-                    "message": "Не удалось создать команду запроса ICCID"
+                    "message": f"Неверный ответ ICCID от станции {station_id}: {response['Error']}"
                 }
+            
+            return {
+                "success": True,
+                "message": f"ICCID получен для станции {station_id}",
+                "station_id": station_id,
+                "request_id": response['RequestId'],
+                "iccid": response['ICCID'],
+                "iccid_length": response['ICCIDLen'],
+                "sent_at": sent_at,
+                "received_at": response['ReceivedAt']
+            }
                 
+        except CommandTimeoutError as e:
+            return {
+                "success": False,
+                "timeout": True,
+                "message": f"Станция не ответила на запрос ICCID: {e}"
+            }
         except Exception as e:
             return {
                 "success": False,
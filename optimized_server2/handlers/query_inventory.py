@@ -9,6 +9,8 @@ from models.station import Station
 from models.powerbank import Powerbank
 from utils.packet_utils import build_query_inventory_request, parse_query_inventory_response, get_moscow_time
 from models.connection import StationConnection
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
+from utils.telemetry_store import telemetry_store
 
 class QueryInventoryHandler:
     """Обработчик для команды запроса инвентаря кабинета (0x64)"""
@@ -18,9 +20,11 @@ class QueryInventoryHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('queryinventoryhandler')
 
-    async def send_inventory_request(self, station_id: int) -> Dict[str, Any]:
+    async def send_inventory_request(self, station_id: int, wait: bool = False,
+                                     timeout: float = DEFAULT_COMMAND_TIMEOUT) -> Dict[str, Any]:
         """
         Отправляет запрос на получение инвентаря станции.
+        При wait=True ждет ответ станции (slots_num, remain_num).
         """
         station = await Station.get_by_id(self.db_pool, station_id)
         if not station:
@@ -32,6 +36,12 @@ class QueryInventoryHandler:
             self.logger.error(f"Соединение со станцией {station.box_id} (ID: {station_id}) неактивно для запроса инвентаря.")
             return {"success": False, "message": "Станция не подключена или соединение неактивно."}
 
+        # Ожидание ответа - на воркере шлюза, где открыт сокет станции
+        if wait and getattr(connection, 'is_remote', False):
+            return await connection.call_handler(
+                'query_inventory_handler', 'send_inventory_request', station_id, wait, timeout
+            )
+
         secret_key = connection.secret_key
         if not secret_key:
             self.logger.error(f"Секретный ключ для станции {station.box_id} (ID: {station_id}) не найден.")
@@ -41,13 +51,25 @@ class QueryInventoryHandler:
             inventory_request_packet = build_query_inventory_request(secret_key, station_box_id=station.box_id)
             packet_hex = inventory_request_packet.hex()
 
-            connection.writer.write(inventory_request_packet)
-            await connection.writer.drain()
+            if not wait:
+                connection.enqueue_command(inventory_request_packet)
+                return {
+                    "success": True,
+                    "message": f"Запрос инвентаря отправлен на станцию {station.box_id}."
+                }
 
+            response = await connection.send_command(inventory_request_packet, timeout=timeout)
+            if not response.get("CheckSumValid", False) or response.get("Error"):
+                return {"success": False, "message": f"Неверный ответ инвентаря от станции {station.box_id}: {response.get('Error', 'Неверный checksum')}"}
             return {
                 "success": True,
-                "message": f"Запрос инвентаря отправлен на станцию {station.box_id}."
+                "message": f"Инвентарь получен от станции {station.box_id}.",
+                "request_id": response["RequestId"],
+                "slots_num": response.get("SlotsNum", 0),
+                "remain_num": response.get("RemainNum", 0)
             }
+        except CommandTimeoutError as e:
+            return {"success": False, "timeout": True, "message": f"Станция не ответила на запрос инвентаря: {e}"}
         except Exception as e:
             self.logger.error(f"Ошибка отправки запроса инвентаря на станцию {station.box_id} (ID: {station_id}): {e}")
             return {"success": False, "message": f"Ошибка отправки запроса инвентаря: {e}"}
@@ -72,6 +94,7 @@ class QueryInventoryHandler:
             from utils.inventory_manager import InventoryManager
             inventory_manager = InventoryManager(self.db_pool)
             await inventory_manager.process_inventory_response(data, connection.station_id)
+            telemetry_store.record(connection.station_id, response.get('Slots', []))
             
             # Обрабатываем каждый слот из ответа
             inventory_data = []
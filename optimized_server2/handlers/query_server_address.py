@@ -7,6 +7,7 @@ from datetime import datetime, timezone, timedelta
 from models.station import Station
 from utils.packet_utils import build_query_server_address_request, parse_query_server_address_response, get_moscow_time
 from models.connection import StationConnection
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
 from utils.centralized_logger import get_logger
 
 
@@ -18,9 +19,11 @@ class QueryServerAddressHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('query_server_address')
 
-    async def send_query_server_address_request(self, station_id: int) -> Dict[str, Any]:
+    async def send_query_server_address_request(self, station_id: int, wait: bool = True,
+                                                timeout: float = DEFAULT_COMMAND_TIMEOUT) -> Dict[str, Any]:
         """
         Отправляет запрос на получение адреса сервера станции.
+        При wait=True ждет ответ станции и возвращает его в server_address.
         """
         station = await Station.get_by_id(self.db_pool, station_id)
         if not station:
@@ -32,6 +35,12 @@ class QueryServerAddressHandler:
             self.logger.error(f"Соединение со станцией {station.box_id} (ID: {station_id}) неактивно для запроса адреса сервера.")
             return {"success": False, "message": "Станция не подключена или соединение неактивно."}
 
+        # Станция на другом воркере шлюза - ответ придет туда, ждем его там
+        if getattr(connection, 'is_remote', False):
+            return await connection.call_handler(
+                'query_server_address_handler', 'send_query_server_address_request', station_id, wait, timeout
+            )
+
         secret_key = connection.secret_key
         if not secret_key:
             self.logger.error(f"Секретный ключ для станции {station.box_id} (ID: {station_id}) не найден.")
@@ -41,14 +50,30 @@ class QueryServerAddressHandler:
             server_address_request_packet = build_query_server_address_request(secret_key, vsn=1)
             packet_hex = server_address_request_packet.hex()
 
-            connection.writer.write(server_address_request_packet)
-            await connection.writer.drain()
+            if not wait:
+                connection.enqueue_command(server_address_request_packet)
+                return {
+                    "success": True,
+                    "message": f"Запрос адреса сервера отправлен на станцию {station.box_id}.",
+                    "packet_hex": packet_hex
+                }
 
+            response = await connection.send_command(server_address_request_packet, timeout=timeout)
+            if not response.get("CheckSumValid", False) or response.get("Error"):
+                return {
+                    "success": False,
+                    "message": f"Неверный ответ адреса сервера от станции {station.box_id}: {response.get('Error', 'Неверный checksum')}"
+                }
 
             return {
                 "success": True,
-                "message": f"Запрос адреса сервера отправлен на станцию {station.box_id}."
+                "message": f"Адрес сервера получен от станции {station.box_id}.",
+                "packet_hex": packet_hex,
+                "request_id": response['RequestId'],
+                "server_address": self._server_address_data(response)
             }
+        except CommandTimeoutError as e:
+            return {"success": False, "timeout": True, "message": f"Станция не ответила на запрос адреса сервера: {e}"}
         except Exception as e:
             self.logger.error(f"Ошибка отправки запроса адреса сервера на станцию {station.box_id} (ID: {station_id}): {e}")
             return {"success": False, "message": f"Ошибка отправки запроса адреса сервера: {e}"}
@@ -65,17 +90,21 @@ class QueryServerAddressHandler:
                 return
             
             # Сохраняем данные адреса сервера в объект соединения для передачи на фронтенд
-            connection.server_address_data = {
-                'address': response.get('Address', 'N/A'),
-                'port': response.get('Ports', 'N/A'),
-                'heartbeat_interval': response.get('Heartbeat', 'N/A'),
-                'last_update': get_moscow_time().isoformat(),
-                'packet_hex': response.get('RawPacket', 'N/A'),
-                'vsn': response.get('VSN', 'N/A'),
-                'checksum': response.get('CheckSum', 'N/A'),
-                'token': response.get('Token', 'N/A')
-            }
-            
+            connection.server_address_data = self._server_address_data(response)
             
         except Exception as e:
             self.logger.error(f"Ошибка обработки ответа на запрос адреса сервера от станции {connection.box_id}: {e}")
+
+    @staticmethod
+    def _server_address_data(response: Dict[str, Any]) -> Dict[str, Any]:
+        """Данные адреса сервера из разобранного ответа станции"""
+        return {
+            'address': response.get('Address', 'N/A'),
+            'port': response.get('Ports', 'N/A'),
+            'heartbeat_interval': response.get('Heartbeat', 'N/A'),
+            'last_update': get_moscow_time().isoformat(),
+            'packet_hex': response.get('RawPacket', 'N/A'),
+            'vsn': response.get('VSN', 'N/A'),
+            'checksum': response.get('CheckSum', 'N/A'),
+            'token': response.get('Token', 'N/A')
+        }
@@ -6,6 +6,7 @@ from utils.time_utils import get_moscow_time
 
 from models.station import Station
 from utils.packet_utils import build_query_voice_volume_request, parse_query_voice_volume_response
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
 from utils.centralized_logger import get_logger
 
 
@@ -17,10 +18,11 @@ class QueryVoiceVolumeHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('query_voice_volume')
     
-    async def send_voice_volume_request(self, station_id: int) -> dict:
+    async def send_voice_volume_request(self, station_id: int, wait: bool = True,
+                                        timeout: float = DEFAULT_COMMAND_TIMEOUT) -> dict:
         """
         Отправляет запрос уровня громкости на станцию
-        Возвращает результат операции
+        При wait=True ждет ответ станции и возвращает его в voice_volume
         """
         try:
             # Получаем станцию из БД
@@ -39,6 +41,12 @@ class QueryVoiceVolumeHandler:
                     "error": f"Станция {station.box_id} не подключена"
                 }
             
+            # Станция на другом воркере шлюза - ответ придет туда, ждем его там
+            if getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'query_voice_volume_handler', 'send_voice_volume_request', station_id, wait, timeout
+                )
+            
             if not connection.secret_key:
                 return {
                     "success": False,
@@ -56,17 +64,37 @@ class QueryVoiceVolumeHandler:
                     "error": f"Соединение со станцией {station.box_id} недоступно"
                 }
             
-            connection.writer.write(voice_volume_packet)
-            await connection.writer.drain()
+            if not wait:
+                connection.enqueue_command(voice_volume_packet)
+                return {
+                    "success": True,
+                    "message": f"Запрос уровня громкости отправлен на станцию {station.box_id}",
+                    "station_box_id": station.box_id,
+                    "packet_hex": voice_volume_packet.hex().upper()
+                }
             
+            response = await connection.send_command(voice_volume_packet, timeout=timeout)
+            if not response.get("CheckSumValid", False) or response.get("Error"):
+                return {
+                    "success": False,
+                    "error": f"Неверный ответ уровня громкости от станции {station.box_id}: {response.get('Error', 'Неверный checksum')}"
+                }
             
             return {
                 "success": True,
-                "message": f"Запрос уровня громкости отправлен на станцию {station.box_id}",
+                "message": f"Уровень громкости получен от станции {station.box_id}",
                 "station_box_id": station.box_id,
-                "packet_hex": voice_volume_packet.hex().upper()
+                "packet_hex": voice_volume_packet.hex().upper(),
+                "request_id": response['RequestId'],
+                "voice_volume": self._voice_volume_data(response)
             }
             
+        except CommandTimeoutError as e:
+            return {
+                "success": False,
+                "timeout": True,
+                "error": f"Станция не ответила на запрос уровня громкости: {e}"
+            }
         except Exception as e:
             error_msg = f"Ошибка отправки запроса уровня громкости: {str(e)}"
             
@@ -91,26 +119,23 @@ class QueryVoiceVolumeHandler:
                 self.logger.error(f"Неверный ответ уровня громкости от станции {connection.box_id}: {response.get('Error', 'Неверный checksum')}")
                 return
             
-            # Получаем данные из ответа
-            volume_level = response.get('VolumeLevel', 'N/A')
-            packet_len = response.get('PacketLen', 'N/A')
-            vsn = response.get('VSN', 'N/A')
-            checksum = response.get('CheckSum', 'N/A')
-            token = response.get('Token', 'N/A')
-            raw_packet = response.get('RawPacket', 'N/A')
-            
             # Сохраняем данные уровня громкости в объект соединения для передачи на фронтенд
-            connection.voice_volume_data = {
-                'volume_level': volume_level,
-                'volume_percentage': int(volume_level) * 10 if volume_level != 'N/A' else 0,
-                'last_update': get_moscow_time().isoformat(),
-                'packet_hex': raw_packet,
-                'vsn': vsn,
-                'checksum': checksum,
-                'token': token
-            }
-            
+            connection.voice_volume_data = self._voice_volume_data(response)
             
         except Exception as e:
             self.logger.error(f"Ошибка обработки ответа на запрос уровня громкости от станции {connection.box_id}: {e}")
+    
+    @staticmethod
+    def _voice_volume_data(response: dict) -> dict:
+        """Данные уровня громкости из разобранного ответа станции"""
+        volume_level = response.get('VolumeLevel', 'N/A')
+        return {
+            'volume_level': volume_level,
+            'volume_percentage': int(volume_level) * 10 if volume_level != 'N/A' else 0,
+            'last_update': get_moscow_time().isoformat(),
+            'packet_hex': response.get('RawPacket', 'N/A'),
+            'vsn': response.get('VSN', 'N/A'),
+            'checksum': response.get('CheckSum', 'N/A'),
+            'token': response.get('Token', 'N/A')
+        }
 
@@ -9,6 +9,7 @@ from utils.centralized_logger import get_logger
 from models.station import Station
 from models.connection import StationConnection
 from utils.packet_utils import build_restart_cabinet_request, parse_restart_cabinet_response
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
 
 
 class RestartCabinetHandler:
@@ -19,9 +20,11 @@ class RestartCabinetHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('restartcabinethandler')
     
-    async def send_restart_command(self, station_id: int, admin_user_id: int) -> dict:
+    async def send_restart_command(self, station_id: int, admin_user_id: int, wait: bool = True,
+                                   timeout: float = DEFAULT_COMMAND_TIMEOUT) -> dict:
         """
         Отправляет команду перезагрузки кабинета на станцию
+        При wait=True ждет подтверждение станции (confirmed)
         """
         try:
             station = await Station.get_by_id(self.db_pool, station_id)
@@ -38,6 +41,12 @@ class RestartCabinetHandler:
                     "error": f"Станция {station.box_id} не подключена"
                 }
             
+            # Станция на другом воркере шлюза - подтверждение придет туда, ждем его там
+            if getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'restart_cabinet_handler', 'send_restart_command', station_id, admin_user_id, wait, timeout
+                )
+            
             if not connection.secret_key:
                 return {
                     "success": False,
@@ -55,19 +64,34 @@ class RestartCabinetHandler:
                     "error": f"Соединение со станцией {station.box_id} недоступно"
                 }
             
-            connection.writer.write(restart_packet)
-            await connection.writer.drain()
+            confirmed = None
+            request_id = None
+            if wait:
+                # Станция может уйти в перезагрузку (и закрыть соединение), не успев ответить
+                try:
+                    response = await connection.send_command(restart_packet, timeout=timeout)
+                    confirmed = bool(response.get("CheckSumValid")) and not response.get("Error")
+                    request_id = response['RequestId']
+                except (CommandTimeoutError, ConnectionError):
+                    confirmed = False
+            else:
+                connection.enqueue_command(restart_packet)
             
             # Меняем статус станции на inactive
             await station.update_status(self.db_pool, "inactive")
             
-            
-            return {
+            result = {
                 "success": True,
                 "message": f"Команда перезагрузки отправлена на станцию {station.box_id}",
                 "station_box_id": station.box_id,
                 "packet_hex": restart_packet.hex().upper()
             }
+            if wait:
+                result["confirmed"] = confirmed
+                result["request_id"] = request_id
+                if confirmed:
+                    result["message"] = f"Станция {station.box_id} подтвердила перезагрузку"
+            return result
             
         except Exception as e:
             error_msg = f"Ошибка отправки команды перезагрузки: {str(e)}"
@@ -6,12 +6,95 @@ from datetime import datetime
 import asyncio
 
 from models.station_powerbank import StationPowerbank
-from models.powerbank import Powerbank
 from models.order import Order
 from models.powerbank_error import PowerbankError
 from models.action_log import ActionLog
 from utils.centralized_logger import get_logger
 from utils.time_utils import get_moscow_time
+from utils.timer_wheel import timer_wheel
+
+
+class PendingErrorReturns:
+    """
+    Ожидающие возвраты с ошибкой: запись на телефон пользователя с индексами
+    по станции и по user_id. Срок записи проверяется и при поиске, поэтому
+    просроченное окно не срабатывает, даже если таймер колеса еще не сработал
+    """
+
+    def __init__(self):
+        self._by_phone: Dict[str, Dict[str, Any]] = {}
+        self._by_station: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        self._by_user: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_phone)
+
+    def __contains__(self, user_phone: str) -> bool:
+        return self.get(user_phone) is not None
+
+    def values(self) -> List[Dict[str, Any]]:
+        return list(self._by_phone.values())
+
+    def add(self, user_phone: str, entry: Dict[str, Any]) -> None:
+        entry['expires_at'] = asyncio.get_running_loop().time() + entry['ttl_seconds']
+        self._by_phone[user_phone] = entry
+        self._by_station.setdefault(entry['station_id'], {})[user_phone] = entry
+        self._by_user[entry['user_id']] = user_phone
+
+    def _alive(self, user_phone: str, entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if entry is not None and asyncio.get_running_loop().time() >= entry['expires_at']:
+            self.expire(user_phone, entry['future'], entry['ttl_seconds'])
+            return None
+        return entry
+
+    def get(self, user_phone: str) -> Optional[Dict[str, Any]]:
+        return self._alive(user_phone, self._by_phone.get(user_phone))
+
+    def get_by_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        user_phone = self._by_user.get(user_id)
+        return self.get(user_phone) if user_phone is not None else None
+
+    def find(self, station_id: int, user_phone: str) -> Optional[Dict[str, Any]]:
+        """Окно владельца повербанка на станции вставки"""
+        return self._alive(user_phone, self._by_station.get(station_id, {}).get(user_phone))
+
+    def has_station(self, station_id: int) -> bool:
+        return station_id in self._by_station
+
+    def pop(self, user_phone: str, future: Optional[asyncio.Future] = None) -> Optional[Dict[str, Any]]:
+        """Удаляет запись (только с этим future, если указан) и ее таймер"""
+        entry = self._by_phone.get(user_phone)
+        if entry is None or (future is not None and entry['future'] is not future):
+            return None
+        del self._by_phone[user_phone]
+        station_entries = self._by_station.get(entry['station_id'])
+        if station_entries is not None:
+            station_entries.pop(user_phone, None)
+            if not station_entries:
+                del self._by_station[entry['station_id']]
+        if self._by_user.get(entry['user_id']) == user_phone:
+            del self._by_user[entry['user_id']]
+        if entry.get('timer'):
+            entry['timer'].cancel()
+        return entry
+
+    def expire(self, user_phone: str, future: asyncio.Future, timeout_seconds: Optional[float] = None) -> None:
+        """Таймаут ожидания вставки повербанка (таймер колеса или проверка срока)"""
+        entry = self.pop(user_phone, future)
+        if not future.done():
+            if entry:
+                timeout_seconds = entry['ttl_seconds']
+            timeout_text = f" ({timeout_seconds} секунд)" if timeout_seconds is not None else ""
+            future.set_result({
+                "success": False,
+                "error": f"Таймаут ожидания вставки повербанка{timeout_text}. Повербанк не был вставлен в станцию."
+            })
+
+    def finish(self, user_phone: str, result: Dict[str, Any]) -> None:
+        """Снимает запись и передает результат ожидающему запросу"""
+        entry = self.pop(user_phone)
+        if entry and not entry['future'].done():
+            entry['future'].set_result(result)
 
 
 class ReturnPowerbankHandler:
@@ -22,8 +105,8 @@ class ReturnPowerbankHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('return_powerbank')
         if not hasattr(ReturnPowerbankHandler, '_pending_error_returns'):
-            ReturnPowerbankHandler._pending_error_returns = {}
-        self.pending_error_returns = ReturnPowerbankHandler._pending_error_returns
+            ReturnPowerbankHandler._pending_error_returns = PendingErrorReturns()
+        self.pending_error_returns: PendingErrorReturns = ReturnPowerbankHandler._pending_error_returns
     
     async def _send_inventory_request_silently(self, station_id: int) -> None:
         """
@@ -54,8 +137,7 @@ class ReturnPowerbankHandler:
             
             # Дополнительная проверка перед записью
             if not writer.is_closing():
-                writer.write(inventory_request_packet)
-                await writer.drain()
+                connection.enqueue_command(inventory_request_packet)
             
         except (ConnectionError, OSError, asyncio.CancelledError):
             # Игнорируем ошибки соединения (без логирования)
@@ -64,16 +146,20 @@ class ReturnPowerbankHandler:
             # Игнорируем остальные ошибки (без логирования)
             pass
 
-    async def start_background_cleanup(self):
-        """Запускает фоновую очистку просроченных запросов. Вызывать после старта event loop."""
-        asyncio.create_task(self._cleanup_expired_requests())
-    
     async def handle_error_return_request(self, user_id: int, station_id: int, error_type: int, timeout_seconds: int = 30) -> Dict[str, Any]:
         """
         Обрабатывает запрос на возврат повербанка с ошибкой с Long Polling
         Ждет вставки повербанка в станцию до timeout_seconds секунд
         """
         try:
+            # Станция на другом воркере шлюза - вставку повербанка увидит он, ждем там
+            connection = self.connection_manager.get_connection_by_station_id(station_id)
+            if getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'return_handler', 'handle_error_return_request',
+                    user_id, station_id, error_type, timeout_seconds
+                )
+            
             # Проверяем, что пользователь существует
             from models.user import User
             user = await User.get_by_id(self.db_pool, user_id)
@@ -99,7 +185,7 @@ class ReturnPowerbankHandler:
             # Проверяем, нет ли уже ожидающего запроса для этого пользователя
             # Используем телефон как ключ, так как в TCP обработчике ищем по телефону
             user_phone = user.phone_e164
-            if user_phone in ReturnPowerbankHandler._pending_error_returns:
+            if user_phone in self.pending_error_returns:
                 return {"success": False, "error": "У пользователя уже есть ожидающий запрос на возврат с ошибкой"}
             
             # Создаем Future для Long Polling
@@ -107,34 +193,28 @@ class ReturnPowerbankHandler:
             
             # Сохраняем запрос на возврат с ошибкой (ключ - телефон пользователя)
             timestamp = get_moscow_time()
-            ReturnPowerbankHandler._pending_error_returns[user_phone] = {
+            self.pending_error_returns.add(user_phone, {
                 'user_id': user_id,  # Добавляем user_id для удобства
+                'user_phone': user_phone,
                 'station_id': station_id,
                 'error_type': error_type,
                 'timestamp': timestamp,
                 'error_name': error.type_error,
                 'future': future,
-                'ttl_seconds': timeout_seconds
-            }
-            
+                'ttl_seconds': timeout_seconds,
+                # Таймаут в колесе таймеров: удаляет запрос и завершает future в срок
+                'timer': timer_wheel.call_later(
+                    timeout_seconds, self.pending_error_returns.expire, user_phone, future, timeout_seconds
+                )
+            })
             
-            # Ждем результат с таймаутом
             try:
-                result = await asyncio.wait_for(future, timeout=timeout_seconds)
-                return result
-            except asyncio.TimeoutError:
-                # Удаляем просроченный запрос
-                if user_phone in ReturnPowerbankHandler._pending_error_returns:
-                    del ReturnPowerbankHandler._pending_error_returns[user_phone]
-                return {
-                    "success": False, 
-                    "error": f"Таймаут ожидания вставки повербанка ({timeout_seconds} секунд). Повербанк не был вставлен в станцию."
-                }
+                return await future
+            finally:
+                # Клиент отключился или запрос завершен - таймер и запрос больше не нужны
+                self.pending_error_returns.pop(user_phone, future)
             
         except Exception as e:
-            # Удаляем запрос в случае ошибки
-            if user_id in ReturnPowerbankHandler._pending_error_returns:
-                del ReturnPowerbankHandler._pending_error_returns[user_id]
             self.logger.error(f"Ошибка обработки запроса на возврат с ошибкой: {e}")
             return {"success": False, "error": f"Ошибка обработки запроса: {str(e)}"}
     
@@ -145,55 +225,37 @@ class ReturnPowerbankHandler:
         Если есть - обрабатывает как возврат с ошибкой, если нет - обрабатывает как обычный возврат.
         """
         try:
-            # Получаем повербанк и активный заказ
-            powerbank = await Powerbank.get_by_id(self.db_pool, powerbank_id)
+            # Повербанк, активный заказ и владелец заказа - одним запросом
+            powerbank, active_order, owner_user_id = await Order.get_return_context(self.db_pool, powerbank_id)
             if not powerbank:
                 self.logger.error(f"Повербанк {powerbank_id} не найден")
                 return {"success": False, "error": "Повербанк не найден", "handled": False}
             
-            active_order = await Order.get_active_by_powerbank_serial(self.db_pool, powerbank.serial_number)
             if not active_order:
                 return {"success": False, "error": "Нет активного заказа для этого повербанка", "handled": False}
             
             owner_user_phone = active_order.user_phone
             
             # Ищем активное окно ожидания "возврата с ошибкой" для владельца павербанка на этой станции
-            matching_return_data = None
-            matching_user_id = None
-            
-            # Проверяем, есть ли активное окно для владельца этого павербанка на этой станции
-            for user_phone, return_data in ReturnPowerbankHandler._pending_error_returns.items():
-                if (return_data.get('station_id') == station_id and 
-                    user_phone == owner_user_phone):
-                    # Нашли активное окно для владельца павербанка на этой станции
-                    matching_return_data = return_data
-                    matching_user_id = return_data.get('user_id')
-                    break
+            matching_return_data = self.pending_error_returns.find(station_id, owner_user_phone)
             
             if matching_return_data:
                 # Есть активное окно ожидания - обрабатываем как возврат с ошибкой
-                error_type = matching_return_data.get('error_type')
                 return await self._process_error_return(
                     station_id=station_id,
                     slot_number=slot_number,
                     powerbank_id=powerbank_id,
                     matching_user_phone=owner_user_phone,
-                    matching_user_id=matching_user_id
+                    matching_user_id=matching_return_data.get('user_id'),
+                    resolved=(powerbank, active_order, owner_user_id)
                 )
             else:
                 # Нет активного окна для владельца - это обычный возврат
                 # Обрабатываем обычный возврат здесь (для консистентности)
-                
-                # Получаем user_id владельца повербанка
-                from models.user import User
-                owner_user = await User.get_by_phone(self.db_pool, owner_user_phone)
-                if not owner_user:
+                if not owner_user_id:
                     self.logger.error(f"Владелец повербанка с телефоном {owner_user_phone} не найден")
                     return {"success": False, "error": "Владелец повербанка не найден", "handled": False}
                 
-                owner_user_id = owner_user.user_id
-                
-                
                 # Закрываем заказ как обычный возврат (без system_error)
                 await active_order.update_status(self.db_pool, 'return')
                 
@@ -212,9 +274,9 @@ class ReturnPowerbankHandler:
                     await station.update_remain_num(self.db_pool, new_remain_num)
                 
                 # Логируем действие для владельца
-                await ActionLog.create(
+                await ActionLog.log(
                     self.db_pool,
-                    user_id=owner_user.user_id,
+                    user_id=owner_user_id,
                     action_type='order_update',
                     entity_type='order',
                     entity_id=active_order.order_id,
@@ -225,7 +287,7 @@ class ReturnPowerbankHandler:
                 try:
                     from utils.user_notification_manager import user_notification_manager
                     await user_notification_manager.send_powerbank_return_notification(
-                        user_id=owner_user.user_id,
+                        user_id=owner_user_id,
                         order_id=active_order.order_id,
                         powerbank_serial=powerbank.serial_number,
                         message='Спасибо за возврат! Заказ успешно закрыт.'
@@ -241,7 +303,7 @@ class ReturnPowerbankHandler:
                     "success": True,
                     "handled": True,
                     "message": "Обычный возврат повербанка. Заказ успешно закрыт.",
-                    "user_id": owner_user.user_id,
+                    "user_id": owner_user_id,
                     "powerbank_id": powerbank_id,
                     "station_id": station_id,
                     "slot_number": slot_number
@@ -251,33 +313,8 @@ class ReturnPowerbankHandler:
             self.logger.error(f"Ошибка обработки вставки повербанка: {e}")
             return {"success": False, "error": f"Ошибка обработки вставки: {str(e)}", "handled": False}
     
-    async def _cleanup_expired_requests(self, cleanup_interval_seconds: int = 60, max_age_minutes: int = 30):
-        """
-        Фоновая задача для очистки просроченных запросов на возврат с ошибкой
-        """
-        while True:
-            await asyncio.sleep(cleanup_interval_seconds)
-            current_time = get_moscow_time()
-            expired_user_ids = []
-            
-            for user_id, request_data in self.pending_error_returns.items():
-                if (current_time - request_data['timestamp']).total_seconds() > max_age_minutes * 60:
-                    expired_user_ids.append(user_id)
-                    
-            for user_id in expired_user_ids:
-                request_data = self.pending_error_returns[user_id]
-                future = request_data.get('future')
-                
-                # Уведомляем Future о таймауте
-                if future and not future.done():
-                    future.set_result({
-                        "success": False,
-                        "error": f"Таймаут ожидания вставки повербанка ({max_age_minutes} минут)"
-                    })
-                
-                del self.pending_error_returns[user_id]
-
-    async def _process_error_return(self, station_id: int, slot_number: int, powerbank_id: int, matching_user_phone: str, matching_user_id: int) -> Dict[str, Any]:
+    async def _process_error_return(self, station_id: int, slot_number: int, powerbank_id: int, matching_user_phone: str,
+                                    matching_user_id: int, resolved: Optional[tuple] = None) -> Dict[str, Any]:
         """Единая обработка успешного возврата с ошибкой: статусы, заказ, лог, future.
         
         Args:
@@ -286,9 +323,10 @@ class ReturnPowerbankHandler:
             powerbank_id: ID повербанка
             matching_user_phone: Телефон пользователя (ключ в _pending_error_returns)
             matching_user_id: ID пользователя
+            resolved: (повербанк, активный заказ, user_id владельца), если уже получены
         """
         try:
-            return_data = ReturnPowerbankHandler._pending_error_returns.get(matching_user_phone, {})
+            return_data = self.pending_error_returns.get(matching_user_phone) or {}
             error_type = return_data.get('error_type')
             error_name = return_data.get('error_name')
             future = return_data.get('future')
@@ -305,13 +343,14 @@ class ReturnPowerbankHandler:
             #         })
             #     return {"success": False, "error": "Неправильная станция для возврата"}
 
-            # Ищем активный заказ по повербанку
-            powerbank = await Powerbank.get_by_id(self.db_pool, powerbank_id)
+            # Повербанк, активный заказ и владелец заказа (Order содержит user_phone, а не user_id)
+            powerbank, active_order, effective_user_id = resolved or await Order.get_return_context(
+                self.db_pool, powerbank_id
+            )
             if not powerbank:
                 if future and not future.done():
                     future.set_result({"error": "Повербанк не найден", "success": False})
                 return {"error": "Повербанк не найден", "success": False}
-            active_order = await Order.get_active_by_powerbank_serial(self.db_pool, powerbank.serial_number)
             if not active_order:
                 if future and not future.done():
                     future.set_result({
@@ -319,19 +358,11 @@ class ReturnPowerbankHandler:
                         "error": "Нет активного заказа для этого повербанка"
                     })
                 return {"success": False, "error": "Нет активного заказа для этого повербанка"}
-
-            # Получаем user_id по телефону из заказа (Order содержит user_phone, а не user_id)
-            from models.user import User
-            order_user = await User.get_by_phone(self.db_pool, active_order.user_phone)
-            if not order_user:
+            if not effective_user_id:
                 self.logger.error(f"Пользователь с телефоном {active_order.user_phone} не найден")
                 if future and not future.done():
                     future.set_result({"success": False, "error": "Пользователь не найден"})
                 return {"success": False, "error": "Пользователь не найден"}
-            
-            effective_user_id = order_user.user_id
-            if effective_user_id != matching_user_id:
-                pass
 
             # Обновляем статус повербанка и тип ошибки
             # powerbank уже получен и проверен выше на строке 309
@@ -352,12 +383,11 @@ class ReturnPowerbankHandler:
                 new_remain_num = int(station.remain_num) + 1
                 await station.update_remain_num(self.db_pool, new_remain_num)
 
-            # Удаляем из ожидающих (используем телефон как ключ)
-            if matching_user_phone in ReturnPowerbankHandler._pending_error_returns:
-                del ReturnPowerbankHandler._pending_error_returns[matching_user_phone]
+            # Удаляем из ожидающих (используем телефон как ключ); future завершается ниже
+            self.pending_error_returns.pop(matching_user_phone, future)
 
             # Логируем действие
-            await ActionLog.create(
+            await ActionLog.log(
                 self.db_pool,
                 user_id=effective_user_id,
                 action_type='order_update',
@@ -366,14 +396,9 @@ class ReturnPowerbankHandler:
                 description=f'Возврат повербанка с ошибкой: {error_name}'
             )
 
-            # Получаем дополнительные данные для ответа фронтенду
-            from models.station import Station
-            station_obj = await Station.get_by_id(self.db_pool, station_id)
-            station_box_id = station_obj.box_id if station_obj else None
-            
-            from models.user import User
-            user_obj = await User.get_by_id(self.db_pool, effective_user_id)
-            user_phone = user_obj.phone_e164 if user_obj else None
+            # Дополнительные данные для ответа фронтенду: телефон владельца - из заказа
+            station_box_id = station.box_id if station else None
+            user_phone = active_order.user_phone
             
             # Отправляем WebSocket уведомление о возврате
             try:
@@ -413,19 +438,38 @@ class ReturnPowerbankHandler:
             self.logger.error(f"Ошибка обработки возврата с ошибкой: {e}")
             return {"success": False, "error": f"Ошибка обработки: {str(e)}"}
     
-    async def get_pending_error_returns(self) -> Dict[int, Dict[str, Any]]:
+    async def get_pending_error_returns(self, user_id: Optional[int] = None) -> Dict[str, Any]:
         """
         Получает список ожидающих возврат с ошибкой
         """
-        return ReturnPowerbankHandler._pending_error_returns.copy()
+        now = asyncio.get_running_loop().time()
+        entries = [self.pending_error_returns.get_by_user(user_id)] if user_id is not None \
+            else self.pending_error_returns.values()
+        pending = [
+            {
+                'user_id': entry['user_id'],
+                'user_phone': entry['user_phone'],
+                'station_id': entry['station_id'],
+                'error_type': entry['error_type'],
+                'error_name': entry['error_name'],
+                'requested_at': entry['timestamp'].isoformat(),
+                'expires_in': round(max(0.0, entry['expires_at'] - now), 1),
+            }
+            for entry in entries if entry is not None
+        ]
+        return {"success": True, "pending": pending, "count": len(pending)}
     
     async def cancel_error_return(self, user_id: int) -> Dict[str, Any]:
         """
         Отменяет ожидание возврата с ошибкой
         """
         try:
-            if user_id in ReturnPowerbankHandler._pending_error_returns:
-                del ReturnPowerbankHandler._pending_error_returns[user_id]
+            entry = self.pending_error_returns.get_by_user(user_id)
+            if entry:
+                self.pending_error_returns.finish(entry['user_phone'], {
+                    "success": False,
+                    "error": "Запрос на возврат с ошибкой отменен"
+                })
                 return {"success": True, "message": "Запрос на возврат с ошибкой отменен"}
             else:
                 return {"success": False, "error": "Запрос на возврат с ошибкой не найден"}
@@ -440,17 +484,17 @@ class ReturnPowerbankHandler:
         """
         try:
             current_time = get_moscow_time()
-            expired_users = []
-            
-            for user_id, return_data in ReturnPowerbankHandler._pending_error_returns.items():
-                age_minutes = (current_time - return_data['timestamp']).total_seconds() / 60
-                if age_minutes > max_age_minutes:
-                    expired_users.append(user_id)
-            
-            for user_id in expired_users:
-                del ReturnPowerbankHandler._pending_error_returns[user_id]
+            expired = [
+                return_data for return_data in self.pending_error_returns.values()
+                if (current_time - return_data['timestamp']).total_seconds() / 60 > max_age_minutes
+            ]
+            
+            for return_data in expired:
+                self.pending_error_returns.expire(
+                    return_data['user_phone'], return_data['future'], return_data['ttl_seconds']
+                )
             
-            return len(expired_users)
+            return len(expired)
             
         except Exception as e:
             self.logger.error(f"Ошибка очистки просроченных запросов: {e}")
@@ -475,7 +519,6 @@ class ReturnPowerbankHandler:
         try:
             from utils.packet_utils import parse_return_power_bank_request, build_return_power_bank_response
             from utils.station_resolver import get_station_id_by_box_id
-            from models.powerbank import Powerbank
             
             # Парсим данные запроса
             parsed_data = parse_return_power_bank_request(data)
@@ -497,13 +540,19 @@ class ReturnPowerbankHandler:
             vsn = parsed_data.get('VSN', 1)
             
             # Получаем ID станции
-            station_id = await get_station_id_by_box_id(self.db_pool, connection.box_id)
+            station_id = connection.station_id or await get_station_id_by_box_id(self.db_pool, connection.box_id)
             if not station_id:
                 self.logger.error(f"Станция с box_id {connection.box_id} не найдена")
                 return None
             
-            # Ищем повербанк по terminal_id
-            powerbank = await Powerbank.get_by_terminal_id(self.db_pool, terminal_id)
+            # Без окон ожидания на станции это обычный возврат - запросы в БД не нужны
+            if not self.pending_error_returns.has_station(station_id):
+                return None
+            
+            # Повербанк по terminal_id, активный заказ и владелец заказа - одним запросом
+            powerbank, active_order, user_id = await Order.get_return_context(
+                self.db_pool, serial_number=terminal_id
+            )
             if not powerbank:
                 self.logger.error(f"Повербанк с terminal_id {terminal_id} не найден")
                 # Отправляем ответ об ошибке
@@ -523,31 +572,13 @@ class ReturnPowerbankHandler:
             
             powerbank_id = powerbank.powerbank_id
 
-            # Получаем активный заказ по повербанку
-            try:
-                active_order = await Order.get_active_by_powerbank_serial(self.db_pool, powerbank.serial_number)
-            except Exception:
-                active_order = None
-
             if not active_order:
                 return None
 
             owner_user_phone = active_order.user_phone
             
             # Ищем активное окно ожидания "возврата с ошибкой" для владельца павербанка на этой станции
-            matching_return_data = None
-            matching_user_id = None
-            error_type = None
-            
-            # Проверяем, есть ли активное окно для владельца этого павербанка на этой станции
-            for user_phone, return_data in self.pending_error_returns.items():
-                if (return_data.get('station_id') == station_id and 
-                    user_phone == owner_user_phone):
-                    # Нашли активное окно для владельца павербанка на этой станции
-                    matching_return_data = return_data
-                    matching_user_id = return_data.get('user_id')
-                    error_type = return_data.get('error_type')
-                    break
+            matching_return_data = self.pending_error_returns.find(station_id, owner_user_phone)
             
             if not matching_return_data:
                 # Нет активного окна для владельца павербанка - это обычный возврат
@@ -558,29 +589,22 @@ class ReturnPowerbankHandler:
             matching_user_phone = owner_user_phone
             
             
-            # Получаем user_id по телефону (уже есть в matching_user_id, но проверяем для безопасности)
-            async with self.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute("""
-                        SELECT user_id FROM app_user WHERE phone_e164 = %s
-                    """, (matching_user_phone,))
-                    user_result = await cur.fetchone()
-                    if not user_result:
-                        self.logger.error(f"Пользователь с телефоном {matching_user_phone} не найден")
-                        return build_return_power_bank_response(
-                            slot=slot,
-                            result=0,
-                            terminal_id=terminal_id.encode('ascii'),
-                            level=level,
-                            voltage=voltage,
-                            current=current,
-                            temperature=temperature,
-                            status=status,
-                            soh=soh,
-                            vsn=vsn,
-                            token=connection.token
-                        )
-                    user_id = user_result[0]
+            # user_id владельца получен тем же запросом
+            if not user_id:
+                self.logger.error(f"Пользователь с телефоном {matching_user_phone} не найден")
+                return build_return_power_bank_response(
+                    slot=slot,
+                    result=0,
+                    terminal_id=terminal_id.encode('ascii'),
+                    level=level,
+                    voltage=voltage,
+                    current=current,
+                    temperature=temperature,
+                    status=status,
+                    soh=soh,
+                    vsn=vsn,
+                    token=connection.token
+                )
             
             # Обрабатываем как возврат с ошибкой
             await self._process_error_return(
@@ -588,7 +612,8 @@ class ReturnPowerbankHandler:
                 slot_number=slot,
                 powerbank_id=powerbank_id,
                 matching_user_phone=matching_user_phone,
-                matching_user_id=user_id
+                matching_user_id=user_id,
+                resolved=(powerbank, active_order, user_id)
             )
             
             return build_return_power_bank_response(
@@ -6,6 +6,7 @@ from datetime import datetime
 from utils.centralized_logger import get_logger
 from models.station import Station
 from utils.packet_utils import build_set_server_address_request, parse_set_server_address_response
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
 
 
 class SetServerAddressHandler:
@@ -16,9 +17,11 @@ class SetServerAddressHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('setserveraddresshandler')
     
-    async def send_set_server_address_request(self, station_id: int, server_address: str, server_port: str, heartbeat_interval: int = 30) -> dict:
+    async def send_set_server_address_request(self, station_id: int, server_address: str, server_port: str, heartbeat_interval: int = 30,
+                                              wait: bool = False, timeout: float = DEFAULT_COMMAND_TIMEOUT) -> dict:
         """
         Отправляет запрос установки адреса сервера на станцию
+        При wait=True ждет подтверждение станции (confirmed)
         """
         try:
             
@@ -50,6 +53,12 @@ class SetServerAddressHandler:
                     "error": f"Станция {station.box_id} не подключена"
                 }
             
+            # Ожидание ответа - на воркере шлюза, где открыт сокет станции
+            if wait and getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'set_server_address_handler', 'send_set_server_address_request', station_id, server_address, server_port, heartbeat_interval, wait, timeout
+                )
+            
             if not connection.secret_key:
                 return {
                     "success": False,
@@ -73,15 +82,25 @@ class SetServerAddressHandler:
                     "error": f"Соединение со станцией {station.box_id} недоступно"
                 }
             
-            connection.writer.write(set_address_packet)
-            await connection.writer.drain()
-            
-            
-            return {
+            result = {
                 "success": True,
                 "message": f"Установка адреса сервера {server_address}:{server_port} отправлена на станцию {station.box_id}"
             }
+            if not wait:
+                connection.enqueue_command(set_address_packet)
+                return result
             
+            response = await connection.send_command(set_address_packet, timeout=timeout)
+            result["confirmed"] = bool(response.get("CheckSumValid")) and not response.get("Error")
+            result["request_id"] = response["RequestId"]
+            return result
+            
+        except CommandTimeoutError as e:
+            return {
+                "success": False,
+                "timeout": True,
+                "error": f"Станция не подтвердила установку адреса сервера: {e}"
+            }
         except Exception as e:
             error_msg = f"Ошибка отправки установки адреса сервера: {str(e)}"
             
@@ -6,6 +6,7 @@ from datetime import datetime
 from utils.centralized_logger import get_logger
 from models.station import Station
 from utils.packet_utils import build_set_voice_volume_request, parse_set_voice_volume_response
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, CommandTimeoutError
 
 
 class SetVoiceVolumeHandler:
@@ -16,9 +17,11 @@ class SetVoiceVolumeHandler:
         self.connection_manager = connection_manager
         self.logger = get_logger('setvoicevolumehandler')
     
-    async def send_set_voice_volume_request(self, station_id: int, volume_level: int) -> dict:
+    async def send_set_voice_volume_request(self, station_id: int, volume_level: int, wait: bool = False,
+                                            timeout: float = DEFAULT_COMMAND_TIMEOUT) -> dict:
         """
         Отправляет запрос установки уровня громкости на станцию
+        При wait=True ждет подтверждение станции (confirmed)
         """
         try:
             # Проверяем корректность уровня громкости
@@ -44,6 +47,12 @@ class SetVoiceVolumeHandler:
                     "error": f"Станция {station.box_id} не подключена"
                 }
             
+            # Ожидание ответа - на воркере шлюза, где открыт сокет станции
+            if wait and getattr(connection, 'is_remote', False):
+                return await connection.call_handler(
+                    'set_voice_volume_handler', 'send_set_voice_volume_request', station_id, volume_level, wait, timeout
+                )
+            
             if not connection.secret_key:
                 return {
                     "success": False,
@@ -67,20 +76,29 @@ class SetVoiceVolumeHandler:
                     "error": f"Соединение со станцией {station.box_id} недоступно"
                 }
             
-            connection.writer.write(set_volume_packet)
-            await connection.writer.drain()
-            
-            
-            print(f"Установка уровня громкости отправлена на станцию {station.box_id} (ID: {station_id})")
-            
-            return {
+            result = {
                 "success": True,
                 "message": f"Установка уровня громкости {volume_level} отправлена на станцию {station.box_id}",
                 "station_box_id": station.box_id,
                 "volume_level": volume_level,
                 "packet_hex": packet_hex
             }
+            if not wait:
+                connection.enqueue_command(set_volume_packet)
+                print(f"Установка уровня громкости отправлена на станцию {station.box_id} (ID: {station_id})")
+                return result
             
+            response = await connection.send_command(set_volume_packet, timeout=timeout)
+            result["confirmed"] = bool(response.get("CheckSumValid")) and not response.get("Error")
+            result["request_id"] = response["RequestId"]
+            return result
+            
+        except CommandTimeoutError as e:
+            return {
+                "success": False,
+                "timeout": True,
+                "error": f"Станция не подтвердила установку уровня громкости: {e}"
+            }
         except Exception as e:
             error_msg = f"Ошибка отправки установки уровня громкости: {str(e)}"
             print(error_msg)
@@ -65,7 +65,9 @@ class SlotAbnormalReportHandler:
             # Используем новую модель для сохранения
             from models.slot_abnormal_report import SlotAbnormalReport
             
-            report = await SlotAbnormalReport.create(
+            # Запись в БД - пачками в фоне (utils/batch_writer.py), ответ станции не ждет ее;
+            # отброшенные при переполнении очереди отчеты считает и логирует сама очередь
+            await SlotAbnormalReport.enqueue(
                 db_pool=self.db_pool,
                 station_id=station_id,
                 slot_number=abnormal_report['SlotNo'],
@@ -74,11 +76,6 @@ class SlotAbnormalReportHandler:
                 reported_at=abnormal_report['ReceivedAt']
             )
             
-            if report:
-                print(f"Отчет об аномалии слота сохранен для станции {station_id}, слот {abnormal_report['SlotNo']}")
-            else:
-                self.logger.error(f"Не удалось создать отчет об аномалии для станции {station_id}")
-            
         except Exception as e:
             self.logger.error(f"Ошибка: {e}")
     
@@ -2,15 +2,22 @@
 Обработчик для работы со станциями
 """
 import asyncio
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict, List
 from datetime import datetime
 
 from models.station import Station
-from models.powerbank import Powerbank
+from models.org_unit import OrgUnit
 from models.station_powerbank import StationPowerbank
 from models.connection import StationConnection
 from utils.packet_utils import parse_login_packet, build_login_response, build_heartbeat_response, log_packet
 from utils.powerbank_status_monitor import PowerbankStatusMonitor
+from utils.login_admission import LoginAdmissionController
+from utils.org_unit_utils import (
+    check_org_units_compatible, describe_org_units_compatibility, log_powerbank_ejection_event
+)
+from utils.time_utils import get_moscow_time
+from utils.fleet_state import fleet_state
+from utils.telemetry_store import telemetry_store
 from utils.centralized_logger import get_logger
 
 
@@ -21,6 +28,7 @@ class StationHandler:
         self.db_pool = db_pool
         self.connection_manager = connection_manager
         self.status_monitor = PowerbankStatusMonitor(db_pool)
+        self.login_admission: Optional[LoginAdmissionController] = None
         self.logger = get_logger('station_handler')
     
     async def handle_login(self, data: bytes, connection: StationConnection) -> Optional[bytes]:
@@ -40,6 +48,19 @@ class StationHandler:
                 print(f"Пакет в hex: {data.hex()}")
                 return None
             
+            # При массовом переподключении логины обрабатываются ограниченно
+            if self.login_admission:
+                async with self.login_admission.slot(packet["BoxID"]):
+                    return await self._process_login(packet, connection)
+            return await self._process_login(packet, connection)
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка: {e}")
+            return None
+    
+    async def _process_login(self, packet: dict, connection: StationConnection) -> Optional[bytes]:
+        """Обрабатывает разобранный пакет логина"""
+        try:
             # Получаем или создаем станцию
             station, secret_key = await Station.get_or_create(
                 self.db_pool, 
@@ -62,7 +83,6 @@ class StationHandler:
             existing_connection = self.connection_manager.get_connection_by_station_id(station.station_id)
             if existing_connection and existing_connection.fd != connection.fd:
                 # Вычисляем время с последнего heartbeat
-                from utils.time_utils import get_moscow_time
                 current_time = get_moscow_time()
                 time_since_heartbeat = (current_time - existing_connection.last_heartbeat).total_seconds()
                 
@@ -76,29 +96,30 @@ class StationHandler:
                 token=session_token,
                 secret_key=secret_key
             )
+            self.connection_manager.notify_login(connection)
             
-            # Обновляем статус станции на active
-            await station.update_status(self.db_pool, "active")
-            
-            # Обновляем last_seen при логине
-            await station.update_last_seen(self.db_pool)
-            
-            # Синхронизируем данные повербанков с БД 
-            await self._sync_powerbanks_to_db(station.station_id, packet["Slots"])
-            
-            # Синхронизируем station_powerbank с данными из пакета
-            await StationPowerbank.sync_station_powerbanks(self.db_pool, station.station_id, packet["Slots"])
-            
-            # Обновляем remain_num в станции
-            await station.update_remain_num(self.db_pool, packet["RemainNum"])
+            # Статус, last_seen, remain_num, повербанки и station_powerbank - одной транзакцией
+            powerbank_statuses, incompatible_slots = await self._sync_login_snapshot(
+                station, packet["Slots"], packet["RemainNum"], fd=connection.fd
+            )
+            telemetry_store.record(station.station_id, packet["Slots"])
             
-            # Инициализируем мониторинг статусов для станции
-            await self.status_monitor.initialize_station(station.station_id)
+            # Инициализируем мониторинг статусов по уже прочитанным данным
+            self.status_monitor.set_station_snapshot(station.station_id, powerbank_statuses)
             
-
+            # Извлекаем несовместимые повербанки после фиксации транзакции
+            for slot_number, terminal_id, powerbank_org_id, reason in incompatible_slots:
+                await log_powerbank_ejection_event(
+                    self.db_pool, station.station_id, slot_number, terminal_id,
+                    powerbank_org_id, station.org_unit_id, reason
+                )
+                await self._schedule_incompatible_powerbank_ejection(station.station_id, slot_number, terminal_id)
             
             # Автоматически запрашиваем ICCID после успешного логина
-            await self._request_iccid_after_login(connection)
+            await self._request_iccid_after_login(connection, station)
+            
+            if self.login_admission:
+                self.login_admission.remember_station(station.box_id, station.station_id)
             
             return response
             
@@ -120,12 +141,14 @@ class StationHandler:
             expected_token_int = generate_session_token(payload, connection.secret_key)
             expected_token = expected_token_int.to_bytes(4, byteorder='big')           
             
-            try:
-                station = await Station.get_by_id(self.db_pool, connection.station_id)
-                if station:
-                    await station.update_last_seen(self.db_pool)
-            except Exception as db_error:
-                self.logger.error(f"Ошибка обновления last_seen в БД: {db_error}")
+            # last_seen подключенной станции пишется в БД пачкой (см. utils/fleet_state.py)
+            if not fleet_state.touch(connection.station_id):
+                try:
+                    station = await Station.get_by_id(self.db_pool, connection.station_id)
+                    if station:
+                        await station.update_last_seen(self.db_pool)
+                except Exception as db_error:
+                    self.logger.error(f"Ошибка обновления last_seen в БД: {db_error}")
             
             vsn = data[3]
             
@@ -159,15 +182,16 @@ class StationHandler:
         except Exception as e:
             logger = get_logger('station_handler'); logger.error(f"Ошибка запроса инвентаря: {e}")
     
-    async def _request_iccid_after_login(self, connection: StationConnection) -> None:
+    async def _request_iccid_after_login(self, connection: StationConnection, station: Optional[Station] = None) -> None:
         """Автоматически запрашивает ICCID после успешного логина только если его нет в БД"""
         try:
             if not connection.writer or connection.writer.is_closing():
                 return
             
-            # Проверяем, есть ли уже ICCID у станции
-            station = await Station.get_by_id(self.db_pool, connection.station_id)
-            if station and station.iccid:
+            # Проверяем, есть ли уже ICCID у станции (при логине станция уже прочитана)
+            if station is None:
+                station = await Station.get_by_id(self.db_pool, connection.station_id)
+            if station and station.iccid and station.iccid.rstrip('\x00'):
                 return
             
             # Создаем запрос ICCID
@@ -175,67 +199,133 @@ class StationHandler:
             iccid_request = build_query_iccid_request(connection.secret_key, vsn=1)
             
             # Отправляем запрос
-            connection.writer.write(iccid_request)
-            await connection.writer.drain()
+            connection.enqueue_command(iccid_request)
             
         except Exception as e:
             self.logger.error(f"Ошибка: {e}")
     
-    async def _sync_powerbanks_to_db(self, station_id: int, slots_data: list) -> None:
-        """Синхронизирует данные повербанков с БД"""
-        
-        # Получаем org_unit_id станции
-        station = await Station.get_by_id(self.db_pool, station_id)
-        if not station:
-            return
+    async def _sync_login_snapshot(self, station: Station, slots_data: list,
+                                   remain_num: int, fd: Optional[int] = None) -> Tuple[Dict[int, str], List[tuple]]:
+        """
+        Применяет данные пакета логина в одной транзакции групповыми запросами:
+        статус/last_seen/remain_num станции, создание неизвестных повербанков, SOH
+        и diff station_powerbank, затем заводит станцию в fleet_state.
+        Возвращает статусы повербанков в станции
+        и несовместимые слоты (slot, serial, org_unit_id повербанка, причина)
+        """
+        slots = [
+            slot for slot in slots_data
+            if slot.get('TerminalID') and slot['TerminalID'] != '0000000000000000'
+        ]
+        serials = list(dict.fromkeys(slot['TerminalID'] for slot in slots))
+        moscow_time = get_moscow_time()
+        incompatible_slots = []
         
-        for slot in slots_data:
-            terminal_id = slot.get('TerminalID')
-            if not terminal_id or terminal_id == '0000000000000000':
-                continue  # Пропускаем пустые слоты
-            
-            # Проверяем, существует ли повербанк в БД
-            existing_powerbank = await Powerbank.get_by_serial(self.db_pool, terminal_id)
-            
-            if existing_powerbank:
-                from utils.org_unit_utils import is_powerbank_compatible, get_compatibility_reason
-                
-                compatible = await is_powerbank_compatible(
-                    self.db_pool, existing_powerbank.org_unit_id, station.org_unit_id
-                )
-                
-                if not compatible:
-                    reason = await get_compatibility_reason(
-                        self.db_pool, existing_powerbank.org_unit_id, station.org_unit_id
-                    )
+        async with self.db_pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor() as cur:
+                    await cur.execute("""
+                        UPDATE station 
+                        SET status = 'active', last_seen = %s, remain_num = %s, updated_at = %s
+                        WHERE station_id = %s
+                    """, (moscow_time, remain_num, moscow_time, station.station_id))
+                    
+                    powerbanks = await self._fetch_powerbanks_by_serial(cur, serials)
+                    
+                    # Неизвестные повербанки создаем со статусом unknown в группе станции
+                    created_serials = [serial for serial in serials if serial not in powerbanks]
+                    if created_serials:
+                        soh_by_serial = {
+                            slot['TerminalID']: int(slot['SOH']) if slot.get('SOH') is not None else 0
+                            for slot in slots
+                        }
+                        rows_sql = ','.join(['(%s, %s, %s, %s, %s, %s)'] * len(created_serials))
+                        params = []
+                        for serial in created_serials:
+                            params.extend([station.org_unit_id, serial, soh_by_serial[serial],
+                                           'unknown', 'none', moscow_time])
+                        await cur.execute(f"""
+                            INSERT INTO powerbank (org_unit_id, serial_number, soh, status, write_off_reason, created_at)
+                            VALUES {rows_sql}
+                        """, params)
+                        powerbanks.update(await self._fetch_powerbanks_by_serial(cur, created_serials))
                     
-                    from utils.org_unit_utils import log_powerbank_ejection_event
-                    await log_powerbank_ejection_event(
-                        self.db_pool, station_id, slot['Slot'], terminal_id,
-                        existing_powerbank.org_unit_id, station.org_unit_id, reason
+                    # Совместимость проверяем в памяти по один раз загруженным org_unit
+                    org_units = await OrgUnit.get_by_ids_with_cursor(
+                        cur, [station.org_unit_id] + [pb[1] for pb in powerbanks.values()]
                     )
+                    station_unit = org_units.get(station.org_unit_id)
                     
-                    await self._schedule_incompatible_powerbank_ejection(station_id, slot['Slot'], terminal_id)
-                    continue
-                
-                # Обновляем SOH если есть данные
-                if slot.get('SOH') is not None:
-                    # Конвертируем SOH в int, чтобы избежать MySQL warnings
-                    soh_int = int(slot['SOH']) if slot['SOH'] is not None else 0
-                    await existing_powerbank.update_soh(self.db_pool, soh_int)
-            else:
-                # Создаем новый повербанк со статусом unknown в группе станции
-                new_powerbank = await Powerbank.create_unknown(
-                    self.db_pool, 
-                    terminal_id, 
-                    station.org_unit_id  # Создаем в группе станции
-                )
+                    soh_updates = {}
+                    for slot in slots:
+                        terminal_id = slot['TerminalID']
+                        if terminal_id in created_serials or terminal_id not in powerbanks:
+                            continue
+                        powerbank_id, powerbank_org_id, current_soh, _ = powerbanks[terminal_id]
+                        
+                        powerbank_unit = org_units.get(powerbank_org_id)
+                        if not check_org_units_compatible(powerbank_unit, station_unit):
+                            reason = describe_org_units_compatibility(
+                                powerbank_unit, station_unit, powerbank_org_id, station.org_unit_id
+                            )
+                            incompatible_slots.append((slot['Slot'], terminal_id, powerbank_org_id, reason))
+                            continue
+                        
+                        # SOH обновляем только если он изменился
+                        if slot.get('SOH') is not None and int(slot['SOH']) != current_soh:
+                            soh_updates[powerbank_id] = int(slot['SOH'])
+                    
+                    if soh_updates:
+                        cases = ' '.join(['WHEN %s THEN %s'] * len(soh_updates))
+                        placeholders = ','.join(['%s'] * len(soh_updates))
+                        params = []
+                        for powerbank_id, soh in soh_updates.items():
+                            params.extend([powerbank_id, soh])
+                        params.extend(soh_updates.keys())
+                        await cur.execute(f"""
+                            UPDATE powerbank SET soh = CASE id {cases} END
+                            WHERE id IN ({placeholders})
+                        """, params)
+                    
+                    target_by_slot = StationPowerbank.build_target_slots(
+                        slots, {serial: pb[0] for serial, pb in powerbanks.items()}
+                    )
+                    await StationPowerbank.apply_slot_diff(cur, station.station_id, target_by_slot)
                 
-                # Обновляем SOH если есть данные
-                if slot.get('SOH') is not None:
-                    # Конвертируем SOH в int, чтобы избежать MySQL warnings
-                    soh_int = int(slot['SOH']) if slot['SOH'] is not None else 0
-                    await new_powerbank.update_soh(self.db_pool, soh_int)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        
+        station.status = 'active'
+        station.last_seen = moscow_time
+        station.remain_num = remain_num
+        station.updated_at = moscow_time
+        fleet_state.set_station(station, target_by_slot.items(), fd)
+        
+        statuses_by_id = {pb[0]: pb[3] for pb in powerbanks.values()}
+        powerbank_statuses = {
+            target[0]: statuses_by_id[target[0]] for target in target_by_slot.values()
+        }
+        return powerbank_statuses, incompatible_slots
+    
+    async def _fetch_powerbanks_by_serial(self, cur, serials: list) -> Dict[str, tuple]:
+        """Возвращает {serial: (id, org_unit_id, soh, status)} одним запросом"""
+        if not serials:
+            return {}
+        
+        placeholders = ','.join(['%s'] * len(serials))
+        await cur.execute(f"""
+            SELECT id, org_unit_id, soh, status, serial_number 
+            FROM powerbank 
+            WHERE serial_number IN ({placeholders})
+        """, serials)
+        rows = await cur.fetchall()
+        return {
+            str(row[4]): (int(row[0]), int(row[1]) if row[1] else None, row[2], str(row[3]))
+            for row in rows
+        }
     
     async def _check_and_extract_incompatible_powerbanks(self, station_id: int) -> None:
         """Проверяет и извлекает несовместимые повербанки"""
@@ -4,12 +4,16 @@ HTTP сервер с API endpoints
 import asyncio
 import aiomysql
 import os
+import platform
+import signal
+import sys
+import time
 from aiohttp import web
 from aiohttp.web import Application
 from aiohttp.web_exceptions import HTTPRequestEntityTooLarge, HTTPException
 from aiohttp_cors import setup as cors_setup, ResourceOptions
 
-from config.settings import DB_CONFIG, HTTP_PORT
+from config.settings import DB_CONFIG, HTTP_PORT, GATEWAY_CLUSTER_CONFIG, LOOP_WATCHDOG_CONFIG
 from utils.centralized_logger import get_logger
 from handlers.auth_handler import AuthHandler
 from api.admin_endpoints import AdminEndpoints
@@ -34,12 +38,26 @@ from api.invitation_api import InvitationAPI
 from api.invitation_storage_api import InvitationStorageAPI
 from api.soft_delete_api import SoftDeleteAPI
 from api.hard_delete_api import HardDeleteAPI
+from api.server_metrics_api import ServerMetricsAPI
+from api.bulk_command_api import BulkCommandAPI
+from api.telemetry_api import TelemetryAPI
+from api.battery_health_api import BatteryHealthAPI
+from api.usage_report_api import UsageReportAPI
 from middleware.auth_middleware import AuthMiddleware
 from utils.user_notification_manager import user_notification_manager
+from utils.runtime_metrics import runtime_metrics
+from utils.socket_tuning import install_event_loop_policy
+from utils.loop_watchdog import loop_watchdog
+from utils.battery_health import battery_health_analyzer
+from utils.usage_rollup import usage_rollup
+from utils.overdue_write_off import overdue_write_off
+from utils.hard_delete_cleanup import hard_delete_cleanup
 import jwt
 from config.settings import JWT_SECRET_KEY, JWT_ALGORITHM
 
 
+logger = get_logger('http_server')
+
 
 
 class HTTPServer:
@@ -70,14 +88,23 @@ class HTTPServer:
         self.invitation_storage_api: InvitationStorageAPI = None
         self.soft_delete_api: SoftDeleteAPI = None
         self.hard_delete_api: HardDeleteAPI = None
+        self.server_metrics_api: ServerMetricsAPI = None
+        self.bulk_command_api: BulkCommandAPI = None
+        self.telemetry_api: TelemetryAPI = None
+        self.battery_health_api: BatteryHealthAPI = None
+        self.usage_report_api: UsageReportAPI = None
         self.auth_middleware: AuthMiddleware = None
+        # Связь со шлюзом, когда HTTP работает отдельным процессом
+        self.gateway_mirror = None
+        self.gateway_router = None
+        self.runner: web.AppRunner = None
+        self.reminder_service = None
         
     
     async def initialize_database(self):
         
         try:
             self.db_pool = await aiomysql.create_pool(**DB_CONFIG)
-            logger = get_logger('http_server')
             logger.info("HTTP сервер: подключение к базе данных установлено")
         except Exception as e:
             logger.error(f"HTTP сервер: ошибка подключения к базе данных: {e}")
@@ -97,6 +124,22 @@ class HTTPServer:
         app = web.Application(client_max_size=client_max_size_bytes)
         app['client_max_size_bytes'] = client_max_size_bytes
         
+        @web.middleware
+        async def metrics_middleware(request, handler):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status
+                return response
+            except HTTPException as e:
+                status = e.status
+                raise
+            finally:
+                resource = request.match_info.route.resource
+                route = resource.canonical if resource else 'unmatched'
+                runtime_metrics.observe_http(route, request.method, status, time.perf_counter() - started)
+        
         @web.middleware
         async def error_to_json_middleware(request, handler):
             try:
@@ -160,6 +203,12 @@ class HTTPServer:
             
             return response
         
+        app.middlewares.append(metrics_middleware)
+        # Блокировка цикла событий внутри запроса помечается его маршрутом
+        loop_watchdog.register_context(
+            metrics_middleware,
+            lambda frame_locals: f"HTTP {frame_locals['request'].method} {frame_locals['request'].path}"
+        )
         app.middlewares.append(error_to_json_middleware)
         app.middlewares.append(cors_middleware)
         
@@ -197,6 +246,14 @@ class HTTPServer:
         self.invitation_storage_api = InvitationStorageAPI(self.db_pool)
         self.soft_delete_api = SoftDeleteAPI(self.db_pool, connection_manager)
         self.hard_delete_api = HardDeleteAPI(self.db_pool, connection_manager)
+        self.bulk_command_api = BulkCommandAPI(self.db_pool, connection_manager)
+        self.telemetry_api = TelemetryAPI(self.db_pool)
+        self.battery_health_api = BatteryHealthAPI(self.db_pool)
+        self.usage_report_api = UsageReportAPI(self.db_pool)
+        self.server_metrics_api = ServerMetricsAPI(
+            self.db_pool, getattr(self, 'login_admission', None),
+            gateway_mirror=self.gateway_mirror, gateway_router=self.gateway_router
+        )
         self.auth_middleware = AuthMiddleware(self.db_pool)
         
         # Регистрируем маршруты
@@ -205,6 +262,19 @@ class HTTPServer:
         # Сохраняем notification manager в app для доступа из роутов
         app['user_notification_manager'] = user_notification_manager
         
+        runtime_metrics.register_gauge(
+            'zaryd_websocket_subscribers', 'WebSocket подписчики уведомлений',
+            user_notification_manager.get_active_users_count
+        )
+        runtime_metrics.register_gauge(
+            'zaryd_notification_queue_depth', 'Уведомления в очереди для отключенных пользователей',
+            lambda: sum(len(queue) for queue in user_notification_manager.pending_notifications.values())
+        )
+        runtime_metrics.register_gauge(
+            'zaryd_bulk_command_jobs_running', 'Выполняющиеся задания массовых команд',
+            self.bulk_command_api.running_jobs
+        )
+        
         return app
     
     def _setup_routes(self, app: Application, connection_manager):
@@ -309,6 +379,24 @@ class HTTPServer:
         app.router.add_delete('/api/hard-delete/{entity_type}/{entity_id}', self.hard_delete_api.hard_delete_entity)
         app.router.add_delete('/api/hard-delete/cleanup', self.hard_delete_api.cleanup_old_deleted)
         app.router.add_get('/api/hard-delete/cleanup/preview', self.hard_delete_api.get_cleanup_candidates)
+        app.router.add_get('/api/hard-delete/cleanup/jobs', self.hard_delete_api.get_cleanup_jobs)
+        app.router.add_get('/api/hard-delete/cleanup/jobs/{job_id}', self.hard_delete_api.get_cleanup_job)
+        app.router.add_post('/api/hard-delete/cleanup/jobs/{job_id}/cancel', self.hard_delete_api.cancel_cleanup_job)
+        
+        # Служебные метрики сервера
+        self.server_metrics_api.setup_routes(app)
+        
+        # Массовые команды станциям
+        self.bulk_command_api.setup_routes(app)
+        
+        # Графики телеметрии слотов
+        self.telemetry_api.setup_routes(app)
+        
+        # Аналитика состояния аккумуляторов
+        self.battery_health_api.setup_routes(app)
+        
+        # Суточная сводка использования по заказам
+        self.usage_report_api.setup_routes(app)
         
         # Путь к папке с логотипами (tcp_server/uploads/logos)
         uploads_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads", "logos")
@@ -391,32 +479,111 @@ class HTTPServer:
         
         return ws
     
-    async def start_server(self):
-        """Запускает HTTP сервер"""
+    async def connect_gateway(self, http_worker_id: int = 0):
+        """
+        Подключается к справочнику станций шлюза (server.py --role gateway).
+        Возвращает менеджер соединений, через который команды уходят воркерам шлюза.
+        """
+        from models.connection import ConnectionManager
+        from utils.gateway_cluster import StationStateMirror, StationCommandRouter, ClusterConnectionManager
+        from handlers.borrow_powerbank import BorrowPowerbankHandler
+        from handlers.return_powerbank import ReturnPowerbankHandler
+
+        socket_dir = GATEWAY_CLUSTER_CONFIG['socket_dir']
+        self.gateway_mirror = StationStateMirror(socket_dir, self.db_pool, queue_notifications=http_worker_id == 0)
+        await self.gateway_mirror.start()
+        self.gateway_router = StationCommandRouter(socket_dir, GATEWAY_CLUSTER_CONFIG['call_timeout'])
+
+        # Локальных станций у HTTP процесса нет - все соединения удаленные
+        connection_manager = ClusterConnectionManager(ConnectionManager(), self.gateway_mirror, self.gateway_router)
+        self.shared_borrow_handler = BorrowPowerbankHandler(self.db_pool, connection_manager)
+        self.shared_return_handler = ReturnPowerbankHandler(self.db_pool, connection_manager)
+        return connection_manager
+    
+    async def start_server(self, http_worker_id: int = 0, reuse_port: bool = False):
+        """
+        Запускает HTTP сервер отдельным процессом со своим пулом БД.
+        Станции доступны через шлюз; при reuse_port несколько процессов делят HTTP_PORT.
+        """
         try:
             # Инициализируем базу данных
             await self.initialize_database()
             
+            runtime_metrics.process_name = f'http-{http_worker_id}'
+            runtime_metrics.instrument_db_pool(self.db_pool)
+            if LOOP_WATCHDOG_CONFIG['enabled']:
+                await loop_watchdog.start()
+            await runtime_metrics.start(probe_loop_lag=not loop_watchdog.running)
+            
+            connection_manager = await self.connect_gateway(http_worker_id)
+            
             # Создаем приложение
-            self.app = self.create_app()
+            self.app = self.create_app(connection_manager)
+            
+            # Фоновые задания - только в HTTP процессе 0, пул БД для API - во всех до приема запросов
+            run_jobs = http_worker_id == 0
+            battery_health_analyzer.attach(self.db_pool, periodic=run_jobs)
+            usage_rollup.attach(self.db_pool, periodic=run_jobs)
+            hard_delete_cleanup.attach(self.db_pool, executor=run_jobs)
+            if run_jobs:
+                overdue_write_off.attach(self.db_pool)
+                runtime_metrics.register_counter(
+                    'zaryd_overdue_written_off_total', 'Заказы, закрытые автоматическим списанием',
+                    lambda: overdue_write_off.written_off_total
+                )
+                runtime_metrics.register_gauge(
+                    'zaryd_overdue_write_off_mail_pending', 'Письма о списании в очереди',
+                    lambda: overdue_write_off.mail_pending
+                )
             
             # Запускаем сервер
-            runner = web.AppRunner(self.app)
-            await runner.setup()
+            self.runner = web.AppRunner(self.app)
+            await self.runner.setup()
             
-            site = web.TCPSite(runner, '0.0.0.0', HTTP_PORT)
+            site = web.TCPSite(self.runner, '0.0.0.0', HTTP_PORT,
+                               reuse_port=reuse_port and platform.system() == 'Linux')
             await site.start()
             
-            logger.info(f"HTTP сервер запущен на порту {HTTP_PORT}")
+            logger.info(f"HTTP сервер {http_worker_id} запущен на порту {HTTP_PORT}")
             logger.info("Доступные endpoints зарегистрированы")
             
+            # Напоминания о возврате - только в одном HTTP процессе
+            from config.settings import POWERBANK_REMINDER_CONFIG
+            if http_worker_id == 0 and POWERBANK_REMINDER_CONFIG.get('enabled', True):
+                from utils.powerbank_reminder_service import PowerbankReminderService
+                self.reminder_service = PowerbankReminderService(self.db_pool)
+                check_interval = POWERBANK_REMINDER_CONFIG.get('check_interval_hours', 1)
+                asyncio.create_task(self.reminder_service.run_periodic_check(interval_hours=check_interval))
+            
             # Ждем завершения
             await asyncio.Future()  # Бесконечное ожидание
             
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            self.logger.error(f"Ошибка: {e}")
+            logger.error(f"Ошибка: {e}")
         finally:
-            await self.cleanup_database()
+            await self.shutdown()
+    
+    async def shutdown(self):
+        """Останавливает отдельный HTTP процесс: сайт, фоновые задания, связь со шлюзом и пул БД"""
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+        await battery_health_analyzer.stop()
+        await usage_rollup.stop()
+        await overdue_write_off.stop()
+        await hard_delete_cleanup.stop()
+        if self.gateway_mirror:
+            await self.gateway_mirror.stop()
+            self.gateway_mirror = None
+        if self.gateway_router:
+            await self.gateway_router.close()
+            self.gateway_router = None
+        await runtime_metrics.stop()
+        await loop_watchdog.stop()
+        await self.cleanup_database()
+        self.db_pool = None
     
     def stop_server(self):
         """Останавливает HTTP сервер"""
@@ -426,20 +593,37 @@ class HTTPServer:
             pass
 
 
-async def main():
+async def main(http_worker_id: int = 0, reuse_port: bool = False):
     """Основная функция HTTP сервера"""
     server = HTTPServer()
+    task = asyncio.create_task(server.start_server(http_worker_id, reuse_port))
+    
+    if sys.platform != 'win32':
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, task.cancel)
     
     try:
-        await server.start_server()
+        await task
     except KeyboardInterrupt:
         logger.info("HTTP сервер остановлен")
+    except asyncio.CancelledError:
+        logger.info("HTTP сервер остановлен")
     except Exception as e:
         logger.error(f"Критическая ошибка HTTP сервера: {e}")
 
 
+def run_http_worker(http_worker_id: int, reuse_port: bool):
+    """Точка входа процесса HTTP сервера (server.py --role http)"""
+    runtime_metrics.event_loop = install_event_loop_policy()
+    try:
+        asyncio.run(main(http_worker_id, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-    logger = get_logger('http_server')
+    runtime_metrics.event_loop = install_event_loop_policy()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -60,7 +60,8 @@ class AuthMiddleware:
                 '/api/auth/login',
                 '/api/invitations/register',
                 '/api/logos/',  # Логотипы должны быть доступны без авторизации
-                '/api/ws/notifications'  # WebSocket - авторизация через query параметр
+                '/api/ws/notifications',  # WebSocket - авторизация через query параметр
+                '/metrics'  # Prometheus - проверка токена метрик в ServerMetricsAPI
             ]
             
             # Проверяем, является ли путь публичным
@@ -5,6 +5,8 @@ from typing import Optional, List
 from datetime import datetime
 import aiomysql
 
+from utils.batch_writer import action_log_writer
+
 
 class ActionLog:
     """Модель лога действия"""
@@ -65,6 +67,19 @@ class ActionLog:
                     created_at=now
                 )
     
+    @classmethod
+    async def log(cls, db_pool, user_id: Optional[int], action_type: str,
+                  entity_type: Optional[str], entity_id: Optional[int],
+                  description: Optional[str], ip_address: Optional[str] = None,
+                  user_agent: Optional[str] = None) -> None:
+        """Записывает действие через очередь пачечной записи, не дожидаясь БД"""
+        if not action_log_writer.running:
+            await cls.create(db_pool, user_id, action_type, entity_type, entity_id,
+                             description, ip_address, user_agent)
+            return
+        action_log_writer.enqueue((user_id, action_type, entity_type, entity_id, description,
+                                   ip_address, user_agent, datetime.now()))
+    
     @classmethod
     async def get_by_user_id(cls, db_pool, user_id: int, limit: int = 100) -> List['ActionLog']:
         """Получает логи пользователя"""
@@ -1,10 +1,13 @@
 """
 Модель соединения со станцией
 """
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 from datetime import datetime
 import asyncio
+from config.settings import HEARTBEAT_TIMEOUT_SECONDS
 from utils.time_utils import get_moscow_time
+from utils.timer_wheel import timer_wheel, WheelTimer
+from utils.command_rpc import DEFAULT_COMMAND_TIMEOUT, StationCommandQueue
 import socket
 
 
@@ -27,6 +30,13 @@ class StationConnection:
         self.inventory_requested = False
         self.connected_at = get_moscow_time()
         self.last_db_update = None
+        # Таймаут heartbeat в колесе таймеров, ставит ConnectionManager
+        self.timeout_timer: Optional[WheelTimer] = None
+        # Исходящие команды станции по одной (см. utils/command_rpc.py)
+        self.command_queue = StationCommandQueue(self)
+        # loop.time() последнего инвентаря и отчета об аномалии (см. utils/inventory_poller.py)
+        self.last_inventory_at: Optional[float] = None
+        self.last_abnormal_report_at: Optional[float] = None
     
     def to_dict(self) -> Dict[str, Any]:
         """Преобразует соединение в словарь"""
@@ -39,7 +49,8 @@ class StationConnection:
             "last_heartbeat": self.last_heartbeat.isoformat(),
             "token": self.token,
             "station_status": self.station_status,
-            "borrow_sent": self.borrow_sent
+            "borrow_sent": self.borrow_sent,
+            "command_queue_depth": self.command_queue.depth
         }
     
     def update_heartbeat(self):
@@ -47,6 +58,8 @@ class StationConnection:
         current_time = get_moscow_time()
         self.last_heartbeat = current_time
         self.last_seen = current_time
+        if self.timeout_timer is not None:
+            self.timeout_timer.reschedule()
     
     def update_login(self, box_id: str, station_id: int, token: int, secret_key: bytes):
         """Обновляет данные после логина"""
@@ -59,13 +72,56 @@ class StationConnection:
         self.last_db_update = None
         self.update_heartbeat()
     
-
+    def enqueue_command(self, packet: bytes, opcode: Optional[int] = None,
+                        timeout: float = DEFAULT_COMMAND_TIMEOUT,
+                        parser: Optional[Callable[[bytes], Dict[str, Any]]] = None) -> asyncio.Future:
+        """
+        Ставит команду в очередь станции (команды уходят по одной, после ответа на предыдущую).
+        Future завершится разобранным ответом; ждать его не обязательно.
+        Отмена future до отправки снимает команду с очереди.
+        """
+        return self.command_queue.submit(packet, opcode, timeout, parser)
+    
+    async def send_command(self, packet: bytes, opcode: Optional[int] = None,
+                           timeout: float = DEFAULT_COMMAND_TIMEOUT,
+                           parser: Optional[Callable[[bytes], Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Отправляет команду станции через очередь и ждет ответ с тем же opcode.
+        Возвращает разобранный ответ (с RequestId); CommandTimeoutError - нет ответа,
+        ConnectionError - соединение закрыто до ответа.
+        """
+        if not self.writer or self.writer.is_closing():
+            raise ConnectionError(f"Соединение со станцией {self.box_id} недоступно")
+        return await self.enqueue_command(packet, opcode, timeout, parser)
+    
+    def resolve_command(self, opcode: int, data: bytes) -> bool:
+        """Передает ответ станции команде в полете с тем же opcode"""
+        return self.command_queue.resolve(opcode, data)
+    
 
 class ConnectionManager:
     """Менеджер соединений"""
     
-    def __init__(self):
+    def __init__(self, heartbeat_timeout: float = HEARTBEAT_TIMEOUT_SECONDS):
         self.connections: Dict[int, StationConnection] = {}
+        self.heartbeat_timeout = heartbeat_timeout
+        # Подписчики на события соединений: callback(event, connection), event: 'login' | 'disconnect'
+        self.listeners: List[Callable[[str, StationConnection], None]] = []
+    
+    def add_listener(self, callback: Callable[[str, StationConnection], None]) -> None:
+        """Добавляет подписчика на события соединений"""
+        self.listeners.append(callback)
+    
+    def _notify(self, event: str, connection: StationConnection) -> None:
+        for callback in self.listeners:
+            try:
+                callback(event, connection)
+            except Exception as e:
+                print(f"Ошибка обработчика события соединения {event}: {e}")
+    
+    def notify_login(self, connection: StationConnection) -> None:
+        """Сообщает подписчикам об успешном логине станции"""
+        self._notify('login', connection)
     
     def add_connection(self, connection: StationConnection):
         """Добавляет соединение"""
@@ -75,6 +131,17 @@ class ConnectionManager:
             self.remove_connection(connection.fd)
         
         self.connections[connection.fd] = connection
+        # Закрытие соединения без heartbeat; heartbeat переносит таймер
+        connection.timeout_timer = timer_wheel.call_later(
+            self.heartbeat_timeout, self._expire_connection, connection
+        )
+    
+    def _expire_connection(self, connection: StationConnection) -> None:
+        """Срабатывание таймаута heartbeat: физически закрывает соединение"""
+        if self.connections.get(connection.fd) is not connection:
+            return
+        print(f"СЕРВЕР ЗАКРЫЛ СОЕДИНЕНИЕ: {connection.box_id} (fd={connection.fd}) - нет heartbeat {self.heartbeat_timeout} сек")
+        self.close_connection(connection.fd)
     
     def close_old_station_connections(self, station_id: int, keep_fd: int):
         """Закрывает старые соединения станции, оставляя только указанное"""
@@ -91,8 +158,13 @@ class ConnectionManager:
     
     def remove_connection(self, fd: int):
         """Удаляет соединение"""
-        if fd in self.connections:
-            del self.connections[fd]
+        connection = self.connections.pop(fd, None)
+        if connection and connection.timeout_timer is not None:
+            connection.timeout_timer.cancel()
+        if connection:
+            connection.command_queue.close(ConnectionError(f"Станция {connection.box_id} отключилась"))
+        if connection and connection.station_id:
+            self._notify('disconnect', connection)
     
     def get_connection(self, fd: int) -> Optional[StationConnection]:
         """Получает соединение по fd"""
@@ -1,7 +1,7 @@
 """
 Модель для работы с заказами
 """
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterable, Set, Tuple
 from datetime import datetime
 import aiomysql
 from utils.time_utils import get_moscow_time
@@ -558,6 +558,65 @@ class Order:
 
                 return orders
 
+    @classmethod
+    async def get_return_context(cls, db_pool, powerbank_id: Optional[int] = None,
+                                 serial_number: Optional[str] = None) -> Tuple[Any, Optional['Order'], Optional[int]]:
+        """
+        Повербанк, его активный заказ и user_id владельца заказа одним запросом (для возврата).
+        Повербанк ищется по ID или серийному номеру; возвращает (Powerbank | None, Order | None, user_id | None)
+        """
+        from models.powerbank import Powerbank
+        if powerbank_id is not None:
+            condition, value = 'p.id = %s', powerbank_id
+        else:
+            condition, value = 'p.serial_number COLLATE utf8mb4_unicode_ci = %s COLLATE utf8mb4_unicode_ci', serial_number
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(f"""
+                    SELECT p.id AS powerbank_id, p.org_unit_id, p.serial_number, p.soh, p.status AS powerbank_status,
+                           p.write_off_reason, p.created_at, p.is_deleted, p.deleted_at, p.power_er,
+                           o.id AS order_id, o.station_box_id, o.user_phone, o.user_fio, o.org_unit_name,
+                           o.status AS order_status, o.timestamp, o.completed_at,
+                           u.user_id
+                    FROM powerbank p
+                    LEFT JOIN orders o
+                        ON o.powerbank_serial COLLATE utf8mb4_unicode_ci = p.serial_number COLLATE utf8mb4_unicode_ci
+                        AND o.status = 'borrow'
+                    LEFT JOIN app_user u ON u.phone_e164 = o.user_phone AND u.status = 'active'
+                    WHERE {condition}
+                    LIMIT 1
+                """, (value,))
+                row = await cursor.fetchone()
+
+        if not row:
+            return None, None, None
+        powerbank = Powerbank(
+            powerbank_id=int(row['powerbank_id']),
+            org_unit_id=int(row['org_unit_id']) if row['org_unit_id'] else None,
+            serial_number=str(row['serial_number']),
+            soh=int(row['soh']) if row['soh'] else None,
+            status=str(row['powerbank_status']),
+            write_off_reason=str(row['write_off_reason']) if row['write_off_reason'] else None,
+            created_at=row['created_at'],
+            is_deleted=int(row['is_deleted']) if row['is_deleted'] is not None else 0,
+            deleted_at=row['deleted_at'],
+            power_er=int(row['power_er']) if row['power_er'] is not None else None
+        )
+        if row['order_id'] is None:
+            return powerbank, None, None
+        order = cls(
+            order_id=row['order_id'],
+            station_box_id=row.get('station_box_id'),
+            user_phone=row.get('user_phone'),
+            user_fio=row.get('user_fio'),
+            powerbank_serial=powerbank.serial_number,
+            org_unit_name=row.get('org_unit_name'),
+            status=row['order_status'],
+            timestamp=row.get('timestamp'),
+            completed_at=row.get('completed_at'),
+        )
+        return powerbank, order, row['user_id']
+
     @classmethod
     async def get_active_by_powerbank_serial(cls, db_pool, powerbank_serial: str) -> Optional['Order']:
         """Получает активный заказ по серийному номеру повербанка"""
@@ -585,6 +644,21 @@ class Order:
                     )
                 return None
 
+    @classmethod
+    async def get_active_powerbank_serials(cls, db_pool, powerbank_serials: Iterable[str]) -> Set[str]:
+        """Серийные номера из списка, по которым есть активный заказ (один запрос)"""
+        powerbank_serials = list(dict.fromkeys(powerbank_serials))
+        if not powerbank_serials:
+            return set()
+        placeholders = ','.join(['%s COLLATE utf8mb4_unicode_ci'] * len(powerbank_serials))
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"""
+                    SELECT DISTINCT powerbank_serial FROM orders
+                    WHERE powerbank_serial COLLATE utf8mb4_unicode_ci IN ({placeholders}) AND status = 'borrow'
+                """, powerbank_serials)
+                return {row[0] for row in await cursor.fetchall()}
+
     @classmethod
     async def get_active_by_station_box_id(cls, db_pool, station_box_id: str) -> List['Order']:
         """Получает активные заказы для станции по box_id"""
@@ -1,7 +1,7 @@
 """
 Модель для работы с организационными единицами
 """
-from typing import Optional
+from typing import Optional, Dict, Iterable
 from datetime import datetime
 import aiomysql
 
@@ -36,20 +36,41 @@ class OrgUnit:
                 """, (org_unit_id,))
                 row = await cur.fetchone()
                 if row:
-                    return cls(
-                        org_unit_id=row[0],
-                        parent_org_unit_id=row[1],
-                        unit_type=row[2],
-                        name=row[3],
-                        adress=row[4],
-                        logo_url=row[5],
-                        created_at=row[6],
-                        default_powerbank_limit=row[7] or 1,
-                        reminder_hours=row[8] or 24,
-                        write_off_hours=row[9] or 48
-                    )
+                    return cls.from_row(row)
                 return None
     
+    @classmethod
+    def from_row(cls, row) -> 'OrgUnit':
+        """Создает организационную единицу из строки выборки (порядок колонок как в get_by_id)"""
+        return cls(
+            org_unit_id=row[0],
+            parent_org_unit_id=row[1],
+            unit_type=row[2],
+            name=row[3],
+            adress=row[4],
+            logo_url=row[5],
+            created_at=row[6],
+            default_powerbank_limit=row[7] or 1,
+            reminder_hours=row[8] or 24,
+            write_off_hours=row[9] or 48
+        )
+    
+    @classmethod
+    async def get_by_ids_with_cursor(cls, cur, org_unit_ids: Iterable[int]) -> Dict[int, 'OrgUnit']:
+        """Получает несколько организационных единиц одним запросом в рамках переданного курсора"""
+        ids = sorted({int(org_unit_id) for org_unit_id in org_unit_ids if org_unit_id is not None})
+        if not ids:
+            return {}
+        
+        placeholders = ','.join(['%s'] * len(ids))
+        await cur.execute(f"""
+            SELECT org_unit_id, parent_org_unit_id, unit_type, name, adress, logo_url, created_at, default_powerbank_limit, reminder_hours, write_off_hours
+            FROM org_unit
+            WHERE org_unit_id IN ({placeholders})
+        """, ids)
+        rows = await cur.fetchall()
+        return {int(row[0]): cls.from_row(row) for row in rows}
+    
     def to_dict(self) -> dict:
         """Преобразует в словарь"""
         return {
@@ -2,7 +2,7 @@
 Модель для работы с повербанками
 """
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable
 from datetime import datetime
 from utils.time_utils import get_moscow_time
 from utils.centralized_logger import get_logger
@@ -57,6 +57,36 @@ class Powerbank:
                     )
                 return None
 
+    @classmethod
+    async def get_by_ids(cls, db_pool, powerbank_ids: Iterable[int]) -> Dict[int, 'Powerbank']:
+        """Получает повербанки по списку ID одним запросом: {id: Powerbank}"""
+        powerbank_ids = list(dict.fromkeys(int(pid) for pid in powerbank_ids))
+        if not powerbank_ids:
+            return {}
+        placeholders = ','.join(['%s'] * len(powerbank_ids))
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT id, org_unit_id, serial_number, soh, status, write_off_reason, created_at, "
+                    f"is_deleted, deleted_at, power_er FROM powerbank WHERE id IN ({placeholders})",
+                    powerbank_ids
+                )
+                return {
+                    int(result[0]): cls(
+                        powerbank_id=int(result[0]),
+                        org_unit_id=int(result[1]) if result[1] else None,
+                        serial_number=str(result[2]),
+                        soh=int(result[3]) if result[3] else None,
+                        status=str(result[4]),
+                        write_off_reason=str(result[5]) if result[5] else None,
+                        created_at=result[6],
+                        is_deleted=int(result[7]) if result[7] is not None else 0,
+                        deleted_at=result[8],
+                        power_er=int(result[9]) if result[9] is not None else None
+                    )
+                    for result in await cursor.fetchall()
+                }
+
     @classmethod
     async def get_by_serial(cls, db_pool, serial_number: str) -> Optional['Powerbank']:
         """Получает повербанк по серийному номеру"""
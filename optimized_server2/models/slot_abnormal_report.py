@@ -5,6 +5,8 @@ from typing import Optional, List
 from datetime import datetime
 import aiomysql
 
+from utils.batch_writer import abnormal_report_writer
+
 
 class SlotAbnormalReport:
     """Модель отчета об аномалии слота"""
@@ -84,6 +86,25 @@ class SlotAbnormalReport:
                     box_id=None,
                 )
     
+    @classmethod
+    async def enqueue(
+        cls,
+        db_pool,
+        station_id: int,
+        slot_number: int,
+        terminal_id: Optional[str],
+        event_type: str,
+        reported_at: Optional[datetime] = None,
+    ) -> bool:
+        """Ставит отчет в очередь пачечной записи; False - отброшен при переполнении очереди"""
+        if not abnormal_report_writer.running:
+            return await cls.create(db_pool, station_id, slot_number, terminal_id, event_type,
+                                    reported_at) is not None
+        now = datetime.now()
+        return abnormal_report_writer.enqueue(
+            (station_id, slot_number, terminal_id, event_type, reported_at or now, now)
+        )
+    
     @classmethod
     async def get_by_station_id(cls, db_pool, station_id: int, limit: int = 100) -> List['SlotAbnormalReport']:
         """Получает отчеты по станции"""
@@ -158,6 +179,11 @@ class SlotAbnormalReport:
     @classmethod
     async def get_statistics(cls, db_pool) -> dict:
         """Возвращает статистику по отчетам """
+        from utils.stats_rollup import stats_rollups
+        if await stats_rollups.ready(db_pool):
+            by_event_type = await stats_rollups.abnormal_by_event_type(db_pool)
+            return {"by_event_type": by_event_type, "total": sum(by_event_type.values())}
+        
         async with db_pool.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
@@ -5,6 +5,7 @@ from typing import Optional, Dict, Any, List
 from datetime import datetime
 import aiomysql
 from utils.time_utils import get_moscow_time
+from utils.fleet_state import fleet_state
 
 
 class Station:
@@ -166,6 +167,7 @@ class Station:
                     (new_status, moscow_time, self.station_id)
                 )
                 self.status = new_status
+                fleet_state.update_station(self.station_id, status=new_status)
                 self.updated_at = get_moscow_time()
     
     async def update_last_seen(self, pool) -> None:
@@ -179,6 +181,7 @@ class Station:
                 )
                 self.last_seen = moscow_time
                 self.updated_at = moscow_time
+                fleet_state.update_station(self.station_id, last_seen=moscow_time)
     
     async def update_remain_num(self, pool, remain_num: int) -> None:
         """Обновляет количество свободных слотов"""
@@ -190,6 +193,7 @@ class Station:
                     (remain_num, moscow_time, self.station_id)
                 )
                 self.remain_num = remain_num
+                fleet_state.update_station(self.station_id, remain_num=remain_num)
                 self.updated_at = moscow_time
     
     async def update_iccid(self, pool, iccid: str) -> None:
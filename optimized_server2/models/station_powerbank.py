@@ -1,10 +1,11 @@
 """
 Модель для работы с повербанками в станциях
 """
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import aiomysql
 from utils.time_utils import get_moscow_time
+from utils.fleet_state import fleet_state
 
 
 class StationPowerbank:
@@ -166,17 +167,20 @@ class StationPowerbank:
                 """, (station_id, slot_number))
                 result = await cur.fetchone()
                 record_id = result[0] if result else cur.lastrowid
-                
-                return cls(
-                    id=record_id,
-                    station_id=station_id,
-                    powerbank_id=powerbank_id,
-                    slot_number=slot_number,
-                    level=level,
-                    voltage=voltage,
-                    temperature=temperature,
-                    last_update=get_moscow_time()
-                )
+        
+        # Повербанк мог уже стоять в другом слоте станции (ON DUPLICATE KEY) - слоты перечитываются
+        await fleet_state.reload_slots(db_pool, station_id)
+        
+        return cls(
+            id=record_id,
+            station_id=station_id,
+            powerbank_id=powerbank_id,
+            slot_number=slot_number,
+            level=level,
+            voltage=voltage,
+            temperature=temperature,
+            last_update=get_moscow_time()
+        )
     
     @classmethod
     async def remove_powerbank(cls, db_pool, station_id: int, slot_number: int) -> bool:
@@ -187,6 +191,7 @@ class StationPowerbank:
                     DELETE FROM station_powerbank 
                     WHERE station_id = %s AND slot_number = %s
                 """, (station_id, slot_number))
+                fleet_state.remove_slots(station_id, [slot_number])
                 return result > 0
     
     @classmethod
@@ -198,6 +203,7 @@ class StationPowerbank:
                     DELETE FROM station_powerbank 
                     WHERE station_id = %s AND powerbank_id = %s
                 """, (station_id, powerbank_id))
+                fleet_state.remove_slots(station_id, powerbank_id=powerbank_id)
                 return result > 0
     
     @classmethod
@@ -210,6 +216,7 @@ class StationPowerbank:
                         DELETE FROM station_powerbank 
                         WHERE station_id = %s
                     """, (station_id,))
+                    fleet_state.remove_slots(station_id)
                     return result
         except Exception as e:
             self.logger.error(f"Ошибка: {e}")
@@ -250,6 +257,7 @@ class StationPowerbank:
                 """
                 
                 result = await cur.execute(query, params)
+                fleet_state.update_slot(station_id, slot_number, level=level, voltage=voltage, temperature=temperature)
                 return result > 0
     
     @classmethod
@@ -260,65 +268,130 @@ class StationPowerbank:
                 result = await cur.execute("""
                     DELETE FROM station_powerbank WHERE station_id = %s
                 """, (station_id,))
+                fleet_state.remove_slots(station_id)
                 return result > 0
     
+    @staticmethod
+    def build_target_slots(slots_data: list, powerbank_ids_by_serial: Dict[str, int]) -> Dict[int, Tuple]:
+        """
+        Строит целевое состояние слотов станции из данных пакета
+        Возвращает {slot_number: (powerbank_id, level, voltage, temperature)}
+        """
+        target_by_slot = {}
+        seen_powerbanks = set()
+        
+        for slot in slots_data:
+            terminal_id = slot.get('TerminalID')
+            
+            if not terminal_id or terminal_id == '0000000000000000':
+                continue  # Пропускаем пустые слоты
+            
+            powerbank_id = powerbank_ids_by_serial.get(terminal_id)
+            if not powerbank_id or powerbank_id in seen_powerbanks:
+                continue
+            seen_powerbanks.add(powerbank_id)
+            
+            # В пакете логина температура приходит в поле Temp, в инвентаре - в Temperature
+            temperature = slot.get('Temp', slot.get('Temperature'))
+            target_by_slot[int(slot['Slot'])] = (
+                int(powerbank_id),
+                int(slot['Level']) if slot.get('Level') is not None else None,
+                int(slot['Voltage']) if slot.get('Voltage') is not None else None,
+                int(temperature) if temperature is not None else None
+            )
+        
+        return target_by_slot
+    
     @classmethod
-    async def sync_station_powerbanks(cls, db_pool, station_id: int, slots_data: list) -> None:
+    async def apply_slot_diff(cls, cur, station_id: int, target_by_slot: Dict[int, Tuple]) -> Dict[str, int]:
+        """
+        Приводит station_powerbank станции к целевому состоянию в рамках переданного курсора.
+        Неизменившиеся слоты не перезаписываются, изменения применяются одним DELETE и одним INSERT
+        """
+        await cur.execute("""
+            SELECT slot_number, powerbank_id, level, voltage, temperature
+            FROM station_powerbank
+            WHERE station_id = %s
+        """, (station_id,))
+        current_by_slot = {
+            int(row[0]): (int(row[1]), row[2], row[3], row[4])
+            for row in await cur.fetchall()
+        }
+        
+        # Слоты, которые опустели или в которых сменился повербанк, удаляем:
+        # так повербанк, переехавший в другой слот, не конфликтует с uq_station_powerbank
+        stale_slots = [
+            slot_number for slot_number, current in current_by_slot.items()
+            if slot_number not in target_by_slot or target_by_slot[slot_number][0] != current[0]
+        ]
+        if stale_slots:
+            placeholders = ','.join(['%s'] * len(stale_slots))
+            await cur.execute(f"""
+                DELETE FROM station_powerbank
+                WHERE station_id = %s AND slot_number IN ({placeholders})
+            """, [station_id] + stale_slots)
+            for slot_number in stale_slots:
+                current_by_slot.pop(slot_number, None)
+        
+        changed = [
+            (slot_number, values) for slot_number, values in target_by_slot.items()
+            if current_by_slot.get(slot_number) != values
+        ]
+        if changed:
+            moscow_time = get_moscow_time()
+            rows_sql = ','.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(changed))
+            params = []
+            for slot_number, (powerbank_id, level, voltage, temperature) in changed:
+                params.extend([station_id, powerbank_id, slot_number, level, voltage, temperature, moscow_time])
+            await cur.execute(f"""
+                INSERT INTO station_powerbank 
+                (station_id, powerbank_id, slot_number, level, voltage, temperature, last_update)
+                VALUES {rows_sql} AS new_sp
+                ON DUPLICATE KEY UPDATE
+                powerbank_id = new_sp.powerbank_id,
+                level = new_sp.level,
+                voltage = new_sp.voltage,
+                temperature = new_sp.temperature,
+                last_update = new_sp.last_update
+            """, params)
+        
+        return {
+            'removed': len(stale_slots),
+            'written': len(changed),
+            'unchanged': len(target_by_slot) - len(changed)
+        }
+    
+    @classmethod
+    async def sync_station_powerbanks(cls, db_pool, station_id: int, slots_data: list) -> Dict[str, int]:
         """
         Синхронизирует повербанки в станции с данными из пакета логина
-
+        Пишутся только изменившиеся слоты
         """
+        serials = list(dict.fromkeys(
+            slot.get('TerminalID') for slot in slots_data
+            if slot.get('TerminalID') and slot.get('TerminalID') != '0000000000000000'
+        ))
         
         async with db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                # Очищаем старые данные
-                await cur.execute("DELETE FROM station_powerbank WHERE station_id = %s", (station_id,))
-                
-                added_count = 0
-                
-                for slot in slots_data:
-                    terminal_id = slot.get('TerminalID')
-                    
-                    if not terminal_id or terminal_id == '0000000000000000':
-                        continue  # Пропускаем пустые слоты
-                    
-                    # Получаем powerbank_id по serial_number
-                    await cur.execute("""
-                        SELECT id FROM powerbank WHERE serial_number COLLATE utf8mb4_unicode_ci = %s COLLATE utf8mb4_unicode_ci
-                    """, (terminal_id,))
-                    powerbank_result = await cur.fetchone()
+            await conn.begin()
+            try:
+                async with conn.cursor() as cur:
+                    powerbank_ids_by_serial = {}
+                    if serials:
+                        placeholders = ','.join(['%s'] * len(serials))
+                        await cur.execute(f"""
+                            SELECT id, serial_number FROM powerbank WHERE serial_number IN ({placeholders})
+                        """, serials)
+                        powerbank_ids_by_serial = {row[1]: int(row[0]) for row in await cur.fetchall()}
                     
-                    if powerbank_result:
-                        powerbank_id = powerbank_result[0]
-                        
-                        # Добавляем в station_powerbank 
-                       
-                        level = int(slot.get('Level', 0)) if slot.get('Level') is not None else None
-                        voltage = int(slot.get('Voltage', 0)) if slot.get('Voltage') is not None else None
-                        temperature = int(slot.get('Temp', 0)) if slot.get('Temp') is not None else None
-                        
-                        moscow_time = get_moscow_time()
-                        await cur.execute("""
-                            INSERT INTO station_powerbank 
-                            (station_id, powerbank_id, slot_number, level, voltage, temperature, last_update)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s) AS new_sp
-                            ON DUPLICATE KEY UPDATE
-                            powerbank_id = new_sp.powerbank_id,
-                            level = new_sp.level,
-                            voltage = new_sp.voltage,
-                            temperature = new_sp.temperature,
-                            last_update = new_sp.last_update
-                        """, (
-                            station_id,
-                            powerbank_id,
-                            int(slot['Slot']),
-                            level,
-                            voltage,
-                            temperature,
-                            moscow_time
-                        ))
-                        
-                        added_count += 1
+                    target_by_slot = cls.build_target_slots(slots_data, powerbank_ids_by_serial)
+                    result = await cls.apply_slot_diff(cur, station_id, target_by_slot)
+                await conn.commit()
+                fleet_state.replace_slots(station_id, target_by_slot.items())
+                return result
+            except Exception:
+                await conn.rollback()
+                raise
     
     async def update_data(self, db_pool, level: int = None, voltage: int = None, 
                          temperature: int = None) -> bool:
@@ -1,17 +1,23 @@
 """
 Оптимизированный сервер с TCP и HTTP серверами
 """
+import argparse
 import asyncio
 import hashlib
+import multiprocessing
 import signal
 import sys
 import platform
+import time
 from typing import Optional
 
 import aiomysql
 from aiohttp import web
 
-from config.settings import SERVER_IP, TCP_PORTS, HTTP_PORT, DB_CONFIG, CONNECTION_TIMEOUT, MAX_PACKET_SIZE
+from config.settings import (
+    SERVER_IP, TCP_PORTS, HTTP_PORT, DB_CONFIG, CONNECTION_TIMEOUT, MAX_PACKET_SIZE, LOGIN_ADMISSION_CONFIG,
+    GATEWAY_CLUSTER_CONFIG, LOOP_WATCHDOG_CONFIG, INVENTORY_POLL_CONFIG, SHUTDOWN_CONFIG
+)
 from models.connection import ConnectionManager, StationConnection
 from models.station import Station
 from handlers.station_handler import StationHandler
@@ -27,9 +33,30 @@ from handlers.query_voice_volume import QueryVoiceVolumeHandler
 from handlers.set_voice_volume import SetVoiceVolumeHandler
 from handlers.set_server_address import SetServerAddressHandler
 from handlers.query_server_address import QueryServerAddressHandler
-from http_server import HTTPServer
+from http_server import HTTPServer, main as http_main, run_http_worker
 from utils.packet_utils import parse_packet
+from utils.time_utils import get_moscow_time
 from utils.station_resolver import StationResolver
+from utils.login_admission import LoginAdmissionController
+from utils.runtime_metrics import runtime_metrics
+from utils.loop_watchdog import loop_watchdog
+from utils.timer_wheel import timer_wheel
+from utils.command_rpc import StationCommandQueue
+from utils.inventory_poller import InventoryPoller
+from utils.fleet_state import fleet_state
+from utils.telemetry_store import telemetry_store
+from utils.battery_health import battery_health_analyzer
+from utils.usage_rollup import usage_rollup
+from utils.overdue_write_off import overdue_write_off
+from utils.hard_delete_cleanup import hard_delete_cleanup
+from utils.batch_writer import abnormal_report_writer, action_log_writer
+from utils.socket_tuning import (
+    install_event_loop_policy, socket_options_for_port, apply_socket_options, apply_buffer_sizes
+)
+from utils.traffic_capture import traffic_capture, CaptureStreamWriter, DIRECTION_IN
+from utils.gateway_cluster import (
+    GatewayDirectory, GatewayWorkerNode, StationStateMirror, StationCommandRouter, ClusterConnectionManager
+)
 from utils.unified_logger import get_logger, close_logger, get_logger_stats, log_server_event
 
 
@@ -37,7 +64,14 @@ from utils.unified_logger import get_logger, close_logger, get_logger_stats, log
 class OptimizedServer:
    
     
-    def __init__(self):
+    def __init__(self, worker_id: Optional[int] = None, serve_http: bool = True, gateway_workers: int = 1):
+        # worker_id задан, когда сервер работает воркером многопроцессного шлюза
+        self.worker_id = worker_id
+        self.gateway_workers = gateway_workers
+        self.serve_http = serve_http
+        self.cluster_node: Optional[GatewayWorkerNode] = None
+        self.cluster_mirror: Optional[StationStateMirror] = None
+        self.cluster_router: Optional[StationCommandRouter] = None
         self.db_pool: Optional[aiomysql.Pool] = None
         self.connection_manager = ConnectionManager()
         self.station_resolver = StationResolver(self.connection_manager)
@@ -56,9 +90,15 @@ class OptimizedServer:
         self.set_server_address_handler: Optional[SetServerAddressHandler] = None
         self.query_server_address_handler: Optional[QueryServerAddressHandler] = None
         self.tcp_servers: list[asyncio.Server] = []
+        self.socket_options = {port: socket_options_for_port(port) for port in TCP_PORTS}
         self.http_server: Optional[HTTPServer] = None
         self.running = False
+        # Режим drain: новые логины отклоняются, ждем завершения выдач и возвратов
+        self.draining = False
+        self._stopped: Optional[asyncio.Future] = None
         self.reminder_service = None  
+        self.login_admission: Optional[LoginAdmissionController] = None
+        self.inventory_poller: Optional[InventoryPoller] = None
         
     
     async def initialize_database(self):
@@ -84,8 +124,7 @@ class OptimizedServer:
                 # Логируем команду, отправляемую на станцию
                 from utils.packet_utils import log_packet
                 log_packet(command_bytes, "OUTGOING", connection.box_id or "unknown", "Command")
-                connection.writer.write(command_bytes)
-                await connection.writer.drain()
+                connection.enqueue_command(command_bytes)
                 return True
             else:
                 self.logger.error(f"TCP соединение со станцией {connection.box_id} недоступно (writer закрыт)")
@@ -167,6 +206,15 @@ class OptimizedServer:
             self.logger.error(f"Ошибка получения секретного ключа: {e}")
             return None
 
+    @staticmethod
+    def _describe_packet_frame(frame_locals: dict) -> str:
+        """Контекст блокировки цикла событий внутри обработки пакета станции"""
+        data = frame_locals.get('data') or b''
+        connection = frame_locals.get('connection')
+        opcode = f"0x{data[2]:02X}" if len(data) > 2 else '?'
+        box_id = connection.box_id if connection else None
+        return f"пакет {opcode} {frame_locals.get('command_name', '')} от станции {box_id or 'unknown'}"
+    
     async def _process_packet_data(self, data: bytes, connection: StationConnection, writer):
         """Обработка данных пакета (вынесена в отдельный метод)"""
         try:
@@ -190,6 +238,9 @@ class OptimizedServer:
             
             # Обработка команд
             if command == 0x60:  # Login
+                if self.draining:
+                    # Сервер останавливается - станция переподключится к другому воркеру или после рестарта
+                    return True
                 if not self.station_handler:
                     self.logger.error("StationHandler не инициализирован!")
                     return False
@@ -224,6 +275,7 @@ class OptimizedServer:
                     if len(data) >= 12:
                         # Это ответ от станции на выдачу
                         await self.borrow_handler.handle_borrow_response(data, connection)
+                        connection.resolve_command(command, data)
                     else:
                         # Это запрос на выдачу
                         response = await self.borrow_handler.handle_borrow_request(data, connection)
@@ -253,16 +305,20 @@ class OptimizedServer:
             elif command == 0x80:  # Force Eject Power Bank
                 # Обрабатываем ответ на принудительное извлечение
                 await self.eject_handler.handle_force_eject_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             elif command == 0x69:  # Query ICCID
                 # Обрабатываем ответ на запрос ICCID
                 iccid_result = await self.query_iccid_handler.handle_query_iccid_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             elif command == 0x83:  # Slot Status Abnormal Report
                 # Обрабатываем отчет об аномалии слота
                 abnormal_response = await self.slot_abnormal_report_handler.handle_slot_abnormal_report_request(data, connection)
+                if self.inventory_poller:
+                    self.inventory_poller.note_abnormal_report(connection)
                 if abnormal_response:
                     writer.write(abnormal_response)
                     await writer.drain()
@@ -271,31 +327,39 @@ class OptimizedServer:
             elif command == 0x67:  # Restart Cabinet Response
                 # Обрабатываем ответ на команду перезагрузки кабинета
                 await self.restart_cabinet_handler.handle_restart_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             elif command == 0x64:  # Query Inventory Response
                 # Обрабатываем ответ на запрос инвентаря
                 await self.query_inventory_handler.handle_inventory_response(data, connection)
+                connection.resolve_command(command, data)
+                if self.inventory_poller:
+                    self.inventory_poller.note_inventory(connection)
                 return False
             
             elif command == 0x77:  # Query Voice Volume Response
                 # Обрабатываем ответ на запрос уровня громкости
                 await self.query_voice_volume_handler.handle_voice_volume_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             elif command == 0x70:  # Set Voice Volume Response
                 # Обрабатываем ответ на установку уровня громкости
                 await self.set_voice_volume_handler.handle_set_voice_volume_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             elif command == 0x63:  # Set Server Address Response
                 # Обрабатываем ответ на установку адреса сервера
                 await self.set_server_address_handler.handle_set_server_address_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             elif command == 0x6A:  # Query Server Address Response
                 # Обрабатываем ответ на запрос адреса сервера
                 await self.query_server_address_handler.handle_query_server_address_response(data, connection)
+                connection.resolve_command(command, data)
                 return False
             
             else:
@@ -324,7 +388,15 @@ class OptimizedServer:
         """Обрабатывает подключение клиента"""
         fd = writer.transport.get_extra_info('socket').fileno()
         addr = writer.get_extra_info('peername')
-        from utils.time_utils import get_moscow_time
+        port = writer.get_extra_info('sockname')[1]
+        apply_socket_options(writer.get_extra_info('socket'), self.socket_options[port])
+        runtime_metrics.connection_opened(port)
+        # Исходящие пакеты станции учитываются в метриках
+        writer = runtime_metrics.wrap_writer(writer)
+        # Захват трафика сессии для воспроизведения (если включен)
+        capture_session = traffic_capture.open_session(fd)
+        if capture_session:
+            writer = CaptureStreamWriter(writer, capture_session)
         connection_time = get_moscow_time()
         
         self.logger.debug(f"Подключен: {addr} (fd={fd}) в {connection_time.strftime('%H:%M:%S')}")
@@ -368,6 +440,8 @@ class OptimizedServer:
                     # Собираем полный пакет
                     data = header + packet_data
                     
+                    if capture_session:
+                        capture_session.record(DIRECTION_IN, data)
                     if not await self._validate_packet(data, connection):
                         continue
                         
@@ -377,7 +451,9 @@ class OptimizedServer:
                     break
                 
                 # Обработка пакета
+                started = time.perf_counter()
                 should_close = await self._process_packet_data(data, connection, writer)
+                runtime_metrics.record_packet_in(data[2], len(data), time.perf_counter() - started)
                 if should_close:
                     break
         
@@ -401,6 +477,8 @@ class OptimizedServer:
             connection_reset = False
         
         finally:
+            runtime_metrics.connection_closed(port)
+            traffic_capture.close_session(capture_session)
             # Закрываем соединение
             remaining_connections = len(self.connection_manager.get_all_connections())
             if connection_reset:
@@ -451,6 +529,65 @@ class OptimizedServer:
             self.set_server_address_handler = SetServerAddressHandler(self.db_pool, self.connection_manager)
             self.query_server_address_handler = QueryServerAddressHandler(self.db_pool, self.connection_manager)
             
+            # Контроль допуска логинов при массовом переподключении станций
+            self.login_admission = LoginAdmissionController(
+                max_concurrent=LOGIN_ADMISSION_CONFIG.get('max_concurrent', 8),
+                has_pending_operations=self._has_pending_user_operations
+            )
+            self.station_handler.login_admission = self.login_admission
+            await self.login_admission.preload_stations(self.db_pool)
+            
+            # Метрики процесса
+            runtime_metrics.process_name = 'main' if self.worker_id is None else f'gateway-{self.worker_id}'
+            runtime_metrics.instrument_db_pool(self.db_pool)
+            runtime_metrics.register_gauge(
+                'zaryd_pending_borrow_requests', 'Выдачи, ожидающие ответа станции',
+                lambda: len(self.borrow_handler.pending_requests)
+            )
+            runtime_metrics.register_gauge(
+                'zaryd_pending_error_returns', 'Возвраты с ошибкой, ожидающие вставки повербанка',
+                lambda: len(getattr(ReturnPowerbankHandler, '_pending_error_returns', {}))
+            )
+            runtime_metrics.register_gauge(
+                'zaryd_timer_wheel_timers', 'Активные таймеры колеса (таймауты heartbeat и запросов)',
+                lambda: timer_wheel.timers
+            )
+            runtime_metrics.register_gauge(
+                'zaryd_login_queue_depth', 'Логины станций в очереди допуска',
+                lambda: self.login_admission.queue_depth
+            )
+            runtime_metrics.register_gauge(
+                'zaryd_station_command_queue_depth', 'Команды станциям в очередях соединений (включая ожидающие ответа)',
+                lambda: sum(conn.command_queue.depth for conn in self.connection_manager.connections.values())
+            )
+            runtime_metrics.register_gauge(
+                'zaryd_station_command_queue_max_depth', 'Самая длинная очередь команд станции',
+                lambda: max((conn.command_queue.depth for conn in self.connection_manager.connections.values()), default=0)
+            )
+            runtime_metrics.register_counter(
+                'zaryd_station_commands_coalesced_total', 'Запросы инвентаря, объединенные с уже поставленными',
+                lambda: StationCommandQueue.coalesced_total
+            )
+            runtime_metrics.register_counter(
+                'zaryd_station_command_timeouts_total', 'Команды станциям без ответа за таймаут',
+                lambda: StationCommandQueue.timeouts_total
+            )
+            
+            # Сторож цикла событий (ведет и замер задержки цикла для метрик)
+            if LOOP_WATCHDOG_CONFIG['enabled']:
+                loop_watchdog.register_context(self._process_packet_data, self._describe_packet_frame)
+                await loop_watchdog.start()
+            await runtime_metrics.start(probe_loop_lag=not loop_watchdog.running)
+            await traffic_capture.start()
+            
+            # Воркер многопроцессного шлюза регистрирует свои станции в общем справочнике
+            if self.worker_id is not None:
+                self.cluster_node = GatewayWorkerNode(
+                    self, self.worker_id,
+                    GATEWAY_CLUSTER_CONFIG['socket_dir'],
+                    GATEWAY_CLUSTER_CONFIG['state_sync_interval']
+                )
+                await self.cluster_node.start()
             
             self.http_server = HTTPServer()
             self.http_server.db_pool = self.db_pool
@@ -458,6 +595,8 @@ class OptimizedServer:
             setattr(self.http_server, 'shared_borrow_handler', self.borrow_handler)
             # Инъекция обработчика возврата для использования
             setattr(self.http_server, 'shared_return_handler', self.return_handler)
+            # Инъекция контроллера логинов для метрик
+            setattr(self.http_server, 'login_admission', self.login_admission)
             
             self.running = True
             
@@ -477,29 +616,112 @@ class OptimizedServer:
                     port,
                     **server_kwargs
                 )
+                # Буферы слушающего сокета наследуют принятые соединения
+                for listen_socket in server.sockets:
+                    apply_buffer_sizes(listen_socket, self.socket_options[port])
                 self.tcp_servers.append(server)
             
-            # Запускаем HTTP сервер с connection_manager
-            http_app = self.http_server.create_app(self.connection_manager)
-            http_runner = web.AppRunner(http_app)
-            await http_runner.setup()
-            http_site = web.TCPSite(http_runner, '0.0.0.0', HTTP_PORT)
-            await http_site.start()
+            # Запускаем мониторинг соединений
+            asyncio.create_task(self._connection_monitor())
             
-            print(f"HTTP сервер запущен на 0.0.0.0:{HTTP_PORT}")
+            # Состояние подключенных станций в памяти и запись last_seen пачками
+            fleet_state.attach(self.connection_manager, self.db_pool)
+            runtime_metrics.register_gauge(
+                'zaryd_fleet_state_stations', 'Станции в памяти процесса шлюза',
+                lambda: len(fleet_state.stations)
+            )
+            runtime_metrics.register_gauge(
+                'zaryd_fleet_state_pending_last_seen', 'last_seen, ожидающие записи в БД',
+                lambda: fleet_state.pending_count
+            )
             
+            # Телеметрия слотов: буферы в памяти, агрегаты в БД
+            telemetry_store.attach(self.db_pool)
+            runtime_metrics.register_gauge(
+                'zaryd_telemetry_pending_samples', 'Замеры телеметрии, ожидающие записи в БД',
+                lambda: telemetry_store.pending_count
+            )
+            runtime_metrics.register_counter(
+                'zaryd_telemetry_dropped_total', 'Замеры телеметрии, перезаписанные до записи в БД',
+                lambda: telemetry_store.dropped_total
+            )
             
-            # Запускаем мониторинг соединений
-            asyncio.create_task(self._connection_monitor())
+            # Очереди пачечной записи журналов (аномалии слотов, action_logs)
+            for writer in (abnormal_report_writer, action_log_writer):
+                writer.attach(self.db_pool)
+                runtime_metrics.register_gauge(
+                    f'zaryd_batch_writer_{writer.name}_pending', f'Строки {writer.name}, ожидающие записи в БД',
+                    lambda writer=writer: writer.pending_count
+                )
+                runtime_metrics.register_counter(
+                    f'zaryd_batch_writer_{writer.name}_written_total', f'Строки {writer.name}, записанные в БД',
+                    lambda writer=writer: writer.written_total
+                )
+                runtime_metrics.register_counter(
+                    f'zaryd_batch_writer_{writer.name}_dropped_total',
+                    f'Строки {writer.name}, отброшенные при переполнении очереди',
+                    lambda writer=writer: writer.dropped_total
+                )
+                runtime_metrics.register_counter(
+                    f'zaryd_batch_writer_{writer.name}_rejected_total',
+                    f'Строки {writer.name}, отвергнутые БД (внешний ключ, недопустимое значение)',
+                    lambda writer=writer: writer.rejected_total
+                )
             
-            # Запускаем сервис напоминаний о возврате аккумуляторов
+            # Периодический опрос инвентаря; темп шлюза делится между воркерами
+            if INVENTORY_POLL_CONFIG['enabled']:
+                self.inventory_poller = InventoryPoller(
+                    self.connection_manager, rate=INVENTORY_POLL_CONFIG['rate'] / max(1, self.gateway_workers)
+                )
+                self.inventory_poller.start()
+                runtime_metrics.register_gauge(
+                    'zaryd_inventory_poll_queue_depth', 'Станции в очереди опроса инвентаря',
+                    lambda: self.inventory_poller.queue_depth
+                )
+                runtime_metrics.register_counter(
+                    'zaryd_inventory_polls_total', 'Отправленные периодические запросы инвентаря',
+                    lambda: self.inventory_poller.polled_total
+                )
+                runtime_metrics.register_counter(
+                    'zaryd_inventory_polls_skipped_total', 'Опросы, пропущенные из-за свежего инвентаря',
+                    lambda: self.inventory_poller.skipped_recent_total
+                )
+            
+            if self.serve_http:
+                await self._start_http_server()
+            
+            # Запускаем сервис напоминаний о возврате аккумуляторов (в кластере - только на воркере с HTTP)
             from config.settings import POWERBANK_REMINDER_CONFIG
-            if POWERBANK_REMINDER_CONFIG.get('enabled', True):
+            if self.serve_http and POWERBANK_REMINDER_CONFIG.get('enabled', True):
                 from utils.powerbank_reminder_service import PowerbankReminderService
                 self.reminder_service = PowerbankReminderService(self.db_pool)
                 check_interval = POWERBANK_REMINDER_CONFIG.get('check_interval_hours', 1)
                 asyncio.create_task(self.reminder_service.run_periodic_check(interval_hours=check_interval))
             
+            # Аналитика аккумуляторов для /api/analytics/battery-health
+            if self.serve_http:
+                battery_health_analyzer.attach(self.db_pool)
+            
+            # Ночная сводка использования для /api/analytics/usage
+            if self.serve_http:
+                usage_rollup.attach(self.db_pool)
+            
+            # Списание невозвращенных повербанков по write_off_hours подразделения
+            if self.serve_http:
+                overdue_write_off.attach(self.db_pool)
+                runtime_metrics.register_counter(
+                    'zaryd_overdue_written_off_total', 'Заказы, закрытые автоматическим списанием',
+                    lambda: overdue_write_off.written_off_total
+                )
+                runtime_metrics.register_gauge(
+                    'zaryd_overdue_write_off_mail_pending', 'Письма о списании в очереди',
+                    lambda: overdue_write_off.mail_pending
+                )
+            
+            # Очистка удаленных записей частями: исполнитель заданий и продолжение прерванных
+            if self.serve_http:
+                hard_delete_cleanup.attach(self.db_pool)
+            
             # Ждем завершения серверов
             await asyncio.gather(*(srv.serve_forever() for srv in self.tcp_servers))
                         
@@ -511,15 +733,43 @@ class OptimizedServer:
  
             pass
     
+    async def _start_http_server(self):
+        """Запускает HTTP сервер (в кластере - с доступом к станциям всех воркеров)"""
+        http_connection_manager = self.connection_manager
+        if self.worker_id is not None:
+            socket_dir = GATEWAY_CLUSTER_CONFIG['socket_dir']
+            self.cluster_mirror = StationStateMirror(socket_dir, self.db_pool)
+            await self.cluster_mirror.start()
+            self.cluster_router = StationCommandRouter(socket_dir, GATEWAY_CLUSTER_CONFIG['call_timeout'])
+            http_connection_manager = ClusterConnectionManager(
+                self.connection_manager, self.cluster_mirror, self.cluster_router
+            )
+            # Метрики API собираются со всех воркеров
+            self.http_server.gateway_mirror = self.cluster_mirror
+            self.http_server.gateway_router = self.cluster_router
+        
+        http_app = self.http_server.create_app(http_connection_manager)
+        http_runner = web.AppRunner(http_app)
+        await http_runner.setup()
+        http_site = web.TCPSite(http_runner, '0.0.0.0', HTTP_PORT)
+        await http_site.start()
+        
+        print(f"HTTP сервер запущен на 0.0.0.0:{HTTP_PORT}")
+    
+    def _has_pending_user_operations(self, station_id: int) -> bool:
+        """Есть ли у станции ожидающие операции пользователей (выдача, возврат с ошибкой)"""
+        if self.borrow_handler and any(
+            request.get('station_id') == station_id
+            for request in self.borrow_handler.pending_requests.values()
+        ):
+            return True
+        pending_error_returns = getattr(ReturnPowerbankHandler, '_pending_error_returns', None)
+        return pending_error_returns is not None and pending_error_returns.has_station(station_id)
+    
     async def _connection_monitor(self):
-        """Мониторинг соединений"""
+        """Мониторинг соединений (соединения без heartbeat закрывает колесо таймеров)"""
         while self.running:
             try:
-                # Очищаем неактивные соединения
-                cleaned = self.connection_manager.cleanup_inactive_connections(120)
-                if cleaned > 0:
-                    self.logger.info(f"Очищено {cleaned} неактивных соединений")
-                
                 # Проверяем соединения только на дублирование
                 connections = self.connection_manager.get_all_connections()
                 if connections:
@@ -536,7 +786,6 @@ class OptimizedServer:
                         if len(station_connections) > 1:
                             print(f"  Станция {station_id}: {len(station_connections)} соединений (дублирование!)")
                             for fd, conn in station_connections:
-                                from utils.time_utils import get_moscow_time
                                 current_time = get_moscow_time()
                                 time_since_heartbeat = (current_time - conn.last_heartbeat).total_seconds()
                                 print(f"  - fd={fd}, box_id={conn.box_id}, heartbeat={time_since_heartbeat:.1f} сек назад")
@@ -558,10 +807,38 @@ class OptimizedServer:
                 await asyncio.sleep(60)
     
     async def stop_servers(self):
-        """Останавливает серверы"""
+        """Останавливает серверы (повторный вызов ждет уже начатую остановку)"""
+        if self._stopped is not None:
+            await self._stopped
+            return
+        self._stopped = asyncio.get_running_loop().create_future()
+        try:
+            await self._stop_servers()
+        finally:
+            self._stopped.set_result(None)
+    
+    async def _stop_servers(self):
         print("Остановка серверов...")
         self.logger.info("Остановка серверов...")
+        started = time.perf_counter()
+        
+        # Drain: новые соединения и логины не принимаются, операции пользователей завершаются
+        self.draining = True
+        for server in self.tcp_servers:
+            if server:
+                server.close()
+        if self.inventory_poller:
+            await self.inventory_poller.stop()
+        await self._wait_pending_operations(SHUTDOWN_CONFIG['drain_timeout'])
         self.running = False
+        await fleet_state.stop()
+        await telemetry_store.stop()
+        await battery_health_analyzer.stop()
+        await usage_rollup.stop()
+        await overdue_write_off.stop()
+        await hard_delete_cleanup.stop()
+        await abnormal_report_writer.stop()
+        await action_log_writer.stop()
         
         # Деактивируем все станции перед закрытием
         await self._deactivate_all_stations()
@@ -569,141 +846,125 @@ class OptimizedServer:
         # Принудительно закрываем все TCP соединения
         await self._close_all_connections()
         
-        # Закрываем все TCP серверы
-        for server in self.tcp_servers:
-            if server:
-                server.close()
-        
         if self.http_server:
             self.http_server.stop_server()
         
+        # Отключаемся от кластера шлюза
+        if self.cluster_node:
+            await self.cluster_node.stop()
+        if self.cluster_mirror:
+            await self.cluster_mirror.stop()
+        if self.cluster_router:
+            await self.cluster_router.close()
+        
+        await runtime_metrics.stop()
+        await loop_watchdog.stop()
+        await traffic_capture.stop()
+        timer_wheel.stop()
+        
         # Закрываем базу данных после деактивации станций
         await self.cleanup_database()
         
+        self.logger.info(f"Серверы остановлены за {time.perf_counter() - started:.1f} сек")
         # Закрываем логгеры
         close_logger()
         # TCP логгер теперь часть единого логгера
         self.logger.info("Логгеры закрыты")
     
+    async def _wait_pending_operations(self, timeout: float):
+        """Ждет ответа станций на выдачи и вставки для возвратов с ошибкой не дольше timeout"""
+        futures = [
+            request['future'] for request in
+            (self.borrow_handler.pending_requests.values() if self.borrow_handler else [])
+        ]
+        futures.extend(
+            pending['future'] for pending in getattr(ReturnPowerbankHandler, '_pending_error_returns', {}).values()
+        )
+        futures = [future for future in futures if not future.done()]
+        if not futures:
+            return
+        self.logger.info(f"Ожидание {len(futures)} операций пользователей (до {timeout:g} сек)")
+        _, pending = await asyncio.wait(futures, timeout=timeout)
+        if pending:
+            self.logger.warning(f"Не дождались {len(pending)} операций пользователей за {timeout:g} сек")
+    
     async def _deactivate_all_stations(self):
-        """Деактивирует все станции при закрытии сервера"""
+        """Деактивирует станции одним UPDATE при закрытии сервера"""
         try:
-            self.logger.info("Деактивация всех станций...")
-            
-            # Сначала деактивируем станции с активными соединениями
-            connections = self.connection_manager.get_all_connections()
-            active_stations = []
-            
-            for fd, conn in connections.items():
-                if conn.station_id and conn.box_id:
-                    active_stations.append((conn.station_id, conn.box_id))
-            
-            if active_stations:
-                self.logger.info(f"Найдено {len(active_stations)} активных станций для деактивации")
-                
-                # Деактивируем каждую станцию
-                for station_id, box_id in active_stations:
-                    try:
-                        # Проверяем, что пул соединений еще доступен
-                        if not self.db_pool or self.db_pool._closed:
-                            self.logger.warning("Пул соединений с БД уже закрыт")
-                            continue
-                            
-                        station = await Station.get_by_id(self.db_pool, station_id)
-                        if station:
-                            await station.update_status(self.db_pool, "inactive")
-                            self.logger.info(f"Станция {box_id} (ID: {station_id}) деактивирована")
-                    except Exception as e:
-                        # Игнорируем ошибки с закрытым пулом соединений
-                        if "Cannot acquire connection after closing pool" in str(e):
-                            self.logger.warning(f"Пул соединений закрыт, пропускаем деактивацию станции {box_id}")
-                        else:
-                            self.logger.error(f"Ошибка деактивации станции {box_id}: {e}")
-            else:
-                self.logger.info("Активных станций не найдено")
-            
-            await self._deactivate_all_active_stations_in_db()
-                
+            if not self.db_pool or self.db_pool._closed:
+                self.logger.warning("Пул соединений с БД уже закрыт")
+                return
+        
+            async with self.db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    if self.worker_id is None:
+                        # Единственный процесс шлюза - неактивны все станции
+                        await cur.execute(
+                            "UPDATE station SET status = 'inactive', updated_at = %s WHERE status = 'active'",
+                            (get_moscow_time(),)
+                        )
+                    else:
+                        # В кластере остальные воркеры продолжают работать - деактивируем только свои станции
+                        station_ids = sorted({
+                            connection.station_id for connection in self.connection_manager.get_all_connections().values()
+                            if connection.station_id
+                        })
+                        if not station_ids:
+                            self.logger.info("Активных станций не найдено")
+                            return
+                        placeholders = ', '.join(['%s'] * len(station_ids))
+                        await cur.execute(
+                            f"UPDATE station SET status = 'inactive', updated_at = %s "
+                            f"WHERE station_id IN ({placeholders})",
+                            (get_moscow_time(), *station_ids)
+                        )
+                    self.logger.info(f"Деактивировано {cur.rowcount} станций в БД")
         except Exception as e:
-            self.logger.error(f"Ошибка при деактивации станций: {e}")
+            if "Cannot acquire connection after closing pool" in str(e):
+                self.logger.warning("Пул соединений закрыт, пропускаем деактивацию станций в БД")
+            else:
+                self.logger.error(f"Ошибка при деактивации станций: {e}")
     
     async def _close_all_connections(self):
-        """Принудительно закрывает все TCP соединения"""
+        """Принудительно закрывает все TCP соединения (одновременно)"""
         try:
-            self.logger.info("Принудительное закрытие всех TCP соединений...")
-            
             connections = self.connection_manager.get_all_connections()
             if not connections:
                 return
-            
-            self.logger.info(f"Найдено {len(connections)} соединений для закрытия")
-            
-            closed_count = 0
-            for fd, conn in connections.items():
+        
+            self.logger.info(f"Закрытие {len(connections)} TCP соединений...")
+            writers = []
+            for conn in list(connections.values()):
                 try:
                     if conn.writer and not conn.writer.is_closing():
-                        self.logger.debug(f"Закрываем соединение {conn.addr} (станция: {conn.box_id})")
                         conn.writer.close()
                         # Правильно очищаем callback
                         if hasattr(conn.writer, '_transport') and conn.writer._transport:
                             conn.writer._transport._read_ready_cb = None
-                        await conn.writer.wait_closed()
-                        closed_count += 1
-                    else:
-                        self.logger.debug(f"Соединение {conn.addr} уже закрыто")
+                        writers.append(conn.writer)
                 except Exception as e:
                     self.logger.error(f"Ошибка закрытия соединения {conn.addr}: {e}")
-            
-            self.logger.info(f"Закрыто {closed_count} соединений")
-            
+        
+            if writers:
+                close_timeout = SHUTDOWN_CONFIG['close_timeout']
+                results = await asyncio.gather(*(
+                    asyncio.wait_for(writer.wait_closed(), timeout=close_timeout) for writer in writers
+                ), return_exceptions=True)
+                failed = sum(isinstance(result, Exception) for result in results)
+                self.logger.info(f"Закрыто {len(writers) - failed} соединений"
+                                 + (f", {failed} не закрылись за {close_timeout:g} сек" if failed else ""))
+        
             # Очищаем менеджер соединений
             self.connection_manager.clear_all_connections()
             self.logger.info("Менеджер соединений очищен")
-            
+        
         except Exception as e:
             self.logger.error(f"Ошибка при закрытии соединений: {e}")
-    
-    async def _deactivate_all_active_stations_in_db(self):
-        """Деактивирует все станции со статусом 'active' в базе данных"""
-        try:
-            self.logger.info("Деактивация всех активных станций в БД...")
-            
-            # Проверяем, что пул соединений еще доступен
-            if not self.db_pool or self.db_pool._closed:
-                self.logger.warning("Пул соединений с БД уже закрыт")
-                return
-            
-            async with self.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    # Получаем все активные станции
-                    await cur.execute("SELECT station_id, box_id FROM station WHERE status = 'active'")
-                    active_stations = await cur.fetchall()
-                    
-                    if active_stations:
-                        self.logger.info(f"Найдено {len(active_stations)} активных станций в БД")
-                        
-                        # Деактивируем все активные станции
-                        await cur.execute("UPDATE station SET status = 'inactive' WHERE status = 'active'")
-                        affected_rows = cur.rowcount
-                        
-                        self.logger.info(f"Деактивировано {affected_rows} станций в БД")
-                        
-                        # Выводим информацию о деактивированных станциях
-                        for station_id, box_id in active_stations:
-                            self.logger.info(f"Станция {box_id} (ID: {station_id}) деактивирована")
-                    else:
-                        self.logger.info("Активных станций в БД не найдено")
-                        
-        except Exception as e:
-            if "Cannot acquire connection after closing pool" in str(e):
-                self.logger.warning("Пул соединений закрыт, пропускаем деактивацию станций в БД")
-            else:
-                self.logger.error(f"Ошибка при деактивации станций в БД: {e}")
 
 
-async def main():
+async def main(worker_id: Optional[int] = None, serve_http: bool = True, gateway_workers: int = 1):
     """Основная функция"""
-    server = OptimizedServer()
+    server = OptimizedServer(worker_id=worker_id, serve_http=serve_http, gateway_workers=gateway_workers)
     
     # Обработчик сигналов для корректного завершения
     def signal_handler():
@@ -738,9 +999,129 @@ async def main():
             print(f"Ошибка при остановке сервера: {e}")
 
 
+def run_gateway_worker(worker_id: int, serve_http: bool, gateway_workers: int = 1):
+    """Точка входа процесса-воркера шлюза"""
+    runtime_metrics.event_loop = install_event_loop_policy()
+    try:
+        asyncio.run(main(worker_id=worker_id, serve_http=serve_http, gateway_workers=gateway_workers))
+    except KeyboardInterrupt:
+        pass
+
+
+async def supervise_processes(target, count: int, name: str, args_for):
+    """
+    Запускает count процессов target(*args_for(index)) и перезапускает упавшие.
+    Завершает процессы по SIGTERM/SIGINT.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+    stopping = asyncio.Event()
+    
+    def spawn(index: int):
+        process = context.Process(target=target, args=args_for(index), name=f"{name}-{index}")
+        process.start()
+        processes[index] = process
+        print(f"Процесс {name} {index} запущен (pid={process.pid})")
+    
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    
+    for index in range(count):
+        spawn(index)
+    
+    try:
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            for index, process in list(processes.items()):
+                if not process.is_alive() and not stopping.is_set():
+                    print(f"Процесс {name} {index} завершился (код {process.exitcode}), перезапуск")
+                    spawn(index)
+    finally:
+        print(f"Остановка процессов {name}...")
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            await loop.run_in_executor(None, process.join, 30)
+
+
+async def run_gateway_cluster(workers: int, serve_http: bool = True):
+    """
+    Мастер-процесс: справочник станций и N воркеров шлюза на общих портах (reuse_port).
+    При serve_http HTTP API работает на воркере 0, иначе - отдельным сервисом (--role http).
+    Команды станциям других воркеров идут через Unix сокеты.
+    """
+    socket_dir = GATEWAY_CLUSTER_CONFIG['socket_dir']
+    directory = GatewayDirectory(socket_dir)
+    await directory.start()
+    print(f"Справочник станций запущен: {socket_dir}")
+    
+    try:
+        await supervise_processes(
+            run_gateway_worker, workers, 'gateway-worker',
+            lambda worker_id: (worker_id, serve_http and worker_id == 0, workers)
+        )
+    finally:
+        await directory.stop()
+
+
+async def run_http_service(http_workers: int):
+    """
+    HTTP API отдельно от шлюза: свои процессы и пулы БД, станции - через справочник шлюза.
+    Несколько процессов делят HTTP_PORT через reuse_port.
+    """
+    if http_workers <= 1:
+        await http_main()
+        return
+    await supervise_processes(
+        run_http_worker, http_workers, 'http-worker',
+        lambda http_worker_id: (http_worker_id, True)
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TCP шлюз станций и HTTP API")
+    parser.add_argument(
+        '--role', choices=('all', 'gateway', 'http'), default=GATEWAY_CLUSTER_CONFIG['role'],
+        help="all - шлюз и HTTP в одном сервисе, gateway - только шлюз, http - только HTTP API"
+    )
+    parser.add_argument(
+        '--workers', type=int, default=GATEWAY_CLUSTER_CONFIG['workers'],
+        help="Количество процессов шлюза (больше 1 - многопроцессный режим, только Linux)"
+    )
+    parser.add_argument(
+        '--http-workers', type=int, default=GATEWAY_CLUSTER_CONFIG['http_workers'],
+        help="Количество процессов HTTP API для --role http (больше 1 - только Linux)"
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    runtime_metrics.event_loop = install_event_loop_policy()
+    print(f"Цикл событий: {runtime_metrics.event_loop}")
+    if platform.system() != 'Linux':
+        if args.workers > 1 or args.http_workers > 1:
+            print("Многопроцессный режим требует reuse_port (Linux), запуск в одном процессе")
+        args.workers = 1
+        args.http_workers = 1
+        if args.role != 'all':
+            print("Раздельный запуск шлюза и HTTP требует Unix сокеты, запуск в режиме all")
+            args.role = 'all'
     try:
-        asyncio.run(main())
+        if args.role == 'gateway':
+            # Справочник нужен HTTP сервису даже при одном воркере
+            asyncio.run(run_gateway_cluster(args.workers, serve_http=False))
+        elif args.role == 'http':
+            asyncio.run(run_http_service(args.http_workers))
+        elif args.workers > 1:
+            asyncio.run(run_gateway_cluster(args.workers))
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("Серверы остановлены")
     except asyncio.CancelledError:
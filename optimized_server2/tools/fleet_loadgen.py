@@ -0,0 +1,224 @@
+"""
+Нагрузочный генератор: парк симулированных кабинетов против TCP шлюза
+
+Кабинеты логинятся с box_id и ключами станций из БД, шлют heartbeat и отвечают
+на команды сервера (0x64, 0x65, 0x67, 0x69, ...). Выдачи запрашиваются через HTTP API
+(/api/borrow/stations/{id}/request-optimal) от имени --borrow-user-id: сервер шлет
+кабинету 0x65, выданные повербанки затем случайно возвращаются (0x66).
+В конце - перцентили времени ответа сервера по типу запроса.
+
+БД: локальный MySQL/MariaDB, развернутый из дампа zaryd. Тестовые станции
+SIM000001... с ключами создаются флагом --seed (повторный запуск их не дублирует).
+--seed пишет в БД из DB_CONFIG, поэтому имя БД нужно подтвердить флагом --seed-db.
+
+Запуск:
+    python tools/fleet_loadgen.py --seed --seed-db zaryd_test --cabinets 2000 --duration 120
+    python tools/fleet_loadgen.py --cabinets 2000 --borrow-user-id 42 --borrow-rate 1 --return-rate 0.5
+
+На тысячи соединений нужен лимит дескрипторов: ulimit -n 65536
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import string
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+import aiohttp
+import aiomysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import DB_CONFIG, HTTP_PORT, TCP_PORTS
+from tools.sim_cabinet import CABINET_REQUESTS, SimulatedCabinet, load_station_credentials
+
+
+BOX_ID_PREFIX = 'SIM'
+KEY_ALPHABET = string.ascii_letters + string.digits
+
+
+async def seed_stations(count: int, slots: int) -> None:
+    """Создает тестовые станции SIM%06d с ключами, существующие не трогает"""
+    conn = await aiomysql.connect(**DB_CONFIG)
+    try:
+        async with conn.cursor() as cur:
+            rows = [(f"{BOX_ID_PREFIX}{index:06d}", slots, slots) for index in range(1, count + 1)]
+            await cur.executemany("""
+                INSERT IGNORE INTO station (org_unit_id, box_id, slots_declared, remain_num, status)
+                VALUES (1, %s, %s, %s, 'active')
+            """, rows)
+            await cur.execute("""
+                SELECT s.station_id FROM station s
+                LEFT JOIN station_secret_key k ON k.station_id = s.station_id
+                WHERE s.box_id LIKE %s AND k.id IS NULL
+            """, (f"{BOX_ID_PREFIX}%",))
+            missing = [row[0] for row in await cur.fetchall()]
+            await cur.executemany(
+                "INSERT INTO station_secret_key (station_id, key_value) VALUES (%s, %s)",
+                [(station_id, ''.join(secrets.choice(KEY_ALPHABET) for _ in range(8))) for station_id in missing]
+            )
+        await conn.commit()
+        print(f"Тестовых станций: {count}, новых ключей: {len(missing)}")
+    finally:
+        conn.close()
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def print_latencies(name: str, ms: List[float], elapsed: float) -> None:
+    if not ms:
+        print(f"  {name:<10} n=0")
+        return
+    print(f"  {name:<10} n={len(ms):<8} ({len(ms) / elapsed:.1f}/с) "
+          f"p50={percentile(ms, 0.5):.1f}мс p95={percentile(ms, 0.95):.1f}мс "
+          f"p99={percentile(ms, 0.99):.1f}мс max={max(ms):.1f}мс")
+
+
+def report(cabinets: List[SimulatedCabinet], borrows: Dict[str, list], elapsed: float) -> None:
+    print(f"\nКабинетов: {len(cabinets)}, залогинено: {sum(c.logged_in.is_set() for c in cabinets)}, "
+          f"время: {elapsed:.0f}с")
+    for name in CABINET_REQUESTS.values():
+        print_latencies(name, [latency * 1000 for c in cabinets for latency in c.latencies[name]], elapsed)
+    # Выдача целиком: HTTP запрос -> 0x65 кабинету -> ответ кабинета -> HTTP ответ
+    print_latencies('borrow', [latency * 1000 for latency in borrows['latencies']], elapsed)
+    if borrows['results']:
+        print("  выдачи: " + ", ".join(f"{result}={n}" for result, n in borrows['results'].most_common()))
+
+    commands = Counter(command for c in cabinets for command in c.received)
+    if commands:
+        print("  команды сервера: " + ", ".join(f"0x{command:02X}={n}" for command, n in sorted(commands.items())))
+    errors = sum(c.errors for c in cabinets)
+    if errors:
+        print(f"  ошибок чтения: {errors}")
+
+
+async def borrows_loop(cabinets: List[SimulatedCabinet], station_ids: Dict[str, int], url: str,
+                       user_id: int, rate: float, borrows: Dict[str, list], stop: asyncio.Event) -> None:
+    """Выдачи через HTTP API: в среднем rate в секунду на весь парк, каждая выдача - отдельная задача"""
+    tasks = set()
+
+    async def borrow(session: aiohttp.ClientSession, cabinet: SimulatedCabinet) -> None:
+        started = time.perf_counter()
+        try:
+            async with session.post(f"{url}/api/borrow/stations/{station_ids[cabinet.box_id]}/request-optimal",
+                                    json={'user_id': user_id}) as response:
+                result = await response.json(content_type=None)
+            if result.get('success'):
+                borrows['latencies'].append(time.perf_counter() - started)
+                borrows['results']['ok'] += 1
+            else:
+                borrows['results'][str(result.get('error', response.status))[:60]] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            borrows['results'][type(e).__name__] += 1
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+        while not stop.is_set():
+            await asyncio.sleep(random.expovariate(rate))
+            candidates = [c for c in cabinets if c.slots and c.logged_in.is_set()]
+            if candidates:
+                task = asyncio.create_task(borrow(session, random.choice(candidates)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks, timeout=60)
+
+
+async def returns_loop(cabinets: List[SimulatedCabinet], rate: float, stop: asyncio.Event) -> None:
+    """Случайные возвраты ранее выданных повербанков: в среднем rate в секунду на весь парк"""
+    while not stop.is_set():
+        await asyncio.sleep(random.expovariate(rate))
+        candidates = [c for c in cabinets if c.borrowed and c.logged_in.is_set()]
+        if candidates:
+            try:
+                await random.choice(candidates).send_return()
+            except ConnectionError:
+                pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Нагрузка парком симулированных кабинетов')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, action='append', help='TCP порт шлюза (можно несколько)')
+    parser.add_argument('--cabinets', type=int, default=1000)
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--seed', action='store_true', help='создать тестовые станции SIM* перед запуском')
+    parser.add_argument('--seed-db', help='имя БД для --seed, должно совпадать с DB_CONFIG')
+    parser.add_argument('--all-stations', action='store_true', help='брать любые станции, а не только SIM*')
+    parser.add_argument('--ramp', type=float, default=200.0, help='логинов в секунду при подключении')
+    parser.add_argument('--heartbeat-interval', type=float, default=30.0)
+    parser.add_argument('--http-url', default=f'http://127.0.0.1:{HTTP_PORT}', help='HTTP API для выдач')
+    parser.add_argument('--borrow-user-id', type=int, help='пользователь с доступом к станциям; без него выдач нет')
+    parser.add_argument('--borrow-rate', type=float, default=0.5, help='выдач в секунду на весь парк')
+    parser.add_argument('--return-rate', type=float, default=0.5, help='возвратов в секунду на весь парк')
+    parser.add_argument('--duration', type=float, default=60.0, help='секунд после подключения всех кабинетов')
+    args = parser.parse_args()
+    ports = args.port or TCP_PORTS
+
+    if args.seed:
+        if args.seed_db != DB_CONFIG['db']:
+            print(f"--seed создает станции в БД {DB_CONFIG['db']} ({DB_CONFIG['host']}); "
+                  f"подтвердите ее флагом --seed-db {DB_CONFIG['db']}")
+            return 1
+        await seed_stations(args.cabinets, args.slots)
+
+    stations = await load_station_credentials(args.cabinets, None if args.all_stations else BOX_ID_PREFIX)
+    if not stations:
+        print("Нет станций с ключами в БД (запустите с --seed)")
+        return 1
+
+    cabinets = [
+        SimulatedCabinet(args.host, ports[index % len(ports)], box_id, key_value,
+                         slots=args.slots, occupied=random.randint(1, args.slots),
+                         heartbeat_interval=args.heartbeat_interval)
+        for index, (_, box_id, key_value) in enumerate(stations)
+    ]
+
+    started = time.perf_counter()
+    failed = 0
+    for cabinet in cabinets:
+        try:
+            await cabinet.connect()
+        except OSError as e:
+            failed += 1
+            print(f"Ошибка подключения {cabinet.box_id}: {e}")
+        await asyncio.sleep(1 / args.ramp)
+    await asyncio.wait([asyncio.create_task(c.logged_in.wait()) for c in cabinets], timeout=30)
+    print(f"Подключено кабинетов: {sum(c.logged_in.is_set() for c in cabinets)}/{len(cabinets)} "
+          f"за {time.perf_counter() - started:.1f}с, ошибок подключения: {failed}")
+
+    stop = asyncio.Event()
+    loops = []
+    borrows = {'latencies': [], 'results': Counter()}
+    if args.borrow_user_id is not None and args.borrow_rate > 0:
+        station_ids = {box_id: station_id for station_id, box_id, _ in stations}
+        loops.append(asyncio.create_task(borrows_loop(cabinets, station_ids, args.http_url, args.borrow_user_id,
+                                                      args.borrow_rate, borrows, stop)))
+    else:
+        print("Выдачи отключены (нет --borrow-user-id): возвращать будет нечего")
+    if args.return_rate > 0:
+        loops.append(asyncio.create_task(returns_loop(cabinets, args.return_rate, stop)))
+    try:
+        await asyncio.sleep(args.duration)
+    except asyncio.CancelledError:
+        pass
+    stop.set()
+    # Циклы выходят после очередной паузы, выдачи дожидаются ответов на отправленные запросы
+    await asyncio.gather(*loops, return_exceptions=True)
+
+    report(cabinets, borrows, time.perf_counter() - started)
+    for cabinet in cabinets:
+        await cabinet.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
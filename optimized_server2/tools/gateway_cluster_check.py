@@ -0,0 +1,79 @@
+"""
+Проверка многопроцессного шлюза на симулированных кабинетах
+
+Сервер должен быть запущен: python server.py --workers 4
+Запуск: python tools/gateway_cluster_check.py --token <JWT service_admin> --stations 20
+
+Скрипт берет активные станции с ключами из БД, подключает кабинеты
+(ядро распределяет соединения по воркерам), отправляет команды через
+HTTP API (обслуживает воркер 0) и проверяет, что каждый кабинет
+получил свою команду независимо от того, какой воркер его держит.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import HTTP_PORT, TCP_PORTS
+from tools.sim_cabinet import SimulatedCabinet, load_station_credentials
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Проверка маршрутизации команд между воркерами шлюза')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--tcp-port', type=int, default=TCP_PORTS[0])
+    parser.add_argument('--http', default=f'http://127.0.0.1:{HTTP_PORT}')
+    parser.add_argument('--token', required=True, help='JWT токен service_admin')
+    parser.add_argument('--stations', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    stations = await load_station_credentials(args.stations)
+    if not stations:
+        print("Нет станций с ключами в БД")
+        return 1
+
+    cabinets = {}
+    for station_id, box_id, key_value in stations:
+        cabinet = SimulatedCabinet(args.host, args.tcp_port, box_id, key_value, heartbeat_interval=5.0)
+        await cabinet.connect()
+        cabinets[station_id] = cabinet
+
+    await asyncio.gather(*(asyncio.wait_for(c.logged_in.wait(), args.timeout) for c in cabinets.values()))
+    print(f"Подключено кабинетов: {len(cabinets)}")
+
+    # Даем воркерам синхронизировать состояние с директорией
+    await asyncio.sleep(2)
+
+    headers = {'Authorization': f'Bearer {args.token}'}
+    failures = []
+    async with aiohttp.ClientSession(headers=headers) as session:
+        for command, path in ((0x67, '/api/restart-cabinet'), (0x64, '/api/query-inventory')):
+            started = time.perf_counter()
+            for station_id in cabinets:
+                async with session.post(f'{args.http}{path}', json={'station_id': station_id}) as response:
+                    if response.status != 200:
+                        failures.append((station_id, path, response.status, await response.text()))
+
+            received = await asyncio.gather(*(c.wait_command(command, args.timeout) for c in cabinets.values()))
+            missing = [station_id for station_id, ok in zip(cabinets, received) if not ok]
+            for station_id in missing:
+                failures.append((station_id, path, 'no command', hex(command)))
+            print(f"{path}: доставлено {len(cabinets) - len(missing)}/{len(cabinets)} "
+                  f"за {time.perf_counter() - started:.2f}с")
+
+    for cabinet in cabinets.values():
+        await cabinet.close()
+
+    for failure in failures:
+        print(f"Ошибка: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
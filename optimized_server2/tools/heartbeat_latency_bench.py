@@ -0,0 +1,142 @@
+"""
+Нагрузочный тест: задержка heartbeat станций под нагрузкой на HTTP API
+
+Сравнение режимов запуска:
+    python server.py                                   # шлюз и HTTP в одном цикле событий
+    python server.py --role gateway & python server.py --role http --http-workers 4
+
+Запуск: python tools/heartbeat_latency_bench.py --token <JWT service_admin> --stations 100
+
+Фаза 1 - только heartbeat, фаза 2 - heartbeat и параллельные запросы к API.
+В раздельном режиме p99 heartbeat во второй фазе должен оставаться на уровне первой.
+Результаты прогонов - doc/performance_benchmarks.md.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import HTTP_PORT, TCP_PORTS
+from tools.sim_cabinet import SimulatedCabinet, load_station_credentials
+
+
+DEFAULT_ENDPOINTS = [
+    '/api/stations',
+    '/api/orders',
+    '/api/admin/powerbank-statistics',
+    '/api/station-powerbanks',
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(title: str, rtts: List[float]) -> None:
+    ms = [rtt * 1000 for rtt in rtts]
+    print(f"{title}: heartbeat n={len(ms)} "
+          f"p50={percentile(ms, 0.5):.1f}мс p99={percentile(ms, 0.99):.1f}мс max={max(ms, default=0):.1f}мс")
+
+
+async def api_load(session: aiohttp.ClientSession, base_url: str, endpoints: List[str],
+                   stop: asyncio.Event, stats: dict) -> None:
+    """Один клиент API: запросы по кругу до остановки"""
+    index = 0
+    while not stop.is_set():
+        path = endpoints[index % len(endpoints)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            async with session.get(f'{base_url}{path}') as response:
+                await response.read()
+                stats['codes'][response.status] = stats['codes'].get(response.status, 0) + 1
+        except aiohttp.ClientError:
+            stats['codes']['error'] = stats['codes'].get('error', 0) + 1
+        stats['latencies'].append(time.perf_counter() - started)
+
+
+async def heartbeat_phase(cabinets: List[SimulatedCabinet], seconds: float, interval: float) -> List[float]:
+    """Отправляет heartbeat от всех кабинетов с интервалом, возвращает RTT за фазу"""
+    for cabinet in cabinets:
+        cabinet.heartbeat_rtts.clear()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for cabinet in cabinets:
+            await cabinet.send_heartbeat()
+        await asyncio.sleep(interval)
+    # Ждем последние ответы
+    await asyncio.sleep(min(interval, 1.0))
+    return [rtt for cabinet in cabinets for rtt in cabinet.heartbeat_rtts]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Задержка heartbeat под нагрузкой на HTTP API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--tcp-port', type=int, default=TCP_PORTS[0])
+    parser.add_argument('--http', default=f'http://127.0.0.1:{HTTP_PORT}')
+    parser.add_argument('--token', required=True, help='JWT токен service_admin')
+    parser.add_argument('--stations', type=int, default=100)
+    parser.add_argument('--phase-seconds', type=float, default=30.0)
+    parser.add_argument('--heartbeat-interval', type=float, default=1.0)
+    parser.add_argument('--api-concurrency', type=int, default=64)
+    parser.add_argument('--endpoint', action='append', help='GET endpoint для нагрузки (можно несколько)')
+    args = parser.parse_args()
+
+    stations = await load_station_credentials(args.stations)
+    if not stations:
+        print("Нет станций с ключами в БД")
+        return 1
+
+    # Свой цикл heartbeat у кабинетов отключен - отправляет фаза теста
+    cabinets = [
+        SimulatedCabinet(args.host, args.tcp_port, box_id, key_value, heartbeat_interval=3600)
+        for _, box_id, key_value in stations
+    ]
+    for cabinet in cabinets:
+        await cabinet.connect()
+    await asyncio.gather(*(asyncio.wait_for(c.logged_in.wait(), 30) for c in cabinets))
+    print(f"Подключено кабинетов: {len(cabinets)}")
+
+    baseline = await heartbeat_phase(cabinets, args.phase_seconds, args.heartbeat_interval)
+    report("Без нагрузки API", baseline)
+
+    endpoints = args.endpoint or DEFAULT_ENDPOINTS
+    stop = asyncio.Event()
+    stats = {'codes': {}, 'latencies': []}
+    headers = {'Authorization': f'Bearer {args.token}'}
+    connector = aiohttp.TCPConnector(limit=args.api_concurrency)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        clients = [
+            asyncio.create_task(api_load(session, args.http, endpoints, stop, stats))
+            for _ in range(args.api_concurrency)
+        ]
+        loaded = await heartbeat_phase(cabinets, args.phase_seconds, args.heartbeat_interval)
+        stop.set()
+        await asyncio.gather(*clients)
+
+    report("Под нагрузкой API", loaded)
+    api_ms = [latency * 1000 for latency in stats['latencies']]
+    print(f"API: запросов {len(api_ms)} ({len(api_ms) / args.phase_seconds:.0f}/с) "
+          f"p50={percentile(api_ms, 0.5):.1f}мс p99={percentile(api_ms, 0.99):.1f}мс коды={stats['codes']}")
+
+    baseline_p99 = percentile(baseline, 0.99)
+    loaded_p99 = percentile(loaded, 0.99)
+    if baseline_p99:
+        print(f"Рост p99 heartbeat: x{loaded_p99 / baseline_p99:.2f}")
+
+    for cabinet in cabinets:
+        await cabinet.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,53 @@
+"""
+Обслуживание автоматического списания просроченных заказов (utils/overdue_write_off.py)
+
+Запуск:
+    python tools/overdue_write_off.py install   - статус written_off в orders.status и индекс
+                                                  idx_orders_status_timestamp
+    python tools/overdue_write_off.py run       - одно списание сейчас (без писем пользователям)
+
+Изменения выполняются онлайн (ALGORITHM=INPLACE, LOCK=NONE); пользователю БД нужна
+привилегия ALTER на orders. Сервер только проверяет их наличие.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import aiomysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import DB_CONFIG
+from utils.overdue_write_off import overdue_write_off
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Списание просроченных заказов')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('install', help='добавить статус written_off и индекс в orders')
+    commands.add_parser('run', help='выполнить списание один раз')
+    args = parser.parse_args()
+
+    db_pool = await aiomysql.create_pool(minsize=1, maxsize=2, **DB_CONFIG)
+    try:
+        if args.command == 'install':
+            changes = await overdue_write_off.install(db_pool)
+            print("Добавлено: " + ", ".join(changes) if changes else "Все уже установлено")
+            return 0
+
+        overdue_write_off.db_pool = db_pool
+        result = await overdue_write_off.run()
+        if result.get('skipped'):
+            print("Списание пропущено: сначала выполните install")
+            return 1
+        print(f"Найдено {result['candidates']}, списано {result['written_off']}, "
+              f"без повербанка в БД {result['unknown_powerbank']}, {result['seconds']} сек")
+        return 0
+    finally:
+        db_pool.close()
+        await db_pool.wait_closed()
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
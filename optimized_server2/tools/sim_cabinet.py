@@ -0,0 +1,243 @@
+"""
+Симулятор кабинета для локальной проверки и нагрузки TCP сервера
+
+Кабинет подключается к серверу, отправляет логин и heartbeat, отвечает на команды
+сервера с учетом состояния слотов (выдача освобождает слот, возврат занимает)
+и измеряет время ответа сервера на свои запросы (логин, heartbeat, возврат).
+"""
+import asyncio
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from typing import Dict, List, Optional
+
+import aiomysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import DB_CONFIG
+from utils.packet_utils import compute_checksum, generate_session_token, parse_borrow_request
+
+
+LOGIN_MAGIC = 0xA0A0
+SLOT_FORMAT = ">B 8s B H H b B B"
+
+# Бит InsertionSwitch + LockStatus: повербанк вставлен и заблокирован
+SLOT_STATUS_OCCUPIED = 0xC0
+
+# Запросы кабинета, на которые сервер отвечает той же командой
+CABINET_REQUESTS = {0x60: 'login', 0x61: 'heartbeat', 0x66: 'return'}
+
+
+async def load_station_credentials(limit: int, box_id_prefix: Optional[str] = None):
+    """Станции с ключами для симуляции: [(station_id, box_id, key_value)]"""
+    conn = await aiomysql.connect(**DB_CONFIG)
+    try:
+        async with conn.cursor() as cur:
+            query = """
+                SELECT s.station_id, s.box_id, k.key_value
+                FROM station s
+                JOIN station_secret_key k ON k.station_id = s.station_id
+                WHERE s.status != 'pending' AND s.is_deleted = 0
+            """
+            params = []
+            if box_id_prefix:
+                query += " AND s.box_id LIKE %s"
+                params.append(f"{box_id_prefix}%")
+            query += " ORDER BY s.station_id LIMIT %s"
+            params.append(limit)
+            await cur.execute(query, params)
+            return await cur.fetchall()
+    finally:
+        conn.close()
+
+
+def build_packet(command: int, payload: bytes, secret_key: str, vsn: int = 1) -> bytes:
+    """Собирает пакет кабинета: заголовок ">HBBBI" + payload"""
+    checksum = compute_checksum(payload)
+    token = generate_session_token(payload, secret_key)
+    header = struct.pack(">HBBBI", len(payload) + 7, command, vsn, checksum, token)
+    return header + payload
+
+
+def make_terminal_id(box_id: str, slot: int) -> bytes:
+    """Детерминированный terminal ID повербанка: 4 ASCII символа + 4 байта (хэш box_id и слот)"""
+    prefix = (box_id[-4:] if len(box_id) >= 4 else box_id.rjust(4, '0')).encode('ascii')
+    return prefix + struct.pack(">I", (zlib.crc32(box_id.encode('ascii')) & 0xFFFFFF00) | slot)
+
+
+class SimulatedCabinet:
+    """Кабинет с заданным box_id и ключом станции"""
+
+    def __init__(self, host: str, port: int, box_id: str, secret_key: str,
+                 slots: int = 8, occupied: Optional[int] = None,
+                 heartbeat_interval: float = 30.0, vsn: int = 1):
+        self.host = host
+        self.port = port
+        self.box_id = box_id
+        self.secret_key = secret_key
+        self.slots_num = slots
+        self.heartbeat_interval = heartbeat_interval
+        self.vsn = vsn
+
+        # slot -> terminal ID вставленного повербанка; выданные повербанки ждут возврата
+        occupied = slots // 2 if occupied is None else occupied
+        self.slots: Dict[int, bytes] = {slot: make_terminal_id(box_id, slot) for slot in range(1, occupied + 1)}
+        self.borrowed: List[bytes] = []
+
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.logged_in = asyncio.Event()
+        self.received: List[int] = []
+        self.command_events: Dict[int, asyncio.Event] = {}
+
+        # Время ответа сервера по типу запроса кабинета
+        self.latencies: Dict[str, List[float]] = {name: [] for name in CABINET_REQUESTS.values()}
+        self.heartbeat_rtts = self.latencies['heartbeat']
+        self.errors = 0
+        self._sent_at: Dict[int, float] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def remain_num(self) -> int:
+        return self.slots_num - len(self.slots)
+
+    def _slot_records(self) -> bytes:
+        return b''.join(
+            struct.pack(SLOT_FORMAT, slot, terminal_id, random.randint(20, 100), 4000, 0, 25, SLOT_STATUS_OCCUPIED, 95)
+            for slot, terminal_id in sorted(self.slots.items())
+        )
+
+    def build_login(self) -> bytes:
+        """Пакет логина (0x60) в формате parse_login_packet"""
+        box_id = self.box_id.encode('ascii')
+        payload = (struct.pack(">IHH", random.getrandbits(32), LOGIN_MAGIC, len(box_id))
+                   + box_id
+                   + struct.pack(">IBB", int(time.time()), self.slots_num, self.remain_num)
+                   + self._slot_records())
+        return build_packet(0x60, payload, self.secret_key, self.vsn)
+
+    def build_heartbeat(self) -> bytes:
+        """Пакет heartbeat (0x61)"""
+        return build_packet(0x61, b'', self.secret_key, self.vsn)
+
+    def build_return(self) -> Optional[bytes]:
+        """Возврат (0x66) случайного выданного повербанка в свободный слот"""
+        free_slots = [slot for slot in range(1, self.slots_num + 1) if slot not in self.slots]
+        if not self.borrowed or not free_slots:
+            return None
+        terminal_id = self.borrowed.pop(random.randrange(len(self.borrowed)))
+        slot = random.choice(free_slots)
+        self.slots[slot] = terminal_id
+        payload = struct.pack(">B8sBHHbBB", slot, terminal_id, random.randint(5, 60), 3800, 0, 27,
+                              SLOT_STATUS_OCCUPIED, 95)
+        return build_packet(0x66, payload, self.secret_key, self.vsn)
+
+    def _take_from_slot(self, slot: int) -> Optional[bytes]:
+        terminal_id = self.slots.pop(slot, None)
+        if terminal_id:
+            self.borrowed.append(terminal_id)
+        return terminal_id
+
+    def build_response(self, command: int, data: bytes) -> Optional[bytes]:
+        """Ответ кабинета на команду сервера (data - пакет целиком)"""
+        payload = data[9:]
+        if command == 0x64:
+            body = struct.pack(">BB", self.slots_num, self.remain_num) + self._slot_records()
+            return build_packet(0x64, body, self.secret_key, self.vsn)
+        if command == 0x65:
+            slot = parse_borrow_request(data)['Slot']
+            terminal_id = self._take_from_slot(slot)
+            body = struct.pack(">BB8sBB", slot, 1 if terminal_id else 0, terminal_id or b'\x00' * 8, 0, 0)
+            return build_packet(0x65, body, self.secret_key, self.vsn)
+        if command == 0x80:
+            slot = payload[0] if payload else 1
+            terminal_id = self._take_from_slot(slot)
+            body = struct.pack(">BB8s", slot, 1 if terminal_id else 0, terminal_id or b'\x00' * 8)
+            return build_packet(0x80, body, self.secret_key, self.vsn)
+        if command in (0x67, 0x70, 0x63):
+            return build_packet(command, b'', self.secret_key, self.vsn)
+        if command == 0x77:
+            return build_packet(0x77, struct.pack(">B", 5), self.secret_key, self.vsn)
+        if command == 0x69:
+            iccid = b'89701010000000000000'
+            return build_packet(0x69, struct.pack(">H", len(iccid)) + iccid, self.secret_key, self.vsn)
+        return None
+
+    async def connect(self) -> None:
+        """Подключается, отправляет логин и запускает чтение и heartbeat"""
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self._tasks.append(asyncio.create_task(self._read_loop()))
+        await self._send(0x60, self.build_login())
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def close(self) -> None:
+        """Отключается от сервера"""
+        for task in self._tasks:
+            task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    async def _send(self, command: int, packet: bytes) -> None:
+        if command in CABINET_REQUESTS:
+            self._sent_at[command] = time.perf_counter()
+        self.writer.write(packet)
+        await self.writer.drain()
+
+    async def send_heartbeat(self) -> None:
+        """Отправляет heartbeat, время ответа попадает в heartbeat_rtts"""
+        await self._send(0x61, self.build_heartbeat())
+
+    async def send_return(self) -> bool:
+        """Возвращает случайный выданный повербанк, если есть что и куда возвращать"""
+        packet = self.build_return()
+        if packet is None:
+            return False
+        await self._send(0x66, packet)
+        return True
+
+    async def wait_command(self, command: int, timeout: float = 10.0) -> bool:
+        """Ждет получения команды от сервера"""
+        event = self.command_events.setdefault(command, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _heartbeat_loop(self) -> None:
+        await self.logged_in.wait()
+        # Случайная фаза, чтобы кабинеты не слали heartbeat одновременно
+        await asyncio.sleep(random.uniform(0, self.heartbeat_interval))
+        while True:
+            await self.send_heartbeat()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                header = await self.reader.readexactly(2)
+                packet_len = struct.unpack(">H", header)[0]
+                data = header + await self.reader.readexactly(packet_len)
+                command = data[2]
+
+                sent_at = self._sent_at.pop(command, None)
+                if sent_at is not None:
+                    self.latencies[CABINET_REQUESTS[command]].append(time.perf_counter() - sent_at)
+                    if command == 0x60:
+                        self.logged_in.set()
+                    continue
+
+                self.received.append(command)
+                self.command_events.setdefault(command, asyncio.Event()).set()
+                response = self.build_response(command, data)
+                if response:
+                    self.writer.write(response)
+                    await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        except Exception:
+            self.errors += 1
@@ -0,0 +1,204 @@
+"""
+Бенчмарк цикла событий и опций сокетов: пакетов/с и RTT heartbeat
+
+Локальный режим (по умолчанию) запускает для каждой конфигурации отдельный
+процесс с TCP сервером, который отвечает на heartbeat так же, как шлюз
+(кадр 0x61 с токеном станции), применяет опции сокетов из utils/socket_tuning.py
+и выбранный цикл событий. Клиенты держат по --pipeline неотвеченных heartbeat.
+
+    python tools/socket_tuning_bench.py --connections 500 --seconds 10
+    python tools/socket_tuning_bench.py --loops asyncio,uvloop --nodelay on,off --rcvbuf 0,262144
+
+Режим --target измеряет запущенный сервер (станции и ключи из БД); конфигурацию
+меняют переменными окружения сервера (EVENT_LOOP, TCP_NODELAY, TCP_RCVBUF, ...):
+
+    python tools/socket_tuning_bench.py --target 127.0.0.1:9066 --connections 200
+
+Результаты сравнения конфигураций - doc/performance_benchmarks.md.
+"""
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import TCP_SOCKET_CONFIG
+from utils.socket_tuning import install_event_loop_policy, apply_socket_options, apply_buffer_sizes
+from tools.sim_cabinet import SimulatedCabinet, build_packet, load_station_credentials
+
+
+BENCH_KEY = 'bench000'
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_bench_server(port: int, loop_policy: str, options: Dict, ready) -> None:
+    """Процесс сервера: цикл событий и опции сокетов конфигурации, ответ на heartbeat"""
+    loop_name = install_event_loop_policy(loop_policy)
+    response = build_packet(0x61, b'', BENCH_KEY)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        apply_socket_options(writer.get_extra_info('socket'), options)
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                data = header + await reader.readexactly(struct.unpack(">H", header)[0])
+                if data[2] == 0x61:
+                    writer.write(response)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve() -> None:
+        server = await asyncio.start_server(handle, '127.0.0.1', port, reuse_address=True, backlog=4096)
+        for listen_socket in server.sockets:
+            apply_buffer_sizes(listen_socket, options)
+        ready.put(loop_name)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+async def bench_client(host: str, port: int, pipeline: int, deadline: float,
+                       rtts: List[float], packet: bytes, login: bytes = b'') -> int:
+    """Одно соединение: держит pipeline heartbeat в полете, возвращает число ответов"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if login:
+        writer.write(login)
+        header = await reader.readexactly(2)
+        await reader.readexactly(struct.unpack(">H", header)[0])
+    sent_at: List[float] = []
+    answered = 0
+    try:
+        for _ in range(pipeline):
+            sent_at.append(time.perf_counter())
+            writer.write(packet)
+        while time.perf_counter() < deadline:
+            header = await reader.readexactly(2)
+            await reader.readexactly(struct.unpack(">H", header)[0])
+            now = time.perf_counter()
+            rtts.append(now - sent_at.pop(0))
+            answered += 1
+            sent_at.append(now)
+            writer.write(packet)
+    finally:
+        writer.close()
+    return answered
+
+
+async def measure(host: str, port: int, connections: int, pipeline: int, seconds: float,
+                  packets: List[bytes]) -> Tuple[float, List[float]]:
+    rtts: List[float] = []
+    # Соединения открываются до начала замера
+    deadline = time.perf_counter() + seconds + 1.0
+    clients = []
+    for index in range(connections):
+        clients.append(asyncio.create_task(
+            bench_client(host, port, pipeline, deadline, rtts, packets[index % len(packets)])
+        ))
+        if index % 100 == 99:
+            await asyncio.sleep(0)
+    started = time.perf_counter()
+    results = await asyncio.gather(*clients, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        print(f"  ошибок соединений: {len(errors)} (первая: {errors[0]!r})")
+    answered = sum(result for result in results if isinstance(result, int))
+    return answered / elapsed, rtts
+
+
+def report(title: str, pps: float, rtts: List[float]) -> None:
+    ms = [rtt * 1000 for rtt in rtts]
+    print(f"{title:<60} {pps:>10.0f} пак/с  p50={percentile(ms, 0.5):6.2f}мс "
+          f"p99={percentile(ms, 0.99):6.2f}мс max={max(ms, default=0):7.2f}мс")
+
+
+async def local_matrix(args) -> None:
+    loops = args.loops.split(',')
+    nodelay = [value == 'on' for value in args.nodelay.split(',')]
+    buffers = [int(value) for value in args.rcvbuf.split(',')]
+    packets = [build_packet(0x61, b'', BENCH_KEY)]
+    context = multiprocessing.get_context('spawn')
+
+    for port_offset, (loop_policy, no_delay, buffer_size) in enumerate(itertools.product(loops, nodelay, buffers)):
+        options = dict(TCP_SOCKET_CONFIG, nodelay=no_delay, rcvbuf=buffer_size, sndbuf=buffer_size)
+        port = args.base_port + port_offset
+        ready = context.Queue()
+        process = context.Process(target=run_bench_server, args=(port, loop_policy, options, ready), daemon=True)
+        process.start()
+        try:
+            loop_name = await asyncio.get_running_loop().run_in_executor(None, ready.get, True, 10)
+            pps, rtts = await measure('127.0.0.1', port, args.connections, args.pipeline, args.seconds, packets)
+            title = f"loop={loop_name} nodelay={'on' if no_delay else 'off'} buf={buffer_size or 'default'}"
+            if loop_name != loop_policy and loop_policy != 'auto':
+                title += ' (uvloop не установлен)'
+            report(title, pps, rtts)
+        finally:
+            process.terminate()
+            process.join()
+
+
+async def target_server(args) -> None:
+    """Замер запущенного шлюза: кабинеты логинятся ключами станций и шлют heartbeat"""
+    host, port = args.target.rsplit(':', 1)
+    stations = await load_station_credentials(args.connections)
+    if not stations:
+        print("Нет станций с ключами в БД")
+        return
+    # Логин каждой станции, затем поток heartbeat на том же соединении
+    logins = []
+    for _, box_id, key_value in stations:
+        cabinet = SimulatedCabinet(host, int(port), box_id, key_value)
+        logins.append((cabinet.build_login(), cabinet.build_heartbeat()))
+
+    rtts: List[float] = []
+    deadline = time.perf_counter() + args.seconds
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        bench_client(host, int(port), args.pipeline, deadline, rtts, heartbeat, login)
+        for login, heartbeat in logins
+    ), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    answered = sum(result for result in results if isinstance(result, int))
+    errors = len(results) - sum(isinstance(result, int) for result in results)
+    report(f"{args.target} ({len(logins)} станций, ошибок {errors})", answered / elapsed, rtts)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Пакетов/с и RTT heartbeat по конфигурациям цикла и сокетов')
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--pipeline', type=int, default=4, help='неотвеченных heartbeat на соединение')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--loops', default='asyncio,uvloop')
+    parser.add_argument('--nodelay', default='on,off')
+    parser.add_argument('--rcvbuf', default='0', help='размеры буферов через запятую, 0 - по умолчанию')
+    parser.add_argument('--base-port', type=int, default=19100)
+    parser.add_argument('--target', help='host:port запущенного шлюза вместо локальных серверов')
+    parser.add_argument('--client-loop', default='auto', help='цикл событий клиентов бенчмарка')
+    args = parser.parse_args()
+
+    print(f"Клиенты: {install_event_loop_policy(args.client_loop)}, соединений {args.connections}, "
+          f"pipeline {args.pipeline}, {args.seconds:g}с на конфигурацию")
+    asyncio.run(target_server(args) if args.target else local_matrix(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
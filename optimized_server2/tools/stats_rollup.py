@@ -0,0 +1,80 @@
+"""
+Установка, заполнение и проверка сводных счетчиков статистики (utils/stats_rollup.py)
+
+Запуск:
+    python tools/stats_rollup.py install              - таблицы, триггеры, заполнение
+    python tools/stats_rollup.py backfill [--stations 1,2] [--skip-powerbanks]
+    python tools/stats_rollup.py check [--fix]        - расхождения с исходными таблицами
+
+Для создания триггеров пользователю БД нужна привилегия TRIGGER, а при
+включенном binlog - еще SUPER или log_bin_trust_function_creators = 1.
+Код выхода check: 0 - расхождений нет (или они исправлены), 1 - есть.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import aiomysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import DB_CONFIG
+from utils.stats_rollup import stats_rollups
+
+
+SHOW_MISMATCHES = 20
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Сводные счетчики статистики')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('install', help='создать таблицы и триггеры, заполнить счетчики')
+    backfill = commands.add_parser('backfill', help='пересчитать счетчики по исходным таблицам')
+    backfill.add_argument('--stations', help='ID станций через запятую (по умолчанию - все)')
+    backfill.add_argument('--skip-powerbanks', action='store_true')
+    check = commands.add_parser('check', help='сравнить счетчики с исходными таблицами')
+    check.add_argument('--fix', action='store_true', help='пересчитать расходящиеся станции и повербанки')
+    args = parser.parse_args()
+
+    db_pool = await aiomysql.create_pool(minsize=1, maxsize=2, **DB_CONFIG)
+    try:
+        if args.command == 'install':
+            await stats_rollups.install(db_pool)
+            print("Таблицы и триггеры установлены, счетчики заполнены")
+            return 0
+
+        if args.command == 'backfill':
+            station_ids = [int(value) for value in args.stations.split(',')] if args.stations else None
+            stations = await stats_rollups.rebuild_abnormal(db_pool, station_ids)
+            print(f"slot_abnormal_daily: пересчитано станций {stations}")
+            if not args.skip_powerbanks:
+                await stats_rollups.rebuild_powerbanks(db_pool)
+                print("powerbank_status_counts: пересчитано")
+            return 0
+
+        result = await stats_rollups.check(db_pool)
+        for table, mismatches in result.items():
+            print(f"{table}: расхождений {len(mismatches)}")
+            for mismatch in mismatches[:SHOW_MISMATCHES]:
+                print(f"  {mismatch}")
+        if not any(result.values()):
+            return 0
+        if not args.fix:
+            return 1
+
+        station_ids = sorted({mismatch['station_id'] for mismatch in result['slot_abnormal_daily']})
+        if station_ids:
+            await stats_rollups.rebuild_abnormal(db_pool, station_ids)
+        if result['powerbank_status_counts']:
+            await stats_rollups.rebuild_powerbanks(db_pool)
+        remaining = await stats_rollups.check(db_pool)
+        print(f"После исправления: {', '.join(f'{table} {len(rows)}' for table, rows in remaining.items())}")
+        return 1 if any(remaining.values()) else 0
+    finally:
+        db_pool.close()
+        await db_pool.wait_closed()
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,285 @@
+"""
+Воспроизведение записанного трафика станций против тестового сервера
+
+Записи делает сервер с TRAFFIC_CAPTURE_ENABLED=true (utils/traffic_capture.py),
+файлы сессий лежат в TRAFFIC_CAPTURE_DIR/<box_id>/*.zcap.
+
+Команды:
+    python tools/traffic_replay.py dump logs/capture/DCHEY02504000018/*.zcap
+    python tools/traffic_replay.py replay logs/capture --speed 1
+    python tools/traffic_replay.py replay logs/capture --speed 10 --port 9066
+    python tools/traffic_replay.py from-log logs/server.log --out logs/capture_from_log
+
+replay открывает по соединению на каждую сессию, отправляет кадры станции с
+записанными интервалами (--speed 10 - в 10 раз быстрее, 0 - без пауз; взаимный
+сдвиг сессий сохраняется) и сравнивает ответы сервера с записанными. Время
+ответа сервера выводится перцентилями по командам - для сравнения версий сервера
+на реальной форме трафика. Тестовый сервер должен работать на копии БД
+с теми же станциями и ключами, что и при записи.
+
+from-log восстанавливает сессии из строк log_packet единого лога (кадры, которые
+логировались; ответы на логин и возврат туда не попадают).
+"""
+import argparse
+import asyncio
+import difflib
+import glob
+import os
+import re
+import struct
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import TCP_PORTS
+from utils.traffic_capture import (
+    DIRECTION_IN, DIRECTION_OUT, login_box_id, read_capture, write_capture
+)
+
+
+# Ответы сервера, которые различаются между запусками: сравнивается только начало payload
+# (0x60: result; новый nonce и время сервера не сравниваются)
+VOLATILE_PAYLOAD = {0x60: 1}
+
+LOG_LINE = re.compile(
+    r"Direction: (?P<direction>INCOMING|OUTGOING) \| .*?Station: (?P<station>[^|]+?) \| .*?"
+    r"Data: (?P<data>[0-9A-F]+) \| Info: TIME:(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6})"
+)
+
+
+def collect_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '**', '*.zcap'), recursive=True))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(files)
+
+
+def frame_key(frame: bytes) -> Tuple[int, bytes]:
+    """Кадр для сравнения: команда и payload без изменчивых полей (токен зависит от payload)"""
+    command = frame[2] if len(frame) > 2 else -1
+    payload = frame[9:]
+    keep = VOLATILE_PAYLOAD.get(command)
+    return command, payload[:keep] if keep is not None else payload
+
+
+def describe(key: Tuple[int, bytes]) -> str:
+    command, payload = key
+    return f"0x{command:02X}:{payload.hex().upper() or '-'}"
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class SessionReplay:
+    """Воспроизведение одной записанной сессии станции"""
+
+    def __init__(self, path: str, host: str, port: int):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.box_id, self.started_us, self.records = read_capture(path)
+        self.expected: List[bytes] = []
+        self.actual: List[bytes] = []
+        self.latencies: Dict[int, List[float]] = defaultdict(list)
+        self.sent = 0
+        self.error: Optional[str] = None
+        self._awaiting: Dict[int, List[float]] = defaultdict(list)
+
+        # Ответом считается исходящий кадр с той же командой, что и последний входящий
+        last_in = None
+        self._answered_commands = set()
+        for _, direction, frame in self.records:
+            if direction == DIRECTION_IN:
+                last_in = frame[2]
+            elif frame[2] == last_in:
+                self.expected.append(frame)
+                self._answered_commands.add(last_in)
+
+    async def run(self, origin_us: int, speed: float, settle: float, started: float) -> None:
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            self.error = f"подключение: {e}"
+            return
+        read_task = asyncio.create_task(self._read_loop(reader))
+        try:
+            for timestamp_us, direction, frame in self.records:
+                if direction != DIRECTION_IN:
+                    continue
+                if speed > 0:
+                    delay = started + (timestamp_us - origin_us) / 1_000_000 / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if frame[2] in self._answered_commands:
+                    self._awaiting[frame[2]].append(time.perf_counter())
+                writer.write(frame)
+                await writer.drain()
+                self.sent += 1
+            await asyncio.sleep(settle)
+        except (ConnectionError, OSError) as e:
+            self.error = f"отправка: {e}"
+        finally:
+            read_task.cancel()
+            writer.close()
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                frame = header + await reader.readexactly(struct.unpack(">H", header)[0])
+                command = frame[2]
+                if command not in self._answered_commands:
+                    continue  # команды сервера по запросам API при воспроизведении не повторяются
+                awaiting = self._awaiting.get(command)
+                if awaiting:
+                    self.latencies[command].append(time.perf_counter() - awaiting.pop(0))
+                self.actual.append(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if self.error is None and self.sent < sum(1 for r in self.records if r[1] == DIRECTION_IN):
+                self.error = "сервер закрыл соединение"
+
+    def diff(self) -> List[str]:
+        """Расхождения ответов сервера с записанными"""
+        expected = [frame_key(frame) for frame in self.expected]
+        actual = [frame_key(frame) for frame in self.actual]
+        lines = []
+        matcher = difflib.SequenceMatcher(a=expected, b=actual, autojunk=False)
+        for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+            lines.append(
+                f"{tag} записано[{a1}:{a2}] {' '.join(describe(k) for k in expected[a1:a2]) or '-'}"
+                f" -> получено[{b1}:{b2}] {' '.join(describe(k) for k in actual[b1:b2]) or '-'}"
+            )
+        return lines
+
+
+async def replay(args) -> int:
+    files = collect_files(args.paths)
+    if not files:
+        print("Файлы захвата не найдены")
+        return 1
+    ports = args.port or TCP_PORTS
+    sessions = [SessionReplay(path, args.host, ports[index % len(ports)]) for index, path in enumerate(files)]
+    # Общая точка отсчета сохраняет взаимный сдвиг сессий
+    origin_us = min((session.records[0][0] for session in sessions if session.records), default=0)
+    print(f"Сессий: {len(sessions)}, кадров станций: "
+          f"{sum(1 for s in sessions for r in s.records if r[1] == DIRECTION_IN)}, скорость: "
+          f"{'без пауз' if args.speed <= 0 else f'x{args.speed:g}'}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session.run(origin_us, args.speed, args.settle, started) for session in sessions))
+    elapsed = time.perf_counter() - started
+
+    mismatched = 0
+    for session in sessions:
+        diff = session.diff()
+        status = 'OK' if not diff and not session.error else 'РАСХОЖДЕНИЕ'
+        if diff or session.error:
+            mismatched += 1
+        if diff or session.error or args.verbose:
+            print(f"\n{status} {session.box_id} {os.path.basename(session.path)}: отправлено {session.sent}, "
+                  f"ответов записано {len(session.expected)}, получено {len(session.actual)}"
+                  + (f", ошибка: {session.error}" if session.error else ''))
+            for line in diff[:args.max_diffs]:
+                print(f"  {line}")
+            if len(diff) > args.max_diffs:
+                print(f"  ... еще {len(diff) - args.max_diffs}")
+
+    print(f"\nВремя воспроизведения: {elapsed:.1f}с, сессий с расхождениями: {mismatched}/{len(sessions)}")
+    latencies: Dict[int, List[float]] = defaultdict(list)
+    for session in sessions:
+        for command, values in session.latencies.items():
+            latencies[command].extend(values)
+    for command in sorted(latencies):
+        ms = [value * 1000 for value in latencies[command]]
+        print(f"  0x{command:02X} n={len(ms):<7} p50={percentile(ms, 0.5):.1f}мс p95={percentile(ms, 0.95):.1f}мс "
+              f"p99={percentile(ms, 0.99):.1f}мс max={max(ms):.1f}мс")
+    return 1 if mismatched else 0
+
+
+def dump(args) -> int:
+    for path in collect_files(args.paths):
+        box_id, started_us, records = read_capture(path)
+        started = datetime.fromtimestamp(started_us / 1_000_000)
+        print(f"{path}: станция {box_id}, начало {started.isoformat()}, кадров {len(records)}")
+        for timestamp_us, direction, frame in records:
+            arrow = '->' if direction == DIRECTION_IN else '<-'
+            print(f"  +{(timestamp_us - started_us) / 1_000_000:10.6f} {arrow} {frame.hex().upper()}")
+    return 0
+
+
+def from_log(args) -> int:
+    """Восстанавливает сессии станций из строк log_packet (новая сессия - на каждом логине)"""
+    sessions: Dict[str, List[List[Tuple[int, int, bytes]]]] = defaultdict(list)
+    for path in args.logs:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = LOG_LINE.search(line)
+                if not match:
+                    continue
+                frame = bytes.fromhex(match['data'])
+                timestamp_us = int(datetime.strptime(match['time'], '%Y-%m-%d %H:%M:%S.%f').timestamp() * 1_000_000)
+                direction = DIRECTION_IN if match['direction'] == 'INCOMING' else DIRECTION_OUT
+                box_id = match['station'].strip()
+                login_box = login_box_id(frame) if direction == DIRECTION_IN else None
+                if login_box:
+                    box_id = login_box
+                    sessions[box_id].append([])
+                elif box_id == 'unknown' or not sessions[box_id]:
+                    continue  # кадр вне сессии с известным логином
+                sessions[box_id][-1].append((timestamp_us, direction, frame))
+
+    written = 0
+    for box_id, station_sessions in sessions.items():
+        station_dir = os.path.join(args.out, box_id.replace(os.sep, '_'))
+        os.makedirs(station_dir, exist_ok=True)
+        for records in station_sessions:
+            started = datetime.fromtimestamp(records[0][0] / 1_000_000).strftime('%Y%m%d-%H%M%S')
+            write_capture(os.path.join(station_dir, f"{started}_log.zcap"), box_id, records)
+            written += 1
+    print(f"Сессий записано: {written} в {args.out}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика станций')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    replay_parser = commands.add_parser('replay', help='воспроизвести сессии против сервера')
+    replay_parser.add_argument('paths', nargs='+', help='файлы .zcap или каталоги')
+    replay_parser.add_argument('--host', default='127.0.0.1')
+    replay_parser.add_argument('--port', type=int, action='append', help='TCP порт сервера (можно несколько)')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='ускорение, 0 - без пауз')
+    replay_parser.add_argument('--settle', type=float, default=2.0, help='секунд ожидания ответов в конце')
+    replay_parser.add_argument('--max-diffs', type=int, default=20)
+    replay_parser.add_argument('--verbose', action='store_true', help='выводить и совпавшие сессии')
+
+    dump_parser = commands.add_parser('dump', help='вывести кадры файлов захвата')
+    dump_parser.add_argument('paths', nargs='+')
+
+    log_parser = commands.add_parser('from-log', help='файлы захвата из строк log_packet единого лога')
+    log_parser.add_argument('logs', nargs='+')
+    log_parser.add_argument('--out', default='logs/capture_from_log')
+
+    args = parser.parse_args()
+    if args.command == 'replay':
+        return asyncio.run(replay(args))
+    if args.command == 'dump':
+        return dump(args)
+    return from_log(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Буферизованная запись журналов в БД (аномалии слотов 0x83, action_logs)
+
+Вызывающий код кладет строку в очередь и сразу продолжает работу. Очередь
+ограничена max_buffer строками и пишется многострочными INSERT по batch_size
+строк: как только набралась пачка или через flush_interval секунд после первой
+строки. При переполнении (шторм 0x83 от неисправного кабинета или недоступная
+БД) строки отбрасываются по политике overflow:
+    drop_new    - новая строка не принимается, сохраняется начало шторма
+    drop_oldest - вытесняется самая старая строка
+Отброшенные строки считаются в dropped_total.
+
+Если пачку отвергает содержимое строки (нарушение внешнего ключа после
+удаления станции или пользователя, недопустимое значение enum), пачка
+пишется по одной строке, а отвергнутые строки отбрасываются и считаются в
+rejected_total - очередь не застревает на повторах одной и той же пачки.
+"""
+import asyncio
+from collections import deque
+from typing import Any, Dict, Optional, Sequence
+
+import aiomysql
+
+from config.settings import BATCH_WRITER_CONFIG
+from utils.centralized_logger import get_logger
+
+
+OVERFLOW_POLICIES = ('drop_new', 'drop_oldest')
+
+# Ошибки, которые вызывает содержимое строки, а не состояние БД: повтор их не исправит
+REJECTED_ROW_ERRORS = (aiomysql.IntegrityError, aiomysql.DataError)
+
+
+class BatchWriter:
+    """Очередь строк одной таблицы с записью пачками"""
+
+    def __init__(self, name: str, table: str, columns: Sequence[str], config: Dict[str, Any]):
+        if config['overflow'] not in OVERFLOW_POLICIES:
+            raise ValueError(f"{name}: неизвестная политика переполнения {config['overflow']}")
+        self.name = name
+        self.table = table
+        self.columns = tuple(columns)
+        self.config = config
+        self.logger = get_logger('batch_writer')
+        self.buffer: deque = deque()
+        self._db_pool = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._row_sql = '(' + ', '.join(['%s'] * len(self.columns)) + ')'
+        self.enqueued_total = 0
+        self.written_total = 0
+        self.dropped_total = 0
+        self.failed_batches_total = 0
+        self.rejected_total = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def attach(self, db_pool) -> None:
+        self._db_pool = db_pool
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Остаток очереди дописывается при остановке
+        while self.buffer and await self.flush():
+            pass
+
+    def enqueue(self, row: Sequence[Any]) -> bool:
+        """Кладет строку в очередь; False - строка отброшена из-за переполнения"""
+        if len(self.buffer) >= self.config['max_buffer']:
+            self.dropped_total += 1
+            if self.dropped_total == 1 or self.dropped_total % 1000 == 0:
+                self.logger.warning(f"{self.name}: очередь переполнена, отброшено строк: {self.dropped_total}")
+            if self.config['overflow'] == 'drop_new':
+                return False
+            self.buffer.popleft()
+        self.buffer.append(tuple(row))
+        self.enqueued_total += 1
+        # Первая строка запускает отсчет flush_interval, полная пачка - запись сразу
+        if len(self.buffer) == 1 or len(self.buffer) >= self.config['batch_size']:
+            self._wakeup.set()
+        return True
+
+    @property
+    def pending_count(self) -> int:
+        return len(self.buffer)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if len(self.buffer) < self.config['batch_size']:
+                # Неполная пачка ждет добора или истечения интервала
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.config['flush_interval'])
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            while self.buffer:
+                if not await self.flush():
+                    # БД недоступна: строки остаются в очереди до следующей попытки
+                    await asyncio.sleep(self.config['flush_interval'])
+                    continue
+                if len(self.buffer) < self.config['batch_size']:
+                    break
+            # Остаток неполной пачки ждет следующего интервала
+            if self.buffer:
+                self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """Пишет одну пачку из начала очереди; False - запись не удалась"""
+        if not self.buffer:
+            return True
+        if not self._db_pool or self._db_pool._closed:
+            return False
+        batch = [self.buffer[index] for index in range(min(len(self.buffer), self.config['batch_size']))]
+        try:
+            await self._insert(batch)
+        except REJECTED_ROW_ERRORS as e:
+            # Пачку отвергла одна из строк (внешний ключ, недопустимое значение) - пишем по одной
+            self.logger.warning(f"{self.name}: пачка из {len(batch)} строк отвергнута ({e}), запись по одной строке")
+            return await self._flush_rows(batch)
+        except Exception as e:
+            self.failed_batches_total += 1
+            self.logger.error(f"{self.name}: ошибка записи пачки из {len(batch)} строк: {e}")
+            return False
+        self._remove_written(batch)
+        self.written_total += len(batch)
+        return True
+
+    async def _insert(self, rows) -> None:
+        async with self._db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"INSERT INTO {self.table} ({', '.join(self.columns)}) "
+                    f"VALUES {', '.join([self._row_sql] * len(rows))}",
+                    [value for row in rows for value in row]
+                )
+
+    async def _flush_rows(self, batch) -> bool:
+        """Пишет пачку построчно; отвергнутые строки отбрасываются и считаются в rejected_total"""
+        for row in batch:
+            try:
+                await self._insert([row])
+                self.written_total += 1
+            except REJECTED_ROW_ERRORS as e:
+                self.rejected_total += 1
+                self.logger.error(f"{self.name}: строка отброшена: {e}; {row}")
+            except Exception as e:
+                self.failed_batches_total += 1
+                self.logger.error(f"{self.name}: ошибка построчной записи: {e}")
+                return False
+            self._remove_written([row])
+        return True
+
+    def _remove_written(self, rows) -> None:
+        # Пока шла запись, drop_oldest мог вытеснить часть строк из очереди
+        for row in rows:
+            if self.buffer and self.buffer[0] is row:
+                self.buffer.popleft()
+
+# Отчеты об аномалиях слотов (0x83)
+abnormal_report_writer = BatchWriter(
+    'slot_abnormal_reports', 'slot_abnormal_reports',
+    ('station_id', 'slot_number', 'terminal_id', 'event_type', 'reported_at', 'created_at'),
+    BATCH_WRITER_CONFIG['abnormal_reports']
+)
+
+# Журнал действий пользователей
+action_log_writer = BatchWriter(
+    'action_logs', 'action_logs',
+    ('user_id', 'action_type', 'entity_type', 'entity_id', 'description', 'ip_address', 'user_agent',
+     'created_at'),
+    BATCH_WRITER_CONFIG['action_logs']
+)
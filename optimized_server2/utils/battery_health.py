@@ -0,0 +1,315 @@
+"""
+Аналитика состояния аккумуляторов парка
+
+Раз в interval_hours часов загружает суточные агрегаты телеметрии
+(slot_telemetry), SOH повербанков и аномалии слотов за window_days дней в
+массивы NumPy и одним векторным проходом считает по каждому повербанку:
+наклон тренда SOH (МНК по суточным точкам), робастный z-score средней
+температуры относительно парка и частоту аномалий; по станциям - частоту
+аномалий, температуру и число деградирующих повербанков. Каждый показатель
+делится на свой порог из BATTERY_HEALTH_CONFIG, сумма дает балл риска, по
+которому строится рейтинг для /api/analytics/battery-health.
+"""
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+import aiomysql
+
+from config.settings import BATTERY_HEALTH_CONFIG, TELEMETRY_CONFIG
+from utils.centralized_logger import get_logger
+from utils.time_utils import get_moscow_time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy ставится вместе с pandas
+    np = None
+
+
+FETCH_CHUNK = 50000
+MAX_COMPONENT = 10.0
+
+
+def _robust_z(values):
+    """z-score по медиане и MAD (nan для отсутствующих значений)"""
+    z = np.full(values.shape, np.nan)
+    known = ~np.isnan(values)
+    if not known.any():
+        return z
+    median = np.median(values[known])
+    deviation = np.abs(values[known] - median)
+    # MAD равна нулю, если больше половины значений совпадают - тогда берем среднее отклонение
+    scale = np.median(deviation) / 0.6745 or 1.2533 * deviation.mean()
+    z[known] = (values[known] - median) / scale if scale > 0 else 0.0
+    return z
+
+
+def _round(value, digits: int = 3) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def compute_fleet_health(powerbanks: Dict[str, Any], telemetry, abnormal: List[tuple],
+                         stations: Dict[str, Any], window_start_ts: int, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Векторный расчет показателей (без обращений к БД, выполняется в пуле потоков)
+    telemetry - массив строк (station_id, powerbank_id, bucket_ts, samples, soh_sum, temperature_sum, temperature_max)
+    abnormal - строки (station_id, terminal_id, количество)
+    """
+    window_days = config['window_days']
+    pb_ids = powerbanks['ids']
+    pb_order = np.argsort(pb_ids)
+    pb_sorted = pb_ids[pb_order]
+    st_ids = stations['ids']
+    st_order = np.argsort(st_ids)
+    st_sorted = st_ids[st_order]
+
+    def index_of(sorted_ids, order, values):
+        """Позиции values в исходном массиве ID (-1 для неизвестных)"""
+        if not len(sorted_ids):
+            return np.full(len(values), -1, dtype=np.int64)
+        position = np.minimum(np.searchsorted(sorted_ids, values), len(sorted_ids) - 1)
+        return np.where(sorted_ids[position] == values, order[position], -1)
+
+    pb_count, st_count = len(pb_ids), len(st_ids)
+
+    # --- повербанки: тренд SOH и температура по суточным агрегатам ---
+    pb_index = index_of(pb_sorted, pb_order, telemetry[:, 1]) if len(telemetry) else np.empty(0, np.int64)
+    rows = telemetry[pb_index >= 0]
+    pb_index = pb_index[pb_index >= 0]
+    samples = rows[:, 3].astype(float)
+    x = (rows[:, 2] - window_start_ts) / 86400.0
+    y = rows[:, 4] / np.maximum(samples, 1)
+    n = np.bincount(pb_index, minlength=pb_count).astype(float)
+    sx = np.bincount(pb_index, x, pb_count)
+    sy = np.bincount(pb_index, y, pb_count)
+    sxy = np.bincount(pb_index, x * y, pb_count)
+    sxx = np.bincount(pb_index, x * x, pb_count)
+    denominator = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where((n >= config['min_days']) & (denominator > 0),
+                         (n * sxy - sx * sy) / denominator, np.nan)
+        samples_total = np.bincount(pb_index, samples, pb_count)
+        temperature_mean = np.where(samples_total > 0,
+                                    np.bincount(pb_index, rows[:, 5], pb_count) / samples_total, np.nan)
+    temperature_max = np.full(pb_count, -np.inf)
+    np.maximum.at(temperature_max, pb_index, rows[:, 6])
+    temperature_max[np.isinf(temperature_max)] = np.nan
+    temperature_z = _robust_z(temperature_mean)
+
+    # --- аномалии слотов (terminal_id - серийный номер повербанка) ---
+    serial_index = {serial: i for i, serial in enumerate(powerbanks['serials'])}
+    abnormal_pb = np.zeros(pb_count)
+    abnormal_st = np.zeros(st_count)
+    if abnormal:
+        counts = np.array([row[2] for row in abnormal], dtype=float)
+        pb_rows = np.array([serial_index.get(row[1], -1) for row in abnormal], dtype=np.int64)
+        st_rows = index_of(st_sorted, st_order, np.array([row[0] for row in abnormal], dtype=np.int64))
+        np.add.at(abnormal_pb, pb_rows[pb_rows >= 0], counts[pb_rows >= 0])
+        np.add.at(abnormal_st, st_rows[st_rows >= 0], counts[st_rows >= 0])
+    per_week = 7.0 / window_days
+
+    # Баллы показателей ограничены MAX_COMPONENT, чтобы один выброс не заслонял остальные признаки
+    pb_components = {
+        'soh_trend': np.clip(np.nan_to_num(-slope * 30 / config['soh_drop_alert']), 0, MAX_COMPONENT),
+        'temperature': np.clip(np.nan_to_num(temperature_z / config['temperature_z_alert']), 0, MAX_COMPONENT),
+        'abnormal': np.clip(abnormal_pb * per_week / config['abnormal_alert'], 0, MAX_COMPONENT),
+    }
+    pb_risk = sum(pb_components.values())
+    degrading = pb_components['soh_trend'] >= 1
+
+    # --- станции: температура и деградирующие повербанки по строкам телеметрии ---
+    st_index = index_of(st_sorted, st_order, rows[:, 0]) if len(rows) else np.empty(0, np.int64)
+    known = st_index >= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        st_samples = np.bincount(st_index[known], samples[known], st_count)
+        st_temperature = np.where(st_samples > 0,
+                                  np.bincount(st_index[known], rows[known, 5], st_count) / st_samples, np.nan)
+    st_temperature_z = _robust_z(st_temperature)
+    # Пары станция-повербанк без повторов по дням
+    pairs = np.unique(st_index[known] * max(pb_count, 1) + pb_index[known])
+    pair_stations, pair_powerbanks = np.divmod(pairs, max(pb_count, 1))
+    st_powerbanks = np.bincount(pair_stations, minlength=st_count)
+    st_degrading = np.bincount(pair_stations, degrading[pair_powerbanks].astype(float), st_count)
+    st_components = {
+        'abnormal': np.clip(abnormal_st * per_week / config['abnormal_alert'], 0, MAX_COMPONENT),
+        'temperature': np.clip(np.nan_to_num(st_temperature_z / config['temperature_z_alert']), 0, MAX_COMPONENT),
+        'degrading_powerbanks': st_degrading,
+    }
+    st_risk = sum(st_components.values())
+
+    def ranked(risk, components) -> List[int]:
+        top = np.argsort(-risk, kind='stable')[:config['keep_top']]
+        return [int(i) for i in top if risk[i] > 0]
+
+    def flags(components, i) -> List[str]:
+        return [name for name, values in components.items() if values[i] >= 1]
+
+    powerbank_rows = [
+        {
+            'powerbank_id': int(pb_ids[i]),
+            'serial_number': powerbanks['serials'][i],
+            'org_unit_id': powerbanks['org_unit_ids'][i],
+            'status': powerbanks['statuses'][i],
+            'soh': _round(powerbanks['soh'][i], 1),
+            'soh_slope_30d': _round(slope[i] * 30, 2),
+            'days_with_data': int(n[i]),
+            'temperature_avg': _round(temperature_mean[i], 1),
+            'temperature_max': _round(temperature_max[i], 1),
+            'temperature_z': _round(temperature_z[i], 2),
+            'abnormal_per_week': _round(abnormal_pb[i] * per_week, 2),
+            'risk': _round(pb_risk[i], 3),
+            'flags': flags(pb_components, i),
+        }
+        for i in ranked(pb_risk, pb_components)
+    ]
+    station_rows = [
+        {
+            'station_id': int(st_ids[i]),
+            'box_id': stations['box_ids'][i],
+            'org_unit_id': stations['org_unit_ids'][i],
+            'powerbanks_seen': int(st_powerbanks[i]),
+            'degrading_powerbanks': int(st_degrading[i]),
+            'temperature_avg': _round(st_temperature[i], 1),
+            'temperature_z': _round(st_temperature_z[i], 2),
+            'abnormal_per_week': _round(abnormal_st[i] * per_week, 2),
+            'risk': _round(st_risk[i], 3),
+            'flags': flags(st_components, i),
+        }
+        for i in ranked(st_risk, st_components)
+    ]
+    return {
+        'powerbanks_analyzed': int(pb_count),
+        'powerbanks_with_trend': int(np.count_nonzero(~np.isnan(slope))),
+        'degrading_powerbanks': int(np.count_nonzero(degrading)),
+        'stations_analyzed': int(st_count),
+        'powerbanks': powerbank_rows,
+        'stations': station_rows,
+    }
+
+
+class BatteryHealthAnalyzer:
+    """Периодический расчет рейтинга риска повербанков и станций"""
+
+    def __init__(self):
+        self.logger = get_logger('battery_health')
+        self.db_pool = None
+        self.result: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Task] = None
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def attach(self, db_pool, periodic: bool = True) -> None:
+        """
+        Пул БД для расчетов по запросу и периодический расчет, если он включен.
+        periodic = False - только расчеты по запросу (остальные HTTP процессы)
+        """
+        self.db_pool = db_pool
+        if not self.available:
+            self.logger.warning("numpy не установлен, аналитика аккумуляторов отключена")
+        elif BATTERY_HEALTH_CONFIG['enabled'] and periodic:
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._running):
+            if task and not task.done():
+                task.cancel()
+        self._task = None
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                self.logger.error(f"Ошибка расчета состояния аккумуляторов: {e}", exc_info=True)
+            await asyncio.sleep(BATTERY_HEALTH_CONFIG['interval_hours'] * 3600)
+
+    async def run(self) -> Dict[str, Any]:
+        """Выполняет расчет; параллельный вызов ждет уже идущий"""
+        if self._running is None or self._running.done():
+            self._running = asyncio.create_task(self._run())
+        return await asyncio.shield(self._running)
+
+    @property
+    def is_running(self) -> bool:
+        return self._running is not None and not self._running.done()
+
+    async def _run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        config = dict(BATTERY_HEALTH_CONFIG)
+        window_start_ts = int(time.time()) - config['window_days'] * 86400
+        powerbanks, telemetry, abnormal, stations = await self._load(window_start_ts, config['window_days'])
+        loaded = time.perf_counter()
+
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, compute_fleet_health, powerbanks, telemetry, abnormal, stations, window_start_ts, config
+        )
+        result.update({
+            'generated_at': get_moscow_time().isoformat(),
+            'window_days': config['window_days'],
+            'telemetry_rows': int(len(telemetry)),
+            'load_seconds': round(loaded - started, 3),
+            'compute_seconds': round(time.perf_counter() - loaded, 3),
+        })
+        self.result = result
+        self.logger.info(
+            f"Состояние аккумуляторов: {result['powerbanks_analyzed']} повербанков, "
+            f"{result['degrading_powerbanks']} деградируют, загрузка {result['load_seconds']} сек, "
+            f"расчет {result['compute_seconds']} сек"
+        )
+        return result
+
+    async def _load(self, window_start_ts: int, window_days: int):
+        """Загружает данные за период в массивы"""
+        # Самый крупный интервал агрегатов телеметрии (по умолчанию сутки)
+        resolution = max(TELEMETRY_CONFIG['resolutions'])
+        window_start = get_moscow_time() - timedelta(days=window_days)
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT id, serial_number, org_unit_id, soh, status FROM powerbank WHERE is_deleted = 0")
+                pb_rows = await cur.fetchall()
+                await cur.execute("SELECT station_id, box_id, org_unit_id FROM station WHERE is_deleted = 0")
+                st_rows = await cur.fetchall()
+                await cur.execute("""
+                    SELECT station_id, terminal_id, COUNT(*)
+                    FROM slot_abnormal_reports
+                    WHERE reported_at >= %s AND terminal_id IS NOT NULL
+                    GROUP BY station_id, terminal_id
+                """, (window_start,))
+                abnormal = [(int(row[0]), row[1], int(row[2])) for row in await cur.fetchall()]
+
+            # Телеметрия - самый большой набор: читаем потоково частями
+            chunks = []
+            async with conn.cursor(aiomysql.SSCursor) as cur:
+                await cur.execute("""
+                    SELECT station_id, powerbank_id, bucket_ts, samples, soh_sum, temperature_sum, temperature_max
+                    FROM slot_telemetry
+                    WHERE bucket_seconds = %s AND bucket_ts >= %s AND powerbank_id > 0
+                """, (resolution, window_start_ts))
+                while True:
+                    rows = await cur.fetchmany(FETCH_CHUNK)
+                    if not rows:
+                        break
+                    chunks.append(np.array(rows, dtype=np.int64))
+
+        powerbanks = {
+            'ids': np.array([row[0] for row in pb_rows], dtype=np.int64),
+            'serials': [row[1] for row in pb_rows],
+            'org_unit_ids': [int(row[2]) if row[2] else None for row in pb_rows],
+            'soh': np.array([row[3] if row[3] is not None else np.nan for row in pb_rows], dtype=float),
+            'statuses': [row[4] for row in pb_rows],
+        }
+        stations = {
+            'ids': np.array([row[0] for row in st_rows], dtype=np.int64),
+            'box_ids': [row[1] for row in st_rows],
+            'org_unit_ids': [int(row[2]) if row[2] else None for row in st_rows],
+        }
+        telemetry = np.concatenate(chunks) if chunks else np.empty((0, 7), dtype=np.int64)
+        return powerbanks, telemetry, abnormal, stations
+
+
+# Аналитика аккумуляторов процесса с HTTP API
+battery_health_analyzer = BatteryHealthAnalyzer()
@@ -0,0 +1,213 @@
+"""
+Команды станции с ожиданием ответа (запрос-ответ поверх TCP протокола)
+
+Кабинет обрабатывает одну команду за раз, поэтому команды соединения идут через
+очередь: следующая отправляется после ответа на предыдущую (или таймаута).
+В кадре протокола нет идентификатора запроса - ответ относится к команде "в полете"
+с тем же opcode. request_id - локальный номер запроса соединения для логов и API.
+
+Повторный запрос инвентаря (0x64), пока предыдущий еще ждет в очереди, не ставится
+второй раз: вызывающий получает ответ уже поставленного запроса.
+"""
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from config.settings import COMMAND_RPC_CONFIG
+from utils.packet_utils import (
+    parse_borrow_response, parse_force_eject_response, parse_query_iccid_response,
+    parse_query_inventory_response, parse_query_server_address_response,
+    parse_query_voice_volume_response, parse_restart_cabinet_response,
+    parse_set_server_address_response, parse_set_voice_volume_response
+)
+from utils.timer_wheel import timer_wheel, WheelTimer
+
+
+# opcode ответа -> парсер кадра ответа
+COMMAND_RESPONSE_PARSERS: Dict[int, Callable[[bytes], Dict[str, Any]]] = {
+    0x63: parse_set_server_address_response,
+    0x64: parse_query_inventory_response,
+    0x65: parse_borrow_response,
+    0x67: parse_restart_cabinet_response,
+    0x69: parse_query_iccid_response,
+    0x6A: parse_query_server_address_response,
+    0x70: parse_set_voice_volume_response,
+    0x77: parse_query_voice_volume_response,
+    0x80: parse_force_eject_response,
+}
+
+# Команды, повторный запрос которых в очереди заменяется уже поставленным
+COALESCED_COMMANDS = frozenset({0x64})
+
+DEFAULT_COMMAND_TIMEOUT = COMMAND_RPC_CONFIG['timeout']
+
+
+def request_timeout(value: Any) -> float:
+    """Таймаут ожидания из запроса API в пределах (0, max_timeout]"""
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_COMMAND_TIMEOUT
+    if timeout <= 0:
+        return DEFAULT_COMMAND_TIMEOUT
+    return min(timeout, COMMAND_RPC_CONFIG['max_timeout'])
+
+
+def request_wait(value: Any) -> Optional[bool]:
+    """Флаг wait из запроса API: по умолчанию True, None - если значение не распознано"""
+    if value is None or isinstance(value, bool):
+        return True if value is None else value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('1', 'true', 'yes'):
+            return True
+        if value in ('0', 'false', 'no'):
+            return False
+    return None
+
+
+class CommandTimeoutError(asyncio.TimeoutError):
+    """Станция не ответила на команду за отведенное время"""
+
+
+class CommandRequest:
+    """Команда в очереди соединения"""
+
+    __slots__ = ('request_id', 'opcode', 'packet', 'timeout', 'parser', 'future', 'reply', 'timer')
+
+    def __init__(self, request_id: int, opcode: int, packet: bytes, timeout: float,
+                 parser: Callable[[bytes], Dict[str, Any]]):
+        loop = asyncio.get_running_loop()
+        self.request_id = request_id
+        self.opcode = opcode
+        self.packet = packet
+        self.timeout = timeout
+        self.parser = parser
+        # future - результат для вызывающего (его можно отменить),
+        # reply - для очереди: станция ответила или ждать больше нечего
+        self.future: asyncio.Future = loop.create_future()
+        self.reply: asyncio.Future = loop.create_future()
+        self.timer: Optional[WheelTimer] = None
+        self.future.add_done_callback(_consume_exception)
+
+    def resolve(self, data: bytes) -> None:
+        if not self.reply.done():
+            self.reply.set_result(None)
+        if self.future.done():
+            return
+        try:
+            response = self.parser(data)
+        except Exception as e:
+            self.future.set_exception(e)
+            return
+        response['RequestId'] = self.request_id
+        self.future.set_result(response)
+
+    def fail(self, error: BaseException) -> None:
+        if not self.reply.done():
+            self.reply.set_result(None)
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def expire(self) -> None:
+        StationCommandQueue.timeouts_total += 1
+        self.fail(CommandTimeoutError(
+            f"Нет ответа 0x{self.opcode:02X} (запрос {self.request_id}) за {self.timeout:g} сек"
+        ))
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Команды "отправил и забыл": ошибка не должна попадать в лог как не полученная
+    if not future.cancelled():
+        future.exception()
+
+
+class StationCommandQueue:
+    """Очередь команд соединения станции: одна команда в полете"""
+
+    # Счетчики процесса для метрик
+    submitted_total = 0
+    coalesced_total = 0
+    timeouts_total = 0
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.queue: Deque[CommandRequest] = deque()
+        self.in_flight: Optional[CommandRequest] = None
+        self._coalescible: Dict[int, CommandRequest] = {}
+        self._seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self._closed: Optional[BaseException] = None
+
+    @property
+    def depth(self) -> int:
+        """Команды в очереди, включая ожидающую ответа"""
+        return len(self.queue) + (1 if self.in_flight else 0)
+
+    def submit(self, packet: bytes, opcode: Optional[int] = None, timeout: float = DEFAULT_COMMAND_TIMEOUT,
+               parser: Optional[Callable[[bytes], Dict[str, Any]]] = None) -> asyncio.Future:
+        """Ставит команду в очередь; future завершится ответом станции (разобранным парсером opcode)"""
+        opcode = packet[2] if opcode is None else opcode
+        if opcode in COALESCED_COMMANDS:
+            queued = self._coalescible.get(opcode)
+            if queued is not None and not queued.future.cancelled():
+                StationCommandQueue.coalesced_total += 1
+                return queued.future
+
+        self._seq += 1
+        request = CommandRequest(self._seq, opcode, packet, timeout, parser or COMMAND_RESPONSE_PARSERS[opcode])
+        StationCommandQueue.submitted_total += 1
+        if self._closed is not None:
+            request.fail(self._closed)
+            return request.future
+        self.queue.append(request)
+        if opcode in COALESCED_COMMANDS:
+            self._coalescible[opcode] = request
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return request.future
+
+    async def _run(self) -> None:
+        try:
+            while self.queue:
+                request = self.queue.popleft()
+                if self._coalescible.get(request.opcode) is request:
+                    del self._coalescible[request.opcode]
+                if request.future.cancelled():
+                    continue  # вызывающий перестал ждать до отправки - команду не отправляем
+                self.in_flight = request
+                request.timer = timer_wheel.call_later(request.timeout, request.expire)
+                try:
+                    writer = self.connection.writer
+                    if not writer or writer.is_closing():
+                        raise ConnectionError(f"Соединение со станцией {self.connection.box_id} недоступно")
+                    writer.write(request.packet)
+                    await writer.drain()
+                except Exception as e:
+                    request.fail(e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+                else:
+                    await request.reply
+                finally:
+                    request.timer.cancel()
+                    self.in_flight = None
+        finally:
+            self._task = None
+
+    def resolve(self, opcode: int, data: bytes) -> bool:
+        """Ответ станции: завершает команду в полете с тем же opcode"""
+        request = self.in_flight
+        if request is None or request.opcode != opcode:
+            return False
+        request.resolve(data)
+        return True
+
+    def close(self, error: BaseException) -> None:
+        """Соединение закрыто: команды в очереди и в полете завершаются ошибкой"""
+        self._closed = error
+        if self.in_flight is not None:
+            self.in_flight.fail(error)
+        while self.queue:
+            self.queue.popleft().fail(error)
+        self._coalescible.clear()
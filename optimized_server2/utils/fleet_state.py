@@ -0,0 +1,324 @@
+"""
+Состояние подключенных станций в памяти процесса шлюза
+
+Запись станции создается при логине и удаляется при отключении. Ее обновляют
+обработчики TCP событий через модели (логин, инвентарь, выдача, возврат,
+извлечение), поэтому запись совпадает с зафиксированными в MySQL данными.
+heartbeat меняет только last_seen в памяти; в БД last_seen пишется пачкой раз
+в flush_interval секунд одним UPDATE.
+
+HTTP чтения карточки станции, доступных повербанков и онлайн статуса берут
+отсюда слоты, remain_num и last_seen (в кластере - из снимка справочника
+воркеров). Статус, подразделение и число слотов всегда читаются из БД
+(load_station): их меняют админские записи HTTP процесса, который запись
+шлюза не видит.
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config.settings import FLEET_STATE_CONFIG
+from utils.centralized_logger import get_logger
+from utils.time_utils import get_moscow_time
+
+
+class SlotState:
+    """Повербанк в слоте станции (строка station_powerbank)"""
+
+    __slots__ = ('slot_number', 'powerbank_id', 'level', 'voltage', 'temperature', 'last_update')
+
+    def __init__(self, slot_number: int, powerbank_id: int, level: Optional[int] = None,
+                 voltage: Optional[int] = None, temperature: Optional[int] = None,
+                 last_update: Optional[datetime] = None):
+        self.slot_number = slot_number
+        self.powerbank_id = powerbank_id
+        self.level = level
+        self.voltage = voltage
+        self.temperature = temperature
+        self.last_update = last_update or get_moscow_time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'slot_number': self.slot_number,
+            'powerbank_id': self.powerbank_id,
+            'level': self.level,
+            'voltage': self.voltage,
+            'temperature': self.temperature,
+            'last_update': self.last_update.isoformat() if self.last_update else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SlotState':
+        last_update = data.get('last_update')
+        return cls(data['slot_number'], data['powerbank_id'], data.get('level'), data.get('voltage'),
+                   data.get('temperature'), datetime.fromisoformat(last_update) if last_update else None)
+
+
+class StationState:
+    """Подключенная станция и ее слоты"""
+
+    __slots__ = ('station_id', 'box_id', 'org_unit_id', 'slots_declared', 'remain_num', 'status',
+                 'last_seen', 'slots', 'fd', 'version')
+
+    def __init__(self, station_id: int, box_id: str, org_unit_id: Optional[int], slots_declared: int,
+                 remain_num: int, status: str, last_seen: Optional[datetime], fd: Optional[int] = None):
+        self.station_id = station_id
+        self.box_id = box_id
+        self.org_unit_id = org_unit_id
+        self.slots_declared = slots_declared
+        self.remain_num = remain_num
+        self.status = status
+        self.last_seen = last_seen
+        self.slots: Dict[int, SlotState] = {}
+        # Соединение, создавшее запись: отключение старого соединения не удаляет запись нового
+        self.fd = fd
+        # Растет при изменении слотов и полей станции (кроме last_seen) - для синхронизации кластера
+        self.version = 0
+
+    def sorted_slots(self) -> List[SlotState]:
+        return [self.slots[slot_number] for slot_number in sorted(self.slots)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'station_id': self.station_id,
+            'box_id': self.box_id,
+            'org_unit_id': self.org_unit_id,
+            'slots_declared': self.slots_declared,
+            'remain_num': self.remain_num,
+            'status': self.status,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'slots': [slot.to_dict() for slot in self.sorted_slots()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'StationState':
+        last_seen = data.get('last_seen')
+        state = cls(data['station_id'], data['box_id'], data.get('org_unit_id'), data.get('slots_declared'),
+                    data.get('remain_num'), data.get('status'),
+                    datetime.fromisoformat(last_seen) if last_seen else None)
+        for slot in data.get('slots', []):
+            state.slots[slot['slot_number']] = SlotState.from_dict(slot)
+        return state
+
+
+class FleetState:
+    """Станции, подключенные к этому процессу"""
+
+    def __init__(self, flush_interval: float = FLEET_STATE_CONFIG['flush_interval']):
+        self.flush_interval = flush_interval
+        self.logger = get_logger('fleet_state')
+        self.stations: Dict[int, StationState] = {}
+        # station_id -> last_seen, еще не записанный в БД
+        self._pending_last_seen: Dict[int, datetime] = {}
+        self._db_pool = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_total = 0
+
+    def attach(self, connection_manager, db_pool) -> None:
+        """Подписка на отключения станций и запуск записи last_seen"""
+        self._db_pool = db_pool
+        connection_manager.add_listener(self._on_connection_event)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def get(self, station_id: int) -> Optional[StationState]:
+        return self.stations.get(station_id)
+
+    def lookup(self, station_id: int, connection_manager=None) -> Optional[StationState]:
+        """Запись станции этого процесса или снимок с воркера шлюза, где станция подключена"""
+        state = self.stations.get(station_id)
+        if state is not None or connection_manager is None:
+            return state
+        connection = connection_manager.get_connection_by_station_id(station_id)
+        snapshot = getattr(connection, 'fleet_state', None) if getattr(connection, 'is_remote', False) else None
+        if not snapshot:
+            return None
+        state = StationState.from_dict(snapshot)
+        # heartbeat синхронизируется чаще, чем снимок станции
+        if connection.last_heartbeat and (state.last_seen is None or connection.last_heartbeat > state.last_seen):
+            state.last_seen = connection.last_heartbeat
+        return state
+
+    async def load_station(self, db_pool, station_id: int, connection_manager=None):
+        """
+        Станция из БД с полями подключения из памяти (remain_num, last_seen) и запись в памяти.
+        Возвращает (station, state); station = None, если станции нет, state = None, если она не подключена
+        """
+        from models.station import Station
+        from utils.time_utils import normalize_datetime_to_moscow
+        station = await Station.get_by_id(db_pool, station_id)
+        if station is None:
+            return None, None
+        state = self.lookup(station_id, connection_manager)
+        if state is None:
+            return station, None
+        station.remain_num = state.remain_num
+        last_seen = normalize_datetime_to_moscow(state.last_seen)
+        if last_seen and (station.last_seen is None or last_seen > station.last_seen):
+            station.last_seen = last_seen
+        # Локальная запись догоняет админские изменения станции
+        local = self.stations.get(station_id)
+        if local is not None:
+            changed = {name: getattr(station, name) for name in ('status', 'org_unit_id', 'slots_declared')
+                       if getattr(local, name) != getattr(station, name)}
+            if changed:
+                self.update_station(station_id, **changed)
+        return station, state
+
+    def _on_connection_event(self, event: str, connection) -> None:
+        if event == 'disconnect':
+            state = self.stations.get(connection.station_id)
+            if state is not None and state.fd == connection.fd:
+                del self.stations[connection.station_id]
+
+    # --- обновления из обработчиков и моделей ---
+
+    def set_station(self, station, slots: Iterable[Tuple[int, Tuple]], fd: Optional[int] = None) -> StationState:
+        """Логин: станция и слоты {slot_number: (powerbank_id, level, voltage, temperature)}"""
+        state = StationState(station.station_id, station.box_id, station.org_unit_id, station.slots_declared,
+                             station.remain_num, station.status, station.last_seen, fd)
+        moscow_time = get_moscow_time()
+        for slot_number, (powerbank_id, level, voltage, temperature) in slots:
+            state.slots[slot_number] = SlotState(slot_number, powerbank_id, level, voltage, temperature, moscow_time)
+        previous = self.stations.get(station.station_id)
+        state.version = previous.version + 1 if previous else 1
+        self.stations[station.station_id] = state
+        return state
+
+    def replace_slots(self, station_id: int, slots: Iterable[Tuple[int, Tuple]]) -> None:
+        """Инвентарь: слоты станции целиком {slot_number: (powerbank_id, level, voltage, temperature)}"""
+        state = self.stations.get(station_id)
+        if state is None:
+            return
+        moscow_time = get_moscow_time()
+        state.slots = {
+            slot_number: SlotState(slot_number, powerbank_id, level, voltage, temperature, moscow_time)
+            for slot_number, (powerbank_id, level, voltage, temperature) in slots
+        }
+        state.version += 1
+
+    def touch(self, station_id: int) -> bool:
+        """heartbeat: last_seen в памяти, в БД - при следующей записи пачкой"""
+        state = self.stations.get(station_id)
+        if state is None:
+            return False
+        state.last_seen = get_moscow_time()
+        self._pending_last_seen[station_id] = state.last_seen
+        return True
+
+    def update_station(self, station_id: int, **fields) -> None:
+        state = self.stations.get(station_id)
+        if state is None:
+            return
+        for name, value in fields.items():
+            setattr(state, name, value)
+        if set(fields) != {'last_seen'}:
+            state.version += 1
+        if 'last_seen' in fields:
+            # Значение уже записано в БД вызывающим
+            self._pending_last_seen.pop(station_id, None)
+
+    def set_slot(self, station_id: int, slot: SlotState) -> None:
+        state = self.stations.get(station_id)
+        if state is None:
+            return
+        state.slots[slot.slot_number] = slot
+        state.version += 1
+
+    def update_slot(self, station_id: int, slot_number: int, **fields) -> None:
+        state = self.stations.get(station_id)
+        slot = state.slots.get(slot_number) if state else None
+        if slot is None:
+            return
+        for name, value in fields.items():
+            if value is not None:
+                setattr(slot, name, int(value))
+        slot.last_update = get_moscow_time()
+        state.version += 1
+
+    def remove_slots(self, station_id: int, slot_numbers: Optional[Iterable[int]] = None,
+                     powerbank_id: Optional[int] = None) -> None:
+        """Удаляет слоты (все, если не указаны) или слот с повербанком"""
+        state = self.stations.get(station_id)
+        if state is None:
+            return
+        if slot_numbers is None and powerbank_id is None:
+            state.slots.clear()
+        elif powerbank_id is not None:
+            for slot_number in [n for n, slot in state.slots.items() if slot.powerbank_id == powerbank_id]:
+                del state.slots[slot_number]
+        else:
+            for slot_number in slot_numbers:
+                state.slots.pop(slot_number, None)
+        state.version += 1
+
+    async def reload_slots(self, db_pool, station_id: int) -> None:
+        """Перечитывает слоты станции из БД (после записей, результат которых зависит от ключей таблицы)"""
+        if station_id not in self.stations:
+            return
+        from models.station_powerbank import StationPowerbank
+        records = await StationPowerbank.get_by_station(db_pool, station_id)
+        state = self.stations.get(station_id)
+        if state is None:
+            return
+        state.slots = {
+            record.slot_number: SlotState(record.slot_number, record.powerbank_id, record.level,
+                                          record.voltage, record.temperature, record.last_update)
+            for record in records
+        }
+        state.version += 1
+
+    # --- запись last_seen ---
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает накопленные last_seen одним UPDATE на пачку станций"""
+        if not self._pending_last_seen or not self._db_pool or self._db_pool._closed:
+            return
+        pending, self._pending_last_seen = self._pending_last_seen, {}
+        items = list(pending.items())
+        batch_size = FLEET_STATE_CONFIG['flush_batch']
+        try:
+            async with self._db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    for start in range(0, len(items), batch_size):
+                        batch = items[start:start + batch_size]
+                        cases = ' '.join(['WHEN %s THEN %s'] * len(batch))
+                        placeholders = ','.join(['%s'] * len(batch))
+                        params = []
+                        for station_id, last_seen in batch:
+                            params.extend([station_id, last_seen])
+                        params.append(get_moscow_time())
+                        params.extend(station_id for station_id, _ in batch)
+                        await cur.execute(f"""
+                            UPDATE station
+                            SET last_seen = CASE station_id {cases} END, updated_at = %s
+                            WHERE station_id IN ({placeholders})
+                        """, params)
+            self.flushed_total += len(items)
+        except Exception as e:
+            # Не записанные значения вернутся в следующую пачку, если станция не прислала новее
+            for station_id, last_seen in pending.items():
+                self._pending_last_seen.setdefault(station_id, last_seen)
+            self.logger.error(f"Ошибка записи last_seen {len(items)} станций: {e}")
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending_last_seen)
+
+
+# Состояние станций процесса
+fleet_state = FleetState()
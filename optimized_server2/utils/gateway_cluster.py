@@ -0,0 +1,603 @@
+"""
+Многопроцессный режим TCP шлюза станций
+
+Мастер-процесс держит справочник station_id -> worker_id (GatewayDirectory),
+воркеры принимают станции на общих портах (reuse_port) и регистрируют их в справочнике.
+Команды из HTTP попадают на воркер, который держит сокет станции, через Unix сокеты.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from models.connection import StationConnection
+from utils.command_rpc import COMMAND_RESPONSE_PARSERS
+from utils.gateway_ipc import IPCServer, IPCClient, IPCError
+from utils.runtime_metrics import runtime_metrics
+from utils.loop_watchdog import loop_watchdog
+from utils.centralized_logger import get_logger
+from utils.fleet_state import fleet_state
+from utils.user_notification_manager import user_notification_manager
+
+
+# Кэшированные ответы станций, которые API читают из соединения
+MIRRORED_CONNECTION_ATTRIBUTES = ('inventory_cache', 'voice_volume_data', 'server_address_data')
+
+# Методы обработчиков, ожидающие ответа станции: выполняются на воркере, где открыт ее сокет.
+# handler -> {method: позиция station_id в аргументах}
+ROUTED_HANDLER_METHODS = {
+    'borrow_handler': {'send_borrow_request_and_wait': 0},
+    'return_handler': {'handle_error_return_request': 1},
+    'query_voice_volume_handler': {'send_voice_volume_request': 0},
+    'query_server_address_handler': {'send_query_server_address_request': 0},
+    'restart_cabinet_handler': {'send_restart_command': 0},
+    'query_iccid_handler': {'send_query_iccid_command': 0},
+    'query_inventory_handler': {'send_inventory_request': 0},
+    'set_voice_volume_handler': {'send_set_voice_volume_request': 0},
+    'set_server_address_handler': {'send_set_server_address_request': 0},
+}
+
+
+def coordinator_socket_path(socket_dir: str) -> str:
+    """Путь к сокету справочника станций"""
+    return os.path.join(socket_dir, 'coordinator.sock')
+
+
+def worker_socket_path(socket_dir: str, worker_id: int) -> str:
+    """Путь к сокету воркера"""
+    return os.path.join(socket_dir, f'worker-{worker_id}.sock')
+
+
+def connection_state(connection: StationConnection, worker_id: int) -> Dict[str, Any]:
+    """Снимок соединения станции для справочника и зеркал в других процессах"""
+    state = {
+        'station_id': connection.station_id,
+        'box_id': connection.box_id,
+        'worker_id': worker_id,
+        'fd': connection.fd,
+        'addr': list(connection.addr) if connection.addr else None,
+        'station_status': connection.station_status,
+        'last_heartbeat': connection.last_heartbeat,
+        'connected_at': connection.connected_at,
+    }
+    for attribute in MIRRORED_CONNECTION_ATTRIBUTES:
+        state[attribute] = getattr(connection, attribute, None)
+    # Слоты и поля станции для HTTP чтений в других процессах
+    record = fleet_state.get(connection.station_id)
+    state['fleet_state'] = record.to_dict() if record is not None else None
+    return state
+
+
+class GatewayDirectory:
+    """Справочник станций кластера (работает в мастер-процессе)"""
+
+    def __init__(self, socket_dir: str):
+        self.socket_dir = socket_dir
+        self.stations: Dict[int, Dict[str, Any]] = {}
+        self.worker_clients: Dict[int, IPCClient] = {}
+        self.workers = set()
+        self.logger = get_logger('gateway_directory')
+        self.server = IPCServer(coordinator_socket_path(socket_dir), {
+            'register': self.register,
+            'unregister': self.unregister,
+            'sync_state': self.sync_state,
+            'worker_reset': self.worker_reset,
+            'lookup': self.lookup,
+            'snapshot': self.snapshot,
+            'workers': self.list_workers,
+            'user_notification': self.user_notification,
+        }, name='gateway_directory')
+
+    async def start(self) -> None:
+        await self.server.start()
+
+    async def stop(self) -> None:
+        for client in self.worker_clients.values():
+            await client.close()
+        await self.server.stop()
+
+    def _worker_client(self, worker_id: int) -> IPCClient:
+        if worker_id not in self.worker_clients:
+            self.worker_clients[worker_id] = IPCClient(
+                worker_socket_path(self.socket_dir, worker_id), name='gateway_directory'
+            )
+        return self.worker_clients[worker_id]
+
+    async def register(self, worker_id: int, state: Dict[str, Any]) -> bool:
+        """Станция залогинилась на воркере"""
+        station_id = int(state['station_id'])
+        previous = self.stations.get(station_id)
+        self.stations[station_id] = state
+        self.server.broadcast('upsert', [state])
+
+        # Станция переподключилась на другой воркер - старый сокет больше не нужен
+        if previous and previous['worker_id'] != worker_id:
+            self.logger.info(f"Станция {station_id} перешла с воркера {previous['worker_id']} на {worker_id}")
+            try:
+                await self._worker_client(previous['worker_id']).call(
+                    'close_station', {'station_id': station_id, 'fd': previous.get('fd')}, timeout=5.0
+                )
+            except Exception as e:
+                self.logger.error(f"Не удалось закрыть старое соединение станции {station_id}: {e}")
+        return True
+
+    async def unregister(self, worker_id: int, station_id: int) -> bool:
+        """Станция отключилась от воркера"""
+        current = self.stations.get(station_id)
+        if not current or current['worker_id'] != worker_id:
+            return False
+        del self.stations[station_id]
+        self.server.broadcast('remove', [station_id])
+        return True
+
+    async def sync_state(self, worker_id: int, states: List[Dict[str, Any]]) -> int:
+        """Обновляет heartbeat и кэшированные ответы станций воркера"""
+        updated = []
+        for state in states:
+            station_id = int(state['station_id'])
+            current = self.stations.get(station_id)
+            if current is None or current['worker_id'] == worker_id:
+                self.stations[station_id] = state
+                updated.append(state)
+        if updated:
+            self.server.broadcast('upsert', updated)
+        return len(updated)
+
+    async def worker_reset(self, worker_id: int, states: Optional[List[Dict[str, Any]]] = None) -> int:
+        """Заменяет все записи воркера (запуск или восстановление связи с справочником)"""
+        self.workers.add(worker_id)
+        removed = [sid for sid, state in self.stations.items() if state['worker_id'] == worker_id]
+        for station_id in removed:
+            del self.stations[station_id]
+        if removed:
+            self.server.broadcast('remove', removed)
+        for state in states or []:
+            self.stations[int(state['station_id'])] = state
+        if states:
+            self.server.broadcast('upsert', states)
+        return len(states or [])
+
+    async def lookup(self, station_id: int) -> Optional[int]:
+        """Возвращает worker_id станции"""
+        state = self.stations.get(station_id)
+        return state['worker_id'] if state else None
+
+    async def snapshot(self) -> List[Dict[str, Any]]:
+        """Возвращает все подключенные станции кластера"""
+        return list(self.stations.values())
+
+    async def list_workers(self) -> List[int]:
+        """Воркеры, подключавшиеся к справочнику"""
+        return sorted(self.workers)
+
+    async def user_notification(self, user_id: int, notification_type: str, data: Dict[str, Any]) -> int:
+        """Уведомление пользователя от воркера: рассылается HTTP процессам, где открыты WebSocket"""
+        self.server.broadcast('user_notification', {'user_id': user_id, 'type': notification_type, 'data': data})
+        return len(self.server.subscribers)
+
+
+class GatewayWorkerNode:
+    """Связь воркера шлюза с кластером: регистрация станций и прием команд"""
+
+    def __init__(self, server, worker_id: int, socket_dir: str, state_sync_interval: float = 1.0):
+        self.gateway = server
+        self.worker_id = worker_id
+        self.socket_dir = socket_dir
+        self.state_sync_interval = state_sync_interval
+        self.connection_manager = server.connection_manager
+        self.logger = get_logger('gateway_worker')
+        self.coordinator = IPCClient(coordinator_socket_path(socket_dir), name='gateway_worker')
+        self.server = IPCServer(worker_socket_path(socket_dir, worker_id), {
+            'call_handler': self.call_handler,
+            'write': self.write,
+            'close_station': self.close_station,
+            'metrics': self.metrics,
+            'loop_stalls': self.loop_stalls,
+        }, name='gateway_worker')
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._signatures: Dict[int, tuple] = {}
+        self._resync = True
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        await self.server.start()
+        self.connection_manager.add_listener(self._on_connection_event)
+        user_notification_manager.forwarder = self.forward_notification
+        self._tasks.append(asyncio.create_task(self._event_sender()))
+        self._tasks.append(asyncio.create_task(self._state_sync_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        user_notification_manager.forwarder = None
+        await self.coordinator.close()
+        await self.server.stop()
+
+    async def forward_notification(self, user_id: int, notification_type: str, data: Dict[str, Any]) -> bool:
+        """Передает уведомление пользователя через справочник в HTTP процессы"""
+        try:
+            subscribers = await self.coordinator.call('user_notification', {
+                'user_id': user_id, 'notification_type': notification_type, 'data': data
+            }, timeout=5.0)
+            return subscribers > 0
+        except Exception as e:
+            self.logger.error(f"Не удалось передать уведомление пользователю {user_id}: {e}")
+            return False
+
+    def _local_connection(self, station_id: int) -> Optional[StationConnection]:
+        return self.connection_manager.get_connection_by_station_id(station_id)
+
+    def _on_connection_event(self, event: str, connection: StationConnection) -> None:
+        self._events.put_nowait((event, connection))
+
+    async def _event_sender(self) -> None:
+        """Передает логины/отключения в справочник в порядке их возникновения"""
+        while True:
+            event, connection = await self._events.get()
+            try:
+                if self._resync:
+                    continue  # полная синхронизация отправит актуальное состояние
+                station_id = connection.station_id
+                if event == 'login':
+                    state = connection_state(connection, self.worker_id)
+                    self._signatures[station_id] = self._signature(connection)
+                    await self.coordinator.call('register', {'worker_id': self.worker_id, 'state': state})
+                elif event == 'disconnect':
+                    # Станция могла уже переподключиться на этом же воркере
+                    if self._local_connection(station_id):
+                        continue
+                    self._signatures.pop(station_id, None)
+                    await self.coordinator.call('unregister', {'worker_id': self.worker_id, 'station_id': station_id})
+            except Exception as e:
+                self.logger.error(f"Ошибка передачи события {event} в справочник: {e}")
+                self._resync = True
+
+    def _signature(self, connection: StationConnection) -> tuple:
+        record = fleet_state.get(connection.station_id)
+        return (connection.last_heartbeat, connection.station_status,
+                record.version if record is not None else None) + tuple(
+            id(getattr(connection, attribute, None)) for attribute in MIRRORED_CONNECTION_ATTRIBUTES
+        )
+
+    def _logged_in_connections(self) -> Dict[int, StationConnection]:
+        return {
+            conn.station_id: conn
+            for conn in self.connection_manager.get_all_connections().values()
+            if conn.station_id and conn.secret_key
+        }
+
+    async def _state_sync_loop(self) -> None:
+        """Периодически отправляет изменившиеся heartbeat и кэшированные ответы станций"""
+        while True:
+            try:
+                connections = self._logged_in_connections()
+                if self._resync:
+                    states = [connection_state(conn, self.worker_id) for conn in connections.values()]
+                    await self.coordinator.call('worker_reset', {'worker_id': self.worker_id, 'states': states})
+                    self._signatures = {sid: self._signature(conn) for sid, conn in connections.items()}
+                    self._resync = False
+                else:
+                    changed = []
+                    for station_id, conn in connections.items():
+                        signature = self._signature(conn)
+                        if self._signatures.get(station_id) != signature:
+                            self._signatures[station_id] = signature
+                            changed.append(connection_state(conn, self.worker_id))
+                    if changed:
+                        await self.coordinator.call('sync_state', {'worker_id': self.worker_id, 'states': changed})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self._resync:
+                    self.logger.error(f"Ошибка синхронизации состояния станций: {e}")
+                self._resync = True
+            await asyncio.sleep(self.state_sync_interval)
+
+    async def call_handler(self, station_id: int, handler: str, method: str,
+                           args: list = None, kwargs: dict = None) -> Any:
+        """Выполняет метод обработчика на этом воркере (разрешены только ROUTED_HANDLER_METHODS)"""
+        if method not in ROUTED_HANDLER_METHODS.get(handler, {}):
+            raise IPCError(f"Метод {handler}.{method} не разрешен для удаленного вызова")
+        target = getattr(self.gateway, handler)
+        return await getattr(target, method)(*(args or []), **(kwargs or {}))
+
+    async def write(self, station_id: int, data: str) -> bool:
+        """Ставит пакет в очередь команд станции (data - hex строка), ответа не ждет"""
+        connection = self._local_connection(station_id)
+        if not connection or not connection.writer or connection.writer.is_closing():
+            return False
+        packet = bytes.fromhex(data)
+        if packet[2] in COMMAND_RESPONSE_PARSERS:
+            connection.enqueue_command(packet)
+        else:
+            connection.writer.write(packet)
+            await connection.writer.drain()
+        return True
+
+    async def close_station(self, station_id: int, fd: Optional[int] = None) -> int:
+        """Закрывает соединения станции на этом воркере"""
+        if fd is not None:
+            connection = self.connection_manager.get_connection(fd)
+            if connection and connection.station_id == station_id:
+                self.connection_manager.close_connection(fd)
+                return 1
+            return 0
+        return self.connection_manager.close_station_connections(station_id)
+
+    async def metrics(self) -> Dict[str, Any]:
+        """Снимок метрик процесса воркера"""
+        return runtime_metrics.snapshot()
+
+    async def loop_stalls(self, limit: int = 20) -> Dict[str, Any]:
+        """Блокировки цикла событий воркера"""
+        return {'process': runtime_metrics.process_name, **loop_watchdog.get_stats(limit)}
+
+
+class StationStateMirror:
+    """
+    Локальная копия справочника станций, обновляемая событиями координатора.
+    Ключи станций по IPC не передаются: зеркало читает их из station_secret_key
+    при появлении станции и забывает при ее отключении. Уведомления пользователей
+    от воркеров шлюза доставляются в WebSocket этого процесса
+    """
+
+    def __init__(self, socket_dir: str, db_pool=None, queue_notifications: bool = True,
+                 reconnect_interval: float = 1.0):
+        self.socket_dir = socket_dir
+        self.db_pool = db_pool
+        # Уведомление неподключенному пользователю сохраняет только один HTTP процесс
+        self.queue_notifications = queue_notifications
+        self.reconnect_interval = reconnect_interval
+        self.stations: Dict[int, Dict[str, Any]] = {}
+        self.secret_keys: Dict[int, str] = {}
+        self._keys_pending = set()
+        self.logger = get_logger('gateway_mirror')
+        self.client = IPCClient(coordinator_socket_path(socket_dir), on_event=self._on_event, name='gateway_mirror')
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        await self.client.close()
+
+    def get(self, station_id: int) -> Optional[Dict[str, Any]]:
+        return self.stations.get(station_id)
+
+    def secret_key(self, station_id: int) -> Optional[str]:
+        return self.secret_keys.get(station_id)
+
+    def _load_keys(self, station_ids) -> None:
+        missing = [station_id for station_id in station_ids
+                   if station_id not in self.secret_keys and station_id not in self._keys_pending]
+        if missing and self.db_pool is not None:
+            self._keys_pending.update(missing)
+            asyncio.create_task(self._fetch_keys(missing))
+
+    async def _fetch_keys(self, station_ids: List[int]) -> None:
+        try:
+            async with self.db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(f"""
+                        SELECT station_id, key_value FROM station_secret_key
+                        WHERE station_id IN ({','.join(['%s'] * len(station_ids))})
+                    """, station_ids)
+                    for station_id, key_value in await cur.fetchall():
+                        # Станция могла отключиться, пока шел запрос
+                        if int(station_id) in self.stations:
+                            self.secret_keys[int(station_id)] = key_value
+        except Exception as e:
+            self.logger.error(f"Ошибка загрузки ключей {len(station_ids)} станций: {e}")
+        finally:
+            self._keys_pending.difference_update(station_ids)
+
+    async def list_workers(self) -> List[int]:
+        """Воркеры шлюза, известные справочнику"""
+        return await self.client.call('workers', timeout=5.0)
+
+    def _on_event(self, event: str, data: Any) -> None:
+        if event == 'upsert':
+            for state in data:
+                self.stations[int(state['station_id'])] = state
+            self._load_keys(int(state['station_id']) for state in data)
+        elif event == 'remove':
+            for station_id in data:
+                self.stations.pop(int(station_id), None)
+                self.secret_keys.pop(int(station_id), None)
+        elif event == 'user_notification':
+            asyncio.create_task(user_notification_manager.deliver(
+                int(data['user_id']), data['type'], data['data'], queue=self.queue_notifications
+            ))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.client.connect()
+                await self.client.subscribe()
+                snapshot = await self.client.call('snapshot')
+                self.stations = {int(state['station_id']): state for state in snapshot}
+                self.secret_keys = {station_id: key for station_id, key in self.secret_keys.items()
+                                    if station_id in self.stations}
+                self._load_keys(self.stations)
+                await self.client.wait_closed()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Нет связи со справочником станций: {e}")
+            await asyncio.sleep(self.reconnect_interval)
+
+
+class StationCommandRouter:
+    """Отправляет команды на воркер, который держит сокет станции"""
+
+    def __init__(self, socket_dir: str, call_timeout: float = 60.0):
+        self.socket_dir = socket_dir
+        self.call_timeout = call_timeout
+        self.clients: Dict[int, IPCClient] = {}
+
+    def _client(self, worker_id: int) -> IPCClient:
+        if worker_id not in self.clients:
+            self.clients[worker_id] = IPCClient(worker_socket_path(self.socket_dir, worker_id), name='gateway_router')
+        return self.clients[worker_id]
+
+    async def write(self, worker_id: int, station_id: int, data: bytes) -> bool:
+        return await self._client(worker_id).call(
+            'write', {'station_id': station_id, 'data': data.hex()}, timeout=10.0
+        )
+
+    async def close_station(self, worker_id: int, station_id: int, fd: Optional[int] = None) -> int:
+        return await self._client(worker_id).call(
+            'close_station', {'station_id': station_id, 'fd': fd}, timeout=5.0
+        )
+
+    async def call_handler(self, worker_id: int, station_id: int, handler: str, method: str, *args, **kwargs) -> Any:
+        return await self._client(worker_id).call('call_handler', {
+            'station_id': station_id, 'handler': handler, 'method': method,
+            'args': list(args), 'kwargs': kwargs
+        }, timeout=self.call_timeout)
+
+    async def call_worker(self, worker_id: int, method: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Служебный вызов воркера (метрики, блокировки цикла)"""
+        return await self._client(worker_id).call(method, params, timeout=5.0)
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
+
+
+async def collect_from_workers(mirror: StationStateMirror, router: StationCommandRouter,
+                               method: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Ответы служебного метода от всех доступных воркеров шлюза"""
+    worker_ids = await mirror.list_workers()
+    results = await asyncio.gather(
+        *(router.call_worker(worker_id, method, params) for worker_id in worker_ids), return_exceptions=True
+    )
+    return [result for result in results if isinstance(result, dict)]
+
+
+class RemoteStationWriter:
+    """Writer станции на другом воркере: write() буферизует, drain() отправляет через IPC"""
+
+    def __init__(self, router: StationCommandRouter, worker_id: int, station_id: int):
+        self.router = router
+        self.worker_id = worker_id
+        self.station_id = station_id
+        self._buffer = bytearray()
+        self._closing = False
+
+    def write(self, data: bytes) -> None:
+        self._buffer.extend(data)
+
+    async def drain(self) -> None:
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        if not await self.router.write(self.worker_id, self.station_id, data):
+            raise ConnectionError(f"Станция {self.station_id} недоступна на воркере {self.worker_id}")
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        self._closing = True
+        asyncio.create_task(self.router.close_station(self.worker_id, self.station_id))
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+class RemoteStationConnection:
+    """Соединение станции, открытое на другом воркере (снимок из справочника)"""
+
+    is_remote = True
+
+    def __init__(self, state: Dict[str, Any], router: StationCommandRouter, secret_key: Optional[str] = None):
+        self.worker_id = state['worker_id']
+        self.fd = state.get('fd')
+        self.addr = tuple(state['addr']) if state.get('addr') else None
+        self.box_id = state.get('box_id')
+        self.station_id = int(state['station_id'])
+        self.secret_key = secret_key
+        self.station_status = state.get('station_status')
+        self.last_heartbeat = self._parse_time(state.get('last_heartbeat'))
+        self.last_seen = self.last_heartbeat
+        self.connected_at = self._parse_time(state.get('connected_at'))
+        for attribute in MIRRORED_CONNECTION_ATTRIBUTES:
+            setattr(self, attribute, state.get(attribute))
+        self.fleet_state = state.get('fleet_state')
+        self.router = router
+        self.writer = RemoteStationWriter(router, self.worker_id, self.station_id)
+
+    @staticmethod
+    def _parse_time(value) -> Optional[datetime]:
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+
+    def enqueue_command(self, packet: bytes, *args, **kwargs) -> asyncio.Future:
+        """Ставит команду в очередь станции на ее воркере; future - факт постановки, не ответ станции"""
+        future = asyncio.ensure_future(self.router.write(self.worker_id, self.station_id, packet))
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return future
+
+    async def call_handler(self, handler: str, method: str, *args, **kwargs) -> Any:
+        """Выполняет метод обработчика на воркере станции"""
+        return await self.router.call_handler(self.worker_id, self.station_id, handler, method, *args, **kwargs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fd": self.fd,
+            "addr": self.addr,
+            "boxid": self.box_id,
+            "station_id": self.station_id,
+            "worker_id": self.worker_id,
+            "last_heartbeat": self.last_heartbeat.isoformat() if self.last_heartbeat else None,
+            "station_status": self.station_status
+        }
+
+
+class ClusterConnectionManager:
+    """
+    ConnectionManager для процессов с HTTP API в кластере:
+    локальные соединения отдаются как есть, станции других воркеров - через RemoteStationConnection
+    """
+
+    def __init__(self, local_manager, mirror: StationStateMirror, router: StationCommandRouter):
+        self.local = local_manager
+        self.mirror = mirror
+        self.router = router
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+    def get_connection_by_station_id(self, station_id: int):
+        connection = self.local.get_connection_by_station_id(station_id) if self.local else None
+        if connection:
+            return connection
+        state = self.mirror.get(station_id)
+        return RemoteStationConnection(state, self.router, self.mirror.secret_key(station_id)) if state else None
+
+    def get_connections_by_station_id(self, station_id: int) -> list:
+        connection = self.get_connection_by_station_id(station_id)
+        return [connection] if connection else []
+
+    def get_all_connections(self) -> dict:
+        connections = dict(self.local.get_all_connections()) if self.local else {}
+        local_station_ids = {conn.station_id for conn in connections.values() if conn.station_id}
+        for station_id, state in self.mirror.stations.items():
+            if station_id not in local_station_ids:
+                connections[f"{state['worker_id']}:{state.get('fd')}"] = RemoteStationConnection(
+                    state, self.router, self.mirror.secret_key(station_id)
+                )
+        return connections
+
+    def close_station_connections(self, station_id: int) -> int:
+        closed = self.local.close_station_connections(station_id) if self.local else 0
+        state = self.mirror.get(station_id)
+        if not closed and state:
+            asyncio.create_task(self.router.close_station(state['worker_id'], station_id))
+            closed = 1
+        return closed
@@ -0,0 +1,237 @@
+"""
+Локальный RPC между процессами сервера через Unix сокеты
+
+Формат: одна JSON строка на сообщение.
+Запрос:  {"id": 1, "method": "name", "params": {...}}
+Ответ:   {"id": 1, "result": ...} или {"id": 1, "error": "..."}
+Событие: {"event": "name", "data": ...} - сервер рассылает подписчикам
+"""
+import asyncio
+import itertools
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from utils.json_utils import serialize_for_json
+from utils.centralized_logger import get_logger
+
+
+# Предел длины одной строки (ответы инвентаря и снимки состояния станций)
+IPC_STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class IPCError(Exception):
+    """Ошибка выполнения удаленного вызова"""
+
+
+def ensure_private_dir(path: str) -> None:
+    """
+    Каталог сокетов доступен только пользователю сервера (0700): сокеты без
+    аутентификации, любой подключившийся может слать команды станциям
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid') and os.stat(path).st_uid != os.getuid():
+        raise PermissionError(f"Каталог сокетов {path} принадлежит другому пользователю")
+    os.chmod(path, 0o700)
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(serialize_for_json(message), ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class IPCServer:
+    """RPC сервер на Unix сокете: method -> async def handler(**params)"""
+
+    def __init__(self, path: str, methods: Dict[str, Callable[..., Awaitable[Any]]], name: str = 'ipc'):
+        self.path = path
+        self.methods = methods
+        self.logger = get_logger(f'{name}_server')
+        self.subscribers: Set[asyncio.StreamWriter] = set()
+        self.clients: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """Запускает сервер, удаляя оставшийся от прошлого запуска файл сокета"""
+        ensure_private_dir(os.path.dirname(self.path))
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_client, self.path, limit=IPC_STREAM_LIMIT)
+        os.chmod(self.path, 0o600)
+
+    async def stop(self) -> None:
+        """Останавливает сервер"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self.clients):
+            writer.close()
+        self.clients.clear()
+        self.subscribers.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def broadcast(self, event: str, data: Any) -> None:
+        """Рассылает событие всем подписчикам (клиентам, вызвавшим subscribe)"""
+        if not self.subscribers:
+            return
+        message = _encode({'event': event, 'data': data})
+        for writer in list(self.subscribers):
+            if writer.is_closing():
+                self.subscribers.discard(writer)
+                continue
+            writer.write(message)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    self.logger.error(f"Некорректное IPC сообщение: {e}")
+                    continue
+
+                # Каждый запрос выполняется отдельно: долгие вызовы (выдача ждет ответа станции)
+                # не блокируют остальные запросы этого клиента
+                task = asyncio.create_task(self._dispatch(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionResetError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            self.subscribers.discard(writer)
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _dispatch(self, request: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        request_id = request.get('id')
+        method_name = request.get('method')
+        try:
+            if method_name == 'subscribe':
+                self.subscribers.add(writer)
+                response = {'id': request_id, 'result': True}
+            else:
+                method = self.methods.get(method_name)
+                if method is None:
+                    raise IPCError(f"Неизвестный метод: {method_name}")
+                result = await method(**(request.get('params') or {}))
+                response = {'id': request_id, 'result': result}
+        except Exception as e:
+            self.logger.error(f"Ошибка IPC вызова {method_name}: {e}")
+            response = {'id': request_id, 'error': str(e)}
+
+        if request_id is not None and not writer.is_closing():
+            writer.write(_encode(response))
+            try:
+                await writer.drain()
+            except (ConnectionResetError, BrokenPipeError):
+                pass
+
+
+class IPCClient:
+    """RPC клиент с постоянным соединением и мультиплексированием запросов"""
+
+    def __init__(self, path: str, on_event: Optional[Callable[[str, Any], None]] = None, name: str = 'ipc'):
+        self.path = path
+        self.on_event = on_event
+        self.logger = get_logger(f'{name}_client')
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        """Подключается к серверу, если соединения еще нет"""
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=IPC_STREAM_LIMIT)
+            self._read_task = asyncio.create_task(self._read_loop())
+
+    async def close(self) -> None:
+        """Закрывает соединение"""
+        if self._writer:
+            self._writer.close()
+        if self._read_task:
+            self._read_task.cancel()
+        self._fail_pending(ConnectionError("IPC соединение закрыто"))
+
+    async def wait_closed(self) -> None:
+        """Ждет разрыва соединения"""
+        if self._read_task:
+            await asyncio.shield(self._read_task)
+
+    async def call(self, method: str, params: Optional[Dict[str, Any]] = None,
+                   timeout: Optional[float] = 30.0) -> Any:
+        """Вызывает метод на сервере и ждет результат"""
+        await self.connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(_encode({'id': request_id, 'method': method, 'params': params or {}}))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def notify(self, method: str, params: Optional[Dict[str, Any]] = None) -> None:
+        """Отправляет вызов без ожидания ответа"""
+        await self.connect()
+        self._writer.write(_encode({'method': method, 'params': params or {}}))
+        await self._writer.drain()
+
+    async def subscribe(self) -> None:
+        """Подписывается на события сервера (обрабатываются on_event)"""
+        await self.call('subscribe')
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if 'event' in message:
+                    if self.on_event:
+                        try:
+                            self.on_event(message['event'], message.get('data'))
+                        except Exception as e:
+                            self.logger.error(f"Ошибка обработки IPC события {message['event']}: {e}")
+                    continue
+
+                future = self._pending.get(message.get('id'))
+                if future is None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(IPCError(message['error']))
+                else:
+                    future.set_result(message.get('result'))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Ошибка чтения IPC {self.path}: {e}")
+        finally:
+            if self._writer:
+                self._writer.close()
+            self._writer = None
+            self._fail_pending(ConnectionError(f"IPC соединение {self.path} разорвано"))
+
+    def _fail_pending(self, error: Exception) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
@@ -0,0 +1,301 @@
+"""
+Фоновая очистка давно удаленных записей (жесткое удаление)
+
+Задание удаляет строки одной таблицы, удаленные (deleted_at) раньше даты
+отсечки, частями по chunk_size строк в порядке первичного ключа, с паузой
+pause секунд между частями, чтобы не держать долгие блокировки на orders или
+powerbank. Прогресс (последний удаленный ключ, счетчики) хранится в
+hard_delete_jobs после каждой части. Задание создает любой HTTP процесс, а
+выполняет один исполнитель (HTTP процесс 0 или процесс с HTTP API): он раз в
+poll_interval секунд забирает задания в статусе running, в том числе
+прерванные перезапуском, и продолжает их с места остановки. Отмена пишет
+статус cancelling, исполнитель останавливает задание после текущей части.
+
+Строки, которые нельзя удалить из-за внешних ключей (например, подразделение
+со станциями), пропускаются и считаются в skipped.
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import aiomysql
+
+from config.settings import HARD_DELETE_CLEANUP_CONFIG
+from utils.centralized_logger import get_logger
+
+
+# entity_type -> (таблица, первичный ключ, условие "давно удалена")
+CLEANUP_TABLES = {
+    'user': ('app_user', 'user_id', 'deleted_at < %s'),
+    'station': ('station', 'station_id', 'deleted_at < %s'),
+    # Повербанки удаляются мягко через power_er = 5
+    'powerbank': ('powerbank', 'id', "power_er = 5 AND status = 'system_error' AND deleted_at < %s"),
+    'org_unit': ('org_unit', 'org_unit_id', 'deleted_at < %s'),
+    'order': ('orders', 'id', 'deleted_at < %s'),
+    'user_role': ('user_role', 'id', 'deleted_at < %s'),
+    'user_favorites': ('user_favorites', 'id', 'deleted_at < %s'),
+}
+
+# Зависимые строки без каскадного удаления по внешнему ключу; условие "давно удалена"
+# проверяется по родительской строке, как и в основном DELETE
+DEPENDENT_DELETES = {
+    'station': ("""
+        DELETE k FROM station_secret_key k
+        JOIN station s ON s.station_id = k.station_id
+        WHERE s.station_id IN ({ids}) AND s.deleted_at < %s
+    """,),
+}
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS hard_delete_jobs (
+        job_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        entity_type VARCHAR(32) NOT NULL,
+        cutoff DATETIME NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        total INT UNSIGNED NOT NULL DEFAULT 0,
+        deleted INT UNSIGNED NOT NULL DEFAULT 0,
+        skipped INT UNSIGNED NOT NULL DEFAULT 0,
+        last_id BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        error TEXT NULL,
+        created_by BIGINT UNSIGNED NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP NULL,
+        KEY idx_hard_delete_jobs_status (status)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+JOB_COLUMNS = ('job_id', 'entity_type', 'cutoff', 'status', 'total', 'deleted', 'skipped', 'last_id', 'error',
+               'created_by', 'created_at', 'updated_at', 'finished_at')
+
+
+def _job_dict(row) -> Dict[str, Any]:
+    job = dict(zip(JOB_COLUMNS, row))
+    for key in ('cutoff', 'created_at', 'updated_at', 'finished_at'):
+        if job[key] is not None:
+            job[key] = job[key].isoformat()
+    return job
+
+
+class HardDeleteCleanup:
+    """Задания очистки удаленных записей частями"""
+
+    def __init__(self):
+        self.logger = get_logger('hard_delete_cleanup')
+        self.db_pool = None
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+        self._table_ready = False
+
+    async def _ensure_table(self, cur) -> None:
+        if not self._table_ready:
+            await cur.execute(CREATE_TABLE_SQL)
+            self._table_ready = True
+
+    def attach(self, db_pool, executor: bool = True) -> None:
+        """Пул БД для API; executor - этот процесс выполняет задания всех процессов"""
+        self.db_pool = db_pool
+        if executor:
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        # Задания остаются в статусе running и продолжатся после запуска
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+
+    @property
+    def executor(self) -> bool:
+        return self._poll_task is not None
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                await self._pick_up()
+            except Exception as e:
+                self.logger.error(f"Ошибка выборки заданий очистки: {e}", exc_info=True)
+            await asyncio.sleep(HARD_DELETE_CLEANUP_CONFIG['poll_interval'])
+
+    async def _pick_up(self) -> None:
+        """Запускает задания, созданные другими процессами или прерванные перезапуском"""
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute("SELECT job_id, status FROM hard_delete_jobs WHERE status IN ('running', 'cancelling')")
+                jobs = await cur.fetchall()
+        for job_id, status in jobs:
+            if job_id in self.tasks:
+                continue
+            if status == 'cancelling':
+                await self._finish(job_id, 'cancelled')
+            else:
+                self.logger.info(f"Запуск очистки, задание {job_id}")
+                self._spawn(job_id)
+
+    def _spawn(self, job_id: int) -> None:
+        if job_id not in self.tasks:
+            self.tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def count_candidates(self, entity_type: str, cutoff: datetime) -> int:
+        """Число строк для очистки; COUNT по индексу deleted_at (для powerbank - power_er)"""
+        table, _, condition = CLEANUP_TABLES[entity_type]
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT COUNT(*) FROM `{table}` WHERE {condition}", (cutoff,))
+                return (await cur.fetchone())[0]
+
+    async def preview(self, entity_type: str, cutoff: datetime, limit: int = 10) -> List[Dict[str, Any]]:
+        """Первые по дате удаления строки для очистки"""
+        table, _, condition = CLEANUP_TABLES[entity_type]
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(f"SELECT * FROM `{table}` WHERE {condition} ORDER BY deleted_at LIMIT %s",
+                                  (cutoff, limit))
+                return list(await cur.fetchall())
+
+    async def start(self, entity_type: str, cutoff: datetime, created_by: Optional[int]) -> Dict[str, Any]:
+        """Создает задание или возвращает уже идущее по этой таблице; выполняет его исполнитель"""
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute(f"""
+                    SELECT {', '.join(JOB_COLUMNS)} FROM hard_delete_jobs
+                    WHERE entity_type = %s AND status IN ('running', 'cancelling')
+                """, (entity_type,))
+                running = await cur.fetchone()
+                if running:
+                    return _job_dict(running)
+        total = await self.count_candidates(entity_type, cutoff)
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    INSERT INTO hard_delete_jobs (entity_type, cutoff, status, total, created_by)
+                    VALUES (%s, %s, 'running', %s, %s)
+                """, (entity_type, cutoff, total, created_by))
+                job_id = cur.lastrowid
+        if self.executor:
+            self._spawn(job_id)
+        return await self.get(job_id)
+
+    async def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM hard_delete_jobs WHERE job_id = %s",
+                                  (job_id,))
+                row = await cur.fetchone()
+        return _job_dict(row) if row else None
+
+    async def list(self, limit: int = HARD_DELETE_CLEANUP_CONFIG['jobs_listed']) -> List[Dict[str, Any]]:
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute(f"""
+                    SELECT {', '.join(JOB_COLUMNS)} FROM hard_delete_jobs
+                    ORDER BY job_id DESC LIMIT %s
+                """, (limit,))
+                return [_job_dict(row) for row in await cur.fetchall()]
+
+    async def cancel(self, job_id: int) -> bool:
+        """Просит задание остановиться после текущей части; False - задание не выполняется"""
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute("""
+                    UPDATE hard_delete_jobs SET status = 'cancelling'
+                    WHERE job_id = %s AND status = 'running'
+                """, (job_id,))
+                return cur.rowcount > 0
+
+    async def _run(self, job_id: int) -> None:
+        try:
+            await self._process(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Ошибка задания очистки {job_id}: {e}", exc_info=True)
+            await self._finish(job_id, 'failed', str(e))
+        finally:
+            self.tasks.pop(job_id, None)
+
+    async def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    UPDATE hard_delete_jobs SET status = %s, error = %s, finished_at = NOW()
+                    WHERE job_id = %s
+                """, (status, error, job_id))
+
+    async def _process(self, job_id: int) -> None:
+        job = await self.get(job_id)
+        table, pk, condition = CLEANUP_TABLES[job['entity_type']]
+        cutoff = datetime.fromisoformat(job['cutoff'])
+        last_id = job['last_id']
+        chunk_size = HARD_DELETE_CLEANUP_CONFIG['chunk_size']
+        while True:
+            async with self.db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT status FROM hard_delete_jobs WHERE job_id = %s", (job_id,))
+                    if (await cur.fetchone())[0] != 'running':
+                        break
+                    await cur.execute(f"""
+                        SELECT {pk} FROM `{table}`
+                        WHERE {pk} > %s AND {condition}
+                        ORDER BY {pk}
+                        LIMIT %s
+                    """, (last_id, cutoff, chunk_size))
+                    ids = [row[0] for row in await cur.fetchall()]
+                    if not ids:
+                        break
+                    deleted, skipped = await self._delete_chunk(conn, cur, job['entity_type'], ids, cutoff)
+                    last_id = ids[-1]
+                    await cur.execute("""
+                        UPDATE hard_delete_jobs
+                        SET last_id = %s, deleted = deleted + %s, skipped = skipped + %s
+                        WHERE job_id = %s
+                    """, (last_id, deleted, skipped, job_id))
+            await asyncio.sleep(HARD_DELETE_CLEANUP_CONFIG['pause'])
+        job = await self.get(job_id)
+        job['status'] = 'cancelled' if job['status'] == 'cancelling' else 'finished'
+        await self._finish(job_id, job['status'])
+        self.logger.info(f"Очистка {job['entity_type']}, задание {job_id}: удалено {job['deleted']}, "
+                         f"пропущено {job['skipped']}, статус {job['status']}")
+
+    async def _delete_chunk(self, conn, cur, entity_type: str, ids: List[int], cutoff: datetime):
+        """Удаляет часть одной транзакцией; при ошибке внешнего ключа - по одной строке"""
+        table, pk, condition = CLEANUP_TABLES[entity_type]
+        try:
+            return await self._delete_ids(conn, cur, entity_type, ids, cutoff), 0
+        except aiomysql.IntegrityError:
+            deleted = 0
+            for record_id in ids:
+                try:
+                    deleted += await self._delete_ids(conn, cur, entity_type, [record_id], cutoff)
+                except aiomysql.IntegrityError as e:
+                    self.logger.warning(f"{table}.{pk} = {record_id} не удален: {e}")
+            return deleted, len(ids) - deleted
+
+    @staticmethod
+    async def _delete_ids(conn, cur, entity_type: str, ids: List[int], cutoff: datetime) -> int:
+        table, pk, condition = CLEANUP_TABLES[entity_type]
+        placeholders = ','.join(['%s'] * len(ids))
+        await conn.begin()
+        try:
+            # Условие повторяется: строку могли восстановить после выборки
+            for sql in DEPENDENT_DELETES.get(entity_type, ()):
+                await cur.execute(sql.format(ids=placeholders), ids + [cutoff])
+            await cur.execute(f"DELETE FROM `{table}` WHERE {pk} IN ({placeholders}) AND {condition}",
+                              ids + [cutoff])
+            deleted = cur.rowcount
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+        return deleted
+
+
+# Задания очистки; исполнитель - процесс с HTTP API (HTTP процесс 0)
+hard_delete_cleanup = HardDeleteCleanup()
@@ -30,11 +30,10 @@ class InventoryManager:
             
             # Отправляем запрос
             if connection.writer and not connection.writer.is_closing():
-                connection.writer.write(inventory_request)
-                await connection.writer.drain()
+                reply = connection.enqueue_command(inventory_request)
                 
                 # Ждем ответ
-                await asyncio.sleep(0.5)
+                await asyncio.wait([reply], timeout=0.5)
                 
         except Exception as e:
             pass
@@ -0,0 +1,175 @@
+"""
+Периодический опрос инвентаря (0x64) подключенных станций
+
+Каждая станция опрашивается раз в period секунд со случайным разбросом jitter,
+первый опрос после логина - в случайный момент периода, чтобы массовое
+переподключение не давало волну запросов. Общий темп ограничен rate запросов
+в секунду (в многопроцессном шлюзе делится между воркерами). Станция, чей
+инвентарь пришел недавно (например, после выдачи), пропускает опрос. Станции
+с недавним отчетом об аномалии слота опрашиваются вне очереди.
+"""
+import asyncio
+import random
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config.settings import INVENTORY_POLL_CONFIG
+from models.connection import StationConnection
+from utils.centralized_logger import get_logger
+from utils.packet_utils import build_query_inventory_request
+from utils.timer_wheel import timer_wheel, WheelTimer
+
+
+class InventoryPoller:
+    """Планировщик опроса инвентаря станций процесса"""
+
+    def __init__(self, connection_manager, rate: float = INVENTORY_POLL_CONFIG['rate'],
+                 period: float = INVENTORY_POLL_CONFIG['period'], jitter: float = INVENTORY_POLL_CONFIG['jitter']):
+        self.connection_manager = connection_manager
+        self.rate = max(0.01, rate)
+        self.period = period
+        self.jitter = min(max(jitter, 0.0), 0.9)
+        self.abnormal_window = INVENTORY_POLL_CONFIG['abnormal_window']
+        self.min_interval = INVENTORY_POLL_CONFIG['min_interval']
+        self.logger = get_logger('inventory_poller')
+
+        # fd -> таймер следующего опроса
+        self._timers: Dict[int, WheelTimer] = {}
+        # Очереди к отправке: станции с аномалиями, затем остальные
+        self._priority: Deque[StationConnection] = deque()
+        self._normal: Deque[StationConnection] = deque()
+        self._queued: set = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.polled_total = 0
+        self.priority_polled_total = 0
+        self.skipped_recent_total = 0
+        self.failed_total = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._priority) + len(self._normal)
+
+    def start(self) -> None:
+        self.connection_manager.add_listener(self._on_connection_event)
+        self._task = asyncio.create_task(self._run())
+        self.logger.info(f"Опрос инвентаря: период {self.period:g}с ±{self.jitter:.0%}, до {self.rate:g} запросов/с")
+
+    async def stop(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_connection_event(self, event: str, connection: StationConnection) -> None:
+        if event == 'login':
+            # Первый опрос - в случайный момент периода
+            self._schedule(connection, random.uniform(0, self.period))
+        elif event == 'disconnect':
+            timer = self._timers.pop(connection.fd, None)
+            if timer is not None:
+                timer.cancel()
+
+    def _schedule(self, connection: StationConnection, delay: float) -> None:
+        timer = self._timers.get(connection.fd)
+        if timer is not None and timer.args[0] is connection:
+            timer.reschedule(delay)
+            return
+        if timer is not None:
+            timer.cancel()
+        self._timers[connection.fd] = timer_wheel.call_later(delay, self._due, connection)
+
+    def _next_delay(self) -> float:
+        return self.period * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _inventory_age(self, connection: StationConnection) -> Optional[float]:
+        if connection.last_inventory_at is None:
+            return None
+        return asyncio.get_running_loop().time() - connection.last_inventory_at
+
+    def _abnormal_recent(self, connection: StationConnection) -> bool:
+        return (connection.last_abnormal_report_at is not None and
+                asyncio.get_running_loop().time() - connection.last_abnormal_report_at < self.abnormal_window)
+
+    def _due(self, connection: StationConnection) -> None:
+        """Срабатывание таймера станции: в очередь или перенос, если инвентарь свежий"""
+        if self.connection_manager.connections.get(connection.fd) is not connection:
+            self._timers.pop(connection.fd, None)
+            return
+        age = self._inventory_age(connection)
+        if age is not None and age < self.period * (1 - self.jitter):
+            self.skipped_recent_total += 1
+            self._schedule(connection, self.period - age + random.uniform(0, self.jitter * self.period))
+            return
+        self._enqueue(connection, self._abnormal_recent(connection))
+
+    def _enqueue(self, connection: StationConnection, priority: bool) -> None:
+        if connection in self._queued:
+            if priority and connection in self._normal:
+                self._normal.remove(connection)
+                self._priority.append(connection)
+            return
+        self._queued.add(connection)
+        (self._priority if priority else self._normal).append(connection)
+        self._wakeup.set()
+
+    def note_inventory(self, connection: StationConnection) -> None:
+        """Станция прислала инвентарь (на опрос или на запрос из API)"""
+        connection.last_inventory_at = asyncio.get_running_loop().time()
+
+    def note_abnormal_report(self, connection: StationConnection) -> None:
+        """Отчет об аномалии слота: опросить станцию вне очереди, если инвентарь не совсем свежий"""
+        connection.last_abnormal_report_at = asyncio.get_running_loop().time()
+        age = self._inventory_age(connection)
+        if connection.station_id and (age is None or age >= self.min_interval):
+            self._enqueue(connection, True)
+
+    async def _run(self) -> None:
+        interval = 1.0 / self.rate
+        while True:
+            try:
+                if not self._priority and not self._normal:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                priority = bool(self._priority)
+                connection = (self._priority if priority else self._normal).popleft()
+                self._queued.discard(connection)
+                if self._poll(connection) and priority:
+                    self.priority_polled_total += 1
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Ошибка опроса инвентаря: {e}")
+                await asyncio.sleep(1)
+
+    def _poll(self, connection: StationConnection) -> bool:
+        if self.connection_manager.connections.get(connection.fd) is not connection or not connection.secret_key:
+            return False
+        self._schedule(connection, self._next_delay())
+        packet = build_query_inventory_request(connection.secret_key, station_box_id=connection.box_id)
+        connection.enqueue_command(packet).add_done_callback(self._on_reply)
+        self.polled_total += 1
+        return True
+
+    def _on_reply(self, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            self.failed_total += 1
+
+    def get_stats(self) -> dict:
+        return {
+            'stations': len(self._timers),
+            'queue_depth': self.queue_depth,
+            'polled_total': self.polled_total,
+            'priority_polled_total': self.priority_polled_total,
+            'skipped_recent_total': self.skipped_recent_total,
+            'failed_total': self.failed_total,
+        }
@@ -0,0 +1,183 @@
+"""
+Контроль допуска логинов станций при массовом переподключении
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+from utils.centralized_logger import get_logger
+
+
+# Приоритеты очереди: меньше - раньше
+PRIORITY_PENDING_OPERATIONS = 0
+PRIORITY_NORMAL = 1
+
+
+class LoginAdmissionController:
+    """
+    Ограничивает число одновременно обрабатываемых логинов станций.
+    Логины сверх лимита ждут в очереди с приоритетом (без таймаута),
+    станции с ожидающими операциями пользователей допускаются первыми.
+    Heartbeat и остальные пакеты уже допущенных станций не ограничиваются.
+    """
+
+    def __init__(self, max_concurrent: int = 8,
+                 has_pending_operations: Optional[Callable[[int], bool]] = None,
+                 wait_samples: int = 1000):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.has_pending_operations = has_pending_operations
+        self.logger = get_logger('login_admission')
+
+        self._in_flight = 0
+        self._queue = []  # (priority, seq, box_id, future)
+        self._waiting = 0
+        self._seq = itertools.count()
+
+        # box_id -> station_id: загружается из БД при старте и обновляется при успешном логине
+        self._station_ids: Dict[str, int] = {}
+
+        # Метрики
+        self._wait_times = deque(maxlen=wait_samples)
+        self.admitted_total = 0
+        self.priority_admitted_total = 0
+        self.queued_total = 0
+        self.cancelled_total = 0
+        self.max_queue_depth = 0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество логинов в очереди"""
+        return self._waiting
+
+    @property
+    def in_flight(self) -> int:
+        """Количество логинов в обработке"""
+        return self._in_flight
+
+    def remember_station(self, box_id: str, station_id: int) -> None:
+        """Запоминает соответствие box_id -> station_id для расчета приоритета"""
+        if box_id and station_id:
+            self._station_ids[box_id] = station_id
+
+    async def preload_stations(self, db_pool) -> int:
+        """
+        Загружает box_id -> station_id всех станций: после перезапуска сервера
+        станции переподключаются разом, и без этого приоритет никому не достается
+        """
+        try:
+            async with db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("""
+                        SELECT box_id, station_id FROM station
+                        WHERE COALESCE(is_deleted, 0) = 0 AND box_id IS NOT NULL
+                    """)
+                    rows = await cur.fetchall()
+        except Exception as e:
+            self.logger.error(f"Ошибка загрузки станций для приоритета логинов: {e}")
+            return 0
+        for box_id, station_id in rows:
+            self._station_ids.setdefault(box_id, station_id)
+        return len(rows)
+
+    def _get_priority(self, box_id: str) -> int:
+        """Определяет приоритет логина станции"""
+        station_id = self._station_ids.get(box_id)
+        if station_id is None or not self.has_pending_operations:
+            return PRIORITY_NORMAL
+        try:
+            if self.has_pending_operations(station_id):
+                return PRIORITY_PENDING_OPERATIONS
+        except Exception as e:
+            self.logger.error(f"Ошибка определения приоритета логина {box_id}: {e}")
+        return PRIORITY_NORMAL
+
+    async def acquire(self, box_id: str) -> float:
+        """Ожидает допуска логина, возвращает время ожидания в секундах"""
+        priority = self._get_priority(box_id)
+        started = time.monotonic()
+
+        if self._in_flight < self.max_concurrent and not self._waiting:
+            self._in_flight += 1
+            self._record_admission(priority, 0.0)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), box_id, future))
+        self._waiting += 1
+        self.queued_total += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            self.cancelled_total += 1
+            # Слот мог быть выдан одновременно с отменой - возвращаем его
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+                self._waiting -= 1
+            raise
+
+        wait_seconds = time.monotonic() - started
+        self._record_admission(priority, wait_seconds)
+        return wait_seconds
+
+    def release(self) -> None:
+        """Освобождает слот и допускает следующий логин из очереди"""
+        self._in_flight -= 1
+        while self._queue and self._in_flight < self.max_concurrent:
+            _, _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._waiting -= 1
+            self._in_flight += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, box_id: str):
+        """Контекст обработки логина: async with controller.slot(box_id): ..."""
+        await self.acquire(box_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _record_admission(self, priority: int, wait_seconds: float) -> None:
+        self.admitted_total += 1
+        if priority == PRIORITY_PENDING_OPERATIONS:
+            self.priority_admitted_total += 1
+        self._wait_times.append(wait_seconds)
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def get_stats(self) -> Dict:
+        """Возвращает метрики очереди логинов"""
+        waits = sorted(self._wait_times)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 3)
+
+        return {
+            'max_concurrent': self.max_concurrent,
+            'in_flight': self._in_flight,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'admitted_total': self.admitted_total,
+            'priority_admitted_total': self.priority_admitted_total,
+            'queued_total': self.queued_total,
+            'cancelled_total': self.cancelled_total,
+            'wait_seconds': {
+                'avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(self.max_wait_seconds, 3),
+                'samples': len(waits)
+            }
+        }
@@ -0,0 +1,189 @@
+"""
+Сторож цикла событий: замер задержки и стек кода, который блокирует цикл
+
+Цикл событий каждые tick_interval отмечает тик. Поток-наблюдатель проверяет,
+как давно был тик; если цикл не отвечает дольше порога, снимает стек потока
+цикла (sys._current_frames) и определяет контекст: пакет станции, HTTP маршрут
+или callback. Когда цикл освобождается, длительность блокировки дописывается в событие.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from config.settings import LOOP_WATCHDOG_CONFIG
+from utils.centralized_logger import get_logger
+from utils.runtime_metrics import runtime_metrics
+from utils.time_utils import get_moscow_time
+
+
+STACK_LIMIT = 40  # кадров в сохраненном стеке
+CONTEXT_MAX_LENGTH = 300
+
+
+class LoopWatchdog:
+    """Наблюдатель за блокировками цикла событий одного процесса"""
+
+    def __init__(self, threshold: float = 0.1, tick_interval: float = 0.05, max_events: int = 100):
+        self.threshold = threshold
+        self.tick_interval = tick_interval
+        self.logger = get_logger('loop_watchdog')
+
+        # code объект функции -> описание контекста по ее локальным переменным
+        self._contexts: Dict[Any, Callable[[Dict[str, Any]], str]] = {}
+
+        self.events = deque(maxlen=max_events)
+        self.stalls_total = 0
+        self.max_stall_ms = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._last_tick = 0.0
+        self._expected_tick = 0.0
+        self._current_stall: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def register_context(self, function: Callable, describe: Callable[[Dict[str, Any]], str]) -> None:
+        """
+        Описание блокировки, если в стеке есть кадр function:
+        describe получает локальные переменные кадра и возвращает строку
+        """
+        code = getattr(function, '__code__', None) or function.__func__.__code__
+        self._contexts[code] = describe
+
+    async def start(self) -> None:
+        """Запускает тики в текущем цикле событий и поток-наблюдатель"""
+        if self._thread:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._expected_tick = self._loop.time() + self.tick_interval
+        self._timer = self._loop.call_later(self.tick_interval, self._tick)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._thread:
+            self._stopping.set()
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _tick(self) -> None:
+        """Тик в цикле событий: задержка относительно расписания и завершение блокировки"""
+        loop_now = self._loop.time()
+        runtime_metrics.observe_loop_lag(max(0.0, loop_now - self._expected_tick))
+
+        now = time.monotonic()
+        with self._lock:
+            stall = self._current_stall
+            self._current_stall = None
+            self._last_tick = now
+        if stall is not None:
+            stall['duration_ms'] = round((now - stall.pop('_blocked_since')) * 1000, 1)
+            self.max_stall_ms = max(self.max_stall_ms, stall['duration_ms'])
+            self.logger.warning(
+                f"Цикл событий был заблокирован {stall['duration_ms']} мс: {stall['context']}"
+            )
+
+        self._expected_tick = loop_now + self.tick_interval
+        self._timer = self._loop.call_later(self.tick_interval, self._tick)
+
+    def _watch(self) -> None:
+        """Поток-наблюдатель: снимает стек, если тик задерживается дольше порога"""
+        while not self._stopping.wait(self.tick_interval / 2):
+            blocked_since = self._last_tick + self.tick_interval
+            if time.monotonic() - blocked_since < self.threshold:
+                continue
+            with self._lock:
+                if self._current_stall is not None or self._last_tick + self.tick_interval != blocked_since:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                try:
+                    stall = self._capture(frame, blocked_since)
+                finally:
+                    del frame
+                self._current_stall = stall
+            self.events.append(stall)
+            self.stalls_total += 1
+            self.logger.warning(
+                f"Цикл событий заблокирован дольше {int(self.threshold * 1000)} мс: {stall['context']}\n"
+                + ''.join(stall['stack'])
+            )
+
+    def _capture(self, frame, blocked_since: float) -> Dict[str, Any]:
+        stack = traceback.format_stack(frame, limit=STACK_LIMIT)
+        return {
+            'detected_at': get_moscow_time().isoformat(),
+            'context': self._describe(frame)[:CONTEXT_MAX_LENGTH],
+            'task': self._current_task_repr(),
+            'stack': stack,
+            'duration_ms': None,  # заполняется, когда цикл освободится
+            '_blocked_since': blocked_since,
+        }
+
+    def _describe(self, frame) -> str:
+        """Контекст блокировки: ближайший к вершине стека зарегистрированный кадр"""
+        callback = None
+        current = frame
+        while current is not None:
+            describe = self._contexts.get(current.f_code)
+            if describe is not None:
+                try:
+                    return describe(current.f_locals)
+                except Exception as e:
+                    return f"{current.f_code.co_name} (ошибка описания: {e})"
+            if callback is None and current.f_code.co_name == '_run' and 'self' in current.f_locals:
+                callback = current.f_locals['self']
+            current = current.f_back
+        if callback is not None:
+            return f"callback {callback!r}"
+        return f"{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}"
+
+    def _current_task_repr(self) -> Optional[str]:
+        current_tasks = getattr(asyncio.tasks, '_current_tasks', None)
+        if not current_tasks:
+            return None
+        task = current_tasks.get(self._loop)
+        return repr(task)[:CONTEXT_MAX_LENGTH] if task else None
+
+    def get_stats(self, limit: int = 20) -> Dict[str, Any]:
+        """Последние блокировки (новые первыми) и сводка"""
+        events = [
+            {key: value for key, value in event.items() if not key.startswith('_')}
+            for event in list(self.events)[-limit:]
+        ]
+        events.reverse()
+        return {
+            'running': self.running,
+            'threshold_ms': int(self.threshold * 1000),
+            'tick_interval_ms': int(self.tick_interval * 1000),
+            'stalls_total': self.stalls_total,
+            'max_stall_ms': self.max_stall_ms,
+            'loop_lag_last_ms': round(runtime_metrics.loop_lag_last * 1000, 1),
+            'events': events,
+        }
+
+
+# Глобальный сторож цикла событий процесса
+loop_watchdog = LoopWatchdog(
+    threshold=LOOP_WATCHDOG_CONFIG['threshold_ms'] / 1000,
+    tick_interval=LOOP_WATCHDOG_CONFIG['tick_interval_ms'] / 1000,
+    max_events=LOOP_WATCHDOG_CONFIG['max_events']
+)
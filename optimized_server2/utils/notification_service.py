@@ -453,6 +453,57 @@ class NotificationService:
         
         return await self.send_email(user_email, subject, body, html_body, max_retries)
 
+    
+    async def send_powerbank_write_off_email(self, user_email: str, full_name: Optional[str] = None,
+                                            powerbank_serial: Optional[str] = None,
+                                            write_off_hours: int = 48) -> bool:
+        """Сообщает о списании невозвращенного аккумулятора"""
+        subject = f"Аккумулятор списан как невозвращенный - {self.smtp_config.get('app_name', 'ЗАРЯД')}"
+        max_retries = self.smtp_config.get('max_retries', 2)
+        
+        greeting = f"Здравствуйте, {full_name}!" if full_name else "Здравствуйте!"
+        serial_text = f" {powerbank_serial}" if powerbank_serial else ""
+        
+        body = f"""{greeting}
+
+Аккумулятор{serial_text} не был возвращен в течение {write_off_hours} часов и списан как утерянный.
+
+Если вы вернули аккумулятор или считаете это ошибкой, обратитесь к администратору вашей организации.
+
+С уважением,
+Команда ЗАРЯД"""
+        
+        html_body = f"""
+<html>
+<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+    <h2 style="color: #dc3545;">⚡ Аккумулятор списан как невозвращенный</h2>
+    
+    <p>{greeting}</p>
+    
+    <div style="background-color: #f8d7da; padding: 15px; border-left: 4px solid #dc3545; margin: 20px 0; border-radius: 5px;">
+        <p style="margin: 0; color: #721c24;">
+            <strong>Аккумулятор{serial_text} не был возвращен в течение {write_off_hours} часов и списан как утерянный.</strong>
+        </p>
+    </div>
+    
+    <p style="color: #6c757d; font-style: italic;">
+        Если вы вернули аккумулятор или считаете это ошибкой, обратитесь к администратору вашей организации.
+    </p>
+    
+    <p style="color: #999; font-size: 12px; margin-top: 30px; text-align: center;">
+        Это автоматическое сообщение. Пожалуйста, не отвечайте на него.
+    </p>
+    
+    <hr style="border: none; border-top: 1px solid #dee2e6; margin: 30px 0;">
+    <p style="color: #6c757d; font-size: 14px;">
+        С уважением,<br>
+        <strong>Команда ЗАРЯД</strong>
+    </p>
+</body>
+</html>"""
+        
+        return await self.send_email(user_email, subject, body, html_body, max_retries)
+
 
 notification_service = NotificationService()
 
@@ -7,6 +7,45 @@ from utils.centralized_logger import get_logger
 from utils.time_utils import get_moscow_time
 
 
+def check_org_units_compatible(powerbank_unit: Optional[OrgUnit], station_unit: Optional[OrgUnit]) -> bool:
+    """
+    Проверяет совместимость уже загруженных организационных единиц повербанка и станции
+    """
+    if not powerbank_unit or not station_unit:
+        return False
+
+    if powerbank_unit.org_unit_id == station_unit.org_unit_id:
+        return True
+
+    if (powerbank_unit.unit_type == 'group' and 
+        station_unit.parent_org_unit_id == powerbank_unit.org_unit_id):
+        return True
+
+    return False
+
+
+def describe_org_units_compatibility(powerbank_unit: Optional[OrgUnit], station_unit: Optional[OrgUnit],
+                                     powerbank_org_id: int = None, station_org_id: int = None) -> str:
+    """
+    Возвращает причину совместимости/несовместимости для уже загруженных организационных единиц
+    """
+    if not powerbank_unit:
+        return f"Организационная единица повербанка {powerbank_org_id} не найдена"
+    
+    if not station_unit:
+        return f"Организационная единица станции {station_org_id} не найдена"
+
+    # Проверяем правила совместимости
+    if powerbank_unit.org_unit_id == station_unit.org_unit_id:
+        return f"Одинаковая организационная единица: {powerbank_unit.name}"
+
+    if (powerbank_unit.unit_type == 'group' and 
+        station_unit.parent_org_unit_id == powerbank_unit.org_unit_id):
+        return f"Повербанк из родительской группы '{powerbank_unit.name}', станция из подгруппы '{station_unit.name}'"
+
+    return f"Несовместимые организационные единицы: повербанк '{powerbank_unit.name}' ({powerbank_unit.unit_type}), станция '{station_unit.name}' ({station_unit.unit_type})"
+
+
 async def is_powerbank_compatible(db_pool, powerbank_org_id: int, station_org_id: int) -> bool:
     """
     Проверяет совместимость повербанка со станцией по организационным единицам
@@ -15,17 +54,7 @@ async def is_powerbank_compatible(db_pool, powerbank_org_id: int, station_org_id
         powerbank_unit = await OrgUnit.get_by_id(db_pool, powerbank_org_id)
         station_unit = await OrgUnit.get_by_id(db_pool, station_org_id)
 
-        if not powerbank_unit or not station_unit:
-            return False
-
-        if powerbank_unit.org_unit_id == station_unit.org_unit_id:
-            return True
-
-        if (powerbank_unit.unit_type == 'group' and 
-            station_unit.parent_org_unit_id == powerbank_unit.org_unit_id):
-            return True
-
-        return False
+        return check_org_units_compatible(powerbank_unit, station_unit)
         
     except Exception as e:
         print(f"Ошибка проверки совместимости org_unit: {e}")
@@ -41,21 +70,9 @@ async def get_compatibility_reason(db_pool, powerbank_org_id: int, station_org_i
         powerbank_unit = await OrgUnit.get_by_id(db_pool, powerbank_org_id)
         station_unit = await OrgUnit.get_by_id(db_pool, station_org_id)
 
-        if not powerbank_unit:
-            return f"Организационная единица повербанка {powerbank_org_id} не найдена"
-        
-        if not station_unit:
-            return f"Организационная единица станции {station_org_id} не найдена"
-
-        # Проверяем правила совместимости
-        if powerbank_unit.org_unit_id == station_unit.org_unit_id:
-            return f"Одинаковая организационная единица: {powerbank_unit.name}"
-
-        if (powerbank_unit.unit_type == 'group' and 
-            station_unit.parent_org_unit_id == powerbank_unit.org_unit_id):
-            return f"Повербанк из родительской группы '{powerbank_unit.name}', станция из подгруппы '{station_unit.name}'"
-
-        return f"Несовместимые организационные единицы: повербанк '{powerbank_unit.name}' ({powerbank_unit.unit_type}), станция '{station_unit.name}' ({station_unit.unit_type})"
+        return describe_org_units_compatibility(
+            powerbank_unit, station_unit, powerbank_org_id, station_org_id
+        )
         
     except Exception as e:
         return f"Ошибка определения совместимости: {e}"
@@ -0,0 +1,299 @@
+"""
+Автоматическое списание невозвращенных повербанков
+
+Раз в interval_minutes минут задание одним запросом по индексу
+idx_orders_status_timestamp (status, timestamp) находит заказы 'borrow',
+открытые дольше write_off_hours подразделения станции выдачи
+(org_unit.write_off_hours, по умолчанию 48), и пачками по batch_size в отдельных транзакциях:
+    - закрывает заказы (status = 'written_off', completed_at = NOW()) - отдельный
+      статус, чтобы списания не смешивались с возвратами в заказах и отчетах,
+    - списывает повербанки (status = 'written_off', write_off_reason = 'lost'),
+    - пишет action_logs одним многострочным INSERT.
+Письма пользователям уходят после фиксации транзакции через очередь писем с
+паузой между отправками.
+
+Задание идемпотентно и безопасно при одновременной работе шлюза: строки заказов
+пачки блокируются SELECT ... FOR UPDATE и перепроверяются, поэтому заказ,
+закрытый возвратом в станцию, пропускается, а повторный запуск ничего не меняет.
+Заказы, чей повербанк уже стоит в станции, не списываются - их закроет возврат.
+Заказы с повербанком, которого нет в БД, не списываются и считаются в
+unknown_powerbank последнего запуска.
+
+Индекс и статус 'written_off' в orders.status создаются командой
+python tools/overdue_write_off.py install. Без статуса задание ничего не списывает,
+без индекса - работает, но читает всю таблицу orders. Задание выключено по
+умолчанию (OVERDUE_WRITE_OFF_ENABLED).
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import aiomysql
+
+from config.settings import OVERDUE_WRITE_OFF_CONFIG
+from utils.centralized_logger import get_logger
+from utils.notification_service import notification_service
+from utils.time_utils import get_moscow_time
+
+
+DEFAULT_WRITE_OFF_HOURS = 48
+INDEX_NAME = 'idx_orders_status_timestamp'
+WRITTEN_OFF_STATUS = 'written_off'
+
+
+class OverdueWriteOffJob:
+    """Периодическое списание просроченных заказов и очередь писем о списании"""
+
+    def __init__(self):
+        self.logger = get_logger('overdue_write_off')
+        self.db_pool = None
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.written_off_total = 0
+        self.emails_dropped_total = 0
+        self._task: Optional[asyncio.Task] = None
+        self._mail_task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Task] = None
+        self._mail_queue: Optional[asyncio.Queue] = None
+        self._index_ready = False
+
+    def attach(self, db_pool) -> None:
+        """Пул БД, очередь писем и периодическое списание, если оно включено"""
+        self.db_pool = db_pool
+        if OVERDUE_WRITE_OFF_CONFIG['enabled']:
+            self._mail_queue = asyncio.Queue(maxsize=OVERDUE_WRITE_OFF_CONFIG['mail_queue_size'])
+            self._mail_task = asyncio.create_task(self._mail_loop())
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._running, self._mail_task):
+            if task and not task.done():
+                task.cancel()
+        self._task = None
+        self._mail_task = None
+
+    @property
+    def mail_pending(self) -> int:
+        return self._mail_queue.qsize() if self._mail_queue else 0
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                self.logger.error(f"Ошибка списания просроченных заказов: {e}", exc_info=True)
+            await asyncio.sleep(OVERDUE_WRITE_OFF_CONFIG['interval_minutes'] * 60)
+
+    async def run(self) -> Dict[str, Any]:
+        """Выполняет списание; параллельный вызов ждет уже идущее"""
+        if self._running is None or self._running.done():
+            self._running = asyncio.create_task(self._run())
+        return await asyncio.shield(self._running)
+
+    @staticmethod
+    async def _index_exists(cur) -> bool:
+        await cur.execute("""
+            SELECT COUNT(*) AS count FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'orders' AND INDEX_NAME = %s
+        """, (INDEX_NAME,))
+        row = await cur.fetchone()
+        return bool(row['count'] if isinstance(row, dict) else row[0])
+
+    @staticmethod
+    async def _status_column(cur) -> Dict[str, Any]:
+        await cur.execute("""
+            SELECT COLUMN_TYPE AS column_type, IS_NULLABLE AS is_nullable FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'orders' AND COLUMN_NAME = 'status'
+        """)
+        row = await cur.fetchone()
+        return row if isinstance(row, dict) else {'column_type': row[0], 'is_nullable': row[1]}
+
+    async def _status_exists(self, cur) -> bool:
+        column = await self._status_column(cur)
+        return f"'{WRITTEN_OFF_STATUS}'" in column['column_type']
+
+    async def _check_index(self, cur) -> None:
+        """Без индекса списание работает, но поиск кандидатов читает всю таблицу orders"""
+        if self._index_ready:
+            return
+        if await self._index_exists(cur):
+            self._index_ready = True
+        else:
+            self.logger.warning(f"Нет индекса {INDEX_NAME} на orders: "
+                                f"создайте его командой python tools/overdue_write_off.py install")
+
+    async def install(self, db_pool) -> List[str]:
+        """
+        Добавляет статус written_off в orders.status и индекс - онлайн, без блокировки
+        записи (значение enum дописывается в конец). Возвращает выполненные изменения.
+        """
+        changes = []
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                column = await self._status_column(cur)
+                if f"'{WRITTEN_OFF_STATUS}'" not in column['column_type']:
+                    column_type = column['column_type'][:-1] + f",'{WRITTEN_OFF_STATUS}')"
+                    null = '' if column['is_nullable'] == 'YES' else ' NOT NULL'
+                    await cur.execute(f"""
+                        ALTER TABLE orders MODIFY status {column_type}{null}, ALGORITHM=INPLACE, LOCK=NONE
+                    """)
+                    changes.append(f"статус {WRITTEN_OFF_STATUS} в orders.status")
+                if not await self._index_exists(cur):
+                    await cur.execute(f"""
+                        ALTER TABLE orders ADD INDEX {INDEX_NAME} (status, timestamp), ALGORITHM=INPLACE, LOCK=NONE
+                    """)
+                    changes.append(f"индекс {INDEX_NAME}")
+        self._index_ready = True
+        return changes
+
+    async def _run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        batch_size = OVERDUE_WRITE_OFF_CONFIG['batch_size']
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                if not await self._status_exists(cur):
+                    self.logger.error(f"В orders.status нет значения '{WRITTEN_OFF_STATUS}', списание пропущено: "
+                                      f"выполните python tools/overdue_write_off.py install")
+                    result = {'finished_at': get_moscow_time().isoformat(), 'candidates': 0, 'written_off': 0,
+                              'unknown_powerbank': 0, 'seconds': 0.0, 'skipped': 'no_status'}
+                    self.last_run = result
+                    return result
+                await self._check_index(cur)
+                # Нижняя граница горизонта по всем подразделениям - диапазон по индексу
+                await cur.execute("SELECT MIN(write_off_hours) AS hours FROM org_unit WHERE write_off_hours > 0")
+                row = await cur.fetchone()
+                min_hours = min(row['hours'] or DEFAULT_WRITE_OFF_HOURS, DEFAULT_WRITE_OFF_HOURS)
+                # Все соединения по уникальным ключам - одна строка на заказ. Подразделение - по станции
+                # выдачи (box_id уникален); если станции уже нет - по названию в заказе, при
+                # одноименных подразделениях берется самый короткий срок
+                await cur.execute("""
+                    SELECT c.* FROM (
+                        SELECT o.id AS order_id, o.timestamp, o.powerbank_serial, o.user_phone, o.user_fio,
+                               p.id AS powerbank_id, u.user_id, u.email,
+                               COALESCE(
+                                   ou.write_off_hours,
+                                   (SELECT MIN(n.write_off_hours) FROM org_unit n
+                                    WHERE n.name = o.org_unit_name AND n.is_deleted = 0),
+                                   %s
+                               ) AS write_off_hours
+                        FROM orders o
+                        LEFT JOIN station s ON s.box_id = o.station_box_id
+                        LEFT JOIN org_unit ou ON ou.org_unit_id = s.org_unit_id AND ou.is_deleted = 0
+                        LEFT JOIN powerbank p ON p.serial_number = o.powerbank_serial
+                        LEFT JOIN app_user u ON u.phone_e164 = o.user_phone
+                        WHERE o.status = 'borrow'
+                          AND o.timestamp < NOW() - INTERVAL %s HOUR
+                          AND o.completed_at IS NULL
+                          AND o.is_deleted = 0
+                          AND NOT EXISTS (SELECT 1 FROM station_powerbank sp WHERE sp.powerbank_id = p.id)
+                    ) c
+                    WHERE c.timestamp < NOW() - INTERVAL c.write_off_hours HOUR
+                    ORDER BY c.order_id
+                """, (DEFAULT_WRITE_OFF_HOURS, min_hours))
+                rows = await cur.fetchall()
+                # Повербанк заказа не найден (серийный номер неизвестен или повербанк удален):
+                # списывать нечего, заказ остается открытым для разбора администратором
+                unknown = [row['order_id'] for row in rows if row['powerbank_id'] is None]
+                if unknown:
+                    self.logger.warning(f"Просроченные заказы без повербанка в БД не списаны: {unknown[:20]}"
+                                        f"{' ...' if len(unknown) > 20 else ''} (всего {len(unknown)})")
+                candidates = [row for row in rows if row['powerbank_id'] is not None]
+
+            written_off = 0
+            for start in range(0, len(candidates), batch_size):
+                if start:
+                    await asyncio.sleep(OVERDUE_WRITE_OFF_CONFIG['batch_pause'])
+                done = await self._write_off_batch(conn, candidates[start:start + batch_size])
+                written_off += len(done)
+                for order in done:
+                    self._notify(order)
+
+        self.written_off_total += written_off
+        result = {
+            'finished_at': get_moscow_time().isoformat(),
+            'candidates': len(candidates),
+            'written_off': written_off,
+            'unknown_powerbank': len(unknown),
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        self.last_run = result
+        if candidates:
+            self.logger.info(f"Списание просроченных: найдено {len(candidates)}, списано {written_off}, "
+                             f"{result['seconds']} сек")
+        return result
+
+    async def _write_off_batch(self, conn, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Списывает пачку одной транзакцией; возвращает заказы, закрытые этим вызовом"""
+        by_id = {order['order_id']: order for order in batch}
+        placeholders = ','.join(['%s'] * len(by_id))
+        async with conn.cursor() as cur:
+            await conn.begin()
+            try:
+                # Перепроверка под блокировкой: шлюз мог закрыть заказ возвратом
+                await cur.execute(f"""
+                    SELECT id FROM orders
+                    WHERE id IN ({placeholders}) AND status = 'borrow' AND completed_at IS NULL
+                    FOR UPDATE
+                """, list(by_id))
+                locked = [row[0] for row in await cur.fetchall()]
+                if not locked:
+                    await conn.commit()
+                    return []
+                orders = [by_id[order_id] for order_id in locked]
+                placeholders = ','.join(['%s'] * len(locked))
+                await cur.execute(f"""
+                    UPDATE orders SET status = %s, completed_at = NOW()
+                    WHERE id IN ({placeholders})
+                """, [WRITTEN_OFF_STATUS] + locked)
+
+                powerbank_ids = sorted({order['powerbank_id'] for order in orders if order['powerbank_id']})
+                if powerbank_ids:
+                    await cur.execute(f"""
+                        UPDATE powerbank SET status = 'written_off', write_off_reason = 'lost'
+                        WHERE id IN ({','.join(['%s'] * len(powerbank_ids))}) AND status <> 'written_off'
+                    """, powerbank_ids)
+
+                logs = []
+                for order in orders:
+                    description = (f"Автоматическое списание: повербанк {order['powerbank_serial'] or '-'} "
+                                   f"не возвращен за {order['write_off_hours']} ч")
+                    logs.append((order['user_id'], 'order_update', 'order', order['order_id'], description))
+                    if order['powerbank_id']:
+                        logs.append((order['user_id'], 'powerbank_update', 'powerbank', order['powerbank_id'],
+                                     description))
+                await cur.execute(f"""
+                    INSERT INTO action_logs (user_id, action_type, entity_type, entity_id, description)
+                    VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(logs))}
+                """, [value for log in logs for value in log])
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        return orders
+
+    # --- очередь писем ---
+
+    def _notify(self, order: Dict[str, Any]) -> None:
+        if not order['email'] or self._mail_queue is None:
+            return
+        try:
+            self._mail_queue.put_nowait(order)
+        except asyncio.QueueFull:
+            self.emails_dropped_total += 1
+
+    async def _mail_loop(self) -> None:
+        while True:
+            order = await self._mail_queue.get()
+            try:
+                await notification_service.send_powerbank_write_off_email(
+                    user_email=order['email'],
+                    full_name=order['user_fio'],
+                    powerbank_serial=order['powerbank_serial'],
+                    write_off_hours=order['write_off_hours']
+                )
+            except Exception as e:
+                self.logger.error(f"Ошибка отправки письма о списании по заказу {order['order_id']}: {e}")
+            await asyncio.sleep(OVERDUE_WRITE_OFF_CONFIG['mail_pause'])
+
+
+# Списание просроченных заказов процесса с HTTP API
+overdue_write_off = OverdueWriteOffJob()
@@ -0,0 +1,63 @@
+"""
+Выбор повербанка для автоматической выдачи
+
+Кандидаты - слоты станции с активным повербанком без активного заказа. Балл
+считается за один проход по уже загруженным данным слотов (заряд, ошибки слота)
+и повербанков (SOH):
+    балл = level_weight * заряд + soh_weight * SOH - error_penalty * (есть ошибки)
+Среди кандидатов с максимальным баллом выбирается случайный, чтобы выдачи
+равномерно распределялись по одинаковым повербанкам.
+"""
+import random
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from config.settings import BORROW_SCORING_CONFIG
+
+
+class PowerbankCandidate:
+    """Слот станции, из которого можно выдать повербанк"""
+
+    __slots__ = ('slot', 'powerbank', 'has_errors', 'score')
+
+    def __init__(self, slot, powerbank, has_errors: bool, score: float):
+        self.slot = slot
+        self.powerbank = powerbank
+        self.has_errors = has_errors
+        self.score = score
+
+
+class PowerbankScorer:
+    """Ранжирование кандидатов на выдачу по настраиваемым весам"""
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(BORROW_SCORING_CONFIG)
+        if weights:
+            self.weights.update(weights)
+
+    def score(self, level: Optional[int], soh: Optional[int], has_errors: bool) -> float:
+        return (
+            self.weights['level_weight'] * (level or 0)
+            + self.weights['soh_weight'] * (soh or 0)
+            - self.weights['error_penalty'] * has_errors
+        )
+
+    def candidates(self, slots: List[Any], powerbanks_by_id: Dict[int, Any], active_serials: Set[str],
+                   check_errors: Callable[[Any], bool]) -> List[PowerbankCandidate]:
+        """Кандидаты с баллами; slots - записи с полями StationPowerbank"""
+        result = []
+        for slot in slots:
+            powerbank = powerbanks_by_id.get(slot.powerbank_id)
+            if not powerbank or powerbank.status != 'active' or powerbank.serial_number in active_serials:
+                continue
+            has_errors = check_errors(slot)
+            result.append(PowerbankCandidate(slot, powerbank, has_errors,
+                                             self.score(slot.level, powerbank.soh, has_errors)))
+        return result
+
+    @staticmethod
+    def select(candidates: List[PowerbankCandidate]) -> Optional[PowerbankCandidate]:
+        """Кандидат с максимальным баллом (случайный среди равных)"""
+        if not candidates:
+            return None
+        best_score = max(candidate.score for candidate in candidates)
+        return random.choice([candidate for candidate in candidates if candidate.score == best_score])
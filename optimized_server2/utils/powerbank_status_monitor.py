@@ -39,6 +39,12 @@ class PowerbankStatusMonitor:
         except Exception as e:
             self.logger.error(f"Ошибка: {e}")
     
+    def set_station_snapshot(self, station_id: int, statuses: Dict[int, str]) -> None:
+        """Инициализирует мониторинг станции из уже известных статусов (без запроса в БД)"""
+        for powerbank_id, status in statuses.items():
+            self.status_cache[powerbank_id] = status
+        self.station_powerbanks[station_id] = set(statuses.keys())
+    
     async def check_status_changes(self, station_id: int) -> Dict[int, str]:
         """Проверяет изменения статусов повербанков в станции"""
         try:
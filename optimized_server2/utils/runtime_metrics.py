@@ -0,0 +1,360 @@
+"""
+Метрики работы процесса сервера: соединения, пакеты, задержки обработчиков, пул БД, цикл событий
+
+Горячий путь (пакет станции) - только инкременты в списках по коду команды
+и одно наблюдение гистограммы. Снимок и текст Prometheus строятся при запросе.
+"""
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.centralized_logger import get_logger
+
+
+# Границы гистограмм, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOOP_LAG_INTERVAL = 0.5  # секунд между замерами задержки цикла событий
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами (формат Prometheus: le - включительно)"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Накопительные значения по границам, как в Prometheus"""
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets.append([bound, total])
+        return {'buckets': buckets, 'sum': round(self.sum, 6), 'count': self.count}
+
+
+class DBPoolStats:
+    """Ожидание соединений пула aiomysql"""
+
+    __slots__ = ('pool', 'wait', 'waiting', 'acquired_total')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.wait = Histogram()
+        self.waiting = 0
+        self.acquired_total = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        pool = self.pool
+        size = getattr(pool, 'size', 0)
+        free = getattr(pool, 'freesize', 0)
+        return {
+            'size': size,
+            'free': free,
+            'in_use': size - free,
+            'max_size': getattr(pool, 'maxsize', 0),
+            'waiting': self.waiting,
+            'acquired_total': self.acquired_total,
+            'wait_seconds': self.wait.to_dict(),
+        }
+
+
+class MeteredStreamWriter:
+    """Обертка writer соединения станции: считает исходящие пакеты и байты по коду команды"""
+
+    __slots__ = ('_writer', '_metrics')
+
+    def __init__(self, writer, metrics: 'RuntimeMetrics'):
+        self._writer = writer
+        self._metrics = metrics
+
+    def write(self, data: bytes) -> None:
+        if len(data) > 2:
+            command = data[2]
+            self._metrics.packets_out[command] += 1
+            self._metrics.bytes_out[command] += len(data)
+        self._writer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+
+class RuntimeMetrics:
+    """Метрики одного процесса сервера"""
+
+    def __init__(self):
+        self.process_name = 'main'
+        self.event_loop = 'asyncio'
+        self.started_at = time.time()
+        self.logger = get_logger('runtime_metrics')
+
+        # Пакеты станций по коду команды
+        self.packets_in = [0] * 256
+        self.bytes_in = [0] * 256
+        self.packets_out = [0] * 256
+        self.bytes_out = [0] * 256
+        self.packet_latency: List[Optional[Histogram]] = [None] * 256
+
+        # TCP соединения по локальному порту
+        self.connections: Dict[int, int] = {}
+        self.connections_total: Dict[int, int] = {}
+
+        # HTTP: (маршрут, метод) -> гистограмма, (маршрут, метод, статус) -> количество
+        self.http_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.http_requests: Dict[Tuple[str, str, int], int] = {}
+
+        self.db_pools: Dict[str, DBPoolStats] = {}
+        # name -> (тип Prometheus, описание, функция чтения)
+        self.gauges: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.loop_lag_last = 0.0
+        self.loop_lag_max = 0.0
+        self._lag_task: Optional[asyncio.Task] = None
+
+    # --- Горячий путь ---
+
+    def record_packet_in(self, command: int, size: int, seconds: float) -> None:
+        """Входящий пакет станции и время его обработки"""
+        self.packets_in[command] += 1
+        self.bytes_in[command] += size
+        histogram = self.packet_latency[command]
+        if histogram is None:
+            histogram = self.packet_latency[command] = Histogram()
+        histogram.observe(seconds)
+
+    def wrap_writer(self, writer) -> MeteredStreamWriter:
+        """Writer соединения станции с учетом исходящих пакетов"""
+        return MeteredStreamWriter(writer, self)
+
+    def connection_opened(self, port: int) -> None:
+        self.connections[port] = self.connections.get(port, 0) + 1
+        self.connections_total[port] = self.connections_total.get(port, 0) + 1
+
+    def connection_closed(self, port: int) -> None:
+        self.connections[port] = self.connections.get(port, 1) - 1
+
+    def observe_http(self, route: str, method: str, status: int, seconds: float) -> None:
+        """Запрос HTTP API"""
+        key = (route, method)
+        histogram = self.http_latency.get(key)
+        if histogram is None:
+            histogram = self.http_latency[key] = Histogram()
+        histogram.observe(seconds)
+        request_key = (route, method, status)
+        self.http_requests[request_key] = self.http_requests.get(request_key, 0) + 1
+
+    # --- Регистрация источников ---
+
+    def register_gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        """Показатель, значение которого читается при снятии метрик"""
+        self.gauges[name] = ('gauge', help_text, read)
+
+    def register_counter(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        """Монотонный счетчик (*_total), значение которого читается при снятии метрик"""
+        self.gauges[name] = ('counter', help_text, read)
+
+    def instrument_db_pool(self, pool, name: str = 'main') -> None:
+        """Подключает учет ожидания соединений пула aiomysql (pool.acquire -> pool._acquire)"""
+        stats = DBPoolStats(pool)
+        self.db_pools[name] = stats
+        acquire = getattr(pool, '_acquire', None)
+        if acquire is None:
+            return
+
+        async def timed_acquire():
+            stats.waiting += 1
+            started = time.perf_counter()
+            try:
+                connection = await acquire()
+            finally:
+                stats.waiting -= 1
+            stats.wait.observe(time.perf_counter() - started)
+            stats.acquired_total += 1
+            return connection
+
+        pool._acquire = timed_acquire
+
+    # --- Задержка цикла событий ---
+
+    async def start(self, probe_loop_lag: bool = True) -> None:
+        """Запускает замер задержки цикла событий (если его не ведет сторож цикла)"""
+        if probe_loop_lag and self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._loop_lag_probe())
+
+    async def stop(self) -> None:
+        if self._lag_task:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    def observe_loop_lag(self, lag: float) -> None:
+        self.loop_lag.observe(lag)
+        self.loop_lag_last = lag
+        if lag > self.loop_lag_max:
+            self.loop_lag_max = lag
+
+    async def _loop_lag_probe(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.observe_loop_lag(max(0.0, loop.time() - expected))
+
+    # --- Снимок ---
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Все метрики процесса в виде JSON-совместимого словаря"""
+        packets = {}
+        for command in range(256):
+            if self.packets_in[command] or self.packets_out[command]:
+                histogram = self.packet_latency[command]
+                packets[f'0x{command:02X}'] = {
+                    'packets_in': self.packets_in[command],
+                    'bytes_in': self.bytes_in[command],
+                    'packets_out': self.packets_out[command],
+                    'bytes_out': self.bytes_out[command],
+                    'handler_seconds': histogram.to_dict() if histogram else None,
+                }
+
+        gauges = {}
+        for name, (metric_type, help_text, read) in self.gauges.items():
+            try:
+                gauges[name] = {'type': metric_type, 'help': help_text, 'value': read()}
+            except Exception as e:
+                self.logger.error(f"Ошибка чтения метрики {name}: {e}")
+
+        return {
+            'process': self.process_name,
+            'pid': os.getpid(),
+            'event_loop': self.event_loop,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'connections': {str(port): count for port, count in self.connections.items()},
+            'connections_total': {str(port): count for port, count in self.connections_total.items()},
+            'packets': packets,
+            'http': [
+                {'route': route, 'method': method, 'seconds': histogram.to_dict()}
+                for (route, method), histogram in self.http_latency.items()
+            ],
+            'http_requests': [
+                {'route': route, 'method': method, 'status': status, 'count': count}
+                for (route, method, status), count in self.http_requests.items()
+            ],
+            'db_pools': {name: stats.to_dict() for name, stats in self.db_pools.items()},
+            'loop_lag': {
+                'last_seconds': round(self.loop_lag_last, 6),
+                'max_seconds': round(self.loop_lag_max, 6),
+                'seconds': self.loop_lag.to_dict(),
+            },
+            'gauges': gauges,
+        }
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class _PrometheusWriter:
+    """Группирует строки по метрике, чтобы HELP/TYPE шли один раз"""
+
+    def __init__(self):
+        self.families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def add(self, name: str, metric_type: str, help_text: str, labels: Dict[str, Any], value: float) -> None:
+        family = self.families.setdefault(name, (metric_type, help_text, []))
+        family[2].append(f'{name}{_labels(labels)} {value}')
+
+    def add_histogram(self, name: str, help_text: str, labels: Dict[str, Any], histogram: Dict[str, Any]) -> None:
+        family = self.families.setdefault(name, ('histogram', help_text, []))
+        lines = family[2]
+        for bound, count in histogram['buckets']:
+            lines.append(f'{name}_bucket{_labels({**labels, "le": bound})} {count}')
+        lines.append(f'{name}_bucket{_labels({**labels, "le": "+Inf"})} {histogram["count"]}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+
+    def render(self) -> str:
+        output = []
+        for name, (metric_type, help_text, lines) in self.families.items():
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} {metric_type}')
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
+
+
+def render_prometheus(snapshots: List[Dict[str, Any]]) -> str:
+    """Текстовый формат Prometheus для снимков одного или нескольких процессов"""
+    out = _PrometheusWriter()
+    for snapshot in snapshots:
+        process = {'process': snapshot['process']}
+        out.add('zaryd_process_uptime_seconds', 'gauge', 'Время работы процесса', process, snapshot['uptime_seconds'])
+
+        for port, count in snapshot['connections'].items():
+            out.add('zaryd_tcp_connections', 'gauge', 'Открытые TCP соединения станций',
+                    {**process, 'port': port}, count)
+        for port, count in snapshot['connections_total'].items():
+            out.add('zaryd_tcp_connections_accepted_total', 'counter', 'Принятые TCP соединения станций',
+                    {**process, 'port': port}, count)
+
+        for opcode, data in snapshot['packets'].items():
+            labels = {**process, 'opcode': opcode}
+            out.add('zaryd_packets_received_total', 'counter', 'Пакеты от станций',
+                    labels, data['packets_in'])
+            out.add('zaryd_packet_bytes_received_total', 'counter', 'Байты от станций',
+                    labels, data['bytes_in'])
+            out.add('zaryd_packets_sent_total', 'counter', 'Пакеты станциям',
+                    labels, data['packets_out'])
+            out.add('zaryd_packet_bytes_sent_total', 'counter', 'Байты станциям',
+                    labels, data['bytes_out'])
+            if data['handler_seconds']:
+                out.add_histogram('zaryd_packet_handler_seconds', 'Время обработки пакета станции',
+                                  labels, data['handler_seconds'])
+
+        for item in snapshot['http']:
+            out.add_histogram('zaryd_http_request_seconds', 'Время обработки HTTP запроса',
+                              {**process, 'route': item['route'], 'method': item['method']}, item['seconds'])
+        for item in snapshot['http_requests']:
+            out.add('zaryd_http_requests_total', 'counter', 'HTTP запросы',
+                    {**process, 'route': item['route'], 'method': item['method'], 'status': item['status']},
+                    item['count'])
+
+        for name, pool in snapshot['db_pools'].items():
+            labels = {**process, 'pool': name}
+            out.add('zaryd_db_pool_size', 'gauge', 'Соединений в пуле БД', labels, pool['size'])
+            out.add('zaryd_db_pool_in_use', 'gauge', 'Занятые соединения пула БД', labels, pool['in_use'])
+            out.add('zaryd_db_pool_max_size', 'gauge', 'Максимальный размер пула БД', labels, pool['max_size'])
+            out.add('zaryd_db_pool_waiting', 'gauge', 'Ожидающие соединения из пула БД', labels, pool['waiting'])
+            out.add_histogram('zaryd_db_pool_wait_seconds', 'Ожидание соединения из пула БД',
+                              labels, pool['wait_seconds'])
+
+        out.add('zaryd_event_loop_lag_seconds_last', 'gauge', 'Последняя задержка цикла событий',
+                process, snapshot['loop_lag']['last_seconds'])
+        out.add('zaryd_event_loop_lag_seconds_max', 'gauge', 'Максимальная задержка цикла событий',
+                process, snapshot['loop_lag']['max_seconds'])
+        out.add_histogram('zaryd_event_loop_lag_seconds', 'Задержка цикла событий',
+                          process, snapshot['loop_lag']['seconds'])
+
+        for name, gauge in snapshot['gauges'].items():
+            out.add(name, gauge.get('type', 'gauge'), gauge['help'], process, gauge['value'])
+
+    return out.render()
+
+
+# Глобальный экземпляр метрик процесса
+runtime_metrics = RuntimeMetrics()
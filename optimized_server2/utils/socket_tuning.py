@@ -0,0 +1,98 @@
+"""
+Политика цикла событий и опции TCP сокетов станций
+
+Кабинеты шлют маленькие кадры (heartbeat - 9 байт) и ждут ответа: без TCP_NODELAY
+ответ может задерживаться алгоритмом Нейгла. Keepalive с короткими интервалами
+закрывает "мертвые" соединения (кабинет пропал из сети) раньше таймаута heartbeat.
+"""
+import asyncio
+import json
+import socket
+from typing import Any, Dict
+
+from config.settings import EVENT_LOOP_POLICY, TCP_SOCKET_CONFIG, TCP_SOCKET_PORT_OPTIONS
+from utils.centralized_logger import get_logger
+
+
+logger = get_logger('socket_tuning')
+
+
+def install_event_loop_policy(policy: str = EVENT_LOOP_POLICY) -> str:
+    """
+    Устанавливает политику цикла событий до asyncio.run, возвращает имя цикла.
+    auto - uvloop, если установлен, иначе стандартный asyncio.
+    """
+    if policy not in ('auto', 'uvloop', 'asyncio'):
+        logger.warning(f"Неизвестная политика цикла событий {policy}, используется asyncio")
+        policy = 'asyncio'
+    if policy != 'asyncio':
+        try:
+            import uvloop
+        except ImportError:
+            if policy == 'uvloop':
+                logger.warning("uvloop не установлен, используется стандартный цикл asyncio")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+    return 'asyncio'
+
+
+def _port_overrides() -> Dict[str, Dict[str, Any]]:
+    if not TCP_SOCKET_PORT_OPTIONS:
+        return {}
+    try:
+        return {str(port): options for port, options in json.loads(TCP_SOCKET_PORT_OPTIONS).items()}
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Некорректный TCP_SOCKET_PORT_OPTIONS: {e}")
+        return {}
+
+
+PORT_OVERRIDES = _port_overrides()
+
+
+def socket_options_for_port(port: int) -> Dict[str, Any]:
+    """Опции сокетов порта: общие настройки с переопределениями порта"""
+    options = dict(TCP_SOCKET_CONFIG)
+    options.update(PORT_OVERRIDES.get(str(port), {}))
+    return options
+
+
+def apply_buffer_sizes(sock, options: Dict[str, Any]) -> None:
+    """Размеры буферов; на слушающем сокете наследуются принятыми соединениями"""
+    if options.get('rcvbuf'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, options['rcvbuf'])
+    if options.get('sndbuf'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, options['sndbuf'])
+
+
+def apply_socket_options(sock, options: Dict[str, Any]) -> None:
+    """Опции принятого соединения станции (TCP_NODELAY, keepalive, буферы)"""
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if options.get('nodelay') else 0)
+        if options.get('keepalive'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # Параметры keepalive есть не на всех платформах (TCP_KEEPIDLE - Linux)
+            for name, key in (('TCP_KEEPIDLE', 'keepalive_idle'), ('TCP_KEEPINTVL', 'keepalive_interval'),
+                              ('TCP_KEEPCNT', 'keepalive_count')):
+                if hasattr(socket, name) and options.get(key):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), options[key])
+        apply_buffer_sizes(sock, options)
+    except OSError as e:
+        logger.warning(f"Не удалось применить опции сокета: {e}")
+
+
+def describe_socket(sock) -> Dict[str, Any]:
+    """Фактические опции сокета (ядро может удвоить или ограничить размеры буферов)"""
+    info = {
+        'nodelay': bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)),
+        'keepalive': bool(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)),
+        'rcvbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+        'sndbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+    }
+    for name, key in (('TCP_KEEPIDLE', 'keepalive_idle'), ('TCP_KEEPINTVL', 'keepalive_interval'),
+                      ('TCP_KEEPCNT', 'keepalive_count')):
+        if hasattr(socket, name):
+            info[key] = sock.getsockopt(socket.IPPROTO_TCP, getattr(socket, name))
+    return info
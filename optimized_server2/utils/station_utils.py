@@ -4,19 +4,21 @@
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 from models.station import Station
+from utils.fleet_state import fleet_state
 from utils.time_utils import get_moscow_time
 from utils.centralized_logger import get_logger
 
 
-async def check_station_online_status(db_pool, station_id: int, required_seconds: int = 30) -> Tuple[bool, str]:
+async def check_station_online_status(db_pool, station_id: int, required_seconds: int = 30,
+                                      connection_manager=None) -> Tuple[bool, str]:
     """
     Проверяет, была ли станция онлайн в течение указанного количества секунд
     """
     try:
         logger = get_logger('station_utils')
         
-        # Получаем информацию о станции
-        station = await Station.get_by_id(db_pool, station_id)
+        # Статус - из БД, last_seen подключенной станции - из памяти шлюза (в БД пишется пачками)
+        station, _ = await fleet_state.load_station(db_pool, station_id, connection_manager)
         if not station:
             return False, f"Станция {station_id} не найдена"
         
@@ -82,9 +84,9 @@ async def validate_station_for_operation(db_pool, connection_manager, station_id
         logger = get_logger('station_utils')
         logger.info(f"Проверка станции {station_id} перед операцией '{operation_name}'")
         
-        # Проверяем статус онлайн по базе данных
+        # Проверяем статус онлайн
         online_status, online_message = await check_station_online_status(
-            db_pool, station_id, required_online_seconds
+            db_pool, station_id, required_online_seconds, connection_manager
         )
         
         if not online_status:
@@ -0,0 +1,311 @@
+"""
+Сводные счетчики для статистики панели администратора
+
+slot_abnormal_daily      - отчеты об аномалиях по станции, типу события и дню
+powerbank_status_counts  - повербанки по подразделению и статусу
+
+Счетчики ведут триггеры MySQL на вставку, изменение и удаление строк исходных
+таблиц: так учитываются записи из любого процесса и любого места кода (CRUD,
+пачечная запись, задания списания и удаления). Подразделение отчета берется
+через станцию при чтении, поэтому перенос станции не требует пересчета.
+
+Каскадные удаления по внешним ключам (удаление станции или подразделения)
+триггеры не вызывают: чтение отбрасывает счетчики удаленных станций и
+подразделений, а сами строки счетчиков убирает проверка:
+    python tools/stats_rollup.py install   - таблицы, триггеры и заполнение
+    python tools/stats_rollup.py check [--fix]
+Пока триггеры не установлены, статистика считается по исходным таблицам.
+"""
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from config.settings import STATS_ROLLUP_CONFIG
+from utils.centralized_logger import get_logger
+
+
+CREATE_TABLES_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS slot_abnormal_daily (
+        station_id BIGINT UNSIGNED NOT NULL,
+        event_type VARCHAR(100) COLLATE utf8mb4_unicode_ci NOT NULL,
+        day DATE NOT NULL,
+        reports INT NOT NULL,
+        PRIMARY KEY (station_id, event_type, day),
+        KEY idx_slot_abnormal_daily_day (day)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS powerbank_status_counts (
+        org_unit_id BIGINT UNSIGNED NOT NULL,
+        status VARCHAR(32) COLLATE utf8mb4_unicode_ci NOT NULL,
+        powerbanks INT NOT NULL,
+        PRIMARY KEY (org_unit_id, status)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+)
+
+# Счетчики знаковые: уменьшение ниже нуля не должно ломать запись в исходную таблицу.
+# Повербанк без подразделения учитывается с org_unit_id = 0.
+TRIGGERS = {
+    'trg_slot_abnormal_daily_ins': """
+        CREATE TRIGGER trg_slot_abnormal_daily_ins AFTER INSERT ON slot_abnormal_reports
+        FOR EACH ROW
+            INSERT INTO slot_abnormal_daily (station_id, event_type, day, reports)
+            VALUES (NEW.station_id, NEW.event_type, DATE(NEW.created_at), 1)
+            ON DUPLICATE KEY UPDATE reports = reports + 1
+    """,
+    'trg_slot_abnormal_daily_upd': """
+        CREATE TRIGGER trg_slot_abnormal_daily_upd AFTER UPDATE ON slot_abnormal_reports
+        FOR EACH ROW
+        BEGIN
+            IF OLD.station_id <> NEW.station_id OR OLD.event_type <> NEW.event_type
+               OR DATE(OLD.created_at) <> DATE(NEW.created_at) THEN
+                UPDATE slot_abnormal_daily SET reports = reports - 1
+                WHERE station_id = OLD.station_id AND event_type = OLD.event_type AND day = DATE(OLD.created_at);
+                INSERT INTO slot_abnormal_daily (station_id, event_type, day, reports)
+                VALUES (NEW.station_id, NEW.event_type, DATE(NEW.created_at), 1)
+                ON DUPLICATE KEY UPDATE reports = reports + 1;
+            END IF;
+        END
+    """,
+    'trg_slot_abnormal_daily_del': """
+        CREATE TRIGGER trg_slot_abnormal_daily_del AFTER DELETE ON slot_abnormal_reports
+        FOR EACH ROW
+            UPDATE slot_abnormal_daily SET reports = reports - 1
+            WHERE station_id = OLD.station_id AND event_type = OLD.event_type AND day = DATE(OLD.created_at)
+    """,
+    'trg_powerbank_status_counts_ins': """
+        CREATE TRIGGER trg_powerbank_status_counts_ins AFTER INSERT ON powerbank
+        FOR EACH ROW
+            INSERT INTO powerbank_status_counts (org_unit_id, status, powerbanks)
+            VALUES (COALESCE(NEW.org_unit_id, 0), NEW.status, 1)
+            ON DUPLICATE KEY UPDATE powerbanks = powerbanks + 1
+    """,
+    'trg_powerbank_status_counts_upd': """
+        CREATE TRIGGER trg_powerbank_status_counts_upd AFTER UPDATE ON powerbank
+        FOR EACH ROW
+        BEGIN
+            IF NOT (OLD.status <=> NEW.status) OR NOT (OLD.org_unit_id <=> NEW.org_unit_id) THEN
+                UPDATE powerbank_status_counts SET powerbanks = powerbanks - 1
+                WHERE org_unit_id = COALESCE(OLD.org_unit_id, 0) AND status = OLD.status;
+                INSERT INTO powerbank_status_counts (org_unit_id, status, powerbanks)
+                VALUES (COALESCE(NEW.org_unit_id, 0), NEW.status, 1)
+                ON DUPLICATE KEY UPDATE powerbanks = powerbanks + 1;
+            END IF;
+        END
+    """,
+    'trg_powerbank_status_counts_del': """
+        CREATE TRIGGER trg_powerbank_status_counts_del AFTER DELETE ON powerbank
+        FOR EACH ROW
+            UPDATE powerbank_status_counts SET powerbanks = powerbanks - 1
+            WHERE org_unit_id = COALESCE(OLD.org_unit_id, 0) AND status = OLD.status
+    """,
+}
+
+
+def _in_clause(column: str, values: Optional[Iterable[int]]):
+    """Условие column IN (...) и параметры; None - без фильтра"""
+    if values is None:
+        return '', []
+    values = list(values)
+    return f" AND {column} IN ({','.join(['%s'] * len(values))})", values
+
+
+class StatsRollups:
+    """Установка, пересчет, проверка и чтение сводных счетчиков"""
+
+    def __init__(self):
+        self.logger = get_logger('stats_rollup')
+        self._ready_until = 0.0
+
+    async def ready(self, db_pool) -> bool:
+        """Установлены ли триггеры (результат кешируется на ready_cache_seconds)"""
+        if not STATS_ROLLUP_CONFIG['enabled']:
+            return False
+        if time.monotonic() < self._ready_until:
+            return True
+        try:
+            async with db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    names = list(TRIGGERS)
+                    await cur.execute(f"""
+                        SELECT COUNT(*) FROM information_schema.TRIGGERS
+                        WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME IN ({','.join(['%s'] * len(names))})
+                    """, names)
+                    installed = (await cur.fetchone())[0] == len(names)
+        except Exception as e:
+            self.logger.error(f"Ошибка проверки сводных счетчиков: {e}")
+            return False
+        if installed:
+            self._ready_until = time.monotonic() + STATS_ROLLUP_CONFIG['ready_cache_seconds']
+        return installed
+
+    # --- установка и пересчет ---
+
+    async def install(self, db_pool) -> None:
+        """Создает таблицы и триггеры, затем заполняет счетчики по исходным таблицам"""
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                for sql in CREATE_TABLES_SQL:
+                    await cur.execute(sql)
+                for name, sql in TRIGGERS.items():
+                    await cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    await cur.execute(sql)
+        # Заполнение после триггеров: строки, вставленные во время пересчета, не теряются
+        await self.rebuild_abnormal(db_pool)
+        await self.rebuild_powerbanks(db_pool)
+
+    async def rebuild_abnormal(self, db_pool, station_ids: Optional[List[int]] = None) -> int:
+        """
+        Пересчитывает slot_abnormal_daily по станциям (по умолчанию - по всем).
+        Каждая станция - своя транзакция: INSERT ... SELECT блокирует прочитанные
+        строки отчетов станции, и одновременные вставки ждут ее окончания.
+        """
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                if station_ids is None:
+                    await cur.execute("""
+                        SELECT station_id FROM station
+                        UNION SELECT station_id FROM slot_abnormal_daily
+                    """)
+                    station_ids = [row[0] for row in await cur.fetchall()]
+                for station_id in station_ids:
+                    await conn.begin()
+                    try:
+                        await cur.execute("DELETE FROM slot_abnormal_daily WHERE station_id = %s", (station_id,))
+                        await cur.execute("""
+                            INSERT INTO slot_abnormal_daily (station_id, event_type, day, reports)
+                            SELECT station_id, event_type, DATE(created_at), COUNT(*)
+                            FROM slot_abnormal_reports
+                            WHERE station_id = %s
+                            GROUP BY station_id, event_type, DATE(created_at)
+                        """, (station_id,))
+                        await conn.commit()
+                    except Exception:
+                        await conn.rollback()
+                        raise
+        return len(station_ids)
+
+    async def rebuild_powerbanks(self, db_pool) -> None:
+        """Пересчитывает powerbank_status_counts одной транзакцией"""
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await conn.begin()
+                try:
+                    await cur.execute("DELETE FROM powerbank_status_counts")
+                    await cur.execute("""
+                        INSERT INTO powerbank_status_counts (org_unit_id, status, powerbanks)
+                        SELECT COALESCE(org_unit_id, 0), status, COUNT(*)
+                        FROM powerbank
+                        GROUP BY COALESCE(org_unit_id, 0), status
+                    """)
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def check(self, db_pool) -> Dict[str, Any]:
+        """Сравнивает счетчики с исходными таблицами; возвращает расхождения"""
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT station_id, event_type, DATE(created_at), COUNT(*)
+                    FROM slot_abnormal_reports
+                    GROUP BY station_id, event_type, DATE(created_at)
+                """)
+                expected = {tuple(row[:3]): row[3] for row in await cur.fetchall()}
+                await cur.execute("SELECT station_id, event_type, day, reports FROM slot_abnormal_daily")
+                actual = {tuple(row[:3]): row[3] for row in await cur.fetchall()}
+                abnormal = [
+                    {'station_id': key[0], 'event_type': key[1], 'day': key[2].isoformat(),
+                     'expected': expected.get(key, 0), 'actual': actual.get(key, 0)}
+                    for key in sorted(set(expected) | set(actual))
+                    if expected.get(key, 0) != actual.get(key, 0)
+                ]
+
+                await cur.execute("""
+                    SELECT COALESCE(org_unit_id, 0), status, COUNT(*)
+                    FROM powerbank
+                    GROUP BY COALESCE(org_unit_id, 0), status
+                """)
+                expected = {tuple(row[:2]): row[2] for row in await cur.fetchall()}
+                await cur.execute("SELECT org_unit_id, status, powerbanks FROM powerbank_status_counts")
+                actual = {tuple(row[:2]): row[2] for row in await cur.fetchall()}
+                powerbanks = [
+                    {'org_unit_id': key[0], 'status': key[1],
+                     'expected': expected.get(key, 0), 'actual': actual.get(key, 0)}
+                    for key in sorted(set(expected) | set(actual))
+                    if expected.get(key, 0) != actual.get(key, 0)
+                ]
+        return {'slot_abnormal_daily': abnormal, 'powerbank_status_counts': powerbanks}
+
+    # --- чтение для статистики ---
+
+    async def abnormal_by_event_type(self, db_pool, org_unit_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """Число отчетов по типам событий (org_unit_ids - подразделения станций, None - все)"""
+        where, params = _in_clause('s.org_unit_id', org_unit_ids)
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT d.event_type, SUM(d.reports)
+                    FROM slot_abnormal_daily d
+                    JOIN station s ON s.station_id = d.station_id
+                    WHERE 1 = 1{where}
+                    GROUP BY d.event_type
+                    HAVING SUM(d.reports) <> 0
+                """, params)
+                return {row[0]: int(row[1]) for row in await cur.fetchall()}
+
+    async def abnormal_top_stations(self, db_pool, org_unit_ids: Optional[List[int]] = None,
+                                    limit: int = 10) -> List[Dict[str, Any]]:
+        """Станции с наибольшим числом отчетов"""
+        where, params = _in_clause('s.org_unit_id', org_unit_ids)
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT s.station_id, s.box_id, SUM(d.reports) AS count
+                    FROM slot_abnormal_daily d
+                    JOIN station s ON s.station_id = d.station_id
+                    WHERE 1 = 1{where}
+                    GROUP BY s.station_id, s.box_id
+                    HAVING count <> 0
+                    ORDER BY count DESC
+                    LIMIT %s
+                """, params + [limit])
+                return [
+                    {'station_id': row[0], 'box_id': row[1], 'count': int(row[2])}
+                    for row in await cur.fetchall()
+                ]
+
+    async def powerbank_counts(self, db_pool, org_unit_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """Число повербанков по статусам"""
+        where, params = _in_clause('c.org_unit_id', org_unit_ids)
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT c.status, SUM(c.powerbanks)
+                    FROM powerbank_status_counts c
+                    LEFT JOIN org_unit ou ON ou.org_unit_id = c.org_unit_id
+                    WHERE (c.org_unit_id = 0 OR ou.org_unit_id IS NOT NULL){where}
+                    GROUP BY c.status
+                """, params)
+                return {row[0]: int(row[1]) for row in await cur.fetchall()}
+
+    async def powerbanks_by_org_unit(self, db_pool, status: str,
+                                     org_unit_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """Число повербанков в статусе по подразделениям"""
+        where, params = _in_clause('c.org_unit_id', org_unit_ids)
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT ou.name, c.powerbanks
+                    FROM powerbank_status_counts c
+                    JOIN org_unit ou ON ou.org_unit_id = c.org_unit_id
+                    WHERE c.status = %s AND c.powerbanks > 0{where}
+                    ORDER BY c.powerbanks DESC
+                """, [status] + params)
+                return [{'org_unit_name': row[0], 'count': row[1]} for row in await cur.fetchall()]
+
+
+# Сводные счетчики статистики
+stats_rollups = StatsRollups()
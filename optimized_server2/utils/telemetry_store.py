@@ -0,0 +1,251 @@
+"""
+Телеметрия слотов станций (уровень заряда, напряжение, ток, температура, SOH)
+
+Замеры из логина и ответов инвентаря 0x64 складываются в кольцевые буферы
+фиксированного размера на слот (array, без объектов на замер). Раз в
+flush_interval секунд новые замеры сворачиваются в агрегаты min/max/sum по
+интервалам TELEMETRY_CONFIG['resolutions'] и дописываются в slot_telemetry
+пачками INSERT ... ON DUPLICATE KEY UPDATE в одной транзакции. API графиков читает только
+агрегаты нужного размера интервала, поэтому месяц по станции - это сотни строк.
+"""
+import asyncio
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import TELEMETRY_CONFIG
+from utils.centralized_logger import get_logger
+from utils.fleet_state import fleet_state
+
+
+METRICS = ('level', 'voltage', 'current', 'temperature', 'soh')
+
+# Ключи значений в разобранных пакетах: в логине температура - Temp, в инвентаре - Temperature
+PACKET_FIELDS = {
+    'level': ('Level',),
+    'voltage': ('Voltage',),
+    'current': ('Current',),
+    'temperature': ('Temperature', 'Temp'),
+    'soh': ('SOH',),
+}
+
+INSERT_BATCH = 500
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS slot_telemetry (
+        station_id INT NOT NULL,
+        slot_number TINYINT UNSIGNED NOT NULL,
+        powerbank_id INT NOT NULL DEFAULT 0,
+        bucket_seconds MEDIUMINT UNSIGNED NOT NULL,
+        bucket_ts INT UNSIGNED NOT NULL,
+        samples INT UNSIGNED NOT NULL,
+        level_min SMALLINT, level_max SMALLINT, level_sum INT,
+        voltage_min INT, voltage_max INT, voltage_sum BIGINT,
+        current_min INT, current_max INT, current_sum BIGINT,
+        temperature_min SMALLINT, temperature_max SMALLINT, temperature_sum INT,
+        soh_min SMALLINT, soh_max SMALLINT, soh_sum INT,
+        PRIMARY KEY (station_id, bucket_seconds, bucket_ts, slot_number, powerbank_id),
+        KEY idx_slot_telemetry_powerbank (powerbank_id, bucket_seconds, bucket_ts)
+    )
+"""
+
+
+class SlotSeries:
+    """Кольцевой буфер замеров одного слота"""
+
+    __slots__ = ('capacity', 'timestamps', 'powerbank_ids', 'values', 'written', 'flushed')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.powerbank_ids = array('i', bytes(4 * capacity))
+        self.values = {metric: array('i', bytes(4 * capacity)) for metric in METRICS}
+        # Счетчики замеров за все время: позиция записи = written % capacity
+        self.written = 0
+        self.flushed = 0
+
+    def append(self, timestamp: float, powerbank_id: int, values: Dict[str, int]) -> bool:
+        """Добавляет замер; возвращает False, если перезаписан еще не записанный в БД"""
+        index = self.written % self.capacity
+        self.timestamps[index] = timestamp
+        self.powerbank_ids[index] = powerbank_id
+        for metric in METRICS:
+            self.values[metric][index] = values[metric]
+        self.written += 1
+        if self.written - self.flushed > self.capacity:
+            self.flushed = self.written - self.capacity
+            return False
+        return True
+
+    def indexes(self, start: int, end: int):
+        """Позиции в буфере замеров с номерами [start, end)"""
+        start = max(start, end - self.capacity)
+        return (number % self.capacity for number in range(start, end))
+
+    def latest(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Последние замеры из памяти, от старых к новым"""
+        start = self.written - (limit or self.capacity)
+        return [
+            {
+                'ts': self.timestamps[index],
+                'powerbank_id': self.powerbank_ids[index] or None,
+                **{metric: self.values[metric][index] for metric in METRICS},
+            }
+            for index in self.indexes(start, self.written)
+        ]
+
+
+class TelemetryStore:
+    """Буферы телеметрии слотов станций этого процесса и их запись в slot_telemetry"""
+
+    def __init__(self):
+        self.logger = get_logger('telemetry_store')
+        self.series: Dict[Tuple[int, int], SlotSeries] = {}
+        self._db_pool = None
+        self._task: Optional[asyncio.Task] = None
+        self._table_ready = False
+        self.recorded_total = 0
+        self.dropped_total = 0
+
+    def attach(self, db_pool) -> None:
+        self._db_pool = db_pool
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record(self, station_id: int, slots: List[Dict[str, Any]], timestamp: Optional[float] = None) -> None:
+        """Замеры слотов из разобранного пакета логина или инвентаря"""
+        if not TELEMETRY_CONFIG['enabled'] or not station_id:
+            return
+        timestamp = timestamp or time.time()
+        # Повербанк в слоте - из состояния станции, уже обновленного по этому пакету
+        state = fleet_state.get(station_id)
+        for slot in slots:
+            terminal_id = slot.get('TerminalID')
+            if not terminal_id or terminal_id == '0000000000000000':
+                continue
+            values = {}
+            for metric, fields in PACKET_FIELDS.items():
+                value = next((slot[field] for field in fields if slot.get(field) is not None), 0)
+                values[metric] = int(value)
+            slot_number = int(slot['Slot'])
+            slot_state = state.slots.get(slot_number) if state else None
+            key = (station_id, slot_number)
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = SlotSeries(TELEMETRY_CONFIG['buffer_size'])
+            if not series.append(timestamp, slot_state.powerbank_id if slot_state else 0, values):
+                self.dropped_total += 1
+            self.recorded_total += 1
+
+    def latest(self, station_id: int, limit: Optional[int] = None) -> Dict[int, List[Dict[str, Any]]]:
+        """Последние замеры станции из памяти по слотам"""
+        return {
+            slot_number: series.latest(limit)
+            for (series_station_id, slot_number), series in sorted(self.series.items())
+            if series_station_id == station_id
+        }
+
+    @property
+    def pending_count(self) -> int:
+        return sum(series.written - series.flushed for series in self.series.values())
+
+    # --- запись агрегатов ---
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(TELEMETRY_CONFIG['flush_interval'])
+            await self.flush()
+
+    def _aggregate(self) -> Tuple[List[list], Dict[Tuple[int, int], int]]:
+        """Сворачивает новые замеры в строки агрегатов; возвращает строки и позиции записи буферов"""
+        buckets: Dict[tuple, list] = {}
+        positions = {}
+        for (station_id, slot_number), series in self.series.items():
+            if series.written == series.flushed:
+                continue
+            positions[(station_id, slot_number)] = series.written
+            for index in series.indexes(series.flushed, series.written):
+                timestamp = int(series.timestamps[index])
+                powerbank_id = series.powerbank_ids[index]
+                for resolution in TELEMETRY_CONFIG['resolutions']:
+                    key = (station_id, slot_number, powerbank_id, resolution, timestamp - timestamp % resolution)
+                    row = buckets.get(key)
+                    if row is None:
+                        # samples, затем min/max/sum по каждой метрике
+                        row = buckets[key] = [0] + [
+                            value for metric in METRICS
+                            for value in (series.values[metric][index], series.values[metric][index], 0)
+                        ]
+                    row[0] += 1
+                    for position, metric in enumerate(METRICS):
+                        value = series.values[metric][index]
+                        offset = 1 + position * 3
+                        if value < row[offset]:
+                            row[offset] = value
+                        if value > row[offset + 1]:
+                            row[offset + 1] = value
+                        row[offset + 2] += value
+        return [list(key) + row for key, row in buckets.items()], positions
+
+    async def flush(self) -> None:
+        """Дописывает агрегаты новых замеров в slot_telemetry"""
+        if not self._db_pool or self._db_pool._closed:
+            return
+        rows, positions = self._aggregate()
+        if rows:
+            columns = ['station_id', 'slot_number', 'powerbank_id', 'bucket_seconds', 'bucket_ts', 'samples']
+            updates = ['samples = slot_telemetry.samples + new_st.samples']
+            for metric in METRICS:
+                columns.extend([f'{metric}_min', f'{metric}_max', f'{metric}_sum'])
+                updates.extend([
+                    f'{metric}_min = LEAST(slot_telemetry.{metric}_min, new_st.{metric}_min)',
+                    f'{metric}_max = GREATEST(slot_telemetry.{metric}_max, new_st.{metric}_max)',
+                    f'{metric}_sum = slot_telemetry.{metric}_sum + new_st.{metric}_sum',
+                ])
+            row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+            try:
+                async with self._db_pool.acquire() as conn:
+                    async with conn.cursor() as cur:
+                        if not self._table_ready:
+                            await cur.execute(CREATE_TABLE_SQL)
+                            self._table_ready = True
+                        # Пачки одной транзакцией: агрегаты суммируются, поэтому частично
+                        # записанный flush при повторе посчитал бы замеры дважды
+                        await conn.begin()
+                        try:
+                            for start in range(0, len(rows), INSERT_BATCH):
+                                batch = rows[start:start + INSERT_BATCH]
+                                await cur.execute(f"""
+                                    INSERT INTO slot_telemetry ({', '.join(columns)})
+                                    VALUES {', '.join([row_sql] * len(batch))} AS new_st
+                                    ON DUPLICATE KEY UPDATE {', '.join(updates)}
+                                """, [value for row in batch for value in row])
+                            await conn.commit()
+                        except Exception:
+                            await conn.rollback()
+                            raise
+            except Exception as e:
+                # Замеры остаются в буферах и попадут в следующую запись целиком
+                self.logger.error(f"Ошибка записи телеметрии ({len(rows)} агрегатов): {e}")
+                return
+        for key, written in positions.items():
+            series = self.series.get(key)
+            if series is not None:
+                series.flushed = max(series.flushed, written)
+        # Буферы отключившихся станций больше не пополняются
+        for key in [key for key, series in self.series.items()
+                    if series.written == series.flushed and key[0] not in fleet_state.stations]:
+            del self.series[key]
+
+
+# Телеметрия слотов процесса
+telemetry_store = TelemetryStore()
@@ -0,0 +1,167 @@
+"""
+Иерархическое колесо таймеров на loop.time()
+
+Таймауты heartbeat станций и ожидающих запросов постоянно переносятся и почти
+никогда не срабатывают. В колесе добавление, перенос и отмена - O(1), а тик
+обрабатывает только слот текущего тика (истекшие таймеры и редкий перенос
+таймеров со старшего уровня), а не все соединения.
+
+Уровень L содержит WHEEL_SIZE слотов по WHEEL_SIZE**L тиков: при тике 0.1 с
+уровни покрывают 6.4 с, 6.8 мин, 7.3 ч и 19 суток.
+"""
+import asyncio
+from typing import Any, Callable, List, Optional, Set
+
+from config.settings import TIMER_WHEEL_CONFIG
+from utils.centralized_logger import get_logger
+
+
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+LEVELS = 4
+
+
+class WheelTimer:
+    """Таймер колеса: отмена и перенос без поиска по колесу"""
+
+    __slots__ = ('wheel', 'delay', 'expires_tick', 'callback', 'args', 'slot')
+
+    def __init__(self, wheel: 'TimerWheel', delay: float, callback: Callable, args: tuple):
+        self.wheel = wheel
+        self.delay = delay
+        self.expires_tick = 0
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[Set['WheelTimer']] = None
+
+    @property
+    def active(self) -> bool:
+        return self.slot is not None
+
+    def cancel(self) -> None:
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+            self.wheel.timers -= 1
+
+    def reschedule(self, delay: Optional[float] = None) -> None:
+        """Переносит срабатывание на delay секунд от текущего момента (по умолчанию - исходная задержка)"""
+        if delay is not None:
+            self.delay = delay
+        self.cancel()
+        self.wheel._schedule(self)
+
+
+class TimerWheel:
+    """Колесо таймеров процесса; тикает, пока есть активные таймеры"""
+
+    def __init__(self, tick: float = 0.1):
+        self.tick = tick
+        self.logger = get_logger('timer_wheel')
+        self.levels: List[List[Set[WheelTimer]]] = [
+            [set() for _ in range(WHEEL_SIZE)] for _ in range(LEVELS)
+        ]
+        self.current_tick = 0
+        self.timers = 0
+        self.fired_total = 0
+        self.cascaded_total = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def call_later(self, delay: float, callback: Callable, *args: Any) -> WheelTimer:
+        """callback(*args) через delay секунд; вызывать из цикла событий"""
+        timer = WheelTimer(self, delay, callback, args)
+        self._schedule(timer)
+        return timer
+
+    def _now_tick(self) -> int:
+        return int(self._loop.time() / self.tick)
+
+    def _schedule(self, timer: WheelTimer) -> None:
+        if self._handle is None:
+            self._loop = asyncio.get_running_loop()
+            self.current_tick = self._now_tick()
+            self._handle = self._loop.call_at((self.current_tick + 1) * self.tick, self._on_tick)
+        # Срабатывание не раньше задержки: округляем вверх до следующего тика
+        timer.expires_tick = max(self.current_tick + 1, int((self._loop.time() + timer.delay) / self.tick) + 1)
+        self._insert(timer)
+        self.timers += 1
+
+    def _insert(self, timer: WheelTimer) -> None:
+        expires = timer.expires_tick
+        for level in range(LEVELS):
+            shift = level * WHEEL_BITS
+            if (expires >> shift) - (self.current_tick >> shift) < WHEEL_SIZE or level == LEVELS - 1:
+                slot = self.levels[level][(expires >> shift) & WHEEL_MASK]
+                break
+        slot.add(timer)
+        timer.slot = slot
+
+    def _on_tick(self) -> None:
+        target = self._now_tick()
+        expired: List[WheelTimer] = []
+        while self.current_tick < target:
+            self.current_tick += 1
+            self._cascade()
+            slot = self.levels[0][self.current_tick & WHEEL_MASK]
+            if slot:
+                expired.extend(slot)
+                slot.clear()
+
+        # Callback может отменить или перенести другой таймер из этой пачки
+        firing: Set[WheelTimer] = set(expired)
+        for timer in expired:
+            timer.slot = firing
+        for timer in expired:
+            if timer.slot is not firing:
+                continue
+            if timer.expires_tick > self.current_tick:
+                # Таймер за пределами диапазона колеса, ждет следующего оборота
+                firing.discard(timer)
+                self._insert(timer)
+                continue
+            firing.discard(timer)
+            timer.slot = None
+            self.timers -= 1
+            self.fired_total += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                self.logger.error(f"Ошибка таймера {getattr(timer.callback, '__qualname__', timer.callback)}: {e}")
+
+        if self.timers > 0:
+            self._handle = self._loop.call_at((self.current_tick + 1) * self.tick, self._on_tick)
+        else:
+            self._handle = None
+
+    def _cascade(self) -> None:
+        """На границе слота старшего уровня раскладывает его таймеры по младшим уровням"""
+        for level in range(1, LEVELS):
+            shift = level * WHEEL_BITS
+            if self.current_tick & ((1 << shift) - 1):
+                return
+            slot = self.levels[level][(self.current_tick >> shift) & WHEEL_MASK]
+            if slot:
+                timers = list(slot)
+                slot.clear()
+                self.cascaded_total += len(timers)
+                for timer in timers:
+                    self._insert(timer)
+
+    def stop(self) -> None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def get_stats(self) -> dict:
+        return {
+            'tick_ms': int(self.tick * 1000),
+            'timers': self.timers,
+            'fired_total': self.fired_total,
+            'cascaded_total': self.cascaded_total,
+        }
+
+
+# Глобальное колесо таймеров процесса
+timer_wheel = TimerWheel(tick=TIMER_WHEEL_CONFIG['tick_ms'] / 1000)
@@ -0,0 +1,253 @@
+"""
+Запись трафика станций в компактный бинарный формат для воспроизведения
+
+Один файл - одна TCP сессия станции: <dir>/<box_id>/<время подключения>_<fd>.zcap
+
+Формат файла:
+    заголовок  ">4sBQH" magic b'ZCAP', версия, время подключения (мкс unix), длина box_id; затем box_id
+    запись     ">IBH"   смещение от предыдущей записи (мкс), направление (0 - от станции, 1 - к станции),
+                        длина кадра; затем кадр целиком (заголовок протокола + payload)
+
+Записи копятся в памяти сессии и раз в flush_interval и при отключении станции
+передаются потоку записи, поэтому цикл событий не ждет диск. Поток один, так что
+куски одного файла дописываются по порядку.
+"""
+import asyncio
+import os
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from config.settings import TRAFFIC_CAPTURE_CONFIG
+from utils.centralized_logger import get_logger
+
+
+FILE_MAGIC = b'ZCAP'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct(">4sBQH")
+RECORD_HEADER = struct.Struct(">IBH")
+
+DIRECTION_IN = 0   # станция -> сервер
+DIRECTION_OUT = 1  # сервер -> станция
+
+MAX_DELTA_US = 0xFFFFFFFF
+FLUSH_BUFFER_SIZE = 64 * 1024
+
+# box_id приходит из логина до проверки подписи: в имени каталога - только безопасные символы
+UNSAFE_PATH_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+MAX_DIR_NAME = 64
+
+
+def login_box_id(frame: bytes) -> Optional[str]:
+    """box_id из пакета логина (0x60) без полного разбора"""
+    if len(frame) < 17 or frame[2] != 0x60:
+        return None
+    box_id_len = struct.unpack_from(">H", frame, 15)[0]
+    box_id = frame[17:17 + box_id_len]
+    return box_id.decode('ascii', errors='replace') if len(box_id) == box_id_len else None
+
+
+def encode_header(box_id: str, started_us: int) -> bytes:
+    box_id_bytes = box_id.encode('utf-8')
+    return FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, started_us, len(box_id_bytes)) + box_id_bytes
+
+
+def read_capture(path: str) -> Tuple[str, int, List[Tuple[int, int, bytes]]]:
+    """Читает файл захвата: (box_id, время подключения мкс, [(время мкс, направление, кадр)])"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, started_us, box_id_len = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path}: не файл захвата (magic={magic!r}, версия={version})")
+    offset = FILE_HEADER.size
+    box_id = data[offset:offset + box_id_len].decode('utf-8')
+    offset += box_id_len
+    return box_id, started_us, list(iter_records(data, offset, started_us))
+
+
+def iter_records(data: bytes, offset: int, started_us: int) -> Iterator[Tuple[int, int, bytes]]:
+    timestamp_us = started_us
+    while offset + RECORD_HEADER.size <= len(data):
+        delta_us, direction, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        frame = data[offset:offset + length]
+        if len(frame) < length:
+            break  # файл обрезан на записи, которая не успела дописаться
+        offset += length
+        timestamp_us += delta_us
+        yield timestamp_us, direction, frame
+
+
+def write_capture(path: str, box_id: str, records: List[Tuple[int, int, bytes]]) -> None:
+    """Пишет файл захвата из готовых записей (например, восстановленных из текстового лога)"""
+    started_us = records[0][0] if records else int(time.time() * 1_000_000)
+    chunks = [encode_header(box_id, started_us)]
+    previous_us = started_us
+    for timestamp_us, direction, frame in records:
+        delta_us = min(MAX_DELTA_US, max(0, timestamp_us - previous_us))
+        previous_us = timestamp_us
+        chunks.append(RECORD_HEADER.pack(delta_us, direction, len(frame)))
+        chunks.append(frame)
+    with open(path, 'wb') as f:
+        f.write(b''.join(chunks))
+
+
+class CaptureSession:
+    """Запись одной TCP сессии станции"""
+
+    __slots__ = ('capture', 'fd', 'box_id', 'started_us', 'path', '_previous_us', '_buffer', 'dropped')
+
+    def __init__(self, capture: 'TrafficCapture', fd: int):
+        self.capture = capture
+        self.fd = fd
+        self.box_id: Optional[str] = None
+        self.started_us = int(time.time() * 1_000_000)
+        self.path: Optional[str] = None
+        self._previous_us = self.started_us
+        self._buffer = bytearray()
+        self.dropped = False
+
+    def record(self, direction: int, frame: bytes) -> None:
+        if self.dropped:
+            return
+        if self.box_id is None and direction == DIRECTION_IN:
+            box_id = login_box_id(frame)
+            if box_id is not None:
+                if not self.capture.wants(box_id):
+                    self.dropped = True
+                    self._buffer.clear()
+                    return
+                self.box_id = box_id
+        now_us = int(time.time() * 1_000_000)
+        delta_us = min(MAX_DELTA_US, max(0, now_us - self._previous_us))
+        self._previous_us = now_us
+        self._buffer += RECORD_HEADER.pack(delta_us, direction, len(frame))
+        self._buffer += frame
+        if len(self._buffer) >= FLUSH_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Отдает накопленные записи потоку записи (до логина станции файл не создается)"""
+        if self.dropped or not self._buffer or self.box_id is None:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self.capture.submit(self, data)
+
+    def write(self, data: bytes) -> None:
+        """Дописывает записи в файл; выполняется в потоке записи"""
+        if self.dropped:
+            return
+        try:
+            if self.path is None:
+                path = self.capture.session_path(self.box_id, self.started_us, self.fd)
+                with open(path, 'wb') as f:
+                    f.write(encode_header(self.box_id, self.started_us))
+                    f.write(data)
+                self.path = path
+            else:
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+            self.capture.bytes_written += len(data)
+        except OSError as e:
+            self.capture.logger.error(f"Ошибка записи захвата трафика {self.box_id}: {e}")
+            self.dropped = True
+
+
+class CaptureStreamWriter:
+    """Обертка writer соединения станции: исходящие кадры попадают в захват"""
+
+    __slots__ = ('_writer', '_session')
+
+    def __init__(self, writer, session: CaptureSession):
+        self._writer = writer
+        self._session = session
+
+    def write(self, data: bytes) -> None:
+        self._session.record(DIRECTION_OUT, data)
+        self._writer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+
+class TrafficCapture:
+    """Захват трафика станций процесса"""
+
+    def __init__(self, directory: str, box_ids: Optional[Set[str]] = None,
+                 flush_interval: float = 1.0, enabled: bool = False):
+        self.directory = directory
+        self.box_ids = box_ids or set()
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.logger = get_logger('traffic_capture')
+
+        self.sessions: Dict[int, CaptureSession] = {}
+        self.sessions_total = 0
+        self.bytes_written = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='traffic_capture')
+
+    def wants(self, box_id: str) -> bool:
+        return not self.box_ids or box_id in self.box_ids
+
+    def session_path(self, box_id: str, started_us: int, fd: int) -> str:
+        dir_name = UNSAFE_PATH_CHARS.sub('_', box_id)[:MAX_DIR_NAME] or '_'
+        station_dir = os.path.join(self.directory, dir_name)
+        os.makedirs(station_dir, exist_ok=True)
+        started = time.strftime('%Y%m%d-%H%M%S', time.localtime(started_us / 1_000_000))
+        return os.path.join(station_dir, f"{started}_{fd}.zcap")
+
+    def submit(self, session: CaptureSession, data: bytes) -> None:
+        self._writer.submit(session.write, data)
+
+    def open_session(self, fd: int) -> Optional[CaptureSession]:
+        """Сессия для нового соединения или None, если захват выключен"""
+        if not self.enabled:
+            return None
+        session = CaptureSession(self, fd)
+        self.sessions[fd] = session
+        self.sessions_total += 1
+        return session
+
+    def close_session(self, session: Optional[CaptureSession]) -> None:
+        if session is None:
+            return
+        session.flush()
+        self.sessions.pop(session.fd, None)
+
+    async def start(self) -> None:
+        if not self.enabled or self._flush_task:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self.logger.info(
+            f"Захват трафика станций в {self.directory}"
+            + (f" (станции: {', '.join(sorted(self.box_ids))})" if self.box_ids else '')
+        )
+
+    async def stop(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        for session in list(self.sessions.values()):
+            session.flush()
+        # Дожидаемся записи всего, что уже передано потоку
+        await asyncio.wrap_future(self._writer.submit(lambda: None))
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for session in list(self.sessions.values()):
+                session.flush()
+
+
+# Глобальный захват трафика процесса
+traffic_capture = TrafficCapture(
+    directory=TRAFFIC_CAPTURE_CONFIG['directory'],
+    box_ids={box_id.strip() for box_id in TRAFFIC_CAPTURE_CONFIG['box_ids'].split(',') if box_id.strip()},
+    flush_interval=TRAFFIC_CAPTURE_CONFIG['flush_interval'],
+    enabled=TRAFFIC_CAPTURE_CONFIG['enabled']
+)
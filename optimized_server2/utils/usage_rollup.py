@@ -0,0 +1,339 @@
+"""
+Суточная сводка использования повербанков по станциям и подразделениям
+
+Раз в сутки (в run_hour по Москве) задание читает заказы потоково, через
+серверный курсор (SSCursor), и считает по дню выдачи, станции и подразделению:
+число выдач, возвратов, среднюю и 95-й перцентиль длительности аренды (по
+возвращенным), число просроченных (дольше write_off_hours подразделения
+станции, для невозвращенных - на момент расчета) и принудительных выбросов.
+Строки подразделения целиком хранятся с station_id = 0.
+
+Задание возобновляемое: каждый день пишется своей транзакцией, после чего
+в usage_rollup_state сдвигается last_day. Последние recompute_days дней
+пересчитываются при каждом запуске, пока по ним возвращаются повербанки, а
+чтение заказов начинается с resume_id - минимального id заказов этого окна,
+поэтому запуск читает только хвост таблицы по первичному ключу.
+Отчет по периоду читает готовые строки: стоимость - O(дней), а не O(заказов).
+"""
+import asyncio
+import math
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiomysql
+
+from config.settings import USAGE_ROLLUP_CONFIG
+from utils.centralized_logger import get_logger
+from utils.time_utils import get_moscow_time
+
+
+FETCH_CHUNK = 10000
+DEFAULT_WRITE_OFF_HOURS = 48
+STATE_NAME = 'orders_daily'
+
+CREATE_TABLES_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS order_usage_daily (
+        day DATE NOT NULL,
+        org_unit_id BIGINT UNSIGNED NOT NULL,
+        station_id BIGINT UNSIGNED NOT NULL,
+        borrows INT UNSIGNED NOT NULL,
+        returned INT UNSIGNED NOT NULL,
+        duration_sum BIGINT UNSIGNED NOT NULL,
+        duration_p95 INT UNSIGNED NULL,
+        overdue INT UNSIGNED NOT NULL,
+        force_ejects INT UNSIGNED NOT NULL,
+        PRIMARY KEY (day, org_unit_id, station_id),
+        KEY idx_order_usage_daily_org (org_unit_id, station_id, day)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS usage_rollup_state (
+        name VARCHAR(64) NOT NULL PRIMARY KEY,
+        last_day DATE NULL,
+        resume_id BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """,
+)
+
+COLUMNS = ('day', 'org_unit_id', 'station_id', 'borrows', 'returned', 'duration_sum', 'duration_p95',
+           'overdue', 'force_ejects')
+
+
+def percentile(values: array, fraction: float) -> Optional[int]:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return int(ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)])
+
+
+class DayStats:
+    """Счетчики одного дня по одной станции"""
+
+    __slots__ = ('borrows', 'durations', 'overdue', 'force_ejects')
+
+    def __init__(self):
+        self.borrows = 0
+        self.durations = array('q')
+        self.overdue = 0
+        self.force_ejects = 0
+
+    def merge(self, other: 'DayStats') -> None:
+        self.borrows += other.borrows
+        self.durations.extend(other.durations)
+        self.overdue += other.overdue
+        self.force_ejects += other.force_ejects
+
+    def row(self, day: date, org_unit_id: int, station_id: int) -> tuple:
+        return (day, org_unit_id, station_id, self.borrows, len(self.durations), sum(self.durations),
+                percentile(self.durations, 0.95), self.overdue, self.force_ejects)
+
+
+class UsageRollup:
+    """Задание суточной сводки по заказам и чтение сводки"""
+
+    def __init__(self):
+        self.logger = get_logger('usage_rollup')
+        self.db_pool = None
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Task] = None
+        self._tables_ready = False
+
+    def attach(self, db_pool, periodic: bool = True) -> None:
+        """
+        Пул БД для отчетов и ночной расчет, если он включен.
+        periodic = False - только отчеты и расчет по запросу (остальные HTTP процессы)
+        """
+        self.db_pool = db_pool
+        if USAGE_ROLLUP_CONFIG['enabled'] and periodic:
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._running):
+            if task and not task.done():
+                task.cancel()
+        self._task = None
+
+    async def _run_loop(self) -> None:
+        while True:
+            # При старте догоняем пропущенные дни, затем - раз в сутки в run_hour
+            try:
+                await self.run()
+            except Exception as e:
+                self.logger.error(f"Ошибка расчета сводки использования: {e}", exc_info=True)
+            now = get_moscow_time()
+            next_run = now.replace(hour=USAGE_ROLLUP_CONFIG['run_hour'], minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+
+    async def run(self) -> Dict[str, Any]:
+        """Выполняет расчет; параллельный вызов ждет уже идущий"""
+        if self._running is None or self._running.done():
+            self._running = asyncio.create_task(self._run())
+        return await asyncio.shield(self._running)
+
+    @property
+    def is_running(self) -> bool:
+        return self._running is not None and not self._running.done()
+
+    async def _ensure_tables(self, cur) -> None:
+        if not self._tables_ready:
+            for sql in CREATE_TABLES_SQL:
+                await cur.execute(sql)
+            self._tables_ready = True
+
+    async def _run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        recompute_days = USAGE_ROLLUP_CONFIG['recompute_days']
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_tables(cur)
+                await cur.execute("SELECT last_day, resume_id FROM usage_rollup_state WHERE name = %s",
+                                  (STATE_NAME,))
+                state = await cur.fetchone()
+                # Время БД: заказы пишутся через NOW()
+                await cur.execute("SELECT NOW()")
+                now = (await cur.fetchone())[0]
+                stations, write_off_hours = await self._load_stations(cur)
+
+            last_day, resume_id = (state[0], int(state[1])) if state else (None, 0)
+            end_day = now.date() - timedelta(days=1)
+            start_day = last_day - timedelta(days=recompute_days - 1) if last_day else None
+            if start_day is not None and start_day > end_day:
+                return {'days': 0, 'orders': 0}
+
+            days, orders_read, next_resume_id = await self._aggregate(
+                conn, resume_id, start_day, end_day, now, stations, write_off_hours,
+                next_window_start=end_day - timedelta(days=recompute_days - 1)
+            )
+            if start_day is None:
+                start_day = min(days) if days else end_day
+
+            # Дни пишутся по порядку, каждый вместе с last_day: прерванный запуск
+            # продолжится с окна пересчета перед последним записанным днем
+            day = start_day
+            async with conn.cursor() as cur:
+                while day <= end_day:
+                    await self._write_day(conn, cur, day, days.get(day, {}), stations, resume_id)
+                    day += timedelta(days=1)
+                # Следующий запуск читает заказы начиная с окна пересчета
+                await self._save_state(cur, end_day, next_resume_id)
+
+        result = {
+            'generated_at': get_moscow_time().isoformat(),
+            'from': start_day.isoformat(),
+            'to': end_day.isoformat(),
+            'days': (end_day - start_day).days + 1,
+            'orders': orders_read,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        self.last_run = result
+        self.logger.info(f"Сводка использования: {len(days)} дней, {orders_read} заказов, "
+                         f"{result['seconds']} сек")
+        return result
+
+    async def _load_stations(self, cur) -> Tuple[Dict[str, Tuple[int, int]], Dict[int, int]]:
+        """box_id -> (station_id, org_unit_id) и write_off_hours подразделений"""
+        await cur.execute("SELECT station_id, box_id, org_unit_id FROM station")
+        stations = {row[1].strip(): (int(row[0]), int(row[2] or 0)) for row in await cur.fetchall() if row[1]}
+        await cur.execute("SELECT org_unit_id, write_off_hours FROM org_unit")
+        write_off_hours = {int(row[0]): int(row[1] or DEFAULT_WRITE_OFF_HOURS) for row in await cur.fetchall()}
+        return stations, write_off_hours
+
+    async def _aggregate(self, conn, resume_id: int, start_day: Optional[date], end_day: date, now: datetime,
+                         stations: Dict[str, Tuple[int, int]], write_off_hours: Dict[int, int],
+                         next_window_start: date):
+        """Потоково читает заказы с id >= resume_id и считает дни [start_day, end_day]"""
+        days: Dict[date, Dict[str, DayStats]] = {}
+        orders_read = 0
+        next_resume_id = None
+        last_id = resume_id - 1
+        async with conn.cursor(aiomysql.SSCursor) as cur:
+            await cur.execute("""
+                SELECT id, station_box_id, status, timestamp, completed_at
+                FROM orders
+                WHERE id >= %s AND is_deleted = 0
+                ORDER BY id
+            """, (resume_id,))
+            while True:
+                rows = await cur.fetchmany(FETCH_CHUNK)
+                if not rows:
+                    break
+                orders_read += len(rows)
+                for order_id, box_id, status, borrowed_at, completed_at in rows:
+                    last_id = order_id
+                    if borrowed_at is None:
+                        continue
+                    day = borrowed_at.date()
+                    if day >= next_window_start and next_resume_id is None:
+                        next_resume_id = order_id
+                    if day > end_day or (start_day is not None and day < start_day):
+                        continue
+                    box_id = (box_id or '').strip()
+                    stats = days.setdefault(day, {}).get(box_id)
+                    if stats is None:
+                        stats = days[day][box_id] = DayStats()
+                    stats.borrows += 1
+                    if status == 'force_eject':
+                        stats.force_ejects += 1
+                        continue
+                    # Списанные (written_off) не возвращены: считаются открытыми до сих пор
+                    finished = completed_at if status == 'return' and completed_at else None
+                    duration = ((finished or now) - borrowed_at).total_seconds()
+                    org_unit_id = stations.get(box_id, (0, 0))[1]
+                    if duration > write_off_hours.get(org_unit_id, DEFAULT_WRITE_OFF_HOURS) * 3600:
+                        stats.overdue += 1
+                    if finished:
+                        stats.durations.append(max(int(duration), 0))
+        # Без заказов в окне пересчета следующий запуск начнет с новых заказов
+        return days, orders_read, next_resume_id if next_resume_id is not None else last_id + 1
+
+    @staticmethod
+    async def _save_state(cur, last_day: date, resume_id: int) -> None:
+        await cur.execute("""
+            INSERT INTO usage_rollup_state (name, last_day, resume_id)
+            VALUES (%s, %s, %s) AS new_state
+            ON DUPLICATE KEY UPDATE last_day = new_state.last_day, resume_id = new_state.resume_id
+        """, (STATE_NAME, last_day, resume_id))
+
+    async def _write_day(self, conn, cur, day: date, by_box: Dict[str, DayStats],
+                         stations: Dict[str, Tuple[int, int]], resume_id: int) -> None:
+        """Заменяет строки дня и сдвигает last_day одной транзакцией"""
+        rows = []
+        by_org_unit: Dict[int, DayStats] = {}
+        for box_id, stats in by_box.items():
+            station_id, org_unit_id = stations.get(box_id, (0, 0))
+            if station_id:
+                rows.append(stats.row(day, org_unit_id, station_id))
+            total = by_org_unit.get(org_unit_id)
+            if total is None:
+                total = by_org_unit[org_unit_id] = DayStats()
+            total.merge(stats)
+        rows.extend(total.row(day, org_unit_id, 0) for org_unit_id, total in by_org_unit.items())
+
+        row_sql = '(' + ', '.join(['%s'] * len(COLUMNS)) + ')'
+        await conn.begin()
+        try:
+            await cur.execute("DELETE FROM order_usage_daily WHERE day = %s", (day,))
+            if rows:
+                await cur.execute(
+                    f"INSERT INTO order_usage_daily ({', '.join(COLUMNS)}) VALUES {', '.join([row_sql] * len(rows))}",
+                    [value for row in rows for value in row]
+                )
+            await self._save_state(cur, day, resume_id)
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+    # --- отчет ---
+
+    async def report(self, start_day: date, end_day: date, org_unit_ids: Optional[List[int]] = None,
+                     station_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Строки сводки за период по дням. Без station_id - итоги подразделений,
+        со station_id - строки станции. org_unit_ids ограничивает подразделения.
+        """
+        where = ['day >= %s', 'day <= %s', 'station_id = %s']
+        params: list = [start_day, end_day, station_id or 0]
+        if org_unit_ids is not None:
+            where.append(f"org_unit_id IN ({','.join(['%s'] * len(org_unit_ids))})")
+            params.extend(org_unit_ids)
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_tables(cur)
+                await cur.execute(f"""
+                    SELECT {', '.join(COLUMNS)}
+                    FROM order_usage_daily
+                    WHERE {' AND '.join(where)}
+                    ORDER BY day, org_unit_id
+                """, params)
+                rows = await cur.fetchall()
+                await cur.execute("SELECT last_day FROM usage_rollup_state WHERE name = %s", (STATE_NAME,))
+                state = await cur.fetchone()
+
+        items = []
+        totals = {'borrows': 0, 'returned': 0, 'duration_sum': 0, 'overdue': 0, 'force_ejects': 0}
+        for row in rows:
+            item = dict(zip(COLUMNS, row))
+            item['day'] = item['day'].isoformat()
+            item['mean_duration'] = round(item['duration_sum'] / item['returned']) if item['returned'] else None
+            for key in totals:
+                totals[key] += int(item[key])
+            items.append(item)
+        totals['mean_duration'] = round(totals['duration_sum'] / totals['returned']) if totals['returned'] else None
+        return {
+            'computed_through': state[0].isoformat() if state and state[0] else None,
+            'totals': totals,
+            'items': items,
+        }
+
+
+# Суточная сводка использования процесса с HTTP API
+usage_rollup = UsageRollup()
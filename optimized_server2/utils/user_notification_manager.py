@@ -1,7 +1,7 @@
 """
 Менеджер WebSocket соединений пользователей для отправки уведомлений
 """
-from typing import Dict, Optional, Any, List
+from typing import Awaitable, Callable, Dict, Optional, Any, List
 from aiohttp import web
 import asyncio
 import json
@@ -16,6 +16,9 @@ class UserNotificationManager:
         self.user_connections: Dict[int, web.WebSocketResponse] = {}
         self.pending_notifications: Dict[int, deque] = defaultdict(lambda: deque(maxlen=10))  # Очередь уведомлений для отключенных пользователей
         self.logger = logging.getLogger('user_notifications')
+        # Воркер кластерного шлюза: WebSocket пользователей открыты в HTTP процессах,
+        # уведомления уходят им через справочник станций (utils/gateway_cluster.py)
+        self.forwarder: Optional[Callable[[int, str, Dict[str, Any]], Awaitable[bool]]] = None
     
     async def register_user(self, user_id: int, ws: web.WebSocketResponse):
         """Регистрирует WebSocket соединение пользователя"""
@@ -35,14 +38,22 @@ class UserNotificationManager:
             del self.user_connections[user_id]
     
     async def send_notification(self, user_id: int, notification_type: str, data: Dict[str, Any]) -> bool:
-        """Отправляет уведомление пользователю"""
+        """Отправляет уведомление пользователю (в кластере - в HTTP процессы через справочник)"""
+        if self.forwarder is not None:
+            return await self.forwarder(user_id, notification_type, data)
+        return await self.deliver(user_id, notification_type, data)
+    
+    async def deliver(self, user_id: int, notification_type: str, data: Dict[str, Any],
+                      queue: bool = True) -> bool:
+        """Отправляет уведомление в WebSocket этого процесса; queue - сохранить для неподключенного"""
         message = {
             'type': notification_type,
             'data': data
         }
         
         if user_id not in self.user_connections:
-            self.pending_notifications[user_id].append(message)
+            if queue:
+                self.pending_notifications[user_id].append(message)
             return False
         
         ws = self.user_connections[user_id]